@@ -142,6 +142,11 @@ def config_cli():
     """Configuration-related commands."""
 
 
+@click.group("jobs", cls=OrderedHelpGroup)
+def jobs_cli():
+    """Check on and resubmit your project's batch jobs."""
+
+
 def _add_commands():
     cli.add_command(project_setup_cli, help_priority=0)
     cli.add_command(convert2bids_cli, help_priority=10)
@@ -169,15 +174,20 @@ def _add_commands():
     roi_cli.add_command(fmri_roi_extraction_cli, help_priority=2)
 
     reports_cli.add_command(get_fmriprep_reports_cli)
+    reports_cli.add_command(resources_report_cli)
 
     config_cli.add_command(get_config_cli)
     config_cli.add_command(update_config_cli)
 
+    jobs_cli.add_command(jobs_status_cli, help_priority=1)
+    jobs_cli.add_command(jobs_resubmit_cli, help_priority=2)
+
     cli.add_command(bids_cli, help_priority=11, hidden=True)
     cli.add_command(dicom_cli, help_priority=5, hidden=True)
     cli.add_command(glm_cli, help_priority=40)
     cli.add_command(roi_cli, help_priority=50)
     cli.add_command(reports_cli, help_priority=60)
+    cli.add_command(jobs_cli, help_priority=65)
     cli.add_command(status_cli, help_priority=70, hidden=True)
 
 
@@ -473,7 +483,8 @@ def get_fmri_process_check_cli(config_file, output_file=None, debug=False):
 @click.option(
     "-processing_stream",
     "-p",
-    default=DEFAULT_PROCESSING_STREAM,
+    multiple=True,
+    default=[DEFAULT_PROCESSING_STREAM],
     required=False,
     help=PROCESSING_STREAM_HELP,
 )
@@ -497,6 +508,9 @@ def get_fmri_process_check_cli(config_file, output_file=None, debug=False):
 )
 @click.option("-batch/-no-batch", is_flag=True, default=True, help=BATCH_HELP)
 @click.option("-cache/-no-cache", is_flag=True, default=True)
+@click.option(
+    "-incremental", is_flag=True, default=False, required=False, help=INCREMENTAL_HELP
+)
 @click.option("-submit", "-s", is_flag=True, default=False, help=SUBMIT_HELP)
 @click.option("-debug", "-d", is_flag=True, default=False, help=DEBUG_HELP)
 def postprocess_cli(
@@ -512,6 +526,7 @@ def postprocess_cli(
     refresh_index,
     debug,
     cache,
+    incremental,
 ):
     """Additional processing for GLM or connectivity analysis.
 
@@ -535,6 +550,7 @@ def postprocess_cli(
         refresh_index=refresh_index,
         debug=debug,
         cache=cache,
+        incremental=incremental,
     )
 
 
@@ -544,6 +560,12 @@ def postprocess_cli(
 @click.argument("subject_out_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_working_dir", type=CLICK_DIR_TYPE)
 @click.argument("subject_log_dir", type=CLICK_DIR_TYPE)
+@click.option(
+    "-stream_run_config",
+    type=CLICK_FILE_TYPE,
+    multiple=True,
+    help=STREAM_RUN_CONFIG_HELP,
+)
 @click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
 def postprocess_image_cli(
     run_config_file,
@@ -551,6 +573,7 @@ def postprocess_image_cli(
     subject_out_dir,
     subject_working_dir,
     subject_log_dir,
+    stream_run_config,
     debug,
 ):
     """Used to distribute postprocessing jobs for individual images.
@@ -565,6 +588,83 @@ def postprocess_image_cli(
         subject_working_dir,
         subject_log_dir,
         debug=debug,
+        stream_run_config_files=list(stream_run_config),
+    )
+
+
+@click.command()
+@click.argument("subject_job_file", type=CLICK_FILE_TYPE_EXISTS)
+@click.argument("subject_log_dir", type=CLICK_DIR_TYPE)
+@click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
+def postprocess_subject_images_cli(subject_job_file, subject_log_dir, debug):
+    """Used to distribute subject-level postprocessing jobs, which run all of a
+    subject's images together.
+    Not intended for direct use by user - this is called by the main postprocess
+    command."""
+    from .postprocess import postprocess_subject_images
+
+    postprocess_subject_images(subject_job_file, subject_log_dir, debug=debug)
+
+
+@click.command()
+@click.argument("pack_file", type=CLICK_FILE_TYPE_EXISTS)
+@click.option("-debug", is_flag=True, default=False, help=DEBUG_HELP)
+def run_job_pack_cli(pack_file, debug):
+    """Runs a pack of jobs within a single batch allocation.
+    Not intended for direct use by user - this is called by batch jobs created
+    with job packing enabled."""
+    from .job_manager import run_job_pack
+
+    sys.exit(run_job_pack(pack_file, debug=debug))
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("command")
+@click.option("-telemetry_file", required=True, type=click.Path())
+@click.option("-job_name", required=True)
+@click.option("-step", default=None)
+@click.option("-mem_use", default=None)
+@click.option("-time_usage", default=None)
+@click.option("-n_threads", default=None)
+def run_with_telemetry_cli(
+    command, telemetry_file, job_name, step, mem_use, time_usage, n_threads
+):
+    """Runs a job's command, recording the resources it uses.
+    Not intended for direct use by user - job managers wrap each job's command
+    with this when telemetry is enabled."""
+    from .job_telemetry import run_with_telemetry
+
+    sys.exit(
+        run_with_telemetry(
+            command,
+            telemetry_file,
+            job_name,
+            step=step,
+            mem_use=mem_use,
+            time=time_usage,
+            threads=n_threads,
+        )
+    )
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.argument("command")
+@click.option("-job_name", required=True)
+@click.option("-scratch_directory", default="")
+@click.option("-output", "outputs", nargs=2, multiple=True)
+def run_in_scratch_cli(command, job_name, scratch_directory, outputs):
+    """Runs a job's command with a node-local scratch directory.
+    Not intended for direct use by user - job builders wrap each job's command
+    with this when scratch staging is enabled."""
+    from .scratch_staging import run_in_scratch
+
+    sys.exit(
+        run_in_scratch(
+            command,
+            job_name,
+            scratch_directory=scratch_directory,
+            outputs=outputs,
+        )
     )
 
 
@@ -999,6 +1099,76 @@ def status_cli(config_file, cache_file):
     show_latest_by_step(config_file=config_file, cache_path=cache_file)
 
 
+@click.command(JOBS_STATUS_COMMAND_NAME, no_args_is_help=True)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, help=CONFIG_HELP, required=False
+)
+@click.option("-registry", type=CLICK_FILE_TYPE_EXISTS, help=JOB_REGISTRY_HELP)
+@click.option("-step", default=None, help=JOB_STEP_HELP)
+@click.option("-debug", "-d", is_flag=True, default=False, help=DEBUG_HELP)
+def jobs_status_cli(config_file, registry, step, debug):
+    """Refresh and count the states of submitted jobs."""
+    from .job_registry import show_jobs
+
+    show_jobs(
+        config_file=config_file, registry_path=registry, step=step, debug=debug
+    )
+
+
+@click.command(JOBS_RESUBMIT_COMMAND_NAME, no_args_is_help=True)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, help=CONFIG_HELP, required=False
+)
+@click.option("-registry", type=CLICK_FILE_TYPE_EXISTS, help=JOB_REGISTRY_HELP)
+@click.option("-step", default=None, help=JOB_STEP_HELP)
+@click.option("-failed", is_flag=True, default=False, help=FAILED_JOBS_HELP)
+@click.option("-memory_factor", type=float, default=1.0, help=MEMORY_FACTOR_HELP)
+@click.option("-time_factor", type=float, default=1.0, help=TIME_FACTOR_HELP)
+@click.option("-submit", "-s", is_flag=True, default=False, help=SUBMIT_HELP)
+@click.option("-debug", "-d", is_flag=True, default=False, help=DEBUG_HELP)
+def jobs_resubmit_cli(
+    config_file, registry, step, failed, memory_factor, time_factor, submit, debug
+):
+    """Resubmit only the jobs which need it, such as those which failed.
+
+    Jobs are resubmitted with the batch settings they were first submitted with,
+    optionally with more memory or time:
+
+    > clpipe jobs resubmit -c clpipe_config.json -failed -memory_factor 1.5 -submit
+    """
+    from .job_registry import resubmit_jobs
+
+    resubmit_jobs(
+        config_file=config_file,
+        registry_path=registry,
+        step=step,
+        failed=failed,
+        memory_factor=memory_factor,
+        time_factor=time_factor,
+        submit=submit,
+        debug=debug,
+    )
+
+
+@click.command(RESOURCES_REPORT_COMMAND_NAME, no_args_is_help=True)
+@click.option(
+    "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, help=CONFIG_HELP, required=False
+)
+@click.option("-telemetry_file", type=CLICK_FILE_TYPE_EXISTS, help=TELEMETRY_FILE_HELP)
+@click.option("-step", default=None, help=JOB_STEP_HELP)
+def resources_report_cli(config_file, telemetry_file, step):
+    """Summarize the resources jobs actually used, by step and request.
+
+    Suggests memory and time requests for your batch options based on the
+    largest usage measured. Requires 'RecordTelemetry' in your configuration.
+    """
+    from .job_telemetry import show_resource_report
+
+    show_resource_report(
+        config_file=config_file, telemetry_file=telemetry_file, step=step
+    )
+
+
 @click.command("flywheel_sync", no_args_is_help=True)
 @click.option(
     "-config_file", "-c", type=CLICK_FILE_TYPE_EXISTS, help=CONFIG_HELP, required=False
@@ -88,12 +88,18 @@ OUTPUT_DIR_HELP = (
     "provided with a output directory, this argument is not necessary."
 )
 PROCESSING_STREAM_HELP = (
-    "Specify a processing stream to use defined in your configuration file."
+    "Specify a processing stream to use defined in your configuration file. "
+    "Repeat to run several streams in the same jobs, e.g. -p stream_a -p stream_b."
 )
+STREAM_RUN_CONFIG_HELP = "The run config of another stream to run on the image."
 INDEX_HELP = "Give the path to an existing pybids index database."
 REFRESH_INDEX_HELP = (
     "Refresh the pybids index database to reflect new fmriprep artifacts."
 )
+INCREMENTAL_HELP = (
+    "Only process images which are new, or whose inputs or postprocessing "
+    "options have changed since they were last exported."
+)
 
 
 # GLM Help
@@ -117,3 +123,22 @@ TEST_ONE_HELP = "Only submit one job for testing purposes."
 # Other Help
 STATUS_COMMAND_NAME = "status"
 CACHE_FILE_HELP = "Path to your status cache file."
+
+# Job registry help
+JOBS_STATUS_COMMAND_NAME = "status"
+JOBS_RESUBMIT_COMMAND_NAME = "resubmit"
+JOB_REGISTRY_HELP = (
+    "Path to a job registry database. Defaults to the registry in your "
+    "project's .pipeline directory."
+)
+JOB_STEP_HELP = "Only include jobs of this step, e.g. postprocess."
+FAILED_JOBS_HELP = "Resubmit jobs which failed, timed out or ran out of memory."
+MEMORY_FACTOR_HELP = "Multiply the memory request of each resubmitted job by this."
+TIME_FACTOR_HELP = "Multiply the time request of each resubmitted job by this."
+
+# Job telemetry help
+RESOURCES_REPORT_COMMAND_NAME = "resources"
+TELEMETRY_FILE_HELP = (
+    "Path to a job telemetry table. Defaults to the table in your "
+    "project's .pipeline directory."
+)
@@ -11,6 +11,9 @@ from ..utils import get_logger
 DEFAULT_CONFIG_FILE_NAME = "clpipe_config.json"
 DEFAULT_PROCESSING_STREAM = "default"
 DEFAULT_WORKING_DIRECTORY = "SET WORKING DIRECTORY"
+PIPELINE_DIRECTORY = ".pipeline"
+JOB_REGISTRY_FILE_NAME = "jobs.db"
+TELEMETRY_FILE_NAME = "telemetry.tsv"
 LOGGER_NAME = "config"
 
 class ClpipeData:
@@ -40,6 +43,12 @@ class ClpipeData:
         config_schema = marshmallow_dataclass.class_schema(self.__class__)
         return config_schema().dump(self)
 
+    @classmethod
+    def from_dict(cls, config_dict: dict) -> "ClpipeData":
+        """Load an instance of the class from a dictionary, as made by to_dict()."""
+        config_schema = marshmallow_dataclass.class_schema(cls)
+        return config_schema().load(config_dict)
+
     def load_cli_args(self, **kwargs):
         """Override class fields with inputted arguments if they aren't None"""
 
@@ -252,6 +261,99 @@ class BatchManagerConfig(Option):
     )
     """Paths made available to the singularity container."""
 
+    array_command: str = field(
+        default="--array={array}", metadata={"required": False}
+    )
+    """The command used to submit a group of jobs as a single array job."""
+
+    array_task_id_variable: str = field(
+        default="SLURM_ARRAY_TASK_ID", metadata={"required": False}
+    )
+    """The environment variable holding the index of a running array task."""
+
+    array_job_id_variable: str = field(
+        default="SLURM_ARRAY_JOB_ID", metadata={"required": False}
+    )
+    """The environment variable holding the ID of a running array job."""
+
+    array_max_size: int = field(default=1000, metadata={"required": False})
+    """The maximum number of tasks submitted in a single array job."""
+
+    array_command_active: bool = field(default=True, metadata={"required": False})
+    """A boolean indicating whether jobs may be submitted as array jobs."""
+
+    dependency_command: str = field(
+        default="--dependency={dependency_type}:{job_ids}",
+        metadata={"required": False},
+    )
+    """The command used to hold a job until its parent jobs finish."""
+
+    dependency_separator: str = field(default=":", metadata={"required": False})
+    """The separator placed between parent job IDs in the dependency command."""
+
+    job_id_pattern: str = field(
+        default=r"Submitted batch job (\d+)", metadata={"required": False}
+    )
+    """A regular expression capturing the job ID from the submission output."""
+
+    dependency_command_active: bool = field(
+        default=True, metadata={"required": False}
+    )
+    """A boolean indicating whether the dependency command is active."""
+
+    script_submission: bool = field(default=False, metadata={"required": False})
+    """A boolean indicating whether each job is submitted as a generated batch
+    script, with its options as directive lines, rather than as a wrapped
+    command."""
+
+    directive_prefix: str = field(default="#SBATCH", metadata={"required": False})
+    """The prefix marking a line of a batch script as a submission option."""
+
+    submission_workers: int = field(default=4, metadata={"required": False})
+    """How many submissions may be in progress at once."""
+
+    submissions_per_second: float = field(default=5.0, metadata={"required": False})
+    """The most submissions started per second. 0 removes the limit."""
+
+    submission_retries: int = field(default=3, metadata={"required": False})
+    """How many times to retry a submission which failed with a transient error."""
+
+    submission_backoff: float = field(default=2.0, metadata={"required": False})
+    """Seconds to wait before the first retry of a submission. The wait doubles
+    with each further retry."""
+
+    transient_error_pattern: str = field(
+        default=(
+            r"timed out|temporarily unavailable|try again|unable to contact"
+            r"|connection refused|communication error"
+        ),
+        metadata={"required": False},
+    )
+    """A regular expression matching submission errors worth retrying."""
+
+    queue_limit_error_pattern: str = field(
+        default=r"MaxSubmitJob|QOSMax|AssocMax|submit limit|jobs are allowed per user",
+        metadata={"required": False},
+    )
+    """A regular expression matching submission errors caused by a limit on
+    queued jobs. Such submissions are held until the queue has room."""
+
+    max_queued_jobs: int = field(default=0, metadata={"required": False})
+    """The most jobs to have queued at once, counting array tasks. Further
+    submissions are held until queued jobs finish. 0 removes the limit."""
+
+    queued_jobs_command: str = field(
+        default="squeue -h -r -u {user}", metadata={"required": False}
+    )
+    """The command listing your queued jobs, one per line, used to count them."""
+
+    queue_poll_interval: float = field(default=60.0, metadata={"required": False})
+    """Seconds between checks for room in the queue while submissions are held."""
+
+    queue_limit_retries: int = field(default=120, metadata={"required": False})
+    """How many times to wait queue_poll_interval and resubmit a job rejected by a
+    queue limit before its submission fails."""
+
     @classmethod
     def from_default(cls, config_type="unc"):
         defaults = {
@@ -270,6 +372,8 @@ class BatchManagerConfig(Option):
                 "thread_command_active": False,
                 "job_id_command_active": False,
                 "output_command_active": False,
+                "array_command_active": False,
+                "dependency_command_active": False,
                 "singularity_bind_paths": "/proj,/nas02,/nas",
             },
             "duke": {
@@ -288,6 +392,14 @@ class BatchManagerConfig(Option):
                 "fmri_prep_batch_commands": "-e",
                 "time_command_active": False,
                 "thread_command_active": False,
+                "array_command": "-t {array}",
+                "array_task_id_variable": "SGE_TASK_ID",
+                "array_job_id_variable": "JOB_ID",
+                "dependency_command": "-hold_jid {job_ids}",
+                "dependency_separator": ",",
+                "job_id_pattern": r"Your job(?:-array)? (\d+)",
+                "directive_prefix": "#$",
+                "queued_jobs_command": "qstat -u {user}",
                 "singularity_bind_paths": "/mnt",
             },
             "uva": {
@@ -478,6 +590,19 @@ class TemporalFiltering(Option):
     filtering_order: int = field(default=2, metadata={"required": True})
     """Order of the filter. Defaults to 2."""
 
+    zero_phase: bool = field(default=False, metadata={"required": False})
+    """Butterworth only - set 'true' to filter forwards and backwards, which
+    removes the filter's phase shift."""
+
+    chunk_size: int = field(default=0, metadata={"required": False})
+    """Butterworth only - filter this many voxels at a time, streaming them
+    from and to disk, so that memory use is set by this size rather than by the
+    image's. Rounded to whole slices. Set to 0 to filter the whole image at
+    once."""
+
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Butterworth only - number of voxel chunks to filter in parallel."""
+
 
 @dataclass
 class IntensityNormalization(Option):
@@ -486,7 +611,8 @@ class IntensityNormalization(Option):
     implementation: str = field(
         default="10000_GlobalMedian", metadata={"required": True}
     )
-    """Currently limited to '10000_GlobalMedian'"""
+    """Available implementations: 10000_GlobalMedian, 100_voxelmean,
+    10000_GlobalMedian_numpy, 100_voxelmean_numpy"""
 
 
 @dataclass
@@ -494,13 +620,17 @@ class SpatialSmoothing(Option):
     """Apply spatial smoothing to the image data."""
 
     implementation: str = field(default="SUSAN", metadata={"required": True})
-    """Currently limited to 'SUSAN'"""
+    """Available implementations: SUSAN, SUSAN_numpy, masked_gaussian"""
 
     fwhm: int = field(default=6, metadata={"required": True})
     """The size of the smoothing kernel.
     Specifically the full width half max of the Gaussian kernel.
     Scaled in millimeters."""
 
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Number of volumes smoothed in parallel by the "SUSAN_numpy" and
+    "masked_gaussian" implementations."""
+
 
 @dataclass
 class AROMARegression(Option):
@@ -508,6 +638,10 @@ class AROMARegression(Option):
     using AROMA. Also applied to confounds."""
 
     implementation: str = field(default="fsl_regfilt", metadata={"required": True})
+    """Available implementations: fsl_regfilt, fsl_regfilt_R, numpy"""
+
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Number of threads used by the "fsl_regfilt_R" and "numpy" implementations."""
 
 
 @dataclass
@@ -580,6 +714,13 @@ class Resample(Option):
     )
     """Path to an image against which to resample - often a template"""
 
+    implementation: str = field(default="flirt", metadata={"required": False})
+    """Available implementations: flirt, numpy"""
+
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Number of volume blocks resampled in parallel by the "numpy"
+    implementation."""
+
 
 @dataclass
 class TrimTimepoints(Option):
@@ -600,7 +741,30 @@ class ConfoundRegression(Option):
     they will be applied first."""
 
     implementation: str = field(default="afni_3dTproject", metadata={"required": True})
-    """Currently limited to "afni_3dTproject"""
+    """Available implementations: afni_3dTproject, fsl_glm, numpy"""
+
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Number of threads used by the "numpy" implementation."""
+
+
+@dataclass
+class TemporalFilteringConfoundRegression(Option):
+    """Temporally filter the image and regress out the confound file values in a
+    single projection, in place of separate TemporalFiltering and
+    ConfoundRegression steps. The pass band is taken from the TemporalFiltering
+    options. The confounds are not filtered first, as the filter's frequencies
+    are regressed alongside them."""
+
+    basis: str = field(default="sincos", metadata={"required": False})
+    """The regressors used to filter frequencies outside of the pass band.
+    Available bases: sincos, dct"""
+
+    censor: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to leave the timepoints targeted by ScrubTimepoints out of
+    the fit. They are still filtered and regressed."""
+
+    n_threads: int = field(default=1, metadata={"required": False})
+    """Number of voxel blocks to regress in parallel."""
 
 
 @dataclass
@@ -631,6 +795,12 @@ class ProcessingStepOptions(Option):
     trim_timepoints: TrimTimepoints = field(
         default_factory=TrimTimepoints, metadata={"required": True}
     )
+    temporal_filtering_confound_regression: TemporalFilteringConfoundRegression = (
+        field(
+            default_factory=TemporalFilteringConfoundRegression,
+            metadata={"required": False},
+        )
+    )
 
 
 @dataclass
@@ -699,6 +869,27 @@ class BatchOptions(Option):
     n_threads: str = field(default="1", metadata={"required": True})
     """How many threads to allocate per job."""
 
+    pack_size: int = field(default=1, metadata={"required": False})
+    """How many jobs to run together in a single batch allocation. 1 disables
+    packing."""
+
+    pack_parallel_jobs: int = field(default=1, metadata={"required": False})
+    """How many jobs within a pack to run at once. Each pack requests this
+    multiple of the per-job memory and threads."""
+
+    pack_time_usage: str = field(default="", metadata={"required": False})
+    """A target time per pack. If set, packs are sized to fit within it based on
+    the time per job, in place of pack_size."""
+
+    estimate_resources: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to size each job's memory and time from its image's header
+    and the processing steps, in place of memory_usage and time_usage."""
+
+    job_level: str = field(default="image", metadata={"required": False})
+    """'image' submits one job per image. 'subject' submits one job per subject,
+    which runs all of the subject's images in one workflow, in parallel within
+    the job's n_threads and memory request."""
+
 
 @dataclass
 class PostProcessingOptions(Option):
@@ -712,6 +903,27 @@ class PostProcessingOptions(Option):
     write_process_graph: bool = field(default=True, metadata={"required": True})
     """Set 'true' to write a processing graph alongside your output."""
 
+    engine: str = field(default="nipype", metadata={"required": False})
+    """How to run the image processing steps. 'nipype' runs each step as its own
+    workflow, writing an intermediate image after every step. 'fused' loads the
+    image once and runs all steps in memory, writing only the final image."""
+
+    step_cache_directory: str = field(default="", metadata={"required": False})
+    """A directory to save the output of each processing step in, shared by all
+    of your processing streams. A stream starts from the output of the longest
+    sequence of steps it shares with a stream already run on the same image.
+    Used by the 'nipype' engine. Leave empty to disable."""
+
+    step_cache_size_gb: float = field(default=100, metadata={"required": False})
+    """The size limit of the step cache in gigabytes. The least recently used
+    outputs are removed first."""
+
+    intermediate_format: str = field(default="NIFTI", metadata={"required": False})
+    """The format of the images written between processing steps. 'NIFTI' writes
+    them uncompressed, which is faster to write and read back. 'NIFTI_GZ'
+    compresses them, using less working directory space. Exported images are
+    compressed either way, in parallel across the job's n_threads."""
+
     target_directory: str = field(default="", metadata={"required": True})
     """Which directory to process - leave empty to use your config's fMRIPrep output
     directory."""
@@ -815,6 +1027,10 @@ class PostProcessingRunConfig(ClpipeData):
 
     pybids_db_path: str = ""
 
+    scratch_staging: bool = False
+
+    scratch_directory: str = ""
+
     # subjects_to_process: list = field(default_factory=list)
 
     @classmethod
@@ -895,6 +1111,20 @@ class ROIExtractOptions(Option):
     n_threads: str = field(default="1", metadata={"required": True})
     log_directory: str = field(default="", metadata={"required": True})
 
+    pack_size: int = field(default=1, metadata={"required": False})
+    """How many extraction jobs to run together in a single batch allocation.
+    1 disables packing."""
+
+    pack_parallel_jobs: int = field(default=1, metadata={"required": False})
+    """How many extraction jobs within a pack to run at once."""
+
+    pack_time_usage: str = field(default="", metadata={"required": False})
+    """A target time per pack, used to size packs in place of pack_size."""
+
+    estimate_resources: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to size each extraction job's memory and time from the headers
+    of its subject's images, in place of memory_usage and time_usage."""
+
     def populate_project_paths(self, project_directory: os.PathLike):
         self.target_directory = os.path.join(project_directory, "data_postproc")
         self.output_directory = os.path.join(project_directory, "data_ROI_ts")
@@ -986,8 +1216,36 @@ class ProjectOptions(Option):
     batch_config_path: str = field(
         default="slurmUNCConfig.json", metadata={"required": True}
     )
+    record_telemetry: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to record the memory, CPU time, wall time and I/O each job
+    actually uses, for review with 'clpipe reports resources'."""
+    scratch_staging: bool = field(default=False, metadata={"required": False})
+    """Set 'true' to run fMRIPrep, postprocessing and ROI extraction jobs from a
+    node-local scratch directory, copying back only their outputs and crash files.
+    Spares shared storage the small-file I/O of working directories."""
+    scratch_directory: str = field(default="", metadata={"required": False})
+    """Where to create each job's scratch directory, on the compute node.
+    Environment variables are expanded on the node. Leave empty to use $TMPDIR."""
     clpipe_version: str = field(default=VERSION, metadata={"required": True})
 
+    def get_job_registry_path(self) -> str:
+        """Get the path of the project's job registry, or None if the project
+        directory is not set."""
+        if not self.project_directory:
+            return None
+        return os.path.join(
+            self.project_directory, PIPELINE_DIRECTORY, JOB_REGISTRY_FILE_NAME
+        )
+
+    def get_telemetry_path(self) -> str:
+        """Get the path of the project's job telemetry table, or None if the
+        project directory is not set."""
+        if not self.project_directory:
+            return None
+        return os.path.join(
+            self.project_directory, PIPELINE_DIRECTORY, TELEMETRY_FILE_NAME
+        )
+
     def get_logs_dir(self) -> str:
         """Get the project's top level log directory."""
 
@@ -1139,6 +1397,10 @@ KEY_MAP = {
     "docker_fmriprep_version": "DockerFMRIPrepVersion",
     "postprocessing": "PostProcessingOptions2",
     "write_process_graph": "WriteProcessGraph",
+    "engine": "Engine",
+    "step_cache_directory": "StepCacheDirectory",
+    "step_cache_size_gb": "StepCacheSizeGB",
+    "intermediate_format": "IntermediateFormat",
     "target_directory": "TargetDirectory",
     "target_image_space": "TargetImageSpace",
     "target_tasks": "TargetTasks",
@@ -1150,6 +1412,8 @@ KEY_MAP = {
     "filtering_high_pass": "FilteringHighPass",
     "filtering_low_pass": "FilteringLowPass",
     "filtering_order": "FilteringOrder",
+    "zero_phase": "ZeroPhase",
+    "chunk_size": "ChunkSize",
     "intensity_normalization": "IntensityNormalization",
     "spatial_smoothing": "SpatialSmoothing",
     "fwhm": "FWHM",
@@ -1160,6 +1424,9 @@ KEY_MAP = {
     "from_end": "FromEnd",
     "from_beginning": "FromBeginning",
     "confound_regression": "ConfoundRegression",
+    "temporal_filtering_confound_regression": "TemporalFilteringConfoundRegression",
+    "basis": "Basis",
+    "censor": "Censor",
     "confound_options": "ConfoundOptions",
     "columns": "Columns",
     "motion_outliers": "MotionOutliers",
@@ -1170,6 +1437,11 @@ KEY_MAP = {
     "scrub_behind": "ScrubBehind",
     "scrub_contiguous": "ScrubContiguous",
     "batch_options": "BatchOptions",
+    "pack_size": "PackSize",
+    "pack_parallel_jobs": "PackParallelJobs",
+    "pack_time_usage": "PackTimeUsage",
+    "estimate_resources": "EstimateResources",
+    "job_level": "JobLevel",
     "memory_usage": "MemoryUsage",
     "target_suffix": "TargetSuffix",
     "output_suffix": "OutputSuffix",
@@ -1197,6 +1469,9 @@ KEY_MAP = {
     "neighborhood": "Neighborhood",
     "t2_star_extraction": "T2StarExtraction",
     "batch_config_path": "BatchConfig",
+    "record_telemetry": "RecordTelemetry",
+    "scratch_staging": "ScratchStaging",
+    "scratch_directory": "ScratchDirectory",
     "target_variable": "TargetVariable",
     "insert_na": "InsertNA",
     "scrub_columns": "scrub_columns",
@@ -1228,5 +1503,26 @@ BATCH_KEY_MAP = {
     "ThreadCommandActive": "thread_command_active",
     "JobIDCommandActive": "job_id_command_active",
     "OutputCommandActive": "output_command_active",
-    "SingularityBindPaths": "singularity_bind_paths"
+    "SingularityBindPaths": "singularity_bind_paths",
+    "ArrayCommand": "array_command",
+    "ArrayTaskIDVariable": "array_task_id_variable",
+    "ArrayJobIDVariable": "array_job_id_variable",
+    "ArrayMaxSize": "array_max_size",
+    "ArrayCommandActive": "array_command_active",
+    "DependencyCommand": "dependency_command",
+    "DependencySeparator": "dependency_separator",
+    "JobIDPattern": "job_id_pattern",
+    "DependencyCommandActive": "dependency_command_active",
+    "ScriptSubmission": "script_submission",
+    "DirectivePrefix": "directive_prefix",
+    "SubmissionWorkers": "submission_workers",
+    "SubmissionsPerSecond": "submissions_per_second",
+    "SubmissionRetries": "submission_retries",
+    "SubmissionBackoff": "submission_backoff",
+    "TransientErrorPattern": "transient_error_pattern",
+    "QueueLimitErrorPattern": "queue_limit_error_pattern",
+    "MaxQueuedJobs": "max_queued_jobs",
+    "QueuedJobsCommand": "queued_jobs_command",
+    "QueuePollInterval": "queue_poll_interval",
+    "QueueLimitRetries": "queue_limit_retries",
 }
\ No newline at end of file
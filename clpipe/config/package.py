@@ -54,6 +54,10 @@ ENTRY_POINTS = """
       fmri_postprocess=clpipe.cli:fmri_postprocess_cli
       fmri_postprocess2=clpipe.cli:fmri_postprocess2_cli
       postprocess_image=clpipe.cli:postprocess_image_cli
+      postprocess_subject_images=clpipe.cli:postprocess_subject_images_cli
+      run_job_pack=clpipe.cli:run_job_pack_cli
+      run_with_telemetry=clpipe.cli:run_with_telemetry_cli
+      run_in_scratch=clpipe.cli:run_in_scratch_cli
       glm_l1_preparefsf=clpipe.cli:glm_l1_preparefsf_cli
       glm_l1_launch=clpipe.cli:glm_l1_launch_cli
       glm_l2_preparefsf=clpipe.cli:glm_l2_preparefsf_cli
@@ -6,6 +6,7 @@ from .job_manager import JobManagerFactory, Job
 from .config.options import ProjectOptions
 from .utils import get_logger
 from .status import needs_processing, write_record
+from . import scratch_staging
 
 STEP_NAME = "fmriprep-process"
 BASE_SINGULARITY_CMD = (
@@ -57,8 +58,13 @@ def fmriprep_process(
 
     logger = get_logger(STEP_NAME, debug=debug, log_dir=config.get_logs_dir())
 
-    # Check to make sure working directory has been changed from the default
-    if config.fmriprep.working_directory == ProjectOptions().fmriprep.working_directory:
+    # Check to make sure working directory has been changed from the default,
+    #   unless jobs work in scratch
+    if (
+        not config.scratch_staging
+        and config.fmriprep.working_directory
+        == ProjectOptions().fmriprep.working_directory
+    ):
         logger.error(
             "A working directory for this step must be provided in your config file."
         )
@@ -153,7 +159,10 @@ def fmriprep_process(
         mem_use=config.fmriprep.fmriprep_memory_usage,
         time=config.fmriprep.fmriprep_time_usage,
         threads=config.fmriprep.n_threads,
-        email=config.email_address
+        email=config.email_address,
+        registry=config.get_job_registry_path(),
+        step=STEP_NAME,
+        telemetry=config.get_telemetry_path() if config.record_telemetry else None,
     )
 
     thread_command_active = batch_manager.config.thread_command_active
@@ -165,10 +174,20 @@ def fmriprep_process(
         logger.debug("Threads command: ACTIVE")
         threads_arg = f"{N_THREADS_FLAG} " + config.fmriprep.n_threads
 
+    working_dir = config.fmriprep.working_directory
+    if config.scratch_staging:
+        logger.debug("Scratch staging: ON")
+        # fMRIPrep writes its crash files to the output directory, so nothing
+        #   needs to be copied back from the working directory
+        working_dir = scratch_staging.SCRATCH_DIR_PLACEHOLDER
+        singularity_bind_paths = ",".join(
+            path for path in (working_dir, singularity_bind_paths) if path
+        )
+
     fmriprep_args = {
         "bids_dir": config.fmriprep.bids_directory,
         "output_dir": config.fmriprep.output_directory,
-        "working_dir": config.fmriprep.working_directory,
+        "working_dir": working_dir,
         "fslicense": config.fmriprep.freesurfer_license_path,
         "threads": threads_arg,
         "useAROMA": use_aroma_arg,
@@ -190,7 +209,12 @@ def fmriprep_process(
 
             submission_string = BASE_SINGULARITY_CMD.format(**fmriprep_args)
 
-        batch_manager.add_job("sub-" + sub + "_fmriprep", submission_string)
+        job_name = "sub-" + sub + "_fmriprep"
+        if config.scratch_staging:
+            submission_string = scratch_staging.wrap_command(
+                submission_string, job_name, config.scratch_directory
+            )
+        batch_manager.add_job(job_name, submission_string)
 
     if submit:
         batch_manager.submit_jobs()
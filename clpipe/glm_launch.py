@@ -1,9 +1,11 @@
 import os
+import re
 import sys
 from pathlib import Path
 
 from .config.glm import *
 from .job_manager import JobManagerFactory
+from .resource_estimator import STEP_FEAT, estimate_resources
 from .utils import get_logger
 
 DEFAULT_BATCH_CONFIG_PATH = "slurmUNCConfig.json"
@@ -22,6 +24,7 @@ STEP_NAME = "glm-launch"
 #   libraries
 SUBMISSION_STRING_TEMPLATE = "unset PYTHONPATH; feat {fsf_file}"
 DEPRECATION_MSG = "Using deprecated GLM setup file."
+FSF_FEAT_FILE_PATTERN = re.compile(r'^\s*set feat_files\(\d+\) "(.*)"')
 
 
 def glm_launch(
@@ -64,7 +67,9 @@ def glm_launch(
         n_threads = int(batch_options["NThreads"])
         batch_config_path = glm_config.parent_options.batch_config_path
         email = batch_options["Email"]
+        estimate = batch_options.get("EstimateResources", False)
     except KeyError:
+        estimate = False
         if level == L1:
             memory_usage = DEFAULT_L1_MEMORY_USAGE
             time_usage = DEFAULT_L1_TIME_USAGE
@@ -96,7 +101,14 @@ def glm_launch(
         mem_use=memory_usage,
         time=time_usage,
         threads=n_threads,
-        email=email
+        email=email,
+        registry=glm_config.parent_options.get_job_registry_path(),
+        step=STEP_NAME,
+        telemetry=(
+            glm_config.parent_options.get_telemetry_path()
+            if glm_config.parent_options.record_telemetry
+            else None
+        ),
     )
 
     submission_strings = _create_submission_strings(fsf_dir, test_one=test_one)
@@ -104,7 +116,17 @@ def glm_launch(
     num_jobs = len(submission_strings)
 
     for key in submission_strings.keys():
-        batch_manager.add_job(key, submission_strings[key])
+        resources = {}
+        # Only first level models run directly on images that can be sized
+        if estimate and level == L1:
+            resource_estimate = estimate_resources(
+                _get_fsf_images(Path(fsf_dir) / f"{key}.fsf"),
+                [STEP_FEAT],
+                logger=logger,
+            )
+            if resource_estimate:
+                resources = resource_estimate._asdict()
+        batch_manager.add_job(key, submission_strings[key], **resources)
 
     if submit:
         logger.info(f"Running {num_jobs} job(s) in batch mode")
@@ -129,3 +151,17 @@ def _create_submission_strings(fsf_files: os.PathLike, test_one: bool = False):
         if test_one:
             break
     return submission_strings
+
+
+def _get_fsf_images(fsf_file: os.PathLike):
+    """List the 4D input images of a first level .fsf file."""
+    images = []
+    try:
+        with open(fsf_file) as fsf:
+            for line in fsf:
+                match = FSF_FEAT_FILE_PATTERN.match(line)
+                if match:
+                    images.append(match.group(1))
+    except FileNotFoundError:
+        pass
+    return images
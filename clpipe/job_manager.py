@@ -1,10 +1,27 @@
 import json
+import math
 from pkg_resources import resource_stream
 import os
+import re
+import shlex
 import subprocess
 import sys
+import threading
+import time as timer
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import psutil
 
 from .utils import get_logger
+from .job_registry import (
+    JobRegistry,
+    STATE_CANCELLED,
+    STATE_COMPLETED,
+    STATE_FAILED,
+    STATE_SUBMITTED,
+)
+from .job_telemetry import wrap_command
+from .submission_engine import QueueLimiter, RateLimiter
 from clpipe.config.options import BatchManagerConfig
 
 # TODO: We need to update the batch manager to be more flexible,
@@ -13,14 +30,67 @@ from clpipe.config.options import BatchManagerConfig
 
 LOGGER_NAME = "batch-manager"
 OUTPUT_FORMAT_STR = "Output-{jobid}-jobid-%j.out"
+ARRAY_OUTPUT_FORMAT_STR = "Output-{jobid}-jobid-%A_%a.out"
+ARRAY_TASK_OUTPUT_FORMAT_STR = "Output-{jobid}-jobid-${{{array_job_id}}}_${{{task_id}}}.out"
+ARRAY_JOB_NAME_FORMAT_STR = "{jobid}-array-{size}"
+ARRAY_TASK_DIR = "array_tasks"
+BATCH_SCRIPT_DIR = "batch_scripts"
+BATCH_SCRIPT_SHEBANG = "#!/bin/bash"
+PACK_JOB_NAME_FORMAT_STR = "{jobid}-pack-{size}"
+PACK_DIR = "job_packs"
+PACK_STATUS_FILE_SUFFIX = "_status.tsv"
+PACK_RUNNER_COMMAND = "run_job_pack {pack_file}"
+ARRAY_FORMAT_STR = "{array}"
 JOB_ID_FORMAT_STR = "{jobid}"
+LOCAL_OUTPUT_FORMAT_STR = "Output-{jobid}-local.out"
 MAX_JOB_DISPLAY = 5
 
+DEPENDENCY_AFTER_OK = "afterok"
+DEPENDENCY_AFTER_ANY = "afterany"
+DEPENDENCY_TYPES = [DEPENDENCY_AFTER_OK, DEPENDENCY_AFTER_ANY]
+
+FAILURE_POLICY_CONTINUE = "continue"
+FAILURE_POLICY_FAIL_FAST = "fail_fast"
+FAILURE_POLICIES = [FAILURE_POLICY_CONTINUE, FAILURE_POLICY_FAIL_FAST]
+
+MEMORY_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+MEMORY_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT])?B?\s*$", re.IGNORECASE)
+TIME_PATTERN = re.compile(r"^\s*(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?\s*$")
+
+ARRAY_TASK_SCRIPT_HEAD = """#!/bin/bash
+# Task table for array job {jobid}: maps each array task index to one command.
+case "${{{task_id}}}" in
+"""
+ARRAY_TASK_ENTRY = """{index})
+    ( {command} ) > "{output}" 2>&1
+    ;;
+"""
+ARRAY_TASK_SCRIPT_TAIL = """*)
+    echo "No command found for array task ${{{task_id}}}" >&2
+    exit 1
+    ;;
+esac
+"""
+
 
 class JobManager:
-    def __init__(self, output_directory=None, debug=False):
+    def __init__(
+        self,
+        output_directory=None,
+        debug=False,
+        registry=None,
+        step=None,
+        telemetry=None,
+    ):
         self.debug = debug
         self.logger = get_logger(LOGGER_NAME, debug=debug)
+        # Where submitted jobs are recorded, along with the step they belong to
+        if registry is not None and not isinstance(registry, JobRegistry):
+            registry = JobRegistry(registry, debug=debug)
+        self.registry = registry
+        self.step = step
+        # Where to record the resources each job actually uses, if anywhere
+        self.telemetry = telemetry
         if output_directory is None:
             self.logger.warning(
                 ("No output directory provided " "- defaulting to current directory")
@@ -57,6 +127,22 @@ class JobManager:
     def add_job(self):
         ...
 
+    def launch_command(self, job):
+        """The command to launch for a job, wrapped to record its resource usage
+        if telemetry is on."""
+        if self.telemetry is None:
+            return job.command
+        mem_use, time, threads = job.resources
+        return wrap_command(
+            job.command,
+            self.telemetry,
+            job.job_name,
+            step=self.step,
+            mem_use=mem_use,
+            time=time,
+            threads=threads,
+        )
+
     def submit_jobs(self):
         ...
 
@@ -71,8 +157,15 @@ class BatchJobManager(JobManager):
         time=None,
         threads=None,
         email=None,
+        array=False,
+        pack_size=1,
+        pack_parallel=1,
+        pack_time=None,
+        registry=None,
+        step=None,
+        telemetry=None,
     ):
-        super().__init__(output_directory, debug)
+        super().__init__(output_directory, debug, registry, step, telemetry)
         self.config = batch_system_config
 
         self.config.mem_use = mem_use if mem_use else self.config.memory_default
@@ -80,49 +173,266 @@ class BatchJobManager(JobManager):
         self.config.threads = threads if threads else self.config.n_threads_default
         self.config.email = email if email else self.config.email_address_default
 
+        self.array = array and self.config.array_command_active
+
+        self.pack_parallel = max(int(pack_parallel) if pack_parallel else 1, 1)
+        self.pack_size = self.calc_pack_size(pack_size, pack_time)
+
         self.header = self.create_submission_head()
+        # Every batch script of this manager starts with the same header
+        self.script_header = (
+            self.create_script_header() if self.config.script_submission else None
+        )
+
+        self._rate_limiter = RateLimiter(self.config.submissions_per_second)
+        self._queue_limiter = QueueLimiter(
+            self.config.max_queued_jobs,
+            self.config.queued_jobs_command,
+            self.config.queue_poll_interval,
+            logger=self.logger,
+        )
+        self._registry_lock = threading.Lock()
+
+    @property
+    def resources(self):
+        """The manager's default (memory, time, threads) request for each job."""
+        return (self.config.mem_use, self.config.time, self.config.threads)
 
-    def create_submission_head(self):
+    def calc_pack_size(self, pack_size=1, pack_time=None):
+        """Determine how many jobs to run together in each packed job.
+
+        If a target time per pack is given, packs are sized so that their
+        estimated run time, at the manager's time per job and running
+        `pack_parallel` jobs at once, fits within it.
+        """
+        if pack_time:
+            job_seconds = parse_time(self.config.time)
+            if not job_seconds:
+                raise ValueError(
+                    "A time per job is required to size packs by pack time."
+                )
+            rounds = max(parse_time(pack_time) // job_seconds, 1)
+            return int(rounds * self.pack_parallel)
+        return max(int(pack_size) if pack_size else 1, 1)
+
+    def create_submission_head(
+        self,
+        output_directory=None,
+        output_format=OUTPUT_FORMAT_STR,
+        array=False,
+        dependency=None,
+        resources=None,
+    ):
+        """Build the submission command used for each job.
+
+        Takes the same arguments as create_job_options.
+        """
         head = [self.config.submission_head]
+        head += self.create_shared_options()
+        head += self.create_job_options(
+            output_directory, output_format, array, dependency, resources
+        )
+        head.append(self.config.command_wrapper)
+
+        return " ".join(head)
+
+    def create_shared_options(self):
+        """Build the submission options shared by every job of this manager."""
+        options = []
         for e in self.config.submission_options:
             temp = e["command"] + " " + e["args"]
-            head.append(temp)
+            options.append(temp)
         for e in self.config.sub_options_equal:
             temp = e["command"] + "=" + e["args"]
-            head.append(temp)
+            options.append(temp)
+        if self.config.email:
+            options.append(self.config.email_command.format(email=self.config.email))
+
+        return options
 
-        head.append(self.config.memory_command.format(mem=self.config.mem_use))
+    def create_job_options(
+        self,
+        output_directory=None,
+        output_format=OUTPUT_FORMAT_STR,
+        array=False,
+        dependency=None,
+        resources=None,
+    ):
+        """Build the submission options specific to a job.
+
+        Options may contain "{jobid}" and "{array}" placeholders for the job's
+        name and array range.
+
+        Args:
+            output_directory: Where the batch system should write the job's output.
+                Defaults to the manager's output directory.
+            output_format: The file name format of the job's output.
+            array: Whether to include the array command, leaving an "{array}"
+                placeholder for the range of task indexes.
+            dependency: A rendered dependency command to hold the job on its
+                parents, if any.
+            resources: A (memory, time, threads) request overriding the manager's.
+        """
+        if output_directory is None:
+            output_directory = self.output_dir
+        mem_use, time, threads = resources if resources else self.resources
+
+        options = [self.config.memory_command.format(mem=mem_use)]
         if self.config.time_command_active:
-            head.append(self.config.time_command.format(time=self.config.time))
+            options.append(self.config.time_command.format(time=time))
         if self.config.thread_command_active:
-            head.append(
-                self.config.n_threads_command.format(
-                    nthreads=self.config.threads
-                )
-            )
+            options.append(self.config.n_threads_command.format(nthreads=threads))
         if self.config.job_id_command_active:
-            head.append(self.config.job_id_command.format(jobid=JOB_ID_FORMAT_STR))
+            options.append(self.config.job_id_command.format(jobid=JOB_ID_FORMAT_STR))
         if self.config.output_command_active:
-            head.append(
+            options.append(
                 self.config.output_command.format(
                     output=os.path.abspath(
-                        os.path.join(self.output_dir, OUTPUT_FORMAT_STR)
+                        os.path.join(output_directory, output_format)
                     )
                 )
             )
-        if self.config.email:
-            head.append(
-                self.config.email_command.format(
-                    email=self.config.email
-                )
+        if array:
+            options.append(self.config.array_command.format(array=ARRAY_FORMAT_STR))
+        if dependency:
+            options.append(dependency)
+
+        return options
+
+    def create_script_header(self):
+        """Build the start of every batch script of this manager: the shell to
+        use and the shared options, as directive lines."""
+        header = [BATCH_SCRIPT_SHEBANG]
+        for option in self.create_shared_options():
+            header.append(f"{self.config.directive_prefix} {option}")
+
+        return "\n".join(header)
+
+    def write_job_script(self, job, dependency=None):
+        """Write a job's batch script, returning its path.
+
+        The script starts with the manager's shared header, followed by the job's
+        own options as directive lines, then the job's command. Commands are
+        written as they are, so they need no quoting for the submission command.
+        """
+        script_dir = os.path.join(self.output_dir, BATCH_SCRIPT_DIR)
+        os.makedirs(script_dir, exist_ok=True)
+        script_path = self._script_path(job)
+
+        if job.array_jobs:
+            options = self.create_job_options(
+                output_format=ARRAY_OUTPUT_FORMAT_STR,
+                array=True,
+                dependency=dependency,
+                resources=job.resources,
             )
-        head.append(self.config.command_wrapper)
+            array = f"1-{len(job.array_jobs)}"
+        else:
+            options = self.create_job_options(
+                job.output_directory, dependency=dependency, resources=job.resources
+            )
+            array = None
+        script = [self.script_header]
+        for option in options:
+            if option:
+                option = option.format(jobid=job.job_name, array=array)
+                script.append(f"{self.config.directive_prefix} {option}")
 
-        return " ".join(head)
+        # Array tasks and a pack's jobs are measured individually
+        if job.array_jobs or job.pack_jobs:
+            command = job.command
+        else:
+            command = self.launch_command(job)
+        script += ["", command, ""]
+
+        with open(script_path, "w") as f:
+            f.write("\n".join(script))
+        self.logger.debug(f"Wrote batch script: {script_path}")
+
+        return script_path
+
+    def _script_path(self, job):
+        return os.path.join(self.output_dir, BATCH_SCRIPT_DIR, f"{job.job_name}.sh")
+
+    def add_job(
+        self,
+        job_name,
+        job_string,
+        output_directory=None,
+        parent_jobs=None,
+        dependency_type=DEPENDENCY_AFTER_OK,
+        mem_use=None,
+        time=None,
+        threads=None,
+    ):
+        """Queue a job for submission.
+
+        Args:
+            job_name: The name of the job.
+            job_string: The command the job should run.
+            output_directory: Where to write this job's output, if different from
+                the manager's output directory.
+            parent_jobs: Jobs which must finish before this job starts.
+            dependency_type: "afterok" to start only if all parents succeed, or
+                "afterany" to start once they finish in any state.
+            mem_use: The job's memory request, if different from the manager's.
+            time: The job's time request, if different from the manager's.
+            threads: The job's thread count, if different from the manager's.
+
+        Returns:
+            The queued Job, which may be given as a parent of later jobs.
+        """
+        if output_directory is None:
+            output_directory = self.output_dir
+        else:
+            output_directory = os.path.abspath(output_directory)
+            os.makedirs(output_directory, exist_ok=True)
+
+        job = Job(
+            job_name,
+            None,
+            command=job_string,
+            output_directory=output_directory,
+            resources=(
+                mem_use if mem_use else self.config.mem_use,
+                time if time else self.config.time,
+                threads if threads else self.config.threads,
+            ),
+            parent_jobs=parent_jobs,
+            dependency_type=dependency_type,
+        )
+        job.job_string = self.render_job(job)
+        self.job_queue.append(job)
+
+        return job
 
-    def add_job(self, job_name, job_string):
-        job_string = self.header.format(jobid=job_name, cmdwrap=job_string)
-        self.job_queue.append(Job(job_name, job_string))
+    def render_job(self, job, dependency=None):
+        """Build the full submission string of a job or array job.
+
+        With script submission, this is the command which submits the job's
+        script, as the options are written to the script itself.
+        """
+        if self.config.script_submission:
+            return f"{self.config.submission_head} {self._script_path(job)}"
+        if job.array_jobs:
+            header = self.create_submission_head(
+                output_format=ARRAY_OUTPUT_FORMAT_STR,
+                array=True,
+                dependency=dependency,
+                resources=job.resources,
+            )
+            return header.format(
+                jobid=job.job_name,
+                array=f"1-{len(job.array_jobs)}",
+                cmdwrap=job.command,
+            )
+
+        header = self.create_submission_head(
+            job.output_directory, dependency=dependency, resources=job.resources
+        )
+        # A pack's jobs are measured individually by the pack runner
+        command = job.command if job.pack_jobs else self.launch_command(job)
+        return header.format(jobid=job.job_name, cmdwrap=command)
 
     def submit_jobs(self):
         self.logger.info(f"Submitting {len(self.job_queue)} job(s) in batch.")
@@ -130,28 +440,541 @@ class BatchJobManager(JobManager):
         self.logger.debug(f"Time usage: {self.config.time}")
         self.logger.debug(f"Number of threads: {self.config.threads}")
         self.logger.debug(f"Email: {self.config.email}")
-        for job in self.job_queue:
-            # os.system(job.job_string)
-            subprocess.run(job.job_string, shell=True)
+
+        # Order parents before their children, which also checks for cycles
+        submissions = sort_jobs(self.job_queue)
+
+        if self.pack_size > 1:
+            submissions = self.create_packs(submissions)
+        if self.array:
+            submissions = self.create_array_jobs(submissions)
+        if len(submissions) != len(self.job_queue):
+            self.logger.info(
+                f"Grouped {len(self.job_queue)} job(s) into "
+                f"{len(submissions)} submission(s)."
+            )
+
+        # Jobs are submitted concurrently, each once the submissions holding its
+        #   parents are done, so that their scheduler IDs are known when the
+        #   dependencies are set
+        waiting_on, children = dependency_graph(submissions)
+        workers = max(int(self.config.submission_workers or 1), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            ready = [job for job in submissions if not waiting_on[id(job)]]
+            while ready or running:
+                for job in ready:
+                    running[executor.submit(self._submit_job, job)] = job
+                ready = []
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    future.result()
+                    ready.extend(release_children(job, children, waiting_on))
+
+        self._log_submission_summary(submissions)
         self.job_queue.clear()
 
+        return submissions
+
+    def _log_submission_summary(self, submissions):
+        """Report how many jobs were submitted, naming any which were not."""
+        failed = [
+            member
+            for job in submissions
+            if job.submission_error is not None
+            for member, _ in job.leaf_jobs()
+        ]
+        total = sum(len(list(job.leaf_jobs())) for job in submissions)
+        self.logger.info(
+            f"Submission complete: {total - len(failed)} of {total} job(s) "
+            f"submitted in {len(submissions)} submission(s), {len(failed)} failed."
+        )
+        if not failed:
+            return
+
+        names = ", ".join(str(job.job_name) for job in failed[:MAX_JOB_DISPLAY])
+        if len(failed) > MAX_JOB_DISPLAY:
+            names += f" and {len(failed) - MAX_JOB_DISPLAY} more"
+        message = f"Failed to submit: {names}."
+        if self.registry is not None:
+            message += " Retry them with 'clpipe jobs resubmit -failed'."
+        self.logger.error(message)
+
+    def _submit_job(self, job) -> bool:
+        """Submit a single job, recording the scheduler ID given to it.
+
+        Submissions failing with a transient error are retried with exponential
+        backoff, and those refused by a queue limit are held until it has room.
+
+        Returns:
+            bool: Whether the job was submitted.
+        """
+        dependency = None
+        if job.parent_jobs:
+            if self.config.dependency_command_active:
+                unsubmitted = [
+                    str(parent.job_name)
+                    for parent in job.parent_jobs
+                    if parent.scheduler_id is None
+                ]
+                if unsubmitted:
+                    return self._fail_submission(
+                        job,
+                        f"parent job(s) {', '.join(unsubmitted)} were not submitted.",
+                    )
+                dependency = self.config.dependency_command.format(
+                    dependency_type=job.dependency_type,
+                    job_ids=self.config.dependency_separator.join(
+                        str(parent.scheduler_id) for parent in job.parent_jobs
+                    ),
+                )
+                if not self.config.script_submission:
+                    job.job_string = self.render_job(job, dependency=dependency)
+            else:
+                self.logger.warning(
+                    f"Batch system does not support job dependencies - job "
+                    f"{job.job_name} will not wait for its parent job(s)."
+                )
+
+        self.logger.debug(job.job_string)
+        if self.config.script_submission:
+            # The script is submitted directly, without a shell to parse it
+            script_path = self.write_job_script(job, dependency=dependency)
+            submission = shlex.split(self.config.submission_head) + [script_path]
+        else:
+            submission = job.job_string
+
+        queued = len(job.array_jobs) if job.array_jobs else 1
+        self._queue_limiter.acquire(queued)
+        retries = 0
+        queue_limit_waits = 0
+        while True:
+            self._rate_limiter.wait()
+            try:
+                result = subprocess.run(
+                    submission,
+                    shell=not self.config.script_submission,
+                    capture_output=True,
+                    text=True,
+                )
+            except OSError as err:
+                # Without a shell, a missing submission command raises
+                self._queue_limiter.release(queued)
+                return self._fail_submission(job, str(err))
+            if result.returncode == 0:
+                break
+
+            error = (result.stderr or result.stdout).strip()
+            if queue_limit_waits < self.config.queue_limit_retries and re.search(
+                self.config.queue_limit_error_pattern, error, re.IGNORECASE
+            ):
+                queue_limit_waits += 1
+                self.logger.info(
+                    f"Queue limit reached submitting job {job.job_name} - "
+                    f"retry {queue_limit_waits} of {self.config.queue_limit_retries} "
+                    f"in {self.config.queue_poll_interval}s."
+                )
+                timer.sleep(self.config.queue_poll_interval)
+                continue
+            if retries < self.config.submission_retries and re.search(
+                self.config.transient_error_pattern, error, re.IGNORECASE
+            ):
+                delay = self.config.submission_backoff * 2**retries
+                retries += 1
+                self.logger.warning(
+                    f"Submission of job {job.job_name} failed ({error}) - "
+                    f"retry {retries} of {self.config.submission_retries} "
+                    f"in {delay}s."
+                )
+                timer.sleep(delay)
+                continue
+            self._queue_limiter.release(queued)
+            return self._fail_submission(job, error)
+
+        if result.stdout:
+            self.logger.info(result.stdout.strip())
+        match = re.search(self.config.job_id_pattern, result.stdout)
+        if match is None:
+            self.logger.debug(
+                f"Could not find a scheduler ID for job {job.job_name}."
+            )
+        else:
+            job.set_scheduler_id(match.group(1))
+        self._record_job(job, STATE_SUBMITTED)
+        return True
+
+    def _fail_submission(self, job, error) -> bool:
+        """Record that a job could not be submitted, so that it isn't lost."""
+        job.submission_error = error
+        self.logger.error(f"Failed to submit job {job.job_name}: {error}")
+        self._record_job(job, STATE_FAILED)
+        return False
+
+    def _record_job(self, job, state):
+        """Record each job run within a submission in the job registry."""
+        if self.registry is None:
+            return
+        with self._registry_lock:
+            for member, array_task in job.leaf_jobs():
+                self.registry.record_job(
+                    member,
+                    step=self.step,
+                    batch_config=self.config,
+                    state=state,
+                    array_task=array_task,
+                )
+
+    def create_array_jobs(self, jobs=None):
+        """Collapse a list of jobs into array jobs.
+
+        Jobs are grouped by their resource request and their dependencies, so
+        that each distinct combination of memory, time, threads and parents becomes
+        a single submission of up to `array_max_size` tasks. Groups with only one
+        job are submitted as-is.
+
+        Args:
+            jobs: The jobs to group, in submission order. Defaults to the job queue.
+
+        Returns:
+            A list of Jobs to submit in place of the given jobs.
+        """
+        if jobs is None:
+            jobs = self.job_queue
+
+        submissions = []
+        for chunk in group_jobs(jobs, self.config.array_max_size):
+            if len(chunk) == 1:
+                submissions.append(chunk[0])
+                continue
+
+            array_name = ARRAY_JOB_NAME_FORMAT_STR.format(
+                jobid=chunk[0].job_name, size=len(chunk)
+            )
+            task_script = self._write_array_task_script(array_name, chunk)
+            array_job = Job(
+                array_name,
+                None,
+                command=f"bash {task_script}",
+                output_directory=self.output_dir,
+                resources=chunk[0].resources,
+                parent_jobs=chunk[0].parent_jobs,
+                dependency_type=chunk[0].dependency_type,
+                array_jobs=chunk,
+            )
+            array_job.job_string = self.render_job(array_job)
+            submissions.append(array_job)
+
+        return submissions
+
+    def create_packs(self, jobs=None):
+        """Pack a list of jobs into fewer, larger jobs.
+
+        Jobs sharing a resource request and dependencies are packed `pack_size` at
+        a time. Each pack runs its jobs inside one allocation with the job pack
+        runner, `pack_parallel` at a time, so it requests that multiple of the
+        per-job memory and threads, and enough time for its jobs to run in turn.
+
+        Args:
+            jobs: The jobs to pack, in submission order. Defaults to the job queue.
+
+        Returns:
+            A list of Jobs to submit in place of the given jobs.
+        """
+        if jobs is None:
+            jobs = self.job_queue
+
+        pack_dir = os.path.join(self.output_dir, PACK_DIR)
+        os.makedirs(pack_dir, exist_ok=True)
+
+        submissions = []
+        for chunk in group_jobs(jobs, self.pack_size):
+            if len(chunk) == 1:
+                submissions.append(chunk[0])
+                continue
+
+            pack_name = PACK_JOB_NAME_FORMAT_STR.format(
+                jobid=chunk[0].job_name, size=len(chunk)
+            )
+            parallel = min(self.pack_parallel, len(chunk))
+            pack_file = os.path.join(pack_dir, f"{pack_name}.json")
+            with open(pack_file, "w") as f:
+                json.dump(
+                    {
+                        "max_parallel": parallel,
+                        "jobs": [
+                            {
+                                "job_name": str(job.job_name),
+                                "command": self.launch_command(job),
+                                "output_directory": job.output_directory,
+                            }
+                            for job in chunk
+                        ],
+                    },
+                    f,
+                    indent=4,
+                )
+
+            mem_use, time, threads = chunk[0].resources
+            rounds = -(-len(chunk) // parallel)
+            pack = Job(
+                pack_name,
+                None,
+                command=PACK_RUNNER_COMMAND.format(pack_file=pack_file),
+                output_directory=self.output_dir,
+                resources=(
+                    scale_memory(mem_use, parallel),
+                    format_time(parse_time(time) * rounds) if time else time,
+                    int(threads) * parallel if threads else threads,
+                ),
+                parent_jobs=chunk[0].parent_jobs,
+                dependency_type=chunk[0].dependency_type,
+                pack_jobs=chunk,
+            )
+            pack.job_string = self.render_job(pack)
+            submissions.append(pack)
+
+        return submissions
+
+    def _write_array_task_script(self, array_name, jobs):
+        """Write the script mapping each array task index to its job's command."""
+        task_dir = os.path.join(self.output_dir, ARRAY_TASK_DIR)
+        os.makedirs(task_dir, exist_ok=True)
+        task_script = os.path.join(task_dir, f"{array_name}.sh")
+
+        task_id = self.config.array_task_id_variable
+        with open(task_script, "w") as f:
+            f.write(ARRAY_TASK_SCRIPT_HEAD.format(jobid=array_name, task_id=task_id))
+            for index, job in enumerate(jobs, start=1):
+                output = os.path.join(
+                    job.output_directory,
+                    ARRAY_TASK_OUTPUT_FORMAT_STR.format(
+                        jobid=job.job_name,
+                        array_job_id=self.config.array_job_id_variable,
+                        task_id=task_id,
+                    ),
+                )
+                f.write(
+                    ARRAY_TASK_ENTRY.format(
+                        index=index, command=self.launch_command(job), output=output
+                    )
+                )
+            f.write(ARRAY_TASK_SCRIPT_TAIL.format(task_id=task_id))
+        self.logger.debug(f"Wrote array task table: {task_script}")
+
+        return task_script
+
 
 class LocalJobManager(JobManager):
-    def __init__(self, output_directory=None, debug=False):
-        super().__init__(output_directory, debug)
+    """Runs jobs on the local machine with a pool of worker processes.
+
+    The number of jobs run at once is capped by the available cores divided by
+    each job's thread count and, if a per-job memory budget is given, by the
+    machine's total memory divided by that budget. Each job's stdout and stderr
+    are streamed to its own log file.
+    """
 
-    def add_job(self, job_name, job_string):
-        job = Job(job_name, job_string)
+    def __init__(
+        self,
+        output_directory=None,
+        debug=False,
+        mem_use=None,
+        threads=None,
+        max_workers=None,
+        failure_policy=FAILURE_POLICY_CONTINUE,
+        registry=None,
+        step=None,
+        telemetry=None,
+    ):
+        super().__init__(output_directory, debug, registry, step, telemetry)
+
+        if failure_policy not in FAILURE_POLICIES:
+            raise ValueError(
+                f"Unknown failure policy '{failure_policy}'. "
+                f"Must be one of: {', '.join(FAILURE_POLICIES)}"
+            )
+        self.failure_policy = failure_policy
+        self.mem_use = mem_use
+        self.threads = int(threads) if threads else 1
+        self.max_workers = (
+            max_workers if max_workers else self.calc_max_workers(mem_use, threads)
+        )
+
+        self._stop = threading.Event()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def calc_max_workers(mem_use=None, threads=None):
+        """Determine how many jobs can run at once on this machine.
+
+        Args:
+            mem_use: The memory budget of a single job, e.g. "20G". A bare
+                number is taken to be in megabytes.
+            threads: The number of threads used by a single job.
+        """
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = os.cpu_count() or 1
+        max_workers = max(cores // max(int(threads) if threads else 1, 1), 1)
+
+        job_memory = parse_memory(mem_use)
+        if job_memory:
+            total_memory = psutil.virtual_memory().total
+            max_workers = min(max_workers, max(total_memory // job_memory, 1))
+
+        return int(max_workers)
+
+    def add_job(
+        self,
+        job_name,
+        job_string,
+        output_directory=None,
+        parent_jobs=None,
+        dependency_type=DEPENDENCY_AFTER_OK,
+        mem_use=None,
+        time=None,
+        threads=None,
+    ):
+        if output_directory is None:
+            output_directory = self.output_dir
+        else:
+            output_directory = os.path.abspath(output_directory)
+            os.makedirs(output_directory, exist_ok=True)
+
+        job = Job(
+            job_name,
+            job_string,
+            output_directory=output_directory,
+            resources=(
+                mem_use if mem_use else self.mem_use,
+                time,
+                threads if threads else self.threads,
+            ),
+            parent_jobs=parent_jobs,
+            dependency_type=dependency_type,
+        )
         self.job_queue.append(job)
 
+        return job
+
     def submit_jobs(self):
-        self.logger.info(f"Submitting {len(self.job_queue)} job(s) locally.")
-        processes = []
-        for job in self.job_queue:
-            process = subprocess.run(job.job_string, shell=True, capture_output=True)
-            processes.append(process)
+        """Run the queued jobs, returning them with their exit codes set.
+
+        Each job starts once its parents have finished, so independent branches of
+        the dependency graph run in parallel. Jobs skipped because a parent failed
+        or because of the fail fast policy keep an exit code of None.
+        """
+        jobs = sort_jobs(self.job_queue)
+        self.logger.info(
+            f"Submitting {len(jobs)} job(s) locally "
+            f"with up to {self.max_workers} running at once."
+        )
+        self.logger.debug(f"Memory usage per job: {self.mem_use}")
+        self.logger.debug(f"Threads per job: {self.threads}")
+        self._stop.clear()
+
+        waiting_on, children = dependency_graph(jobs)
+
+        finished = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            ready = [job for job in jobs if not waiting_on[id(job)]]
+            while ready or running:
+                for job in ready:
+                    if self._stop.is_set():
+                        continue
+                    if not job.dependencies_met():
+                        self.logger.warning(
+                            f"Skipping job {job.job_name}: a parent job failed."
+                        )
+                        ready.extend(release_children(job, children, waiting_on))
+                        continue
+                    running[executor.submit(self._run_job, job)] = job
+                ready = []
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    future.result()
+                    ready.extend(release_children(job, children, waiting_on))
+                    if job.returncode is None:
+                        continue
+                    finished += 1
+                    if job.returncode == 0:
+                        self.logger.info(
+                            f"({finished}/{len(jobs)}) Job {job.job_name} finished."
+                        )
+                    else:
+                        self.logger.error(
+                            f"({finished}/{len(jobs)}) Job {job.job_name} failed "
+                            f"with exit code {job.returncode}. "
+                            f"See: {job.output_file}"
+                        )
+
+        failed = [job for job in jobs if job.returncode not in (0, None)]
+        skipped = [job for job in jobs if job.returncode is None]
+        self.logger.info(
+            f"Local jobs complete: {len(jobs) - len(failed) - len(skipped)} "
+            f"succeeded, {len(failed)} failed, {len(skipped)} skipped."
+        )
+
+        if self.registry is not None:
+            for job in jobs:
+                if job.returncode is None:
+                    state = STATE_CANCELLED
+                elif job.returncode == 0:
+                    state = STATE_COMPLETED
+                else:
+                    state = STATE_FAILED
+                self.registry.record_job(job, step=self.step, state=state)
+
         self.job_queue.clear()
-        return processes
+        return jobs
+
+    def _run_job(self, job):
+        if self._stop.is_set():
+            return
+
+        job.output_file = os.path.join(
+            job.output_directory, LOCAL_OUTPUT_FORMAT_STR.format(jobid=job.job_name)
+        )
+        with open(job.output_file, "w") as output:
+            process = subprocess.Popen(
+                self.launch_command(job),
+                shell=True,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            )
+            with self._lock:
+                self._running.add(process)
+            try:
+                # A job started while cancelling must not outlive the cancel
+                if self._stop.is_set():
+                    process.terminate()
+                job.returncode = process.wait()
+            finally:
+                with self._lock:
+                    self._running.discard(process)
+
+        if job.returncode != 0 and self.failure_policy == FAILURE_POLICY_FAIL_FAST:
+            self._cancel()
+
+    def _cancel(self):
+        """Stop launching queued jobs and terminate the running ones."""
+        with self._lock:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            self.logger.warning("Failing fast: cancelling remaining local jobs.")
+            for process in self._running:
+                process.terminate()
 
 
 class JobManagerFactory:
@@ -165,6 +988,14 @@ class JobManagerFactory:
         time=None,
         threads=None,
         email=None,
+        array=False,
+        failure_policy=FAILURE_POLICY_CONTINUE,
+        pack_size=1,
+        pack_parallel=1,
+        pack_time=None,
+        registry=None,
+        step=None,
+        telemetry=None,
     ) -> JobManager:
         """
         Initializes a JobManager object.
@@ -172,6 +1003,19 @@ class JobManagerFactory:
         Args:
             method (str): "batch / Local"
             The method to be used for running the job.
+            array (bool): Submit jobs sharing a resource request as array jobs,
+                if the batch system supports it.
+            failure_policy (str): For local jobs, whether to "continue" past
+                failed jobs or "fail_fast" by cancelling the rest.
+            pack_size (int): For batch jobs, how many jobs to run together in
+                one allocation. 1 disables packing.
+            pack_parallel (int): How many of a pack's jobs to run at once.
+            pack_time (str): A target time per pack, used to size packs in
+                place of pack_size.
+            registry: A JobRegistry, or the path to one, recording submitted jobs.
+            step (str): The name of the step the jobs belong to, for the registry.
+            telemetry (str): A telemetry table to record the resources each job
+                actually uses in. Telemetry is off if not given.
         """
         if batch_config:    # Instantiate Batch Manager
             if not isinstance(batch_config, BatchManagerConfig):
@@ -187,13 +1031,304 @@ class JobManagerFactory:
                     batch_config = BatchManagerConfig.load(batch_config)
 
             return BatchJobManager(
-                batch_config, output_directory, debug, mem_use, time, threads, email
+                batch_config,
+                output_directory,
+                debug,
+                mem_use,
+                time,
+                threads,
+                email,
+                array,
+                pack_size,
+                pack_parallel,
+                pack_time,
+                registry,
+                step,
+                telemetry,
             )
         else:   # Instantiate Local Manager
-            return LocalJobManager()
+            return LocalJobManager(
+                output_directory,
+                debug,
+                mem_use=mem_use,
+                threads=threads,
+                failure_policy=failure_policy,
+                registry=registry,
+                step=step,
+                telemetry=telemetry,
+            )
 
 
 class Job:
-    def __init__(self, job_name, job_string):
+    def __init__(
+        self,
+        job_name,
+        job_string,
+        command=None,
+        output_directory=None,
+        resources=None,
+        parent_jobs=None,
+        dependency_type=DEPENDENCY_AFTER_OK,
+        array_jobs=None,
+        pack_jobs=None,
+    ):
+        if dependency_type not in DEPENDENCY_TYPES:
+            raise ValueError(
+                f"Unknown dependency type '{dependency_type}'. "
+                f"Must be one of: {', '.join(DEPENDENCY_TYPES)}"
+            )
+
         self.job_name = job_name
-        self.job_string = job_string
\ No newline at end of file
+        self.job_string = job_string
+        self.command = command if command is not None else job_string
+        self.output_directory = output_directory
+        # The resource request of the job, used to group jobs into arrays
+        self.resources = resources
+        # Jobs which must finish before this one starts
+        self.parent_jobs = list(parent_jobs) if parent_jobs else []
+        self.dependency_type = dependency_type
+        # The jobs run as tasks of this job, if it is an array job
+        self.array_jobs = array_jobs
+        # The jobs run inside this job's allocation, if it is a job pack
+        self.pack_jobs = pack_jobs
+        # Set once the job has been submitted to a batch system, or failed to be
+        self.scheduler_id = None
+        self.submission_error = None
+        # Registry entries of this job and of the job it was resubmitted from
+        self.registry_id = None
+        self.resubmitted_from = None
+        # Set once the job has been run locally
+        self.output_file = None
+        self.returncode = None
+
+    def set_scheduler_id(self, scheduler_id):
+        """Record the scheduler ID of this job and of any jobs run within it."""
+        self.scheduler_id = scheduler_id
+        for member in (self.array_jobs or []) + (self.pack_jobs or []):
+            member.set_scheduler_id(scheduler_id)
+
+    def leaf_jobs(self, array_task=None):
+        """Yield each job run within this job, with its array task index."""
+        if self.array_jobs:
+            for index, member in enumerate(self.array_jobs, start=1):
+                yield from member.leaf_jobs(index)
+        elif self.pack_jobs:
+            for member in self.pack_jobs:
+                yield from member.leaf_jobs(array_task)
+        else:
+            yield self, array_task
+
+    def dependencies_met(self) -> bool:
+        """Whether this job may run locally, given how its parents finished."""
+        if self.dependency_type == DEPENDENCY_AFTER_ANY:
+            return True
+        return all(parent.returncode == 0 for parent in self.parent_jobs)
+
+
+def dependency_graph(jobs):
+    """Find which of a list of jobs each job waits on, and which wait on it.
+
+    A parent run within one of the jobs, such as an array task, is waited on
+    through that job. Parents outside the list are ignored.
+
+    Returns:
+        A tuple of a dict mapping each job's id to the ids of the jobs it waits on,
+        and a dict mapping each job's id to the jobs waiting on it.
+    """
+    owners = {}
+    for job in jobs:
+        owners[id(job)] = job
+        for member, _ in job.leaf_jobs():
+            owners[id(member)] = job
+
+    waiting_on = {id(job): set() for job in jobs}
+    children = {id(job): [] for job in jobs}
+    for job in jobs:
+        for parent in job.parent_jobs:
+            owner = owners.get(id(parent))
+            if owner is None or owner is job or id(owner) in waiting_on[id(job)]:
+                continue
+            waiting_on[id(job)].add(id(owner))
+            children[id(owner)].append(job)
+
+    return waiting_on, children
+
+
+def release_children(job, children, waiting_on):
+    """Mark a job as finished, returning any children now free to start."""
+    released = []
+    for child in children[id(job)]:
+        waiting_on[id(child)].discard(id(job))
+        if not waiting_on[id(child)]:
+            released.append(child)
+    return released
+
+
+def group_jobs(jobs, max_size):
+    """Split jobs into chunks of jobs sharing a resource request and dependencies.
+
+    Chunks hold at most `max_size` jobs and are ordered by their first job, so
+    that chunks of a topologically sorted list of jobs are sorted as well.
+    """
+    max_size = max(int(max_size), 1)
+
+    groups = {}
+    for job in jobs:
+        key = (
+            job.resources,
+            frozenset(id(parent) for parent in job.parent_jobs),
+            job.dependency_type,
+        )
+        groups.setdefault(key, []).append(job)
+
+    chunks = [
+        group[start : start + max_size]
+        for group in groups.values()
+        for start in range(0, len(group), max_size)
+    ]
+    order = {id(job): index for index, job in enumerate(jobs)}
+    chunks.sort(key=lambda chunk: order[id(chunk[0])])
+
+    return chunks
+
+
+def run_job_pack(pack_file, debug=False) -> int:
+    """Run the jobs of a job pack within the current allocation.
+
+    Each job's output is written to its own log file, and the exit code of each
+    job is recorded in a status file next to the pack file.
+
+    Returns:
+        0 if every job in the pack succeeded, otherwise 1.
+    """
+    with open(pack_file) as f:
+        pack = json.load(f)
+
+    job_manager = LocalJobManager(
+        output_directory=os.path.dirname(os.path.abspath(pack_file)),
+        debug=debug,
+        max_workers=pack["max_parallel"],
+    )
+    for job in pack["jobs"]:
+        job_manager.add_job(
+            job["job_name"], job["command"], output_directory=job["output_directory"]
+        )
+    jobs = job_manager.submit_jobs()
+
+    status_file = os.path.splitext(pack_file)[0] + PACK_STATUS_FILE_SUFFIX
+    with open(status_file, "w") as f:
+        f.write("job_name\texit_code\toutput_file\n")
+        for job in jobs:
+            exit_code = "" if job.returncode is None else job.returncode
+            f.write(f"{job.job_name}\t{exit_code}\t{job.output_file or ''}\n")
+
+    return 0 if all(job.returncode == 0 for job in jobs) else 1
+
+
+def sort_jobs(jobs):
+    """Order jobs so that every job comes after its parents.
+
+    Jobs keep their queued order where their dependencies allow it. Parents which
+    are not in the given list are assumed to have been handled already.
+
+    Raises:
+        ValueError: If the job dependencies contain a cycle.
+    """
+    queued = {id(job) for job in jobs}
+    sorted_jobs = []
+    visited = set()
+    visiting = set()
+
+    def visit(job):
+        if id(job) in visited:
+            return
+        if id(job) in visiting:
+            raise ValueError(f"Job dependencies contain a cycle at: {job.job_name}")
+        visiting.add(id(job))
+        for parent in job.parent_jobs:
+            if id(parent) in queued:
+                visit(parent)
+        visiting.discard(id(job))
+        visited.add(id(job))
+        sorted_jobs.append(job)
+
+    for job in jobs:
+        visit(job)
+
+    return sorted_jobs
+
+
+def parse_memory(mem_use) -> int:
+    """Convert a memory request such as "20G" or "1000" into bytes.
+
+    A bare number is taken to be in megabytes, matching the batch defaults.
+    Returns None if no memory request was given.
+    """
+    if mem_use is None or str(mem_use).strip() == "":
+        return None
+    match = MEMORY_PATTERN.match(str(mem_use))
+    if not match:
+        raise ValueError(f"Could not parse memory request: {mem_use}")
+    amount, unit = match.groups()
+    return int(float(amount) * MEMORY_UNITS[(unit or "M").upper()])
+
+
+def scale_memory(mem_use, factor):
+    """Multiply a memory request such as "20G" by a factor.
+
+    The request keeps its unit if the result is a whole amount of it. Otherwise
+    it is rounded up to whole megabytes, as batch systems reject fractional
+    requests such as "12.5G".
+    """
+    match = MEMORY_PATTERN.match(str(mem_use)) if mem_use else None
+    if not match or factor == 1:
+        return mem_use
+    amount, unit = match.groups()
+    scaled = float(amount) * factor
+    if scaled.is_integer():
+        return f"{int(scaled)}{unit or ''}"
+    return format_memory(parse_memory(mem_use) * factor)
+
+
+def format_memory(num_bytes) -> str:
+    """Format bytes as a memory request, rounded up to whole megabytes.
+
+    Whole gigabytes are given in "G", anything else in "M".
+    """
+    megabytes = math.ceil(num_bytes / MEMORY_UNITS["M"])
+    if megabytes % 1024 == 0:
+        return f"{megabytes // 1024}G"
+    return f"{megabytes}M"
+
+
+def parse_time(time) -> int:
+    """Convert a time request into seconds.
+
+    Accepts the Slurm time formats "minutes", "minutes:seconds",
+    "hours:minutes:seconds" and "days-hours[:minutes[:seconds]]".
+    Returns None if no time request was given.
+    """
+    if time is None or str(time).strip() == "":
+        return None
+    match = TIME_PATTERN.match(str(time))
+    if not match:
+        raise ValueError(f"Could not parse time request: {time}")
+    days, first, second, third = match.groups()
+    if days is not None:
+        hours, minutes, seconds = first, second, third
+    elif third is not None:
+        hours, minutes, seconds = first, second, third
+    else:
+        hours, minutes, seconds = 0, first, second
+    return (
+        int(days or 0) * 86400
+        + int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + int(seconds or 0)
+    )
+
+
+def format_time(seconds) -> str:
+    """Format seconds as an "hours:minutes:seconds" time request."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,477 @@
+"""Persistent record of the jobs submitted by clpipe's job managers.
+
+Each submitted job is recorded in a SQLite database within the project's
+.pipeline directory, along with the resources it requested and the batch
+configuration used to submit it. Job states are refreshed by polling the batch
+system, which allows failed jobs to be resubmitted without rerunning a whole step.
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+import subprocess
+from collections import Counter
+
+from .config.options import BatchManagerConfig, ProjectOptions
+from .utils import get_logger
+
+LOGGER_NAME = "job-registry"
+
+STATE_SUBMITTED = "SUBMITTED"
+STATE_PENDING = "PENDING"
+STATE_RUNNING = "RUNNING"
+STATE_COMPLETED = "COMPLETED"
+STATE_FAILED = "FAILED"
+STATE_TIMEOUT = "TIMEOUT"
+STATE_OUT_OF_MEMORY = "OUT_OF_MEMORY"
+STATE_CANCELLED = "CANCELLED"
+STATE_UNKNOWN = "UNKNOWN"
+
+ACTIVE_STATES = [STATE_SUBMITTED, STATE_PENDING, STATE_RUNNING, STATE_UNKNOWN]
+FAILED_STATES = [STATE_FAILED, STATE_TIMEOUT, STATE_OUT_OF_MEMORY]
+
+SLURM_STATE_MAP = {
+    "PENDING": STATE_PENDING,
+    "REQUEUED": STATE_PENDING,
+    "RESIZING": STATE_PENDING,
+    "SUSPENDED": STATE_PENDING,
+    "CONFIGURING": STATE_RUNNING,
+    "RUNNING": STATE_RUNNING,
+    "COMPLETING": STATE_RUNNING,
+    "COMPLETED": STATE_COMPLETED,
+    "FAILED": STATE_FAILED,
+    "BOOT_FAIL": STATE_FAILED,
+    "NODE_FAIL": STATE_FAILED,
+    "PREEMPTED": STATE_FAILED,
+    "TIMEOUT": STATE_TIMEOUT,
+    "DEADLINE": STATE_TIMEOUT,
+    "OUT_OF_MEMORY": STATE_OUT_OF_MEMORY,
+    "CANCELLED": STATE_CANCELLED,
+}
+SLURM_ARRAY_RANGE_PATTERN = re.compile(r"^(\d+)_\[([^\]]+)\]$")
+
+SGE_ARRAY_TASK_PATTERN = re.compile(r"^\d+(-\d+(:\d+)?)?(,\d+(-\d+(:\d+)?)?)*$")
+
+REGISTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_name TEXT NOT NULL,
+    step TEXT,
+    command TEXT NOT NULL,
+    output_directory TEXT,
+    scheduler_id TEXT,
+    array_task INTEGER,
+    memory TEXT,
+    time TEXT,
+    threads TEXT,
+    submit_time TEXT NOT NULL,
+    state TEXT NOT NULL,
+    exit_code INTEGER,
+    batch_config TEXT,
+    resubmitted_from INTEGER REFERENCES jobs(id)
+)
+"""
+
+
+class JobRegistry:
+    """A SQLite-backed record of submitted jobs."""
+
+    def __init__(self, registry_path: os.PathLike, debug=False):
+        self.registry_path = os.path.abspath(registry_path)
+        self.logger = get_logger(LOGGER_NAME, debug=debug)
+        self._initialized = False
+
+    def _connect(self):
+        # The database is created on first use, so that dry runs leave no trace
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.registry_path), exist_ok=True)
+            with sqlite3.connect(self.registry_path, timeout=30) as conn:
+                conn.execute(REGISTRY_SCHEMA)
+            self._initialized = True
+
+        conn = sqlite3.connect(self.registry_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record_job(
+        self,
+        job,
+        step=None,
+        batch_config: BatchManagerConfig = None,
+        state=STATE_SUBMITTED,
+        array_task=None,
+    ) -> int:
+        """Record a job, returning the ID of its entry in the registry."""
+        mem_use, time, threads = job.resources if job.resources else (None,) * 3
+        batch_config_json = (
+            json.dumps(batch_config.to_dict()) if batch_config is not None else None
+        )
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (job_name, step, command, output_directory, "
+                "scheduler_id, array_task, memory, time, threads, submit_time, "
+                "state, exit_code, batch_config, resubmitted_from) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(job.job_name),
+                    step,
+                    job.command,
+                    job.output_directory,
+                    job.scheduler_id,
+                    array_task,
+                    None if mem_use is None else str(mem_use),
+                    None if time is None else str(time),
+                    None if threads is None else str(threads),
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                    state,
+                    job.returncode,
+                    batch_config_json,
+                    job.resubmitted_from,
+                ),
+            )
+        job.registry_id = cursor.lastrowid
+        return job.registry_id
+
+    def update_state(self, record_id: int, state: str, exit_code: int = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, exit_code = COALESCE(?, exit_code) "
+                "WHERE id = ?",
+                (state, exit_code, record_id),
+            )
+
+    def get_jobs(self, step=None, states=None, latest=True) -> list:
+        """Fetch job records, optionally filtered by step and state.
+
+        Args:
+            step: Only return jobs of this step.
+            states: Only return jobs in one of these states.
+            latest: Leave out jobs which have since been resubmitted.
+        """
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        params = []
+        if step is not None:
+            query += " AND step = ?"
+            params.append(step)
+        if states is not None:
+            query += f" AND state IN ({', '.join('?' * len(states))})"
+            params.extend(states)
+        if latest:
+            query += (
+                " AND id NOT IN (SELECT resubmitted_from FROM jobs "
+                "WHERE resubmitted_from IS NOT NULL)"
+            )
+        query += " ORDER BY id"
+
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def poll(self, adapter=None):
+        """Refresh the state of active jobs from their batch systems.
+
+        Args:
+            adapter: A SchedulerAdapter to query. Defaults to an adapter chosen by
+                each job's batch configuration.
+        """
+        active_jobs = [
+            job
+            for job in self.get_jobs(states=ACTIVE_STATES)
+            if job["scheduler_id"] is not None
+        ]
+
+        by_config = {}
+        for job in active_jobs:
+            by_config.setdefault(job["batch_config"], []).append(job)
+
+        for batch_config, jobs in by_config.items():
+            job_adapter = adapter
+            if job_adapter is None and batch_config is not None:
+                job_adapter = get_scheduler_adapter(
+                    BatchManagerConfig.from_dict(json.loads(batch_config))
+                )
+            if job_adapter is None:
+                self.logger.warning(
+                    f"Unable to poll {len(jobs)} job(s) - no supported batch system."
+                )
+                continue
+
+            states = job_adapter.query(
+                sorted({job["scheduler_id"] for job in jobs})
+            )
+            for job in jobs:
+                key = scheduler_key(job["scheduler_id"], job["array_task"])
+                state = states.get(key, states.get(job["scheduler_id"]))
+                if state is not None and state != job["state"]:
+                    self.update_state(job["id"], state)
+
+    def summarize(self, step=None) -> Counter:
+        """Count the latest jobs by step and state."""
+        return Counter(
+            (job["step"], job["state"]) for job in self.get_jobs(step=step)
+        )
+
+
+class SchedulerAdapter:
+    """Queries a batch system for the state of submitted jobs.
+
+    Commands are run through `runner`, which takes a list of arguments and
+    returns the command's stdout, so that a fake scheduler can stand in for the
+    real one.
+    """
+
+    def __init__(self, runner=None):
+        self.runner = runner if runner is not None else run_scheduler_command
+
+    def query(self, scheduler_ids: list) -> dict:
+        """Map the scheduler key of each given job, or its array tasks, to a state."""
+        raise NotImplementedError
+
+
+class SlurmAdapter(SchedulerAdapter):
+    """Polls Slurm with sacct, falling back on squeue if accounting is disabled."""
+
+    def query(self, scheduler_ids: list) -> dict:
+        if not scheduler_ids:
+            return {}
+        job_list = ",".join(scheduler_ids)
+
+        output = self.runner(
+            ["sacct", "-n", "-P", "-X", "-j", job_list, "--format=JobID,State"]
+        )
+        if output is None:
+            output = self.runner(["squeue", "-h", "-o", "%i|%T", "-j", job_list])
+        if output is None:
+            return {}
+
+        states = {}
+        for line in output.splitlines():
+            if "|" not in line:
+                continue
+            job_id, state = line.split("|")[:2]
+            state = SLURM_STATE_MAP.get(state.split(" ")[0], STATE_UNKNOWN)
+            for key in _expand_slurm_job_id(job_id.strip()):
+                states[key] = state
+        return states
+
+
+class SGEAdapter(SchedulerAdapter):
+    """Polls SGE with qstat, using qacct for jobs which have left the queue."""
+
+    def query(self, scheduler_ids: list) -> dict:
+        if not scheduler_ids:
+            return {}
+
+        states = {}
+        output = self.runner(["qstat"]) or ""
+        for line in output.splitlines()[2:]:
+            fields = line.split()
+            if len(fields) < 8 or fields[0] not in scheduler_ids:
+                continue
+            sge_state = fields[4]
+            if "E" in sge_state:
+                state = STATE_FAILED
+            elif "r" in sge_state or "t" in sge_state:
+                state = STATE_RUNNING
+            else:
+                state = STATE_PENDING
+            # Only running jobs list their queue
+            task_index = 9 if state == STATE_RUNNING else 8
+            if len(fields) > task_index and SGE_ARRAY_TASK_PATTERN.match(
+                fields[task_index]
+            ):
+                for task in _expand_task_ranges(fields[task_index]):
+                    states[scheduler_key(fields[0], task)] = state
+            else:
+                states[fields[0]] = state
+
+        queued = {key.split("_")[0] for key in states}
+        for scheduler_id in scheduler_ids:
+            if scheduler_id not in queued:
+                states.update(self._query_accounting(scheduler_id))
+        return states
+
+    def _query_accounting(self, scheduler_id):
+        output = self.runner(["qacct", "-j", scheduler_id])
+        if output is None:
+            return {}
+
+        states = {}
+        for block in output.split("=" * 10):
+            record = {}
+            for line in block.splitlines():
+                fields = line.split(None, 1)
+                if len(fields) == 2:
+                    record[fields[0]] = fields[1].strip()
+            if "exit_status" not in record:
+                continue
+            failed = record.get("failed", "0").split(" ")[0] != "0"
+            state = (
+                STATE_FAILED
+                if failed or record["exit_status"] != "0"
+                else STATE_COMPLETED
+            )
+            task = record.get("taskid", "undefined")
+            key = scheduler_id if not task.isdigit() else scheduler_key(
+                scheduler_id, int(task)
+            )
+            states[key] = state
+        return states
+
+
+def run_scheduler_command(args) -> str:
+    """Run a batch system query, returning its output or None if it failed."""
+    try:
+        result = subprocess.run(args, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def get_scheduler_adapter(batch_config: BatchManagerConfig, runner=None):
+    """Choose the adapter for polling the batch system of a batch configuration."""
+    submission_command = batch_config.submission_head.split(" ")[0]
+    if submission_command == "sbatch":
+        return SlurmAdapter(runner)
+    if submission_command == "qsub":
+        return SGEAdapter(runner)
+    return None
+
+
+def scheduler_key(scheduler_id, array_task=None) -> str:
+    """Identify a job, or a task of an array job, within a batch system."""
+    if array_task is None:
+        return str(scheduler_id)
+    return f"{scheduler_id}_{array_task}"
+
+
+def _expand_slurm_job_id(job_id):
+    """Expand Slurm's compressed array IDs, e.g. 123_[1-3,5%2], into keys."""
+    match = SLURM_ARRAY_RANGE_PATTERN.match(job_id)
+    if not match:
+        return [job_id]
+    scheduler_id, ranges = match.groups()
+    return [
+        scheduler_key(scheduler_id, task)
+        for task in _expand_task_ranges(ranges.split("%")[0])
+    ]
+
+
+def _expand_task_ranges(ranges):
+    """Expand task ranges such as "1-5:2,8" into task indexes."""
+    tasks = []
+    for part in ranges.split(","):
+        bounds, _, step = part.partition(":")
+        start, _, end = bounds.partition("-")
+        tasks.extend(range(int(start), int(end or start) + 1, int(step or 1)))
+    return tasks
+
+
+def resubmit_jobs(
+    config_file=None,
+    registry_path=None,
+    step=None,
+    failed=False,
+    memory_factor=1.0,
+    time_factor=1.0,
+    submit=False,
+    debug=False,
+):
+    """Resubmit jobs from the registry, after refreshing their states.
+
+    Args:
+        config_file: The project configuration, used to locate the registry.
+        registry_path: The registry to use, in place of the project's.
+        step: Only resubmit jobs of this step.
+        failed: Resubmit jobs which failed, timed out or ran out of memory.
+        memory_factor: Multiply each job's memory request by this factor.
+        time_factor: Multiply each job's time request by this factor.
+        submit: Submit the jobs, rather than printing them.
+    """
+    # Imported here to avoid a circular import with the job manager
+    from .job_manager import JobManagerFactory, format_time, parse_time, scale_memory
+
+    logger = get_logger(LOGGER_NAME, debug=debug)
+    registry = load_registry(config_file, registry_path, debug=debug)
+    telemetry = None
+    if config_file is not None:
+        options = ProjectOptions.load(config_file)
+        if options.record_telemetry:
+            telemetry = options.get_telemetry_path()
+
+    if not failed:
+        logger.error("Please choose which jobs to resubmit, e.g. with -failed.")
+        return
+
+    registry.poll()
+    jobs = registry.get_jobs(step=step, states=FAILED_STATES)
+    if not jobs:
+        logger.info("No jobs need resubmission.")
+        return
+    logger.info(f"Found {len(jobs)} job(s) to resubmit.")
+
+    # Jobs are resubmitted with the batch configuration they were submitted with
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job["batch_config"], job["step"]), []).append(job)
+
+    for (batch_config, job_step), group in groups.items():
+        if batch_config is not None:
+            batch_config = BatchManagerConfig.from_dict(json.loads(batch_config))
+        job_manager = JobManagerFactory.get(
+            batch_config=batch_config,
+            output_directory=group[0]["output_directory"],
+            debug=debug,
+            array=True,
+            registry=registry,
+            step=job_step,
+            telemetry=telemetry,
+        )
+        for job in group:
+            time = job["time"]
+            if time and time_factor != 1:
+                time = format_time(parse_time(time) * time_factor)
+            resubmission = job_manager.add_job(
+                job["job_name"],
+                job["command"],
+                output_directory=job["output_directory"],
+                mem_use=scale_memory(job["memory"], memory_factor),
+                time=time,
+                threads=job["threads"],
+            )
+            resubmission.resubmitted_from = job["id"]
+
+        if submit:
+            job_manager.submit_jobs()
+        else:
+            job_manager.print_jobs()
+
+
+def show_jobs(config_file=None, registry_path=None, step=None, debug=False):
+    """Refresh and print the number of jobs in each state, by step."""
+    registry = load_registry(config_file, registry_path, debug=debug)
+    registry.poll()
+
+    counts = registry.summarize(step=step)
+    if not counts:
+        print("No jobs recorded.")
+        return
+    for (job_step, state), count in sorted(
+        counts.items(), key=lambda item: (str(item[0][0]), item[0][1])
+    ):
+        print(f"{job_step or 'unknown'}\t{state}\t{count}")
+
+
+def load_registry(config_file=None, registry_path=None, debug=False) -> JobRegistry:
+    """Open the job registry given directly or by a project configuration file."""
+    if registry_path is None:
+        if config_file is None:
+            raise ValueError("A config file or job registry path is required.")
+        registry_path = ProjectOptions.load(config_file).get_job_registry_path()
+    if registry_path is None or not os.path.exists(registry_path):
+        raise FileNotFoundError(f"No job registry found at: {registry_path}")
+
+    return JobRegistry(registry_path, debug=debug)
@@ -0,0 +1,298 @@
+"""Measured resource usage of the jobs launched by clpipe's job managers.
+
+When telemetry is enabled, each job's command is run through a lightweight
+wrapper which samples the whole process tree of the command for peak memory,
+CPU time and bytes read and written, then appends one record per job to the
+project's telemetry table. The table can be summarized per step and resource
+request to suggest tighter memory and time requests for later runs.
+"""
+
+import csv
+import datetime
+import fcntl
+import math
+import os
+import resource
+import shlex
+import signal
+import socket
+import subprocess
+import time as timer
+
+import psutil
+
+from .config.options import ProjectOptions
+
+SAMPLE_INTERVAL = 1.0
+"""Seconds between samples of a job's process tree."""
+
+TELEMETRY_COMMAND = (
+    "run_with_telemetry -telemetry_file={telemetry_file} -job_name={job_name}"
+    "{options} {command}"
+)
+TELEMETRY_FIELDS = [
+    "job_name",
+    "step",
+    "requested_memory",
+    "requested_time",
+    "requested_threads",
+    "exit_code",
+    "start_time",
+    "wall_seconds",
+    "cpu_seconds",
+    "peak_rss_bytes",
+    "read_bytes",
+    "write_bytes",
+    "host",
+]
+
+SUGGESTION_HEADROOM = 1.2
+"""Headroom added to the largest measured usage when suggesting requests."""
+MEMORY_INCREMENT = 1024**3
+TIME_INCREMENT = 15 * 60
+
+
+def wrap_command(
+    command,
+    telemetry_file,
+    job_name,
+    step=None,
+    mem_use=None,
+    time=None,
+    threads=None,
+):
+    """Wrap a job's command so that its resource usage is recorded."""
+    options = ""
+    for option, value in (
+        ("step", step),
+        ("mem_use", mem_use),
+        ("time_usage", time),
+        ("n_threads", threads),
+    ):
+        if value:
+            options += f" -{option}={shlex.quote(str(value))}"
+
+    return TELEMETRY_COMMAND.format(
+        telemetry_file=shlex.quote(str(telemetry_file)),
+        job_name=shlex.quote(str(job_name)),
+        options=options,
+        command=shlex.quote(command),
+    )
+
+
+def run_with_telemetry(
+    command,
+    telemetry_file,
+    job_name,
+    step=None,
+    mem_use=None,
+    time=None,
+    threads=None,
+    interval=SAMPLE_INTERVAL,
+) -> int:
+    """Run a shell command, recording the resources used by its process tree.
+
+    Peak memory is the largest total resident memory of the tree seen while
+    sampling. CPU time covers every process of the tree, including those too
+    short lived to be sampled. Bytes read and written are those of the sampled
+    processes, as reported by /proc/<pid>/io.
+
+    Returns:
+        int: The command's exit code.
+    """
+    start_time = datetime.datetime.now()
+    start = timer.monotonic()
+    process = subprocess.Popen(command, shell=True)
+
+    # Pass on termination, e.g. from a cancelled local job, to the whole tree
+    def _terminate(signum, frame):
+        for proc in _process_tree(process.pid):
+            try:
+                proc.send_signal(signum)
+            except psutil.Error:
+                pass
+
+    previous_handler = signal.signal(signal.SIGTERM, _terminate)
+
+    peak_rss = 0
+    usage = {}
+    try:
+        while True:
+            peak_rss = max(peak_rss, _sample(process.pid, usage))
+            try:
+                process.wait(timeout=interval)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+    wall_seconds = timer.monotonic() - start
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes, and covers the largest single process
+    peak_rss = max(peak_rss, children.ru_maxrss * 1024)
+    cpu_seconds = max(
+        children.ru_utime + children.ru_stime,
+        sum(cpu for cpu, _, _ in usage.values()),
+    )
+
+    exit_code = process.returncode
+    if exit_code < 0:
+        exit_code = 128 - exit_code
+
+    append_record(
+        telemetry_file,
+        {
+            "job_name": job_name,
+            "step": step or "",
+            "requested_memory": mem_use or "",
+            "requested_time": time or "",
+            "requested_threads": threads or "",
+            "exit_code": exit_code,
+            "start_time": start_time.isoformat(timespec="seconds"),
+            "wall_seconds": round(wall_seconds, 2),
+            "cpu_seconds": round(cpu_seconds, 2),
+            "peak_rss_bytes": peak_rss,
+            "read_bytes": sum(read for _, read, _ in usage.values()),
+            "write_bytes": sum(write for _, _, write in usage.values()),
+            "host": socket.gethostname(),
+        },
+    )
+
+    return exit_code
+
+
+def append_record(telemetry_file, record: dict):
+    """Append a job's record to the telemetry table, creating it if needed.
+
+    The table is locked while writing, as many jobs may finish at once.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(telemetry_file)), exist_ok=True)
+    with open(telemetry_file, "a", newline="") as table:
+        fcntl.flock(table, fcntl.LOCK_EX)
+        try:
+            writer = csv.DictWriter(table, TELEMETRY_FIELDS, delimiter="\t")
+            if table.tell() == 0:
+                writer.writeheader()
+            writer.writerow(record)
+        finally:
+            fcntl.flock(table, fcntl.LOCK_UN)
+
+
+def load_telemetry(telemetry_file):
+    """Read the records of a telemetry table."""
+    with open(telemetry_file, newline="") as table:
+        return list(csv.DictReader(table, delimiter="\t"))
+
+
+def summarize_telemetry(records, step=None):
+    """Summarize measured usage per step and resource request.
+
+    Returns:
+        list: One summary dict per step and requested (memory, time, threads),
+            including suggested memory and time requests based on the largest
+            usage of its successful jobs.
+    """
+    from .job_manager import format_memory, format_time
+
+    groups = {}
+    for record in records:
+        if step is not None and record["step"] != step:
+            continue
+        key = (
+            record["step"],
+            record["requested_memory"],
+            record["requested_time"],
+            record["requested_threads"],
+        )
+        groups.setdefault(key, []).append(record)
+
+    summaries = []
+    for (job_step, mem_use, time, threads), group in sorted(groups.items()):
+        succeeded = [record for record in group if record["exit_code"] == "0"]
+        measured = succeeded if succeeded else group
+        peak_rss = max(int(record["peak_rss_bytes"]) for record in measured)
+        wall = max(float(record["wall_seconds"]) for record in measured)
+        cpu_efficiency = sum(
+            float(record["cpu_seconds"])
+            / max(float(record["wall_seconds"]) * int(threads or 1), 1)
+            for record in measured
+        ) / len(measured)
+
+        summaries.append(
+            {
+                "step": job_step,
+                "requested_memory": mem_use,
+                "requested_time": time,
+                "requested_threads": threads,
+                "jobs": len(group),
+                "failed": len(group) - len(succeeded),
+                "max_peak_memory": format_memory(peak_rss),
+                "max_wall_time": format_time(wall),
+                "cpu_efficiency": round(cpu_efficiency, 2),
+                "suggested_memory": format_memory(
+                    _round_up(peak_rss * SUGGESTION_HEADROOM, MEMORY_INCREMENT)
+                ),
+                "suggested_time": format_time(
+                    _round_up(wall * SUGGESTION_HEADROOM, TIME_INCREMENT)
+                ),
+            }
+        )
+    return summaries
+
+
+def show_resource_report(config_file=None, telemetry_file=None, step=None):
+    """Print a summary of measured job resources, with suggested requests."""
+    if telemetry_file is None:
+        if config_file is None:
+            raise ValueError("A config file or telemetry file is required.")
+        telemetry_file = ProjectOptions.load(config_file).get_telemetry_path()
+    if telemetry_file is None or not os.path.exists(telemetry_file):
+        raise FileNotFoundError(f"No telemetry found at: {telemetry_file}")
+
+    summaries = summarize_telemetry(load_telemetry(telemetry_file), step=step)
+    if not summaries:
+        print("No jobs recorded.")
+        return
+    print("\t".join(summaries[0].keys()))
+    for summary in summaries:
+        print("\t".join(str(value) for value in summary.values()))
+
+
+def _process_tree(pid):
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def _sample(pid, usage: dict) -> int:
+    """Sample a process tree, returning its total resident memory.
+
+    The latest CPU time and I/O of each process are kept in usage, keyed by
+    process so that a reused pid is not mistaken for an earlier process.
+    """
+    total_rss = 0
+    for proc in _process_tree(pid):
+        try:
+            with proc.oneshot():
+                total_rss += proc.memory_info().rss
+                cpu = proc.cpu_times()
+                try:
+                    io = proc.io_counters()
+                    read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                except (psutil.AccessDenied, AttributeError):
+                    read_bytes, write_bytes = 0, 0
+                usage[(proc.pid, proc.create_time())] = (
+                    cpu.user + cpu.system,
+                    read_bytes,
+                    write_bytes,
+                )
+        except psutil.Error:
+            continue
+    return total_rss
+
+
+def _round_up(amount, increment):
+    return math.ceil(amount / increment) * increment
@@ -20,6 +20,7 @@ from .postprocutils.utils import (
     notch_filter,
 )
 from .postprocutils.spec_interpolate import spec_inter
+from .postprocutils.masked_image import MaskedImage
 from .job_manager import BatchManager, Job
 from .config_json_parser import ClpipeConfigParser
 from .errors import SubjectNotFoundError
@@ -267,18 +268,10 @@ def _fmri_postprocess_image(
             tr = image_json["RepetitionTime"]
         tr = float(tr)
         logger.info("TR found: " + str(tr))
-        image = nib.load(file)
-        data = image.get_fdata()
-        data = data.astype(numpy.float32)
-        orgImageShape = data.shape
-        coordMap = image.affine
-        data = data.reshape((numpy.prod(numpy.shape(data)[:-1]), data.shape[-1]))
-        data = numpy.transpose(data)
+        image = MaskedImage.load(file, mask=_find_brain_mask(file, logger))
+        data = image.data
         if drop_tps is not None:
             data = data[0 : (data.shape[0] - (drop_tps)), :]
-            orgImageShape = list(orgImageShape)
-            orgImageShape[3] = data.shape[0]
-            orgImageShape = tuple(orgImageShape)
         row_means = data.mean(axis=0)
         data = data - data.mean(axis=0)
     if not beta_series:
@@ -352,10 +345,7 @@ def _fmri_postprocess_image(
 
         data = data + row_means
 
-        data = numpy.transpose(data)
-        data = data.reshape(orgImageShape)
-        data32 = numpy.float32(data)
-        out_image = nib.Nifti1Image(data32, coordMap)
+        out_image = image.with_data(data).to_nifti()
 
         output_file_path = _build_output_directory_structure(config, file, logger)
         logger.info("Saving post processed data to " + output_file_path)
@@ -430,20 +420,12 @@ def _fmri_postprocess_image(
                 events_file, filt, tr, ntp, beta_series_options, logger
             )
 
-            image = nib.load(file)
-            data = image.get_fdata()
-            data = data.astype(numpy.float32)
-            orgImageShape = data.shape
-            coordMap = image.affine
-            data = data.reshape((numpy.prod(numpy.shape(data)[:-1]), data.shape[-1]))
-            data = numpy.transpose(data)
+            image = MaskedImage.load(file, mask=_find_brain_mask(file, logger))
+            data = image.data
             data = data - data.mean(axis=0)
             logger.debug(filt_ev_array)
             beta_image_2d = _beta_series_calc(data, filt_ev_array, confounds, logger)
-            beta_series_dims = orgImageShape[:-1]
-            beta_series_dims = beta_series_dims + (len(valid_events),)
-            beta_3d = beta_image_2d.transpose().reshape(beta_series_dims)
-            beta_image = nib.Nifti1Image(beta_3d, coordMap)
+            beta_image = image.with_data(beta_image_2d).to_nifti()
             output_file_path = _build_output_directory_structure(
                 config, file, logger, beta_series
             )
@@ -689,6 +671,23 @@ def _find_confounds(config, filepath):
     )
 
 
+def _find_brain_mask(filepath, logger):
+    """Find the fMRIPrep brain mask next to an image, so that only brain voxels
+    are processed. Returns None, keeping all voxels, if there is none."""
+    file_name = os.path.basename(filepath)
+    mask_path = os.path.join(
+        os.path.dirname(filepath),
+        file_name.replace("desc-preproc_bold", "desc-brain_mask"),
+    )
+    if mask_path == filepath or not os.path.exists(mask_path):
+        logger.warning(
+            "Could not find a brain mask for " + file_name + ". Using all voxels."
+        )
+        return None
+    logger.info("Using brain mask: " + mask_path)
+    return mask_path
+
+
 def _find_events(config, filepath):
     session_toggle = False
     if "ses-" in filepath:
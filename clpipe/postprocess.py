@@ -8,8 +8,11 @@ import sys
 import os
 import warnings
 import json
+import tempfile
 import time
+from contextlib import nullcontext
 from pathlib import Path
+from typing import NamedTuple
 
 from .bids import (
     get_bids,
@@ -32,13 +35,17 @@ with warnings.catch_warnings():
 
 from .config.options import (
     ProjectOptions,
+    PostProcessingOptions,
     PostProcessingRunConfig,
     DEFAULT_WORKING_DIRECTORY,
 )
 from .config.options import DEFAULT_PROCESSING_STREAM
-from .job_manager import JobManagerFactory
+from .job_manager import JobManager, JobManagerFactory, MEMORY_UNITS, parse_memory
+from .resource_estimator import declare_node_resources, estimate_resources
 from .postprocutils.global_workflows import build_postprocessing_wf
+from .postprocutils.manifest import PostprocessingManifest, options_hash
 from .postprocutils.utils import draw_graph
+from . import scratch_staging
 from .utils import get_logger, resolve_fmriprep_dir
 from .errors import *
 
@@ -48,15 +55,37 @@ IMAGE_TIME_DIMENSION_INDEX = 3
 IMAGE_SUBMISSION_STRING_TEMPLATE = (
     "postprocess_image {run_config_file} "
     "{image_file} {subject_out_dir} {subject_working_dir} {subject_log_dir} "
-    "{debug}"
+    "{stream_run_configs}{debug}"
 )
+STREAM_RUN_CONFIG_OPTION_TEMPLATE = "-stream_run_config {run_config_file} "
+"""Adds another stream's run config to an image job, for multi-stream jobs"""
 BIDS_INDEX_NAME = "bids_index"
 """This is the location of the pybids-generated index"""
+CACHE_DIR_NAME = "cache"
+"""Where to save files shared between a stream's images, such as resampling maps,
+within the stream's working directory"""
+STREAM_STEP_CACHE_PREFIX = "step_cache_"
+"""Prefix of the step cache shared by the streams of a multi-stream image job,
+within the first stream's subject working directory"""
+MANIFEST_DIR_NAME = "manifest"
+"""Where to record the inputs and options of each exported image, within the
+stream's working directory"""
 
 SUBJECT_LOG_DIR = "distributor"
 """Where to save batch files, within the postprocessing log folder, for subject-level batch logs"""
+SUBJECT_BATCH_LOG_DIR = "slurm_out"
+"""Where to save batch output, within a subject's log folder, for image-level jobs"""
 RUN_CONFIG_FILE_NAME = "run_config.json"
 
+JOB_LEVEL_IMAGE = "image"
+JOB_LEVEL_SUBJECT = "subject"
+SUBJECT_SUBMISSION_STRING_TEMPLATE = (
+    "postprocess_subject_images {subject_job_file} {subject_log_dir} {debug}"
+)
+SUBJECT_JOB_FILE_NAME = "subject_images.json"
+"""Lists the images and streams of a subject-level job, within the subject's log
+folder"""
+
 
 def postprocess_subjects(
     subjects=None,
@@ -72,11 +101,23 @@ def postprocess_subjects(
     refresh_index=False,
     debug=False,
     cache=True,
+    incremental=False,
 ):
     """
     Parse configuration and sanitize inputs in preparation for
         subject job distribution.
+
+    Several processing streams may be given as a list. Each image then gets one
+    job which runs every stream, writing each stream's exports to its own output
+    directory.
+
+    If incremental is set, only images without current exports are scheduled.
     """
+    processing_streams = (
+        [processing_stream]
+        if isinstance(processing_stream, str)
+        else list(processing_stream) or [DEFAULT_PROCESSING_STREAM]
+    )
 
     options: ProjectOptions = ProjectOptions.load(config_file)
     options.fmriprep.load_cli_args(
@@ -89,42 +130,21 @@ def postprocess_subjects(
     )
     if options.postprocessing.working_directory == DEFAULT_WORKING_DIRECTORY:
         raise ValueError("No working directory specified.")
-    if processing_stream is not DEFAULT_PROCESSING_STREAM:
-        options.postprocessing = apply_stream(options, processing_stream)
-
-    # Initialize the run config
-    # TODO: The getters here are still a bit confusing and could be moved to run_config,
-    #   handled internally
-    run_config: PostProcessingRunConfig = PostProcessingRunConfig(
-        options=options.postprocessing,
-        target_directory=options.postprocessing.target_directory,
-        bids_directory=options.fmriprep.bids_directory,
-        batch_config_file=options.batch_config_path,
-        email_address=options.email_address,
-        stream_working_directory=options.postprocessing.get_stream_working_dir(
-            processing_stream
-        ),
-        stream_log_directory=options.postprocessing.get_stream_log_dir(
-            processing_stream
-        ),
-        stream_output_directory=options.postprocessing.get_stream_output_dir(
-            processing_stream
-        ),
-        pybids_db_path=options.postprocessing.get_pybids_db_path(
-            processing_stream, BIDS_INDEX_NAME
-        ),
-    )
-    # This is the only run-related attribute that can be set by the CLI right now
-    run_config.load_cli_args(pybids_db_path=pybids_db_path)
 
-    # Setup top-level directories
-    setup_dirs(run_config)
-
-    # Save the run configuration for use downstream
-    stream_run_config_path = (
-        Path(run_config.stream_working_directory) / RUN_CONFIG_FILE_NAME
-    )
-    run_config.dump(stream_run_config_path)
+    # Setup and save a run config for each stream. The first stream's options and
+    #   directories are used for anything shared between streams, like the index
+    stream_run_configs = []
+    for stream in processing_streams:
+        postprocessing_options = options.postprocessing
+        if stream != DEFAULT_PROCESSING_STREAM:
+            postprocessing_options = apply_stream(options, stream)
+        stream_run_configs.append(
+            setup_stream_run_config(
+                options, postprocessing_options, stream, pybids_db_path
+            )
+        )
+    run_config, stream_run_config_path = stream_run_configs[0]
+    options.postprocessing = run_config.options
 
     # Setup Logging
     logger = get_logger(STEP_NAME, debug=debug, log_dir=options.get_logs_dir())
@@ -164,8 +184,35 @@ def postprocess_subjects(
         logger.info(
             f"Processing requested for subject(s): {','.join(subjects_to_process)}"
         )
+        if len(processing_streams) > 1:
+            logger.info(
+                f"Processing requested for stream(s): {','.join(processing_streams)}"
+            )
         time.sleep(0.5)
 
+        # Share one job manager across subjects so that image jobs with the
+        #   same resource request can be submitted together as array jobs,
+        #   or run together in the local worker pool
+        batch_manager = JobManagerFactory.get(
+            batch_config=run_config.batch_config_file if batch else None,
+            output_directory=Path(run_config.stream_log_directory)
+            / SUBJECT_LOG_DIR,
+            mem_use=run_config.options.batch_options.memory_usage,
+            threads=run_config.options.batch_options.n_threads,
+            time=run_config.options.batch_options.time_usage,
+            email=run_config.email_address,
+            debug=debug,
+            array=True,
+            pack_size=run_config.options.batch_options.pack_size,
+            pack_parallel=run_config.options.batch_options.pack_parallel_jobs,
+            pack_time=run_config.options.batch_options.pack_time_usage,
+            registry=options.get_job_registry_path(),
+            step=STEP_NAME,
+            telemetry=(
+                options.get_telemetry_path() if options.record_telemetry else None
+            ),
+        )
+
         for subject in subjects_to_process:
             postprocess_subject(
                 subject_id=subject,
@@ -175,8 +222,18 @@ def postprocess_subjects(
                 batch=batch,
                 submit=submit,
                 debug=debug,
+                batch_manager=batch_manager,
+                incremental=incremental,
+                additional_run_config_paths=[
+                    path for _, path in stream_run_configs[1:]
+                ],
             )
 
+        if submit:
+            batch_manager.submit_jobs()
+        else:
+            batch_manager.print_jobs()
+
     except NoSubjectsFoundError as nsfe:
         logger.error(nsfe)
         sys.exit(1)
@@ -185,6 +242,56 @@ def postprocess_subjects(
         sys.exit(1)
 
 
+def setup_stream_run_config(
+    options: ProjectOptions,
+    postprocessing_options: PostProcessingOptions,
+    processing_stream: str,
+    pybids_db_path: os.PathLike = None,
+) -> tuple:
+    """Setup a stream's directories and save its run config within them.
+
+    Returns:
+        tuple: The stream's run config, and where it was saved.
+    """
+    # Initialize the run config
+    # TODO: The getters here are still a bit confusing and could be moved to run_config,
+    #   handled internally
+    run_config: PostProcessingRunConfig = PostProcessingRunConfig(
+        options=postprocessing_options,
+        target_directory=postprocessing_options.target_directory,
+        bids_directory=options.fmriprep.bids_directory,
+        batch_config_file=options.batch_config_path,
+        email_address=options.email_address,
+        stream_working_directory=postprocessing_options.get_stream_working_dir(
+            processing_stream
+        ),
+        stream_log_directory=postprocessing_options.get_stream_log_dir(
+            processing_stream
+        ),
+        stream_output_directory=postprocessing_options.get_stream_output_dir(
+            processing_stream
+        ),
+        pybids_db_path=postprocessing_options.get_pybids_db_path(
+            processing_stream, BIDS_INDEX_NAME
+        ),
+        scratch_staging=options.scratch_staging,
+        scratch_directory=options.scratch_directory,
+    )
+    # This is the only run-related attribute that can be set by the CLI right now
+    run_config.load_cli_args(pybids_db_path=pybids_db_path)
+
+    # Setup top-level directories
+    setup_dirs(run_config)
+
+    # Save the run configuration for use downstream
+    stream_run_config_path = (
+        Path(run_config.stream_working_directory) / RUN_CONFIG_FILE_NAME
+    )
+    run_config.dump(stream_run_config_path)
+
+    return run_config, stream_run_config_path
+
+
 def setup_dirs(run_config: PostProcessingRunConfig):
     os.makedirs(run_config.stream_output_directory, exist_ok=True)
     os.makedirs(run_config.stream_working_directory, exist_ok=True)
@@ -211,9 +318,25 @@ def postprocess_subject(
     batch: bool = False,
     submit: bool = False,
     debug=False,
+    batch_manager: JobManager = None,
+    incremental: bool = False,
+    additional_run_config_paths: list = None,
 ):
     """
     Handle postprocessing for a single subject.
+
+    If a job manager is given, this subject's image jobs are added to it and
+    submission is left to the caller. Otherwise, a job manager is created for
+    this subject alone - a batch manager if batch is set, or a local one.
+
+    If incremental is set, images whose exports are current according to the
+    stream's manifest are skipped.
+
+    The run configs of further streams may be given to process them in the same
+    jobs. Each image then gets one job running every stream that targets it.
+
+    If the batch options' job level is "subject", the subject instead gets one job
+    running all of its images together.
     """
 
     sub_with_id = "sub-" + subject_id
@@ -231,12 +354,12 @@ def postprocess_subject(
     )
     logger.info(f"Processing subject: {subject_id}")
 
-    batch_manager = None
-    if batch:
-        subject_slurm_log_dir = subject_log_dir / "slurm_out"
-        subject_slurm_log_dir.mkdir(exist_ok=True)
+    subject_slurm_log_dir = subject_log_dir / SUBJECT_BATCH_LOG_DIR
+    subject_slurm_log_dir.mkdir(exist_ok=True)
+    owns_batch_manager = batch_manager is None
+    if owns_batch_manager:
         batch_manager = JobManagerFactory.get(
-            batch_config=run_config.batch_config_file,
+            batch_config=run_config.batch_config_file if batch else None,
             output_directory=subject_slurm_log_dir,
             mem_use=run_config.options.batch_options.memory_usage,
             threads=run_config.options.batch_options.n_threads,
@@ -248,75 +371,125 @@ def postprocess_subject(
         logger.info(f"Checking for requested subject in fmriprep output")
         validate_subject_exists(bids, subject_id)
 
-        try:
-            tasks = run_config.options.target_tasks
-        except KeyError:
-            logger.warn(
-                (
-                    "Postprocessing configuration setting 'TargetTasks' not set. "
-                    "Defaulting to all tasks."
+        stream_run_configs = [(run_config, run_config_path)] + [
+            (PostProcessingRunConfig.load(path), path)
+            for path in additional_run_config_paths or []
+        ]
+
+        # Gather the streams to run on each image, querying the index once for
+        #   streams with the same targets
+        image_streams = {}
+        images_by_target = {}
+        for stream_run_config, stream_run_config_path in stream_run_configs:
+            target = _get_stream_target(stream_run_config, logger)
+            if target not in images_by_target:
+                images_by_target[target] = get_images_to_process(
+                    subject_id=subject_id,
+                    image_space=target[0],
+                    bids=bids,
+                    logger=logger,
+                    tasks=list(target[1]),
+                    acquisitions=list(target[2]),
                 )
-            )
-            tasks = None
-        try:
-            acquisitions = run_config.options.target_acquisitions
-        except KeyError:
-            logger.warn(
-                (
-                    "Postprocessing configuration setting 'TargetAcquisitions' "
-                    "not set. Defaulting to all acquisitions."
+            images_to_process = images_by_target[target]
+            if incremental:
+                images_to_process = _select_stale_images(
+                    images_to_process,
+                    stream_run_config,
+                    stream_run_config_path,
+                    bids,
+                    logger,
                 )
-            )
-            acquisitions = None
 
-        images_to_process = get_images_to_process(
-            subject_id=subject_id,
-            image_space=run_config.options.target_image_space,
-            bids=bids,
-            logger=logger,
-            tasks=tasks,
-            acquisitions=acquisitions,
-        )
-
-        subject_out_dir = Path(run_config.stream_output_directory) / sub_with_id
-        subject_working_dir = Path(run_config.stream_working_directory) / sub_with_id
-
-        if not subject_out_dir.exists():
-            logger.info(f"Creating subject directory: {subject_out_dir}")
-            subject_out_dir.mkdir(parents=True)
+            _setup_subject_dirs(stream_run_config, sub_with_id, logger)
 
-        if not subject_working_dir.exists():
-            logger.info(f"Creating subject working directory: {subject_working_dir}")
-            subject_working_dir.mkdir(parents=True, exist_ok=False)
+            for image in images_to_process:
+                image_streams.setdefault(image.path, (image, []))[1].append(
+                    (stream_run_config, stream_run_config_path)
+                )
 
-        submission_strings = _create_image_submission_strings(
-            run_config_path,
-            images_to_process,
-            subject_out_dir,
-            subject_working_dir,
-            subject_log_dir,
-            debug,
-            logger,
+        if run_config.options.batch_options.job_level == JOB_LEVEL_SUBJECT:
+            submission_strings = _create_subject_submission_string(
+                image_streams.values(),
+                sub_with_id,
+                subject_log_dir,
+                debug,
+                logger,
+            )
+            job_images = {sub_with_id: list(image_streams.keys())}
+        else:
+            submission_strings = _create_image_submission_strings(
+                image_streams.values(),
+                sub_with_id,
+                subject_log_dir,
+                debug,
+                logger,
+            )
+            job_images = {Path(path).stem: [path] for path in image_streams.keys()}
+
+        # Submit the jobs through the job manager
+        logger.info("Setting up job manager with jobs to run.")
+
+        # A multi-stream job runs the steps of each of its streams
+        image_processing_steps = {
+            path: [
+                step
+                for stream_run_config, _ in streams
+                for step in stream_run_config.options.processing_steps
+            ]
+            for path, (_, streams) in image_streams.items()
+        }
+        subject_level = (
+            run_config.options.batch_options.job_level == JOB_LEVEL_SUBJECT
         )
+        for key in submission_strings.keys():
+            resources = {}
+            if run_config.options.batch_options.estimate_resources:
+                # A subject-level job runs up to one image per thread at once
+                parallel_images = 1
+                if subject_level:
+                    parallel_images = int(run_config.options.batch_options.n_threads)
+                estimate = estimate_resources(
+                    job_images[key],
+                    max(
+                        (image_processing_steps[path] for path in job_images[key]),
+                        key=len,
+                    ),
+                    logger=logger,
+                    parallel_images=parallel_images,
+                )
+                if estimate:
+                    logger.debug(
+                        f"Estimated resources for {key}: "
+                        f"{estimate.mem_use} memory, {estimate.time} time"
+                    )
+                    resources = estimate._asdict()
+
+            submission_string = submission_strings[key]
+            if run_config.scratch_staging:
+                submission_string = scratch_staging.wrap_command(
+                    submission_string,
+                    key,
+                    run_config.scratch_directory,
+                    outputs=_scratch_outputs(
+                        [stream_config for stream_config, _ in stream_run_configs]
+                    ),
+                )
 
-        # Submit the jobs through batch manager
-        if batch_manager:
-            logger.info("Setting up batch manager with jobs to run.")
-
-            for key in submission_strings.keys():
-                batch_manager.add_job(key, submission_strings[key])
+            job = batch_manager.add_job(
+                key,
+                submission_string,
+                output_directory=subject_slurm_log_dir,
+                **resources,
+            )
+            if subject_level:
+                _record_subject_job_memory(subject_log_dir, job.resources[0])
 
+        if owns_batch_manager:
             if submit:
                 batch_manager.submit_jobs()
             else:
                 batch_manager.print_jobs()
-        else:
-            if submit:
-                for key in submission_strings.keys():
-                    os.system(submission_strings[key])
-            else:
-                for key in submission_strings.keys():
-                    print(submission_strings[key])
 
     except SubjectNotFoundError as snfe:
         logger.error(snfe)
@@ -334,14 +507,35 @@ def postprocess_image(
     subject_log_dir: os.PathLike,
     confounds_only=False,
     debug=False,
+    stream_run_config_files: list = None,
 ):
     """
     Setup the workflows specified in the postprocessing configuration.
+
+    The run configs of further streams may be given to run them on the same
+    image. Their subject directories are found within their own stream
+    directories. The image's companion files are only looked up once.
     """
     image_path = Path(image_path)
     image_short_name = f"{str(Path(image_path).stem)}"
 
     run_config: PostProcessingRunConfig = PostProcessingRunConfig.load(run_config_file)
+    subject_working_dir = _local_working_dir(run_config, subject_working_dir)
+    streams = [(run_config, subject_out_dir, subject_working_dir)]
+    for stream_run_config_file in stream_run_config_files or []:
+        stream_run_config = PostProcessingRunConfig.load(stream_run_config_file)
+        streams.append(
+            (
+                stream_run_config,
+                Path(stream_run_config.stream_output_directory)
+                / Path(subject_out_dir).name,
+                _local_working_dir(
+                    stream_run_config,
+                    Path(stream_run_config.stream_working_directory)
+                    / Path(subject_working_dir).name,
+                ),
+            )
+        )
 
     logger = get_logger(
         "postprocess_image",
@@ -351,6 +545,184 @@ def postprocess_image(
     )
     logger.info(f"Processing image: {image_path}")
 
+    pipeline_name = _get_pipeline_name(image_path)
+
+    bids: BIDSLayout = get_bids(
+        run_config.bids_directory,
+        database_path=run_config.pybids_db_path,
+        fmriprep_dir=run_config.target_directory,
+    )
+    image_inputs = _find_image_inputs(
+        bids,
+        image_path,
+        [stream_run_config for stream_run_config, _, _ in streams],
+        logger,
+    )
+
+    # Streams run one after another, so that later streams can start from the
+    #   outputs of any steps they share with earlier streams. Streams without
+    #   a step cache of their own share one for the length of this job
+    shared_step_cache = nullcontext()
+    if len(streams) > 1:
+        shared_step_cache = tempfile.TemporaryDirectory(
+            prefix=f"{pipeline_name}_{STREAM_STEP_CACHE_PREFIX}",
+            dir=subject_working_dir,
+        )
+    with shared_step_cache as shared_step_cache_dir:
+        for stream_run_config, stream_out_dir, stream_working_dir in streams:
+            if shared_step_cache_dir:
+                logger.info(
+                    f"Running stream with output directory: "
+                    f"{stream_run_config.stream_output_directory}"
+                )
+                if not stream_run_config.options.step_cache_directory:
+                    stream_run_config.options.step_cache_directory = (
+                        shared_step_cache_dir
+                    )
+
+            postproc_wf, export_paths = _build_image_stream_wf(
+                stream_run_config,
+                image_inputs,
+                pipeline_name,
+                stream_out_dir,
+                stream_working_dir,
+                confounds_only,
+                logger,
+            )
+            if stream_run_config.options.write_process_graph:
+                draw_graph(
+                    postproc_wf,
+                    "processing_graph",
+                    stream_run_config.stream_output_directory,
+                    logger=logger,
+                )
+
+            postproc_wf.run()
+            _record_exports(stream_run_config, image_inputs, export_paths)
+
+    sys.exit(0)
+
+
+def postprocess_subject_images(
+    subject_job_file: os.PathLike,
+    subject_log_dir: os.PathLike,
+    debug=False,
+):
+    """
+    Run all of a subject's image workflows as one workflow, with nipype's MultiProc
+    plugin.
+
+    Nodes from any image and stream run in parallel, within the first stream's
+    batch n_threads and the job's memory request. Each node declares its memory need
+    from its image's size, so that nipype can pack nodes within the memory limit.
+
+    Args:
+        subject_job_file (os.PathLike): A file listing the subject's images, each
+            with the run configs of the streams to run on it, as written by
+            postprocess_subject.
+        subject_log_dir (os.PathLike): Where to write the job's log.
+    """
+    with open(subject_job_file) as job_file:
+        subject_job = json.load(job_file)
+    sub_with_id = subject_job["subject"]
+
+    logger = get_logger(
+        "postprocess_subject_images",
+        log_dir=subject_log_dir,
+        f_name=f"{sub_with_id}_images.log",
+        debug=debug,
+    )
+    logger.info(f"Processing images of subject: {sub_with_id}")
+
+    run_configs = {}
+    for image_job in subject_job["images"]:
+        for run_config_file in image_job["run_configs"]:
+            if run_config_file not in run_configs:
+                run_configs[run_config_file] = PostProcessingRunConfig.load(
+                    run_config_file
+                )
+    run_config = run_configs[subject_job["images"][0]["run_configs"][0]]
+    subject_working_dir = _local_working_dir(
+        run_config, Path(run_config.stream_working_directory) / sub_with_id
+    )
+
+    bids: BIDSLayout = get_bids(
+        run_config.bids_directory,
+        database_path=run_config.pybids_db_path,
+        fmriprep_dir=run_config.target_directory,
+    )
+
+    subject_wf = pe.Workflow(
+        name=f"{sub_with_id.replace('-', '_')}_images", base_dir=subject_working_dir
+    )
+    subject_wf.config["execution"]["crashdump_dir"] = str(subject_working_dir)
+    # Run within the job's actual memory request, which may be an estimate
+    batch_options = run_config.options.batch_options
+    plugin_args = {"n_procs": int(batch_options.n_threads)}
+    memory = parse_memory(subject_job.get("memory_usage", batch_options.memory_usage))
+    if memory:
+        plugin_args["memory_gb"] = memory / MEMORY_UNITS["G"]
+
+    recorded_streams = []
+    for image_job in subject_job["images"]:
+        image_path = Path(image_job["image"])
+        logger.info(f"Adding image: {image_path}")
+        image_run_configs = [run_configs[path] for path in image_job["run_configs"]]
+        image_inputs = _find_image_inputs(bids, image_path, image_run_configs, logger)
+        pipeline_name = _get_pipeline_name(image_path)
+
+        for stream_run_config in image_run_configs:
+            postproc_wf, export_paths = _build_image_stream_wf(
+                stream_run_config,
+                image_inputs,
+                _get_stream_pipeline_name(
+                    stream_run_config, pipeline_name, len(image_run_configs)
+                ),
+                Path(stream_run_config.stream_output_directory) / sub_with_id,
+                _local_working_dir(
+                    stream_run_config,
+                    Path(stream_run_config.stream_working_directory) / sub_with_id,
+                ),
+                False,
+                logger,
+            )
+            declare_node_resources(
+                postproc_wf,
+                image_path,
+                stream_run_config.options.processing_steps,
+                logger=logger,
+                memory_limit_gb=plugin_args.get("memory_gb"),
+            )
+            subject_wf.add_nodes([postproc_wf])
+            recorded_streams.append((stream_run_config, image_inputs, export_paths))
+
+    start_time = time.time()
+    try:
+        subject_wf.run(plugin="MultiProc", plugin_args=plugin_args)
+    finally:
+        # Record every image whose exports were all written, even if others failed
+        for stream_run_config, image_inputs, export_paths in recorded_streams:
+            if _exported_since(export_paths, start_time):
+                _record_exports(stream_run_config, image_inputs, export_paths)
+
+    sys.exit(0)
+
+
+class ImageInputs(NamedTuple):
+    """An image and the companion files used to postprocess it."""
+
+    image_path: Path
+    bids_image: BIDSFile
+    subject_id: str
+    tr: float
+    mask_image: os.PathLike
+    confounds_path: os.PathLike
+    mixing_file: os.PathLike
+    noise_file: os.PathLike
+
+
+def _get_pipeline_name(image_path: os.PathLike) -> str:
+    image_path = Path(image_path)
     # Grab only the image file name in a way that works
     #   on both .nii and .nii.gz
     file_name_no_extensions = Path(
@@ -359,29 +731,33 @@ def postprocess_image(
     # Remove modality to shorten necessary pipeline name
     file_name_no_modality = file_name_no_extensions.replace("_desc-preproc_bold", "")
     # Remove hyphens to allow use as a pipeline name
-    pipeline_name = file_name_no_modality.replace("-", "_")
+    return file_name_no_modality.replace("-", "_")
 
-    bids: BIDSLayout = get_bids(
-        run_config.bids_directory,
-        database_path=run_config.pybids_db_path,
-        fmriprep_dir=run_config.target_directory,
-    )
+
+def _get_stream_pipeline_name(
+    run_config: PostProcessingRunConfig, pipeline_name: str, stream_count: int
+) -> str:
+    """Prefix an image's pipeline name with its stream's name, if the image has
+    several streams, as workflows in the same parent need distinct names."""
+    if stream_count == 1:
+        return pipeline_name
+    stream_name = Path(run_config.stream_working_directory).name
+    return f"{stream_name}_{pipeline_name}".replace("-", "_")
+
+
+def _find_image_inputs(
+    bids: BIDSLayout, image_path: Path, run_configs: list, logger
+) -> ImageInputs:
+    """Look up the files needed to postprocess an image with the given streams."""
     # Lookup the BIDSFile with the image path
     bids_image: BIDSFile = bids.get_file(image_path)
-    # Fetch the image's entities
-    image_entities = bids_image.get_entities()
-    # Create a sub dict of the entities we will need to query on
-    query_params = {
-        k: image_entities[k]
-        for k in image_entities.keys()
-        & {"session", "subject", "task", "run", "acquisition", "space"}
-    }
-    # Create a specific dict for searching non-image files
-    non_image_query_params = query_params.copy()
-    non_image_query_params.pop("space")
+    query_params, non_image_query_params = _get_query_params(bids_image)
 
     mixing_file, noise_file = None, None
-    if "AROMARegression" in run_config.options.processing_steps:
+    if any(
+        "AROMARegression" in run_config.options.processing_steps
+        for run_config in run_configs
+    ):
         try:
             # TODO: update these for image entities
             mixing_file = get_mixing_file(bids, non_image_query_params, logger)
@@ -395,18 +771,40 @@ def postprocess_image(
             sys.exit(1)
 
     # Search for this subject's files necessary for processing
-    mask_image = get_mask(bids, query_params, logger)
-    tr = get_tr(bids, query_params, logger)
-    confounds_path = get_confounds(bids, non_image_query_params, logger)
+    return ImageInputs(
+        image_path=image_path,
+        bids_image=bids_image,
+        subject_id=query_params["subject"],
+        tr=get_tr(bids, query_params, logger),
+        mask_image=get_mask(bids, query_params, logger),
+        confounds_path=get_confounds(bids, non_image_query_params, logger),
+        mixing_file=mixing_file,
+        noise_file=noise_file,
+    )
+
 
+def _build_image_stream_wf(
+    run_config: PostProcessingRunConfig,
+    image_inputs: ImageInputs,
+    pipeline_name: str,
+    subject_out_dir: os.PathLike,
+    subject_working_dir: os.PathLike,
+    confounds_only: bool,
+    logger,
+) -> tuple:
+    """Build one stream's postprocessing workflow for an image.
+
+    Returns:
+        tuple: The workflow, and the paths of the files it exports.
+    """
     # Try and build an export path for postprocess confounds if the subject has
     #   confounds to work with
     confounds_export_path = None
-    if confounds_path is not None:
+    if image_inputs.confounds_path is not None:
         try:
             confounds_export_path = build_export_path(
-                confounds_path,
-                query_params["subject"],
+                image_inputs.confounds_path,
+                image_inputs.subject_id,
                 run_config.target_directory,
                 subject_out_dir,
             )
@@ -418,8 +816,8 @@ def postprocess_image(
     image_export_path = None
     if not confounds_only:
         image_export_path = build_export_path(
-            image_path,
-            query_params["subject"],
+            image_inputs.image_path,
+            image_inputs.subject_id,
             run_config.target_directory,
             subject_out_dir,
         )
@@ -427,30 +825,71 @@ def postprocess_image(
     # Build the global postprocessing workflow
     postproc_wf: pe.Workflow = build_postprocessing_wf(
         run_config.options,
-        tr,
+        image_inputs.tr,
         name=pipeline_name,
-        image_file=bids_image,
+        image_file=image_inputs.bids_image,
         image_export_path=image_export_path,
-        confounds_file=confounds_path,
+        confounds_file=image_inputs.confounds_path,
         confounds_export_path=confounds_export_path,
         working_dir=subject_working_dir,
-        mask_file=mask_image,
-        mixing_file=mixing_file,
-        noise_file=noise_file,
+        mask_file=image_inputs.mask_image,
+        mixing_file=image_inputs.mixing_file,
+        noise_file=image_inputs.noise_file,
         base_dir=subject_working_dir,
         crashdump_dir=subject_working_dir,
+        cache_dir=Path(run_config.stream_working_directory) / CACHE_DIR_NAME,
     )
 
-    if run_config.options.write_process_graph:
-        draw_graph(
-            postproc_wf,
-            "processing_graph",
-            run_config.stream_output_directory,
-            logger=logger,
+    return postproc_wf, [image_export_path, confounds_export_path]
+
+
+def _local_working_dir(
+    run_config: PostProcessingRunConfig, subject_working_dir: os.PathLike
+) -> Path:
+    """Get where a stream's working files for a subject are written - within the
+    job's scratch directory when it is staged there, as <stream>/<subject>."""
+    subject_working_dir = scratch_staging.local_path(
+        subject_working_dir, Path(run_config.stream_working_directory).parent
+    )
+    os.makedirs(subject_working_dir, exist_ok=True)
+    return subject_working_dir
+
+
+def _scratch_outputs(run_configs: list) -> list:
+    """Declare the files a staged job copies back: the crash files of each of its
+    streams, to the streams' working directories."""
+    return [
+        (
+            f"{Path(run_config.stream_working_directory).name}/"
+            f"{scratch_staging.CRASH_FILE_PATTERN}",
+            Path(run_config.stream_working_directory).parent,
         )
+        for run_config in run_configs
+    ]
+
+
+def _record_exports(
+    run_config: PostProcessingRunConfig, image_inputs: ImageInputs, export_paths: list
+):
+    """Record what an image's exports were made from, for incremental runs."""
+    manifest = PostprocessingManifest(
+        Path(run_config.stream_working_directory) / MANIFEST_DIR_NAME
+    )
+    manifest.record(
+        Path(image_inputs.image_path).stem,
+        image_inputs.image_path,
+        image_inputs.confounds_path,
+        options_hash(run_config.options),
+        export_paths=export_paths,
+    )
 
-    postproc_wf.run()
-    sys.exit(0)
+
+def _exported_since(export_paths: list, start_time: float) -> bool:
+    export_paths = [path for path in export_paths if path]
+    return bool(export_paths) and all(
+        os.path.exists(path) and os.path.getmtime(path) >= start_time
+        for path in export_paths
+    )
 
 
 def build_export_path(
@@ -484,6 +923,116 @@ def build_export_path(
     return export_path
 
 
+def _get_query_params(bids_image: BIDSFile):
+    """Get the entities to search for an image's companion files with, for
+    images and for non-image files."""
+    # Fetch the image's entities
+    image_entities = bids_image.get_entities()
+    # Create a sub dict of the entities we will need to query on
+    query_params = {
+        k: image_entities[k]
+        for k in image_entities.keys()
+        & {"session", "subject", "task", "run", "acquisition", "space"}
+    }
+    # Create a specific dict for searching non-image files
+    non_image_query_params = query_params.copy()
+    non_image_query_params.pop("space")
+
+    return query_params, non_image_query_params
+
+
+def _select_stale_images(
+    images_to_process: list,
+    run_config: PostProcessingRunConfig,
+    run_config_path: os.PathLike,
+    bids: BIDSLayout,
+    logger,
+) -> list:
+    """Drop the images whose exports are current according to the stream's
+    manifest."""
+    manifest = PostprocessingManifest(
+        Path(run_config.stream_working_directory) / MANIFEST_DIR_NAME
+    )
+    # Hash the options as the image jobs will load them
+    current_options_hash = options_hash(
+        PostProcessingRunConfig.load(run_config_path).options
+    )
+
+    stale_images = []
+    for image in images_to_process:
+        _, non_image_query_params = _get_query_params(image)
+        confounds_path = get_confounds(bids, non_image_query_params, logger)
+        if manifest.is_current(
+            Path(image.path).stem, image.path, confounds_path, current_options_hash
+        ):
+            logger.debug(f"Skipping image with current exports: {image.path}")
+        else:
+            stale_images.append(image)
+
+    logger.info(
+        f"Skipping {len(images_to_process) - len(stale_images)} image(s) with "
+        f"current exports, processing {len(stale_images)} new or changed image(s)"
+    )
+    return stale_images
+
+
+def _create_subject_submission_string(
+    image_streams,
+    sub_with_id,
+    subject_log_dir,
+    debug,
+    logger,
+):
+    """Build the command of a job processing all of a subject's images, saving the
+    images and their streams to a file for the job to read.
+
+    Args:
+        image_streams: The images to process, each paired with a list of the
+            (run config, run config path) of each stream to run on it.
+    """
+    logger.info(f"Building subject job submission string")
+    image_streams = list(image_streams)
+    if not image_streams:
+        return {}
+
+    subject_job = {
+        "subject": sub_with_id,
+        "images": [
+            {
+                "image": str(image.path),
+                "run_configs": [str(path) for _, path in streams],
+            }
+            for image, streams in image_streams
+        ],
+    }
+    subject_job_file = Path(subject_log_dir) / SUBJECT_JOB_FILE_NAME
+    with open(subject_job_file, "w") as job_file:
+        json.dump(subject_job, job_file, indent=4)
+
+    debug_flag = ""
+    if debug:
+        debug_flag = "-debug"
+
+    submission_string = SUBJECT_SUBMISSION_STRING_TEMPLATE.format(
+        subject_job_file=str(subject_job_file),
+        subject_log_dir=str(subject_log_dir),
+        debug=debug_flag,
+    )
+    logger.debug(submission_string)
+    return {sub_with_id: submission_string}
+
+
+def _record_subject_job_memory(subject_log_dir: os.PathLike, mem_use: str):
+    """Save the memory requested for a subject's job to its job file, so that the
+    job runs its images within that request."""
+    subject_job_file = Path(subject_log_dir) / SUBJECT_JOB_FILE_NAME
+    with open(subject_job_file) as job_file:
+        subject_job = json.load(job_file)
+    subject_job["memory_usage"] = mem_use
+    with open(subject_job_file, "w") as job_file:
+        json.dump(subject_job, job_file, indent=4)
+
+
 def _list_available_streams(postprocessing_config: dict):
     return postprocessing_config.keys()
 
@@ -511,15 +1060,62 @@ def _get_processing_streams(options: ProjectOptions):
     pass
 
 
+def _get_stream_target(run_config: PostProcessingRunConfig, logger) -> tuple:
+    """Get the image space, tasks and acquisitions a stream targets."""
+    try:
+        tasks = run_config.options.target_tasks
+    except KeyError:
+        logger.warn(
+            (
+                "Postprocessing configuration setting 'TargetTasks' not set. "
+                "Defaulting to all tasks."
+            )
+        )
+        tasks = None
+    try:
+        acquisitions = run_config.options.target_acquisitions
+    except KeyError:
+        logger.warn(
+            (
+                "Postprocessing configuration setting 'TargetAcquisitions' "
+                "not set. Defaulting to all acquisitions."
+            )
+        )
+        acquisitions = None
+
+    return (
+        run_config.options.target_image_space,
+        tuple(tasks or ()),
+        tuple(acquisitions or ()),
+    )
+
+
+def _setup_subject_dirs(run_config: PostProcessingRunConfig, sub_with_id: str, logger):
+    subject_out_dir = Path(run_config.stream_output_directory) / sub_with_id
+    subject_working_dir = Path(run_config.stream_working_directory) / sub_with_id
+
+    if not subject_out_dir.exists():
+        logger.info(f"Creating subject directory: {subject_out_dir}")
+        subject_out_dir.mkdir(parents=True)
+
+    if not subject_working_dir.exists():
+        logger.info(f"Creating subject working directory: {subject_working_dir}")
+        subject_working_dir.mkdir(parents=True, exist_ok=False)
+
+
 def _create_image_submission_strings(
-    run_config_file,
-    images_to_process,
-    subject_out_dir,
-    subject_working_dir,
+    image_streams,
+    sub_with_id,
     subject_log_dir,
     debug,
     logger,
 ):
+    """Build each image's job command.
+
+    Args:
+        image_streams: The images to process, each paired with a list of the
+            (run config, run config path) of each stream to run on it.
+    """
     logger.info(f"Building image job submission strings")
     submission_strings = {}
 
@@ -528,15 +1124,25 @@ def _create_image_submission_strings(
         debug_flag = "-debug"
 
     logger.info("Creating submission string(s)")
-    for image in images_to_process:
+    for image, streams in image_streams:
         key = f"{Path(image.path).stem}"
 
+        # The first stream's directories are given directly, while those of
+        #   further streams are found through their run configs
+        (run_config, run_config_file), *other_streams = streams
+        stream_run_configs = "".join(
+            STREAM_RUN_CONFIG_OPTION_TEMPLATE.format(run_config_file=str(path))
+            for _, path in other_streams
+        )
         submission_strings[key] = IMAGE_SUBMISSION_STRING_TEMPLATE.format(
             run_config_file=str(run_config_file),
             image_file=image.path,
-            subject_out_dir=str(subject_out_dir),
-            subject_working_dir=str(subject_working_dir),
+            subject_out_dir=str(Path(run_config.stream_output_directory) / sub_with_id),
+            subject_working_dir=str(
+                Path(run_config.stream_working_directory) / sub_with_id
+            ),
             subject_log_dir=str(subject_log_dir),
+            stream_run_configs=stream_run_configs,
             debug=debug_flag,
         )
         logger.debug(submission_strings[key])
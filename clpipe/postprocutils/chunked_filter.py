@@ -0,0 +1,198 @@
+"""Chunked Temporal Filtering.
+
+Filters an image's voxel timeseries a block of voxels at a time, so that the
+memory needed is set by the block size rather than by the size of the image.
+Blocks are spread across a thread pool, as SciPy's filters release the GIL.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+from .compression import GZIP_BLOCK_SIZE, is_gzipped
+from .utils import apply_filter
+from .masked_image import _load_mask
+
+FILTER_DTYPE = np.float32
+NIFTI_SINGLE_VOX_OFFSET = 352
+"""Where the data of a single file NIfTI image without extensions begins."""
+GZIP_COMPRESS_LEVEL = 1
+"""The compression level nibabel uses for .gz images."""
+
+
+def filter_in_blocks(
+    sos,
+    data: np.ndarray,
+    chunk_size: int = 0,
+    n_threads: int = 1,
+    zero_phase: bool = False,
+) -> np.ndarray:
+    """Filter a time by voxel matrix in place, a block of voxels at a time.
+
+    Args:
+        sos: Second-order sections of the filter, from calc_filter.
+        data (np.ndarray): A time by voxel matrix.
+        chunk_size (int, optional): Voxels per block. Set to 0 to split the
+            voxels evenly across threads. Defaults to 0.
+        n_threads (int, optional): Blocks to filter in parallel. Defaults to 1.
+        zero_phase (bool, optional): Filter forwards and backwards. Defaults to
+            False.
+
+    Returns:
+        np.ndarray: The filtered matrix.
+    """
+    if isinstance(sos, str):
+        return data
+    sos = sos.astype(data.dtype)
+
+    def _filter_block(block: slice):
+        data[:, block] = apply_filter(sos, data[:, block], zero_phase=zero_phase)
+
+    n_threads = max(n_threads, 1)
+    blocks = _blocks(data.shape[1], chunk_size or -(-data.shape[1] // n_threads))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(_filter_block, blocks))
+
+    return data
+
+
+def filter_image_in_chunks(
+    sos,
+    in_file: os.PathLike,
+    out_file: os.PathLike,
+    chunk_size: int,
+    n_threads: int = 1,
+    zero_phase: bool = False,
+    mask_file: os.PathLike = None,
+) -> str:
+    """Filter an image a slab of slices at a time, writing each slab as it is done.
+
+    Slabs are read from and written to disk directly, so at most n_threads slabs
+    are in memory at once. Each slab holds as many whole slices as fit in
+    chunk_size voxels, and at least one. A .gz input is decompressed to a
+    temporary file first, as reading a slab of a compressed image decompresses it
+    from the start. A .gz output is likewise written uncompressed first, then
+    compressed as a stream. If a mask is given, only its voxels are filtered, and
+    voxels outside of it are zeroed.
+
+    Returns:
+        str: The path of the filtered image.
+    """
+    image = nib.load(in_file)
+    if len(image.shape) != 4:
+        raise ValueError(f"Expected a 4D image, got shape: {image.shape}")
+
+    raw_in_file = None
+    if is_gzipped(in_file):
+        raw_in_file = _decompress(in_file, os.path.dirname(os.path.abspath(out_file)))
+        image = nib.load(raw_in_file)
+    try:
+        _filter_image_slabs(
+            sos, image, out_file, chunk_size, n_threads, zero_phase, mask_file
+        )
+    finally:
+        if raw_in_file is not None:
+            os.remove(raw_in_file)
+
+    return os.path.abspath(out_file)
+
+
+def _filter_image_slabs(
+    sos,
+    image: nib.Nifti1Image,
+    out_file: os.PathLike,
+    chunk_size: int,
+    n_threads: int,
+    zero_phase: bool,
+    mask_file: os.PathLike,
+):
+    nx, ny, nz, _ = image.shape
+    mask = _load_mask(mask_file, image.shape[:3]) if mask_file is not None else None
+
+    compress = str(out_file).endswith(".gz")
+    raw_file = str(out_file)[: -len(".gz")] if compress else str(out_file)
+    if compress and os.path.exists(raw_file):
+        raw_file = f"{raw_file}.tmp"
+    out_data = _create_raw_nifti(image, raw_file)
+
+    if not isinstance(sos, str):
+        sos = sos.astype(FILTER_DTYPE)
+
+    def _filter_slab(slab: slice):
+        volumes = np.asarray(image.dataobj[:, :, slab, :], dtype=FILTER_DTYPE)
+        if mask is None:
+            timeseries = volumes.reshape(-1, volumes.shape[-1]).T
+            filtered = apply_filter(sos, timeseries, zero_phase=zero_phase)
+            out_data[:, :, slab, :] = filtered.T.reshape(volumes.shape)
+            return
+
+        slab_mask = mask[:, :, slab]
+        filtered = np.zeros_like(volumes)
+        filtered[slab_mask] = apply_filter(
+            sos, volumes[slab_mask].T, zero_phase=zero_phase
+        ).T
+        out_data[:, :, slab, :] = filtered
+
+    slices_per_slab = max(chunk_size // (nx * ny), 1)
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        list(executor.map(_filter_slab, _blocks(nz, slices_per_slab)))
+    out_data.flush()
+    del out_data
+
+    if compress:
+        with open(raw_file, "rb") as raw, gzip.open(
+            out_file, "wb", compresslevel=GZIP_COMPRESS_LEVEL
+        ) as compressed:
+            shutil.copyfileobj(raw, compressed)
+        os.remove(raw_file)
+
+
+def _decompress(in_file: os.PathLike, out_dir: os.PathLike) -> str:
+    """Decompress a gzipped image to a temporary file in a directory."""
+    file_descriptor, raw_file = tempfile.mkstemp(suffix=".nii", dir=out_dir)
+    try:
+        with gzip.open(in_file, "rb") as compressed, os.fdopen(
+            file_descriptor, "wb"
+        ) as raw:
+            shutil.copyfileobj(compressed, raw, GZIP_BLOCK_SIZE)
+    except BaseException:
+        os.remove(raw_file)
+        raise
+
+    return raw_file
+
+
+def _create_raw_nifti(image: nib.Nifti1Image, raw_file: os.PathLike) -> np.memmap:
+    """Write a float32 header for the image and map its (empty) data for writing."""
+    header = image.header.copy()
+    header.extensions.clear()
+    header.set_data_dtype(FILTER_DTYPE)
+    header.set_data_shape(image.shape)
+    header.set_slope_inter(1, 0)
+    header.set_data_offset(NIFTI_SINGLE_VOX_OFFSET)
+
+    data_bytes = int(np.prod(image.shape)) * header.get_data_dtype().itemsize
+    with open(raw_file, "wb") as f:
+        header.write_to(f)
+        f.truncate(NIFTI_SINGLE_VOX_OFFSET + data_bytes)
+
+    return np.memmap(
+        raw_file,
+        dtype=header.get_data_dtype(),
+        mode="r+",
+        offset=NIFTI_SINGLE_VOX_OFFSET,
+        shape=image.shape,
+        order="F",
+    )
+
+
+def _blocks(length: int, block_size: int) -> list:
+    return [
+        slice(start, min(start + block_size, length))
+        for start in range(0, length, block_size)
+    ]
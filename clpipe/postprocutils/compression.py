@@ -0,0 +1,125 @@
+"""Parallel Gzip Export.
+
+Intermediate images are written uncompressed, as each is read back immediately
+by the next step. Only final exports are compressed, with a block-parallel gzip
+writer: the image is split into blocks which are compressed at the same time and
+written as consecutive gzip members. A file of several gzip members is standard
+gzip, and reads like a single stream with gzip, zlib, nibabel and FSL.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .step_cache import default_file_mode
+
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_LEVEL = 6
+GZIP_BLOCK_SIZE = 4 * 1024**2
+"""Bytes of input compressed per gzip member."""
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+"""Tells zlib to write a gzip header and trailer."""
+
+OUTPUT_TYPE_EXTENSIONS = {"NIFTI": ".nii", "NIFTI_GZ": ".nii.gz"}
+"""The NIfTI formats intermediate images may be written in, named as FSL and
+AFNI name them."""
+
+
+def is_gzipped(path: os.PathLike) -> bool:
+    """Check whether a file is gzip compressed from its first bytes."""
+    with open(path, "rb") as in_file:
+        return in_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def parallel_gzip(
+    in_file: os.PathLike,
+    out_file: os.PathLike,
+    n_threads: int = 1,
+    level: int = GZIP_LEVEL,
+    block_size: int = GZIP_BLOCK_SIZE,
+) -> str:
+    """Gzip compress a file, compressing blocks of it in parallel.
+
+    Blocks are read and written in order, with at most two blocks per thread
+    held in memory at once.
+
+    Args:
+        in_file (os.PathLike): The file to compress.
+        out_file (os.PathLike): Where to write the compressed file.
+        n_threads (int, optional): Blocks to compress at once. Defaults to 1.
+        level (int, optional): The gzip compression level.
+        block_size (int, optional): Bytes of input per block.
+
+    Returns:
+        str: The path of the compressed file.
+    """
+    n_threads = max(int(n_threads), 1)
+    out_dir = os.path.dirname(os.path.abspath(out_file))
+    # Write under a temporary name first, so that a partially written export is
+    #   never left under the export's name
+    file_descriptor, temp_path = tempfile.mkstemp(suffix=".gz", dir=out_dir)
+    try:
+        with open(in_file, "rb") as source, os.fdopen(
+            file_descriptor, "wb"
+        ) as destination, ThreadPoolExecutor(max_workers=n_threads) as executor:
+            pending = deque()
+            for block in iter(lambda: source.read(block_size), b""):
+                pending.append(executor.submit(_compress_block, block, level))
+                if len(pending) >= 2 * n_threads:
+                    destination.write(pending.popleft().result())
+            while pending:
+                destination.write(pending.popleft().result())
+        os.chmod(temp_path, default_file_mode())
+        os.replace(temp_path, out_file)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return os.path.abspath(out_file)
+
+
+def export_image(
+    in_file: os.PathLike, out_file: os.PathLike, n_threads: int = 1
+) -> str:
+    """Export an image, compressing or decompressing it to match the export's
+    extension.
+
+    An uncompressed image exported to a .gz path is compressed with
+    parallel_gzip, and a compressed image exported without one is decompressed.
+    Otherwise, the image is copied as is.
+
+    Returns:
+        str: The path of the exported image.
+    """
+    compress = str(out_file).endswith(".gz")
+    compressed = is_gzipped(in_file)
+    if compress and not compressed:
+        return parallel_gzip(in_file, out_file, n_threads)
+
+    if compressed and not compress:
+        with gzip.open(in_file, "rb") as source, open(out_file, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+    else:
+        shutil.copyfile(in_file, out_file)
+    return os.path.abspath(out_file)
+
+
+def intermediate_extension(output_type: str) -> str:
+    """Get the file extension of images written in an intermediate format."""
+    try:
+        return OUTPUT_TYPE_EXTENSIONS[output_type]
+    except KeyError:
+        raise ValueError(
+            f"Unknown intermediate format: {output_type}. Available formats: "
+            f"{', '.join(OUTPUT_TYPE_EXTENSIONS)}"
+        ) from None
+
+
+def _compress_block(block: bytes, level: int) -> bytes:
+    # zlib releases the GIL while compressing, so blocks compress in parallel
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(block) + compressor.flush()
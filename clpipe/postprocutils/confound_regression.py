@@ -0,0 +1,413 @@
+"""Native Confound Regression.
+
+Regresses confounds, or AROMA noise components, out of a time by voxel matrix
+with NumPy. The design is factored once, and its projection is then applied to
+blocks of voxels across a thread pool, as NumPy's matrix products release the GIL.
+
+Temporal filtering can be folded into the same projection by adding bandstop
+regressors to the confounds, as 3dTproject does, so that filtering and
+regression take one pass over the image.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import qr, solve_triangular
+
+from .masked_image import MaskedImage
+
+REGRESSION_BLOCK_VOXELS = 4096
+"""Voxels per block, sized to keep a block of a few hundred timepoints in cache."""
+RANK_TOLERANCE = 1e-10
+"""Confound columns whose QR pivot falls below this, relative to the largest,
+are treated as linearly dependent on the others."""
+
+BASIS_SINCOS = "sincos"
+BASIS_DCT = "dct"
+BASES = (BASIS_SINCOS, BASIS_DCT)
+
+
+def confound_basis(confounds: np.ndarray) -> np.ndarray:
+    """Factor a confound design into an orthonormal basis of its centred columns.
+
+    Uses a column-pivoted QR decomposition, so that constant or linearly
+    dependent confounds are dropped rather than destabilizing the fit.
+
+    Args:
+        confounds (np.ndarray): A time by confound matrix without missing values.
+
+    Returns:
+        np.ndarray: A time by rank matrix with orthonormal, zero-mean columns.
+    """
+    return confound_projection(confounds)[0]
+
+
+def confound_projection(confounds: np.ndarray, fit_rows: np.ndarray = None) -> tuple:
+    """Factor a confound design fit on a subset of its timepoints.
+
+    The orthonormal basis spans the centred confounds at the fitted timepoints.
+    The extension maps the basis coefficients back onto every timepoint, so
+    that the fit can also be removed from timepoints left out of it.
+
+    Args:
+        confounds (np.ndarray): A time by confound matrix without missing values.
+        fit_rows (np.ndarray, optional): A boolean vector selecting the
+            timepoints to fit. Defaults to all timepoints.
+
+    Returns:
+        tuple: The fit by rank basis and the time by rank extension. These are
+            the same matrix when every timepoint is fit.
+    """
+    fit = confounds if fit_rows is None else confounds[fit_rows]
+    design = confounds - fit.mean(axis=0)
+    fit_design = design if fit_rows is None else design[fit_rows]
+    if design.shape[1] == 0:
+        return fit_design, design
+
+    basis, r, pivots = qr(fit_design, mode="economic", pivoting=True)
+    diagonal = np.abs(np.diag(r))
+    rank = np.count_nonzero(diagonal > RANK_TOLERANCE * max(diagonal.max(), 1e-300))
+    basis = basis[:, :rank]
+    if fit_rows is None:
+        return basis, basis
+
+    # The design is basis @ r over the fitted timepoints, so the same
+    #   coefficients reach every timepoint through design @ inv(r)
+    extension = solve_triangular(
+        r[:rank, :rank], design[:, pivots[:rank]].T, trans="T"
+    ).T
+    return basis, extension
+
+
+def bandstop_basis(
+    n_timepoints: int,
+    tr: float,
+    high_pass: float,
+    low_pass: float,
+    basis: str = BASIS_SINCOS,
+) -> np.ndarray:
+    """Build regressors spanning the frequencies outside of a pass band.
+
+    Regressing these out of a timeseries removes its power below the high pass
+    and above the low pass cutoff, as with 3dTproject's -passband.
+
+    Args:
+        n_timepoints (int): The length of the timeseries.
+        tr (float): The repetition time in seconds.
+        high_pass (float): Frequencies below this are removed. Set to 0 or less
+            to disable.
+        low_pass (float): Frequencies above this are removed. Set to 0 or less
+            to disable.
+        basis (str, optional): "sincos" for sine and cosine pairs at the
+            Fourier frequencies, or "dct" for discrete cosines.
+
+    Returns:
+        np.ndarray: A time by regressor matrix, without a constant column.
+    """
+    if basis not in BASES:
+        raise ValueError(f"Bandstop basis must be one of {BASES}, got: {basis}")
+
+    if basis == BASIS_SINCOS:
+        periods = np.arange(1, n_timepoints // 2 + 1)
+        frequencies = periods / (n_timepoints * tr)
+    else:
+        periods = np.arange(1, n_timepoints)
+        frequencies = periods / (2 * n_timepoints * tr)
+
+    stopped = np.zeros(len(periods), dtype=bool)
+    if high_pass > 0:
+        stopped |= frequencies < high_pass
+    if low_pass > 0:
+        stopped |= frequencies > low_pass
+    periods = periods[stopped]
+
+    timepoints = np.arange(n_timepoints)[:, np.newaxis]
+    if basis == BASIS_DCT:
+        return np.cos(np.pi * (timepoints + 0.5) * periods / n_timepoints)
+
+    angles = 2 * np.pi * timepoints * periods / n_timepoints
+    # The sine at the Nyquist frequency is zero at every timepoint
+    sines = np.sin(angles[:, 2 * periods != n_timepoints])
+    return np.hstack([np.cos(angles), sines])
+
+
+def residualize(
+    data: np.ndarray,
+    confounds: np.ndarray,
+    voxels: np.ndarray = None,
+    n_threads: int = 1,
+    block_size: int = REGRESSION_BLOCK_VOXELS,
+    censored: np.ndarray = None,
+) -> np.ndarray:
+    """Regress confounds out of each voxel's timeseries in place, keeping its mean.
+
+    Matches afni_3dTproject with polort 0 followed by adding back the mean image:
+    unselected voxels are left at their mean. Timepoints with missing confounds,
+    or scrubbed with NaN, are left out of the fit and set to NaN.
+
+    Args:
+        data (np.ndarray): A time by voxel matrix.
+        confounds (np.ndarray): A time by confound matrix.
+        voxels (np.ndarray, optional): A boolean vector over the columns of data
+            selecting the voxels to regress. Defaults to all voxels.
+        n_threads (int, optional): Blocks to regress in parallel. Defaults to 1.
+        block_size (int, optional): Voxels per block.
+        censored (np.ndarray, optional): A boolean vector over the timepoints
+            to leave out of the fit. Unlike missing timepoints, these are still
+            regressed, using the fit from the others.
+
+    Returns:
+        np.ndarray: The regressed matrix.
+    """
+    if confounds.shape[0] != data.shape[0]:
+        raise ValueError(
+            f"Confounds have {confounds.shape[0]} timepoints, but the image has "
+            f"{data.shape[0]}."
+        )
+    if voxels is None:
+        voxels = np.ones(data.shape[1], dtype=bool)
+
+    kept = np.isfinite(confounds).all(axis=1) & ~np.isnan(data).all(axis=1)
+    fit_rows = None
+    if censored is not None and censored[kept].any():
+        fit_rows = ~censored[kept]
+        if not fit_rows.any():
+            raise ValueError("Every timepoint is censored, leaving nothing to fit.")
+    basis, extension = confound_projection(confounds[kept], fit_rows)
+    basis = basis.astype(data.dtype)
+    extension = extension.astype(data.dtype)
+    all_kept = kept.all()
+
+    def _regress_block(block: slice):
+        values = data[:, block] if all_kept else data[kept, block]
+        fit_values = values if fit_rows is None else values[fit_rows]
+        mean = fit_values.mean(axis=0)
+        values -= extension @ (basis.T @ (fit_values - mean))
+        values[:, ~voxels[block]] = mean[~voxels[block]]
+        if not all_kept:
+            data[kept, block] = values
+
+    _run_in_blocks(_regress_block, data.shape[1], n_threads, block_size)
+
+    data[~kept] = np.nan
+    return data
+
+
+def filter_and_regress(
+    data: np.ndarray,
+    confounds: np.ndarray,
+    tr: float,
+    high_pass: float,
+    low_pass: float,
+    basis: str = BASIS_SINCOS,
+    censored: np.ndarray = None,
+    voxels: np.ndarray = None,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Temporally filter and regress confounds out of each voxel in one projection.
+
+    The confounds and the bandstop regressors are fit together, so neither
+    step reintroduces what the other removed. Each voxel's mean is kept.
+
+    Args:
+        data (np.ndarray): A time by voxel matrix.
+        confounds (np.ndarray): A time by confound matrix, not yet filtered.
+        tr (float): The repetition time in seconds.
+        high_pass (float): The high pass cutoff in Hz. Set to -1 to disable.
+        low_pass (float): The low pass cutoff in Hz. Set to -1 to disable.
+        basis (str, optional): The bandstop basis, "sincos" or "dct".
+        censored (np.ndarray, optional): A boolean vector over the timepoints
+            to leave out of the fit.
+        voxels (np.ndarray, optional): A boolean vector over the columns of data
+            selecting the voxels to regress. Defaults to all voxels.
+        n_threads (int, optional): Blocks to regress in parallel. Defaults to 1.
+
+    Returns:
+        np.ndarray: The filtered and regressed matrix.
+    """
+    design = np.hstack(
+        [confounds, bandstop_basis(data.shape[0], tr, high_pass, low_pass, basis)]
+    )
+    return residualize(
+        data, design, voxels=voxels, n_threads=n_threads, censored=censored
+    )
+
+
+def regress_noise_components(
+    data: np.ndarray,
+    mixing: np.ndarray,
+    noise_ics: np.ndarray,
+    voxels: np.ndarray = None,
+    n_threads: int = 1,
+    block_size: int = REGRESSION_BLOCK_VOXELS,
+) -> np.ndarray:
+    """Non-aggressively regress AROMA noise components out of each voxel, in place.
+
+    As with fsl_regfilt and fsl_regfilt_R, every component of the MELODIC mixing
+    matrix is fit jointly, without an intercept, but only the fitted noise
+    components are subtracted. Voxels which are constant over time are left
+    unchanged.
+
+    Args:
+        data (np.ndarray): A time by voxel matrix.
+        mixing (np.ndarray): The time by component MELODIC mixing matrix.
+        noise_ics (np.ndarray): The 1-based indices of the noise components.
+        voxels (np.ndarray, optional): A boolean vector over the columns of data
+            selecting the voxels to regress. Defaults to all voxels.
+        n_threads (int, optional): Blocks to regress in parallel. Defaults to 1.
+        block_size (int, optional): Voxels per block.
+
+    Returns:
+        np.ndarray: The regressed matrix.
+    """
+    if mixing.shape[0] != data.shape[0]:
+        raise ValueError(
+            f"The mixing matrix has {mixing.shape[0]} timepoints, but the image "
+            f"has {data.shape[0]}."
+        )
+    noise_ics = np.asarray(noise_ics, dtype=int) - 1
+    if voxels is None:
+        voxels = np.ones(data.shape[1], dtype=bool)
+
+    # Only the noise rows of the joint fit are needed
+    noise_weights = np.linalg.pinv(mixing)[noise_ics].astype(data.dtype)
+    noise_mixing = mixing[:, noise_ics].astype(data.dtype)
+
+    def _regress_block(block: slice):
+        values = data[:, block]
+        varying = voxels[block] & (values != values[0]).any(axis=0)
+        if varying.all():
+            values -= noise_mixing @ (noise_weights @ values)
+        elif varying.any():
+            selected = values[:, varying]
+            values[:, varying] = selected - noise_mixing @ (noise_weights @ selected)
+
+    _run_in_blocks(_regress_block, data.shape[1], n_threads, block_size)
+
+    return data
+
+
+def regress_image(
+    in_file: os.PathLike,
+    confounds_file: os.PathLike,
+    out_file: os.PathLike,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+) -> str:
+    """Regress a processed confounds file out of an image.
+
+    Voxels outside of the mask are left at their mean.
+
+    Returns:
+        str: The path of the regressed image.
+    """
+    image = MaskedImage.load(in_file)
+    voxels = image.voxels_in(mask_file) if mask_file else None
+    residualize(
+        image.data, load_confounds(confounds_file), voxels=voxels, n_threads=n_threads
+    )
+    return image.save(out_file)
+
+
+def filter_and_regress_image(
+    in_file: os.PathLike,
+    confounds_file: os.PathLike,
+    out_file: os.PathLike,
+    tr: float,
+    high_pass: float,
+    low_pass: float,
+    basis: str = BASIS_SINCOS,
+    scrub_vector: list = None,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+) -> str:
+    """Temporally filter and regress a confounds file out of an image in one pass.
+
+    Timepoints flagged in the scrub vector are left out of the fit, if given.
+    Voxels outside of the mask are left at their mean.
+
+    Returns:
+        str: The path of the processed image.
+    """
+    image = MaskedImage.load(in_file)
+    voxels = image.voxels_in(mask_file) if mask_file else None
+    filter_and_regress(
+        image.data,
+        load_confounds(confounds_file),
+        tr,
+        high_pass,
+        low_pass,
+        basis=basis,
+        censored=censor_vector(scrub_vector, image.n_timepoints),
+        voxels=voxels,
+        n_threads=n_threads,
+    )
+    return image.save(out_file)
+
+
+def regfilt_image(
+    in_file: os.PathLike,
+    mixing_file: os.PathLike,
+    noise_file: os.PathLike,
+    out_file: os.PathLike,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+) -> str:
+    """Non-aggressively regress AROMA noise components out of an image.
+
+    Voxels outside of the mask are left unchanged.
+
+    Returns:
+        str: The path of the regressed image.
+    """
+    image = MaskedImage.load(in_file)
+    voxels = image.voxels_in(mask_file) if mask_file else None
+    regress_noise_components(
+        image.data,
+        load_mixing(mixing_file),
+        load_noise_ics(noise_file),
+        voxels=voxels,
+        n_threads=n_threads,
+    )
+    return image.save(out_file)
+
+
+def load_confounds(confounds_file: os.PathLike) -> np.ndarray:
+    """Load a processed confounds file as a time by confound matrix."""
+    return pd.read_csv(confounds_file, sep="\t").to_numpy(dtype=np.float64)
+
+
+def load_mixing(mixing_file: os.PathLike) -> np.ndarray:
+    """Load a MELODIC mixing matrix as a time by component matrix."""
+    return np.loadtxt(mixing_file, dtype=np.float64, ndmin=2)
+
+
+def load_noise_ics(noise_file: os.PathLike) -> np.ndarray:
+    """Load the 1-based indices of the noise components from AROMAnoiseICs.csv."""
+    return np.loadtxt(noise_file, delimiter=",", dtype=np.int64, ndmin=1)
+
+
+def censor_vector(scrub_vector: list, n_timepoints: int) -> np.ndarray:
+    """Convert a scrub vector of 1s and 0s into a boolean censoring vector.
+
+    Returns None if no scrub vector is given.
+    """
+    if scrub_vector is None:
+        return None
+    if len(scrub_vector) != n_timepoints:
+        raise ValueError(
+            f"The scrub vector has {len(scrub_vector)} timepoints, but the image "
+            f"has {n_timepoints}."
+        )
+    return np.asarray(scrub_vector) == 1
+
+
+def _run_in_blocks(function, n_voxels: int, n_threads: int, block_size: int):
+    blocks = [
+        slice(start, min(start + block_size, n_voxels))
+        for start in range(0, n_voxels, block_size)
+    ]
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        list(executor.map(function, blocks))
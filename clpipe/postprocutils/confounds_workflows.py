@@ -67,10 +67,13 @@ def build_confounds_processing_workflow(
     if column_names is None:
         column_names = processing_options.confound_options.columns
 
-    # Force use of the R variant of fsl_regfilt for confounds
+    # Confounds are not a brain image, so always regress AROMA noise out of them
+    #   with the native implementation. The options are copied so the image
+    #   workflow keeps its own implementation.
     if "AROMARegression" in processing_steps:
+        processing_options = copy.deepcopy(processing_options)
         processing_options.processing_step_options.aroma_regression.implementation = (
-            "fsl_regfilt_R"
+            "numpy"
         )
 
     # Gather motion outlier details if present
@@ -0,0 +1,536 @@
+"""Fused In-Memory Postprocessing Engine.
+
+Runs a stream's image processing steps as NumPy/SciPy operations on a single
+in-memory copy of the image, rather than as a chain of nipype sub-workflows which
+each write and re-read a full 4D image. The image is read once and only the final
+image is written.
+
+The engine is wrapped in a workflow with the same inputs and outputs as the
+nipype image processing workflow, so confounds processing and scrub target
+calculation are unchanged.
+"""
+
+import os
+
+import numpy as np
+from nipype.interfaces.utility import Function, IdentityInterface
+import nipype.pipeline.engine as pe
+
+from .image_workflows import (
+    STEP_TEMPORAL_FILTERING,
+    IMPLEMENTATION_BUTTERWORTH,
+    STEP_INTENSITY_NORMALIZATION,
+    IMPLEMENTATION_10000_GLOBAL_MEDIAN,
+    IMPLEMENTATION_100_VOXEL_MEAN,
+    IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY,
+    IMPLEMENTATION_100_VOXEL_MEAN_NUMPY,
+    STEP_CONFOUND_REGRESSION,
+    IMPLEMENTATION_AFNI_3DTPROJECT,
+    STEP_SPATIAL_SMOOTHING,
+    IMPLEMENTATION_SUSAN,
+    IMPLEMENTATION_SUSAN_NUMPY,
+    IMPLEMENTATION_MASKED_GAUSSIAN,
+    STEP_AROMA_REGRESSION,
+    IMPLEMENTATION_FSL_REGFILT,
+    IMPLEMENTATION_FSL_REGFILT_R,
+    IMPLEMENTATION_NUMPY,
+    STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION,
+    STEP_APPLY_MASK,
+    STEP_TRIM_TIMEPOINTS,
+    STEP_SCRUB_TIMEPOINTS,
+)
+from .chunked_filter import filter_in_blocks
+from .confound_regression import (
+    residualize,
+    filter_and_regress,
+    censor_vector,
+    regress_noise_components,
+    load_confounds,
+    load_mixing,
+    load_noise_ics,
+)
+from .masked_image import MaskedImage
+from .intensity_normalization import (
+    global_median_normalize,
+    voxel_mean_normalize,
+    METHOD_GLOBAL_MEDIAN,
+    METHOD_VOXEL_MEAN,
+)
+from .spatial_smoothing import (
+    susan_smooth,
+    gaussian_smooth,
+    METHOD_SUSAN,
+    METHOD_GAUSSIAN,
+)
+from .utils import calc_filter, get_scrub_targets
+from ..errors import ImplementationNotFoundError
+from ..config.options import PostProcessingOptions
+
+ENGINE_NIPYPE = "nipype"
+ENGINE_FUSED = "fused"
+ENGINES = (ENGINE_NIPYPE, ENGINE_FUSED)
+
+FUSED_IMPLEMENTATIONS = {
+    STEP_TEMPORAL_FILTERING: {IMPLEMENTATION_BUTTERWORTH},
+    STEP_INTENSITY_NORMALIZATION: {
+        IMPLEMENTATION_10000_GLOBAL_MEDIAN,
+        IMPLEMENTATION_100_VOXEL_MEAN,
+        IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY,
+        IMPLEMENTATION_100_VOXEL_MEAN_NUMPY,
+    },
+    STEP_CONFOUND_REGRESSION: {IMPLEMENTATION_AFNI_3DTPROJECT, IMPLEMENTATION_NUMPY},
+    STEP_SPATIAL_SMOOTHING: {
+        IMPLEMENTATION_SUSAN,
+        IMPLEMENTATION_SUSAN_NUMPY,
+        IMPLEMENTATION_MASKED_GAUSSIAN,
+    },
+    STEP_AROMA_REGRESSION: {
+        IMPLEMENTATION_FSL_REGFILT,
+        IMPLEMENTATION_FSL_REGFILT_R,
+        IMPLEMENTATION_NUMPY,
+    },
+}
+"""The implementations of each configurable step available to the fused engine."""
+
+NORMALIZATION_METHODS = {
+    IMPLEMENTATION_10000_GLOBAL_MEDIAN: METHOD_GLOBAL_MEDIAN,
+    IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY: METHOD_GLOBAL_MEDIAN,
+    IMPLEMENTATION_100_VOXEL_MEAN: METHOD_VOXEL_MEAN,
+    IMPLEMENTATION_100_VOXEL_MEAN_NUMPY: METHOD_VOXEL_MEAN,
+}
+SMOOTHING_METHODS = {
+    IMPLEMENTATION_SUSAN: METHOD_SUSAN,
+    IMPLEMENTATION_SUSAN_NUMPY: METHOD_SUSAN,
+    IMPLEMENTATION_MASKED_GAUSSIAN: METHOD_GAUSSIAN,
+}
+
+
+def build_fused_image_postprocessing_workflow(
+    processing_options: PostProcessingOptions,
+    in_file: os.PathLike = None,
+    export_path: os.PathLike = None,
+    name: str = "Postprocessing_Pipeline",
+    processing_steps: list = None,
+    mask_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    tr: float = None,
+    scrub_vector: list = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+    cache_dir: os.PathLike = None,
+):
+    """Builds an image processing workflow which runs every step in one node.
+
+    Takes the same arguments, and exposes the same input and output nodes, as
+    build_image_postprocessing_workflow. The cache directory is not used, as
+    none of the fused steps share files between images.
+
+    Returns:
+        pe.Workflow: A fused image processing workflow.
+    """
+    if processing_steps is None:
+        processing_steps = processing_options.processing_steps
+    plan = build_fused_plan(processing_options, processing_steps, tr, mask_file)
+
+    workflow = pe.Workflow(name=name, base_dir=base_dir)
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=[
+                "in_file",
+                "export_path",
+                "confounds_file",
+                "scrub_vector",
+                "mask_file",
+                "mixing_file",
+                "noise_file",
+                "tr",
+            ],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    fused_node = pe.Node(
+        Function(
+            input_names=[
+                "in_file",
+                "plan",
+                "out_file",
+                "mask_file",
+                "confounds_file",
+                "scrub_vector",
+                "mixing_file",
+                "noise_file",
+            ],
+            output_names=["out_file"],
+            function=_run_fused_plan_node,
+        ),
+        name="fused_processing",
+    )
+    fused_node.inputs.plan = plan
+
+    # Set WF inputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if export_path:
+        input_node.inputs.export_path = export_path
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+    if scrub_vector:
+        input_node.inputs.scrub_vector = scrub_vector
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+    if mixing_file:
+        input_node.inputs.mixing_file = mixing_file
+    if noise_file:
+        input_node.inputs.noise_file = noise_file
+
+    workflow.connect(input_node, "in_file", fused_node, "in_file")
+    workflow.connect(input_node, "export_path", fused_node, "out_file")
+    workflow.connect(input_node, "mask_file", fused_node, "mask_file")
+    if any(step_plan.get("confounds") for step_plan in plan):
+        workflow.connect(input_node, "confounds_file", fused_node, "confounds_file")
+    if any(step_plan.get("scrub_vector") for step_plan in plan):
+        workflow.connect(input_node, "scrub_vector", fused_node, "scrub_vector")
+    if STEP_AROMA_REGRESSION in processing_steps:
+        workflow.connect(input_node, "mixing_file", fused_node, "mixing_file")
+        workflow.connect(input_node, "noise_file", fused_node, "noise_file")
+    workflow.connect(fused_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
+def build_fused_plan(
+    processing_options: PostProcessingOptions,
+    processing_steps: list,
+    tr: float = None,
+    mask_file: os.PathLike = None,
+):
+    """Resolve each processing step and its options into a plan for the engine.
+
+    Configuration problems are raised here, while the workflow is built, rather
+    than once the image is loaded.
+
+    Returns:
+        list: One dict per step, holding the step name and its options.
+    """
+    if len(processing_steps) < 1:
+        raise ValueError(
+            "The PostProcess workflow requires at least 1 processing step."
+        )
+
+    step_options = processing_options.processing_step_options
+    plan = []
+    for step in processing_steps:
+        if step in FUSED_IMPLEMENTATIONS:
+            implementation_name = _get_step_option(step_options, step).implementation
+            if implementation_name not in FUSED_IMPLEMENTATIONS[step]:
+                raise ImplementationNotFoundError(
+                    f"{step} implementation not available to the {ENGINE_FUSED} "
+                    f"engine: {implementation_name}"
+                )
+
+        if step == STEP_TEMPORAL_FILTERING:
+            if not tr:
+                raise ValueError(f"{STEP_TEMPORAL_FILTERING}: Missing TR.")
+            plan.append(
+                {
+                    "step": step,
+                    "hp": step_options.temporal_filtering.filtering_high_pass,
+                    "lp": step_options.temporal_filtering.filtering_low_pass,
+                    "order": step_options.temporal_filtering.filtering_order,
+                    "tr": tr,
+                    "zero_phase": step_options.temporal_filtering.zero_phase,
+                    "chunk_size": step_options.temporal_filtering.chunk_size,
+                    "n_threads": step_options.temporal_filtering.n_threads,
+                }
+            )
+        elif step == STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION:
+            if not tr:
+                raise ValueError(
+                    f"{STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION}: Missing TR."
+                )
+            filter_regress = step_options.temporal_filtering_confound_regression
+            plan.append(
+                {
+                    "step": step,
+                    "hp": step_options.temporal_filtering.filtering_high_pass,
+                    "lp": step_options.temporal_filtering.filtering_low_pass,
+                    "tr": tr,
+                    "basis": filter_regress.basis,
+                    "n_threads": filter_regress.n_threads,
+                    "confounds": True,
+                    "scrub_vector": filter_regress.censor,
+                }
+            )
+        elif step == STEP_TRIM_TIMEPOINTS:
+            plan.append(
+                {
+                    "step": step,
+                    "from_beginning": step_options.trim_timepoints.from_beginning,
+                    "from_end": step_options.trim_timepoints.from_end,
+                }
+            )
+        elif step == STEP_SCRUB_TIMEPOINTS:
+            plan.append(
+                {
+                    "step": step,
+                    "insert_na": step_options.scrub_timepoints.insert_na,
+                    "scrub_vector": True,
+                }
+            )
+        elif step == STEP_APPLY_MASK:
+            if mask_file is None:
+                raise ValueError(f"{STEP_APPLY_MASK}: No mask file provided.")
+            plan.append({"step": step})
+        elif step == STEP_CONFOUND_REGRESSION:
+            plan.append(
+                {
+                    "step": step,
+                    "n_threads": step_options.confound_regression.n_threads,
+                    "confounds": True,
+                }
+            )
+        elif step == STEP_SPATIAL_SMOOTHING:
+            spatial_smoothing = step_options.spatial_smoothing
+            plan.append(
+                {
+                    "step": step,
+                    "method": SMOOTHING_METHODS[spatial_smoothing.implementation],
+                    "fwhm": spatial_smoothing.fwhm,
+                    "n_threads": spatial_smoothing.n_threads,
+                }
+            )
+        elif step == STEP_AROMA_REGRESSION:
+            plan.append(
+                {"step": step, "n_threads": step_options.aroma_regression.n_threads}
+            )
+        elif step == STEP_INTENSITY_NORMALIZATION:
+            implementation_name = step_options.intensity_normalization.implementation
+            plan.append(
+                {"step": step, "method": NORMALIZATION_METHODS[implementation_name]}
+            )
+        else:
+            raise ImplementationNotFoundError(
+                f"Processing step not available to the {ENGINE_FUSED} engine: {step}"
+            )
+
+    return plan
+
+
+def run_fused_plan(
+    in_file: os.PathLike,
+    plan: list,
+    out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    scrub_vector: list = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+):
+    """Load an image once, run each step of the plan on it, and save the result.
+
+    Returns:
+        str: The path of the processed image.
+    """
+    # Voxels outside of the mask are zeroed by streams which apply it, so there
+    #   is no need to load them
+    applies_mask = any(step_plan["step"] == STEP_APPLY_MASK for step_plan in plan)
+    image = MaskedImage.load(in_file, mask=mask_file if applies_mask else None)
+    voxels = image.voxels_in(mask_file) if mask_file else None
+    data = image.data
+
+    for step_plan in plan:
+        step = step_plan["step"]
+
+        if step == STEP_TEMPORAL_FILTERING:
+            data = butterworth_filter(
+                data,
+                hp=step_plan["hp"],
+                lp=step_plan["lp"],
+                tr=step_plan["tr"],
+                order=step_plan["order"],
+                zero_phase=step_plan["zero_phase"],
+                chunk_size=step_plan["chunk_size"],
+                n_threads=step_plan["n_threads"],
+            )
+        elif step == STEP_TRIM_TIMEPOINTS:
+            data = trim_timepoints(
+                data,
+                from_beginning=step_plan["from_beginning"],
+                from_end=step_plan["from_end"],
+            )
+        elif step == STEP_SCRUB_TIMEPOINTS:
+            data = scrub_timepoints(
+                data, scrub_vector, insert_na=step_plan["insert_na"]
+            )
+        elif step == STEP_INTENSITY_NORMALIZATION:
+            if step_plan["method"] == METHOD_GLOBAL_MEDIAN:
+                data = global_median_normalize(data, voxels=voxels)
+            else:
+                data = voxel_mean_normalize(data)
+        elif step == STEP_CONFOUND_REGRESSION:
+            data = regress_confounds(
+                data,
+                load_confounds(confounds_file),
+                voxels=voxels,
+                n_threads=step_plan["n_threads"],
+            )
+        elif step == STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION:
+            censored = None
+            if step_plan["scrub_vector"]:
+                censored = censor_vector(scrub_vector, data.shape[0])
+            data = filter_and_regress(
+                data,
+                load_confounds(confounds_file),
+                tr=step_plan["tr"],
+                high_pass=step_plan["hp"],
+                low_pass=step_plan["lp"],
+                basis=step_plan["basis"],
+                censored=censored,
+                voxels=voxels,
+                n_threads=step_plan["n_threads"],
+            )
+        elif step == STEP_SPATIAL_SMOOTHING:
+            data = spatial_smooth(
+                image.with_data(data),
+                method=step_plan["method"],
+                fwhm_mm=step_plan["fwhm"],
+                voxels=voxels,
+                n_threads=step_plan["n_threads"],
+            )
+        elif step == STEP_AROMA_REGRESSION:
+            data = regress_noise_components(
+                data,
+                load_mixing(mixing_file),
+                load_noise_ics(noise_file),
+                voxels=voxels,
+                n_threads=step_plan["n_threads"],
+            )
+        elif step == STEP_APPLY_MASK:
+            data = apply_mask(data, voxels)
+
+    if out_file is None:
+        out_file = _default_out_file(in_file)
+
+    return image.with_data(data).save(out_file)
+
+
+def trim_timepoints(data: np.ndarray, from_beginning: int = 0, from_end: int = 0):
+    """Drop timepoints from the beginning and end of a time by voxel matrix."""
+    return data[from_beginning : data.shape[0] - from_end]
+
+
+def butterworth_filter(
+    data: np.ndarray,
+    hp: float,
+    lp: float,
+    tr: float,
+    order,
+    zero_phase: bool = False,
+    chunk_size: int = 0,
+    n_threads: int = 1,
+):
+    """Apply a Butterworth filter to each voxel's timeseries, in place."""
+    return filter_in_blocks(
+        calc_filter(hp, lp, tr, order),
+        data,
+        chunk_size=chunk_size,
+        n_threads=n_threads,
+        zero_phase=zero_phase,
+    )
+
+
+def spatial_smooth(
+    image: MaskedImage,
+    method: str,
+    fwhm_mm: float,
+    voxels: np.ndarray = None,
+    n_threads: int = 1,
+):
+    """Smooth each volume of a masked image, returning the smoothed matrix.
+
+    Smoothing is within the selected voxels, and unselected voxels are zeroed.
+    """
+    mask = image.voxel_mask(voxels) if voxels is not None else None
+    smooth = susan_smooth if method == METHOD_SUSAN else gaussian_smooth
+
+    array = smooth(
+        image.to_array(), fwhm_mm, image.header.get_zooms()[:3], mask, n_threads
+    )
+    return np.ascontiguousarray(array[image.mask].T)
+
+
+def scrub_timepoints(data: np.ndarray, scrub_vector: list, insert_na: bool = True):
+    """Replace scrub targets with NaN, or remove them if insert_na is False."""
+    scrub_targets = get_scrub_targets(scrub_vector)
+    if insert_na:
+        data[scrub_targets] = np.nan
+        return data
+    return np.delete(data, scrub_targets, axis=0)
+
+
+def regress_confounds(
+    data: np.ndarray,
+    confounds: np.ndarray,
+    voxels: np.ndarray = None,
+    n_threads: int = 1,
+):
+    """Regress confounds out of each voxel's timeseries, keeping the voxel mean."""
+    return residualize(data, confounds, voxels=voxels, n_threads=n_threads)
+
+
+def apply_mask(data: np.ndarray, voxels: np.ndarray):
+    """Zero out all unselected voxels."""
+    data[:, ~voxels] = 0
+    return data
+
+
+def _get_step_option(step_options, step: str):
+    return {
+        STEP_TEMPORAL_FILTERING: step_options.temporal_filtering,
+        STEP_INTENSITY_NORMALIZATION: step_options.intensity_normalization,
+        STEP_CONFOUND_REGRESSION: step_options.confound_regression,
+        STEP_SPATIAL_SMOOTHING: step_options.spatial_smoothing,
+        STEP_AROMA_REGRESSION: step_options.aroma_regression,
+    }[step]
+
+
+def _default_out_file(in_file: os.PathLike):
+    from pathlib import Path
+
+    path_stem = Path(in_file).name.split(".")[0]
+    return str(Path(path_stem + "_postprocessed.nii.gz").absolute())
+
+
+def _run_fused_plan_node(
+    in_file,
+    plan,
+    out_file=None,
+    mask_file=None,
+    confounds_file=None,
+    scrub_vector=None,
+    mixing_file=None,
+    noise_file=None,
+):
+    # Imports must be in function for running as node
+    from clpipe.postprocutils.fused_engine import run_fused_plan
+
+    return run_fused_plan(
+        in_file,
+        plan,
+        out_file=out_file,
+        mask_file=mask_file,
+        confounds_file=confounds_file,
+        scrub_vector=scrub_vector,
+        mixing_file=mixing_file,
+        noise_file=noise_file,
+    )
@@ -7,9 +7,15 @@ from .utils import get_scrub_vector_node, logical_or_across_lists, expand_scrub_
 from .image_workflows import (
     build_image_postprocessing_workflow,
     STEP_CONFOUND_REGRESSION,
+    STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION,
     STEP_SCRUB_TIMEPOINTS,
 )
 from .confounds_workflows import build_confounds_processing_workflow
+from .fused_engine import (
+    build_fused_image_postprocessing_workflow,
+    ENGINE_NIPYPE,
+    ENGINE_FUSED,
+)
 from ..utils import get_logger
 from ..config.options import PostProcessingOptions
 
@@ -28,6 +34,7 @@ def build_postprocessing_wf(
     working_dir: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
+    cache_dir: os.PathLike = None,
 ):
     """Creates a top-level postprocessing workflow which combines the image and confounds processing workflows
 
@@ -36,6 +43,7 @@ def build_postprocessing_wf(
         confounds_wf (pe.Workflow, optional): A confound processing workflow. Defaults to None.
         name (str, optional): The name for the constructed workflow. Defaults to "Postprocessing_Pipeline".
         confound_regression (bool, optional): Should the processed confounds be passed to the image workflow for regression? Defaults to False.
+        cache_dir (os.PathLike, optional): A directory for files shared between images, such as resampling maps. Defaults to None.
 
     Returns:
         pe.Workflow: A complete postprocessing workflow.
@@ -50,6 +58,15 @@ def build_postprocessing_wf(
 
     logger = get_logger("postprocessing_wf_builder")
     processing_steps = processing_options.processing_steps
+    regresses_confounds = (
+        STEP_CONFOUND_REGRESSION in processing_steps
+        or STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION in processing_steps
+    )
+    # Scrub targets are also needed to censor the combined filter and regression
+    censors = (
+        STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION in processing_steps
+        and processing_options.processing_step_options.temporal_filtering_confound_regression.censor
+    )
 
     # Create the global postprocessing workflow
     postproc_wf = pe.Workflow(name=name, base_dir=base_dir)
@@ -82,7 +99,8 @@ def build_postprocessing_wf(
     image_wf = None
     if image_file:
         logger.info(f"Building postprocessing workflow for: {name}")
-        image_wf = build_image_postprocessing_workflow(
+        image_wf_builder = _get_image_workflow_builder(processing_options.engine)
+        image_wf = image_wf_builder(
             processing_options,
             in_file=image_file,
             export_path=image_export_path,
@@ -94,10 +112,11 @@ def build_postprocessing_wf(
             tr=tr,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
+            cache_dir=cache_dir,
         )
 
         # Connect postprocessed confound file to image_wf if needed
-        if STEP_CONFOUND_REGRESSION in processing_steps:
+        if regresses_confounds:
             postproc_wf.connect(
                 confounds_wf,
                 "outputnode.out_file",
@@ -112,7 +131,7 @@ def build_postprocessing_wf(
     )
 
     # Setup scrub target if needed
-    if STEP_SCRUB_TIMEPOINTS in processing_steps:
+    if STEP_SCRUB_TIMEPOINTS in processing_steps or censors:
         mult_scrub_wf = build_multiple_scrubbing_workflow(
             processing_options.processing_step_options.scrub_timepoints.scrub_columns,
             confounds_file,
@@ -134,6 +153,15 @@ def build_postprocessing_wf(
     return postproc_wf
 
 
+def _get_image_workflow_builder(engine: str):
+    if engine == ENGINE_NIPYPE:
+        return build_image_postprocessing_workflow
+    elif engine == ENGINE_FUSED:
+        return build_fused_image_postprocessing_workflow
+    else:
+        raise ValueError(f"Postprocessing engine not found: {engine}")
+
+
 def build_multiple_scrubbing_workflow(
     scrub_configs: list,
     confounds_file: os.PathLike,
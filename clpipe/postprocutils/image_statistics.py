@@ -0,0 +1,185 @@
+"""Per-Image Statistics.
+
+Computes the summaries that postprocessing steps need from an image - its
+temporal mean and robust intensity percentiles - in one pass over the image.
+Results are cached by the image's file identity, so each statistic is computed
+once per image however many steps ask for it.
+"""
+
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import nibabel as nib
+
+STATISTICS_DTYPE = np.float32
+LOAD_CHUNK_VOLUMES = 32
+"""How many volumes to read at a time while computing statistics."""
+STATISTICS_CACHE_SIZE = 16
+"""How many images' statistics to keep in memory."""
+MEAN_IMAGE_NAME = "mean_image.nii.gz"
+
+
+class ImageStatistics:
+    """The temporal mean and intensity percentiles of a 4D image.
+
+    Percentiles are taken over the image's non-zero values across all volumes,
+    within the mask if one was given, as with fslstats -k <mask> -p.
+
+    Attributes:
+        temporal_mean (np.ndarray): The 3D mean of the image over time.
+        p2 (float): The 2nd percentile intensity, or None if not computed.
+        median (float): The median intensity, or None if not computed.
+        affine (np.ndarray): The image's affine.
+        header (nib.Nifti1Header): The image's header, if computed from a file.
+    """
+
+    def __init__(
+        self,
+        temporal_mean: np.ndarray,
+        p2: float,
+        median: float,
+        affine: np.ndarray = None,
+        header: nib.Nifti1Header = None,
+    ):
+        self.temporal_mean = temporal_mean
+        self.p2 = p2
+        self.median = median
+        self.affine = affine
+        self.header = header
+        self._mean_file = None
+        self._lock = Lock()
+
+    @classmethod
+    def from_array(
+        cls, data: np.ndarray, mask: np.ndarray = None, affine=None
+    ) -> "ImageStatistics":
+        """Compute the statistics of an in-memory 4D image.
+
+        Args:
+            data (np.ndarray): A 4D image.
+            mask (np.ndarray, optional): A 3D boolean mask.
+            affine (np.ndarray, optional): The image's affine.
+        """
+        values = data[mask] if mask is not None else data
+        return cls(
+            data.mean(axis=3, dtype=np.float64).astype(STATISTICS_DTYPE),
+            *_robust_percentiles(values),
+            affine=affine,
+        )
+
+    @classmethod
+    def from_file(
+        cls,
+        image_path: os.PathLike,
+        mask_file: os.PathLike = None,
+        percentiles: bool = True,
+    ) -> "ImageStatistics":
+        """Compute an image's statistics, reading a few volumes at a time.
+
+        Args:
+            image_path (os.PathLike): Path to a 4D image.
+            mask_file (os.PathLike, optional): A mask to take percentiles within.
+            percentiles (bool, optional): Set to False to compute only the
+                temporal mean, which avoids holding the image's values in memory.
+        """
+        # Keep the file open between reads, so that a gzipped image is
+        #   decompressed once rather than from its start for each read
+        image = nib.load(image_path, keep_file_open=True)
+        if len(image.shape) != 4:
+            raise ValueError(f"Expected a 4D image, got shape: {image.shape}")
+        mask = np.ones(image.shape[:3], dtype=bool)
+        if mask_file:
+            mask = np.asanyarray(nib.load(mask_file).dataobj) > 0
+
+        timepoints = image.shape[3]
+        total = np.zeros(image.shape[:3], dtype=np.float64)
+        values = None
+        if percentiles:
+            values = np.empty((np.count_nonzero(mask), timepoints), STATISTICS_DTYPE)
+        for start in range(0, timepoints, LOAD_CHUNK_VOLUMES):
+            end = min(start + LOAD_CHUNK_VOLUMES, timepoints)
+            volumes = np.asarray(image.dataobj[..., start:end], dtype=np.float64)
+            total += volumes.sum(axis=3)
+            if percentiles:
+                values[:, start:end] = volumes[mask]
+
+        return cls(
+            (total / timepoints).astype(STATISTICS_DTYPE),
+            *(_robust_percentiles(values) if percentiles else (None, None)),
+            affine=image.affine,
+            header=image.header.copy(),
+        )
+
+    @property
+    def has_percentiles(self) -> bool:
+        return self.median is not None
+
+    def mean_file(self, directory: os.PathLike = None) -> str:
+        """Save the temporal mean as an image, once, returning its path.
+
+        Later calls return the same file while it still exists.
+        """
+        with self._lock:
+            if self._mean_file is None or not os.path.exists(self._mean_file):
+                path = os.path.join(directory or os.getcwd(), MEAN_IMAGE_NAME)
+                mean_image = nib.Nifti1Image(
+                    self.temporal_mean, self.affine, self.header
+                )
+                mean_image.set_data_dtype(STATISTICS_DTYPE)
+                nib.save(mean_image, path)
+                self._mean_file = os.path.abspath(path)
+            return self._mean_file
+
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+
+
+def get_image_statistics(
+    image_path: os.PathLike, mask_file: os.PathLike = None, percentiles: bool = True
+) -> ImageStatistics:
+    """Get an image's statistics, computing them only if not already cached.
+
+    Entries are keyed by the identity of the image and mask files - their
+    paths, sizes and modification times - so a rewritten file is recomputed.
+
+    Args:
+        image_path (os.PathLike): Path to a 4D image.
+        mask_file (os.PathLike, optional): A mask to take percentiles within.
+        percentiles (bool, optional): Set to False if only the temporal mean is
+            needed. Defaults to True.
+    """
+    mask_identity = _file_identity(mask_file) if mask_file else None
+    key = (_file_identity(image_path), mask_identity)
+    with _cache_lock:
+        statistics = _cache.get(key)
+        if statistics is not None and (statistics.has_percentiles or not percentiles):
+            _cache.move_to_end(key)
+            return statistics
+
+    statistics = ImageStatistics.from_file(image_path, mask_file, percentiles)
+    with _cache_lock:
+        _cache[key] = statistics
+        while len(_cache) > STATISTICS_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return statistics
+
+
+def clear_image_statistics_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _file_identity(path: os.PathLike) -> tuple:
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _robust_percentiles(values: np.ndarray) -> tuple:
+    values = values[(values != 0) & np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 0.0
+    p2, median = np.percentile(values, [2, 50])
+    return float(p2), float(median)
@@ -13,17 +13,16 @@ import pandas as pd
 
 # TODO: import these without specifying, to help with code readability
 from nipype.interfaces.fsl.maths import (
-    MeanImage,
     BinaryMaths,
     ApplyMask,
     TemporalFilter,
 )
-from nipype.interfaces.fsl.utils import ImageStats, FilterRegressor
+from nipype.interfaces.fsl.utils import FilterRegressor
 from nipype.interfaces.afni import TProject
 from nipype.interfaces.fsl.model import GLM
 from nipype.interfaces.fsl import SUSAN, FLIRT
 from nipype.interfaces.utility import Function, IdentityInterface
-from nipype.interfaces.io import ExportFile
+from nipype.interfaces.base.traits_extension import isdefined
 import nipype.pipeline.engine as pe
 
 import clpipe.postprocutils.r_setup
@@ -33,13 +32,26 @@ from .nodes import (
     ButterworthFilter,
     RegressAromaR,
     ImageSlice,
+    RegressConfounds,
+    FilterRegressConfounds,
+    RegressAroma,
+    SpatialSmooth,
+    IntensityNormalize,
+    ComputeImageStatistics,
+    ResampleImage,
+    ExportImage,
 )
 from .utils import (
     scrub_image,
     get_scrub_vector_node,
     vector_to_txt,
+    confounds_to_design,
     logical_or_across_lists,
 )
+from .spatial_smoothing import METHOD_SUSAN, METHOD_GAUSSIAN
+from .intensity_normalization import METHOD_GLOBAL_MEDIAN, METHOD_VOXEL_MEAN
+from .step_cache import StepCache, step_cache_keys, store_step_output, GIGABYTE
+from .compression import intermediate_extension
 from ..errors import ImplementationNotFoundError
 from ..config.options import PostProcessingOptions
 
@@ -52,9 +64,13 @@ IMPLEMENTATION_FSLMATHS = "fslmaths"
 STEP_INTENSITY_NORMALIZATION = "IntensityNormalization"
 IMPLEMENTATION_10000_GLOBAL_MEDIAN = "10000_GlobalMedian"
 IMPLEMENTATION_100_VOXEL_MEAN = "100_voxelmean"
+IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY = "10000_GlobalMedian_numpy"
+IMPLEMENTATION_100_VOXEL_MEAN_NUMPY = "100_voxelmean_numpy"
 
 STEP_SPATIAL_SMOOTHING = "SpatialSmoothing"
 IMPLEMENTATION_SUSAN = "SUSAN"
+IMPLEMENTATION_SUSAN_NUMPY = "SUSAN_numpy"
+IMPLEMENTATION_MASKED_GAUSSIAN = "masked_gaussian"
 
 STEP_AROMA_REGRESSION = "AROMARegression"
 IMPLEMENTATION_FSL_REGFILT = "fsl_regfilt"
@@ -63,13 +79,22 @@ IMPLEMENTATION_FSL_REGFILT_R = "fsl_regfilt_R"
 STEP_CONFOUND_REGRESSION = "ConfoundRegression"
 IMPLEMENTATION_FSL_GLM = "fsl_glm"
 IMPLEMENTATION_AFNI_3DTPROJECT = "afni_3dTproject"
+IMPLEMENTATION_NUMPY = "numpy"
+
+STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION = "TemporalFilteringConfoundRegression"
 
 STEP_APPLY_MASK = "ApplyMask"
 STEP_TRIM_TIMEPOINTS = "TrimTimepoints"
 STEP_RESAMPLE = "Resample"
+IMPLEMENTATION_FLIRT = "flirt"
 
 STEP_SCRUB_TIMEPOINTS = "ScrubTimepoints"
 
+# Node inputs which set the format of the images a node writes
+FORMAT_TRAIT_NAMES = ("output_type", "outputtype")
+# Node inputs which name an output image, including its extension
+NAMED_OUTPUT_TRAIT_NAMES = ("out_res_name",)
+
 
 def build_image_postprocessing_workflow(
     processing_options: PostProcessingOptions,
@@ -85,6 +110,7 @@ def build_image_postprocessing_workflow(
     scrub_vector: list = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
+    cache_dir: os.PathLike = None,
 ):
     postproc_wf = pe.Workflow(name=name, base_dir=base_dir)
 
@@ -138,6 +164,30 @@ def build_image_postprocessing_workflow(
     if tr:
         input_node.inputs.tr = tr
 
+    # Start from the output of the longest sequence of steps already cached
+    step_cache = StepCache.from_options(processing_options)
+    step_keys = []
+    if step_cache is not None and in_file:
+        step_keys = step_cache_keys(
+            processing_options,
+            processing_steps,
+            in_file,
+            mask_file=mask_file,
+            confounds_file=confounds_file,
+            mixing_file=mixing_file,
+            noise_file=noise_file,
+            tr=tr,
+        )
+        resume_dir = Path(base_dir or os.getcwd()) / name / "step_cache"
+        cached_file, cached_count = _resume_from_step_cache(
+            step_cache, step_keys, resume_dir
+        )
+        if cached_count:
+            input_node.inputs.in_file = str(cached_file)
+            processing_steps = processing_steps[cached_count:]
+            step_keys = step_keys[cached_count:]
+            step_count = len(processing_steps)
+
     current_wf = None
     prev_wf = None
 
@@ -159,6 +209,9 @@ def build_image_postprocessing_workflow(
             implementation_name = (
                 processing_options.processing_step_options.temporal_filtering.implementation
             )
+            temporal_filtering = (
+                processing_options.processing_step_options.temporal_filtering
+            )
 
             current_wf = build_temporal_filter_workflow(
                 implementation_name,
@@ -167,8 +220,12 @@ def build_image_postprocessing_workflow(
                 tr=tr,
                 order=order,
                 scrub_targets=None,
+                mask_file=mask_file,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
+                zero_phase=temporal_filtering.zero_phase,
+                chunk_size=temporal_filtering.chunk_size,
+                n_threads=temporal_filtering.n_threads,
             )
 
         elif step == STEP_INTENSITY_NORMALIZATION:
@@ -196,11 +253,21 @@ def build_image_postprocessing_workflow(
                 implementation_name
             )
 
+            implementation_options = {}
+            if implementation_name in (
+                IMPLEMENTATION_SUSAN_NUMPY,
+                IMPLEMENTATION_MASKED_GAUSSIAN,
+            ):
+                implementation_options[
+                    "n_threads"
+                ] = processing_options.processing_step_options.spatial_smoothing.n_threads
+
             current_wf = spatial_smoothing_implementation(
                 base_dir=postproc_wf.base_dir,
                 mask_path=mask_file,
                 fwhm_mm=fwhm_mm,
                 crashdump_dir=crashdump_dir,
+                **implementation_options,
             )
 
         elif step == STEP_AROMA_REGRESSION:
@@ -212,12 +279,22 @@ def build_image_postprocessing_workflow(
                 implementation_name
             )
 
+            implementation_options = {}
+            if implementation_name in (
+                IMPLEMENTATION_FSL_REGFILT_R,
+                IMPLEMENTATION_NUMPY,
+            ):
+                implementation_options[
+                    "n_threads"
+                ] = processing_options.processing_step_options.aroma_regression.n_threads
+
             current_wf = apply_aroma_implementation(
                 mixing_file=mixing_file,
                 noise_file=noise_file,
                 mask_file=mask_file,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
+                **implementation_options,
             )
 
         elif step == STEP_CONFOUND_REGRESSION:
@@ -229,15 +306,51 @@ def build_image_postprocessing_workflow(
                 implementation_name
             )
 
+            implementation_options = {}
+            if implementation_name == IMPLEMENTATION_NUMPY:
+                implementation_options[
+                    "n_threads"
+                ] = processing_options.processing_step_options.confound_regression.n_threads
+
             current_wf = confound_regression_implementation(
                 mask_file=mask_file,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
+                **implementation_options,
+            )
+
+            postproc_wf.connect(
+                input_node, "confounds_file", current_wf, "inputnode.confounds_file"
+            )
+
+        elif step == STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION:
+            if not tr:
+                raise ValueError(f"Missing TR corresponding to image: {in_file}")
+            temporal_filtering = (
+                processing_options.processing_step_options.temporal_filtering
+            )
+            filter_regress_options = (
+                processing_options.processing_step_options.temporal_filtering_confound_regression
+            )
+
+            current_wf = build_temporal_filtering_confound_regression_workflow(
+                hp=temporal_filtering.filtering_high_pass,
+                lp=temporal_filtering.filtering_low_pass,
+                tr=tr,
+                basis=filter_regress_options.basis,
+                mask_file=mask_file,
+                n_threads=filter_regress_options.n_threads,
+                base_dir=postproc_wf.base_dir,
+                crashdump_dir=crashdump_dir,
             )
 
             postproc_wf.connect(
                 input_node, "confounds_file", current_wf, "inputnode.confounds_file"
             )
+            if filter_regress_options.censor:
+                postproc_wf.connect(
+                    input_node, "scrub_vector", current_wf, "inputnode.scrub_vector"
+                )
 
         elif step == STEP_APPLY_MASK:
             if mask_file is None:
@@ -272,10 +385,24 @@ def build_image_postprocessing_workflow(
                     "No reference image provided. Please set a path to reference in clpipe_config.json"
                 )
 
-            current_wf = build_resample_workflow(
+            implementation_name = (
+                processing_options.processing_step_options.resample.implementation
+            )
+
+            resample_implementation = _getResampleImplementation(implementation_name)
+
+            implementation_options = {}
+            if implementation_name == IMPLEMENTATION_NUMPY:
+                implementation_options["cache_dir"] = cache_dir
+                implementation_options[
+                    "n_threads"
+                ] = processing_options.processing_step_options.resample.n_threads
+
+            current_wf = resample_implementation(
                 reference_image=reference_image,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
+                **implementation_options,
             )
 
         elif step == STEP_SCRUB_TIMEPOINTS:
@@ -285,6 +412,7 @@ def build_image_postprocessing_workflow(
 
             current_wf = build_scrubbing_workflow(
                 insert_na=insert_na,
+                mask_file=mask_file,
                 base_dir=postproc_wf.base_dir,
                 crashdump_dir=crashdump_dir,
             )
@@ -301,22 +429,98 @@ def build_image_postprocessing_workflow(
                 prev_wf, "outputnode.out_file", current_wf, "inputnode.in_file"
             )
 
+        # Save the step's output for other streams sharing this step
+        if step_keys:
+            cache_node = pe.Node(
+                Function(
+                    input_names=["in_file", "cache_directory", "max_size_gb", "key"],
+                    output_names=["out_file"],
+                    function=store_step_output,
+                ),
+                name=f"step_cache_{index}",
+            )
+            cache_node.inputs.cache_directory = str(step_cache.directory)
+            cache_node.inputs.max_size_gb = step_cache.max_size / GIGABYTE
+            cache_node.inputs.key = step_keys[index]
+            postproc_wf.connect(current_wf, "outputnode.out_file", cache_node, "in_file")
+
         # Keep a reference to current_wf as "prev_wf" for the next loop
         prev_wf = current_wf
 
+    # If every step was cached, the cached output is the final image
+    last_wf, last_field = prev_wf, "outputnode.out_file"
+    if prev_wf is None:
+        last_wf, last_field = input_node, "in_file"
+
     # Connect the output of the last node to postproc workflow's output node
-    postproc_wf.connect(prev_wf, "outputnode.out_file", output_node, "out_file")
+    postproc_wf.connect(last_wf, last_field, output_node, "out_file")
     if export_path:
-        # TODO: Update the postproc workflow to make extension guarentees
+        # Intermediates may be uncompressed, so the export compresses if needed
         export_node = pe.Node(
-            ExportFile(out_file=export_path, clobber=True, check_extension=False),
+            ExportImage(
+                out_file=export_path,
+                n_threads=int(processing_options.batch_options.n_threads),
+            ),
             name="export_image",
         )
-        postproc_wf.connect(current_wf, "outputnode.out_file", export_node, "in_file")
+        export_node.n_procs = export_node.inputs.n_threads
+        postproc_wf.connect(last_wf, last_field, export_node, "in_file")
+
+    set_intermediate_format(postproc_wf, processing_options.intermediate_format)
 
     return postproc_wf
 
 
+def set_intermediate_format(workflow: pe.Workflow, output_type: str):
+    """Set the format every node of a workflow writes its output images in.
+
+    Covers FSL's output_type, AFNI's outputtype and the native nodes' output_type
+    inputs, as well as output names given with an extension, such as fsl_glm's
+    residuals.
+
+    Args:
+        workflow (pe.Workflow): The workflow to update, including sub-workflows.
+        output_type (str): 'NIFTI' or 'NIFTI_GZ'.
+    """
+    extension = intermediate_extension(output_type)
+    for node in workflow._get_all_nodes():
+        inputs = node.inputs
+        for trait_name in FORMAT_TRAIT_NAMES:
+            if inputs.trait(trait_name) is not None:
+                setattr(inputs, trait_name, output_type)
+        for trait_name in NAMED_OUTPUT_TRAIT_NAMES:
+            if inputs.trait(trait_name) is not None and isdefined(
+                getattr(inputs, trait_name)
+            ):
+                setattr(
+                    inputs,
+                    trait_name,
+                    _with_extension(getattr(inputs, trait_name), extension),
+                )
+
+
+def _with_extension(path: str, extension: str) -> str:
+    for current_extension in (".nii.gz", ".nii"):
+        if path.endswith(current_extension):
+            return path[: -len(current_extension)] + extension
+    return path
+
+
+def _resume_from_step_cache(
+    step_cache: StepCache, step_keys: list, destination_dir: os.PathLike
+):
+    """Fetch the cached output of the longest leading sequence of steps.
+
+    Returns:
+        tuple: The fetched output, or None, and how many steps it covers.
+    """
+    for count in range(len(step_keys), 0, -1):
+        cached_file = step_cache.fetch(step_keys[count - 1], destination_dir)
+        if cached_file is not None:
+            return cached_file, count
+    return None, 0
+
+
 def build_temporal_filter_workflow(
     implementationName: str,
     hp: float,
@@ -329,6 +533,9 @@ def build_temporal_filter_workflow(
     crashdump_dir: os.PathLike = None,
     scrub_targets: os.PathLike = None,
     mask_file: os.PathLike = None,
+    zero_phase: bool = False,
+    chunk_size: int = 0,
+    n_threads: int = 1,
 ):
     if implementationName == IMPLEMENTATION_BUTTERWORTH:
         return build_butterworth_filter_workflow(
@@ -338,6 +545,10 @@ def build_temporal_filter_workflow(
             order=order,
             base_dir=base_dir,
             crashdump_dir=crashdump_dir,
+            mask_file=mask_file,
+            zero_phase=zero_phase,
+            chunk_size=chunk_size,
+            n_threads=n_threads,
         )
     elif implementationName == IMPLEMENTATION_FSLMATHS:
         return build_fslmath_temporal_filter(
@@ -368,6 +579,12 @@ def build_temporal_filter_workflow(
 def _getIntensityNormalizationImplementation(implementationName: str):
     if implementationName == IMPLEMENTATION_10000_GLOBAL_MEDIAN:
         return build_10000_global_median_workflow
+    elif implementationName == IMPLEMENTATION_100_VOXEL_MEAN:
+        return build_100_voxel_mean_workflow
+    elif implementationName == IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY:
+        return build_10000_global_median_numpy_workflow
+    elif implementationName == IMPLEMENTATION_100_VOXEL_MEAN_NUMPY:
+        return build_100_voxel_mean_numpy_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_INTENSITY_NORMALIZATION} implementation not found: {implementationName}"
@@ -377,6 +594,10 @@ def _getIntensityNormalizationImplementation(implementationName: str):
 def _getSpatialSmoothingImplementation(implementationName: str):
     if implementationName == IMPLEMENTATION_SUSAN:
         return build_SUSAN_workflow
+    elif implementationName == IMPLEMENTATION_SUSAN_NUMPY:
+        return build_SUSAN_numpy_workflow
+    elif implementationName == IMPLEMENTATION_MASKED_GAUSSIAN:
+        return build_masked_gaussian_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_SPATIAL_SMOOTHING} implementation not found: {implementationName}"
@@ -388,6 +609,8 @@ def _getAROMARegressionImplementation(implementationName: str):
         return build_aroma_workflow_fsl_regfilt
     if implementationName == IMPLEMENTATION_FSL_REGFILT_R:
         return build_aroma_workflow_fsl_regfilt_R
+    if implementationName == IMPLEMENTATION_NUMPY:
+        return build_aroma_workflow_numpy
     else:
         raise ImplementationNotFoundError(
             f"{STEP_AROMA_REGRESSION} implementation not found: {implementationName}"
@@ -399,6 +622,8 @@ def _getConfoundRegressionImplementation(implementationName: str):
         return build_confound_regression_fsl_glm_workflow
     elif implementationName == IMPLEMENTATION_AFNI_3DTPROJECT:
         return build_confound_regression_afni_3dTproject
+    elif implementationName == IMPLEMENTATION_NUMPY:
+        return build_confound_regression_numpy_workflow
     else:
         raise ImplementationNotFoundError(
             f"{STEP_CONFOUND_REGRESSION} implementation not found: {implementationName}"
@@ -423,7 +648,7 @@ def build_10000_global_median_workflow(
 
     input_node = build_input_node()
     output_node = build_output_node()
-    median_node = pe.Node(ImageStats(op_string="-p 50"), name="global_median")
+    statistics_node = pe.Node(ComputeImageStatistics(), name="image_statistics")
     mul_10000_node = pe.Node(
         BinaryMaths(operation="mul", operand_value=10000), name="mul_10000"
     )
@@ -436,8 +661,7 @@ def build_10000_global_median_workflow(
         input_node.inputs.out_file = out_file
 
     if mask_file:
-        median_node.inputs.mask_file = mask_file
-        median_node.inputs.op_string = "-k %s -p 50"
+        statistics_node.inputs.mask_file = mask_file
 
     workflow = pe.Workflow(
         name=f"{STEP_INTENSITY_NORMALIZATION}_{IMPLEMENTATION_10000_GLOBAL_MEDIAN}",
@@ -446,12 +670,12 @@ def build_10000_global_median_workflow(
     if crashdump_dir is not None:
         workflow.config["execution"]["crashdump_dir"] = crashdump_dir
 
-    workflow.connect(input_node, "in_file", median_node, "in_file")
+    workflow.connect(input_node, "in_file", statistics_node, "in_file")
     workflow.connect(input_node, "in_file", mul_10000_node, "in_file")
     workflow.connect(input_node, "out_file", div_median_node, "out_file")
 
     workflow.connect(mul_10000_node, "out_file", div_median_node, "in_file")
-    workflow.connect(median_node, "out_stat", div_median_node, "operand_value")
+    workflow.connect(statistics_node, "median", div_median_node, "operand_value")
     workflow.connect(div_median_node, "out_file", output_node, "out_file")
 
     return workflow
@@ -460,6 +684,7 @@ def build_10000_global_median_workflow(
 def build_100_voxel_mean_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -468,26 +693,28 @@ def build_100_voxel_mean_workflow(
     Args:
         in_path (str): A path to an input .nii to normalize.
         out_path (str): A path to save the normalized image.
+        mask_file (os.PathLike, optional): Unused, as each voxel is scaled by its
+            own mean. Accepted for consistency with the other implementations.
 
     Returns:
         pe.Workflow: A 100 voxel mean workflow.
     """
 
-    if in_file != None:
-        mean_image = MeanImage(in_file=in_file)
-        mul_math = BinaryMaths(operation="mul", operand_value=100, in_file=in_file)
-    else:
-        mean_image = MeanImage()
-        mul_math = BinaryMaths(operation="mul", operand_value=100)
-
-    mean_node = pe.Node(mean_image, name="mean")
-    mul100_node = pe.Node(mul_math, name="mul100")
+    input_node = build_input_node()
+    output_node = build_output_node()
+    statistics_node = pe.Node(
+        ComputeImageStatistics(percentiles=False), name="image_statistics"
+    )
+    mul100_node = pe.Node(
+        BinaryMaths(operation="mul", operand_value=100), name="mul100"
+    )
+    div_mean_node = pe.Node(BinaryMaths(operation="div"), name="div_mean")
 
-    if out_file != None:
-        div_math = BinaryMaths(operation="div", out_file=out_file)
-    else:
-        div_math = BinaryMaths(operation="div")
-    div_mean_node = pe.Node(div_math, name="div_mean")  # operand_file=mean_path
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
 
     workflow = pe.Workflow(
         name=f"{STEP_INTENSITY_NORMALIZATION}_{IMPLEMENTATION_100_VOXEL_MEAN}",
@@ -496,8 +723,103 @@ def build_100_voxel_mean_workflow(
     if crashdump_dir is not None:
         workflow.config["execution"]["crashdump_dir"] = crashdump_dir
 
+    workflow.connect(input_node, "in_file", statistics_node, "in_file")
+    workflow.connect(input_node, "in_file", mul100_node, "in_file")
+    workflow.connect(input_node, "out_file", div_mean_node, "out_file")
+
     workflow.connect(mul100_node, "out_file", div_mean_node, "in_file")
-    workflow.connect(mean_node, "out_file", div_mean_node, "operand_file")
+    workflow.connect(statistics_node, "mean_file", div_mean_node, "operand_file")
+    workflow.connect(div_mean_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
+def build_10000_global_median_numpy_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Perform intensity normalization using the 10,000 global median method,
+    in a single node which reads and writes the image once.
+
+    Args:
+        in_file (os.PathLike): A path to an input .nii to normalize.
+        out_file (os.PathLike): A path to save the normalized image.
+        mask_file (os.PathLike, optional): A path a mask to apply during the median calculation.
+        base_dir (os.PathLike, optional): A path to the base directory for the workflow.
+    """
+    return _build_native_normalization_workflow(
+        IMPLEMENTATION_10000_GLOBAL_MEDIAN_NUMPY,
+        METHOD_GLOBAL_MEDIAN,
+        in_file=in_file,
+        out_file=out_file,
+        mask_file=mask_file,
+        base_dir=base_dir,
+        crashdump_dir=crashdump_dir,
+    )
+
+
+def build_100_voxel_mean_numpy_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Perform intensity normalization using the 100 voxel mean method,
+    in a single node which reads and writes the image once.
+
+    Args:
+        in_file (os.PathLike): A path to an input .nii to normalize.
+        out_file (os.PathLike): A path to save the normalized image.
+        mask_file (os.PathLike, optional): Unused, as each voxel is scaled by its
+            own mean. Accepted for consistency with the other implementations.
+        base_dir (os.PathLike, optional): A path to the base directory for the workflow.
+    """
+    return _build_native_normalization_workflow(
+        IMPLEMENTATION_100_VOXEL_MEAN_NUMPY,
+        METHOD_VOXEL_MEAN,
+        in_file=in_file,
+        out_file=out_file,
+        base_dir=base_dir,
+        crashdump_dir=crashdump_dir,
+    )
+
+
+def _build_native_normalization_workflow(
+    implementation_name: str,
+    method: str,
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    workflow = pe.Workflow(
+        name=f"{STEP_INTENSITY_NORMALIZATION}_{implementation_name}",
+        base_dir=base_dir,
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = build_input_node()
+    output_node = build_output_node()
+
+    normalize_node = pe.Node(IntensityNormalize(method=method), name="normalize")
+    if mask_file:
+        normalize_node.inputs.mask_file = mask_file
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+
+    workflow.connect(input_node, "in_file", normalize_node, "in_file")
+    workflow.connect(input_node, "out_file", normalize_node, "out_file")
+    workflow.connect(normalize_node, "out_file", output_node, "out_file")
 
     return workflow
 
@@ -532,9 +854,9 @@ def build_SUSAN_workflow(
     input_node = build_input_node()
     output_node = build_output_node()
 
-    # Setup nodes to calculate susan threshold inputs
-    p2_intensity_node = pe.Node(ImageStats(op_string="-p 2"), name="p2")
-    median_intensity_node = pe.Node(ImageStats(op_string="-p 50"), name="median")
+    # Setup a node to calculate the susan threshold inputs and the mean image
+    #   in one pass
+    statistics_node = pe.Node(ComputeImageStatistics(), name="image_statistics")
 
     # Setup an arbitrary function node to calculate the susan threshold from two scalars with helper function
     susan_thresh_node = pe.Node(
@@ -549,7 +871,6 @@ def build_SUSAN_workflow(
     # Setup susan node
     #   Usage: susan <input> <bt> <dt> <dim> <use_median> <n_usans> [<usan1> <bt1> [<usan2> <bt2>]] <output>
     #   Ref: susan {in_file} {susan_thresh} {sigma} 3 1 1 {temp_tmean} {susan_thresh} {out_file}
-    tmean_image_node = pe.Node(MeanImage(), name="mean_image")
     setup_usans_node = pe.Node(
         Function(
             input_names=["tmean_image", "susan_threshold"],
@@ -570,21 +891,17 @@ def build_SUSAN_workflow(
         input_node.inputs.out_file = out_file
 
     # Map the input node to the first steps of the susan threshold calculation
-    workflow.connect(input_node, "in_file", p2_intensity_node, "in_file")
-    workflow.connect(input_node, "in_file", median_intensity_node, "in_file")
+    workflow.connect(input_node, "in_file", statistics_node, "in_file")
     workflow.connect(input_node, "in_file", susan_node, "in_file")
-    workflow.connect(input_node, "in_file", tmean_image_node, "in_file")
     workflow.connect(input_node, "out_file", susan_node, "out_file")
 
     # Setup calculations for susan threshold
-    workflow.connect(
-        median_intensity_node, "out_stat", susan_thresh_node, "median_intensity"
-    )
-    workflow.connect(p2_intensity_node, "out_stat", susan_thresh_node, "p2_intensity")
+    workflow.connect(statistics_node, "median", susan_thresh_node, "median_intensity")
+    workflow.connect(statistics_node, "p2", susan_thresh_node, "p2_intensity")
     workflow.connect(
         susan_thresh_node, "susan_threshold", susan_node, "brightness_threshold"
     )
-    workflow.connect(tmean_image_node, "out_file", setup_usans_node, "tmean_image")
+    workflow.connect(statistics_node, "mean_file", setup_usans_node, "tmean_image")
     workflow.connect(
         susan_thresh_node, "susan_threshold", setup_usans_node, "susan_threshold"
     )
@@ -601,11 +918,8 @@ def build_SUSAN_workflow(
         workflow.connect(susan_node, "smoothed_file", masker_node, "in_file")
         workflow.connect(masker_node, "out_file", output_node, "out_file")
 
-        # Add mask to the inputs of the fslstats commands
-        p2_intensity_node.inputs.mask_file = mask_path
-        median_intensity_node.inputs.mask_file = mask_path
-        p2_intensity_node.inputs.op_string = "-k %s -p 2"
-        median_intensity_node.inputs.op_string = "-k %s -p 50"
+        # Take the threshold's percentiles within the mask
+        statistics_node.inputs.mask_file = mask_path
     # Tie the SUSAN output directly to output node if no mask is included
     else:
         workflow.connect(susan_node, "smoothed_file", output_node, "out_file")
@@ -613,6 +927,121 @@ def build_SUSAN_workflow(
     return workflow
 
 
+def build_SUSAN_numpy_workflow(
+    in_file: os.PathLike = None,
+    mask_path: os.PathLike = None,
+    fwhm_mm: int = 6,
+    out_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow to perform SUSAN smoothing in a single node.
+
+    Follows build_SUSAN_workflow, but calculates the brightness threshold, mean
+    image and smoothing weights in Python, and smooths volumes in parallel.
+
+    Args:
+        in_file (os.PathLike, optional): The input image to smooth. Defaults to None.
+        mask_path (os.PathLike, optional): A mask to apply after smoothing. Defaults to None.
+        fwhm_mm (int, optional): Full width at half maximum in millimeters. Defaults to 6.
+        out_file (os.PathLike, optional): An output path for the smoothed image. Defaults to None.
+        n_threads (int, optional): Number of volumes to smooth in parallel. Defaults to 1.
+
+    Returns:
+        pe.Workflow: A SUSAN smoothing workflow.
+    """
+    return _build_native_smoothing_workflow(
+        IMPLEMENTATION_SUSAN_NUMPY,
+        METHOD_SUSAN,
+        in_file=in_file,
+        mask_path=mask_path,
+        fwhm_mm=fwhm_mm,
+        out_file=out_file,
+        n_threads=n_threads,
+        base_dir=base_dir,
+        crashdump_dir=crashdump_dir,
+    )
+
+
+def build_masked_gaussian_workflow(
+    in_file: os.PathLike = None,
+    mask_path: os.PathLike = None,
+    fwhm_mm: int = 6,
+    out_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Builds a workflow to perform Gaussian smoothing within a mask.
+
+    Faster than SUSAN, but does not preserve edges.
+
+    Args:
+        in_file (os.PathLike, optional): The input image to smooth. Defaults to None.
+        mask_path (os.PathLike, optional): A mask to smooth within. Defaults to None.
+        fwhm_mm (int, optional): Full width at half maximum in millimeters. Defaults to 6.
+        out_file (os.PathLike, optional): An output path for the smoothed image. Defaults to None.
+        n_threads (int, optional): Number of volumes to smooth in parallel. Defaults to 1.
+
+    Returns:
+        pe.Workflow: A Gaussian smoothing workflow.
+    """
+    return _build_native_smoothing_workflow(
+        IMPLEMENTATION_MASKED_GAUSSIAN,
+        METHOD_GAUSSIAN,
+        in_file=in_file,
+        mask_path=mask_path,
+        fwhm_mm=fwhm_mm,
+        out_file=out_file,
+        n_threads=n_threads,
+        base_dir=base_dir,
+        crashdump_dir=crashdump_dir,
+    )
+
+
+def _build_native_smoothing_workflow(
+    implementation_name: str,
+    method: str,
+    in_file: os.PathLike = None,
+    mask_path: os.PathLike = None,
+    fwhm_mm: int = 6,
+    out_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    workflow = pe.Workflow(
+        name=f"{STEP_SPATIAL_SMOOTHING}_{implementation_name}", base_dir=base_dir
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    # Setup identity (pass through) input/output nodes
+    input_node = build_input_node()
+    output_node = build_output_node()
+
+    smoothing_node = pe.Node(
+        SpatialSmooth(fwhm=fwhm_mm, method=method, n_threads=n_threads),
+        name="spatial_smooth",
+    )
+    smoothing_node.n_procs = n_threads
+    if mask_path:
+        smoothing_node.inputs.mask_file = mask_path
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+
+    workflow.connect(input_node, "in_file", smoothing_node, "in_file")
+    workflow.connect(input_node, "out_file", smoothing_node, "out_file")
+    workflow.connect(smoothing_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
 def _calc_susan_threshold(median_intensity: float, p2_intensity: float):
     """Calculates the SUSAN threshold for a given image's median intensity
     and 2nd percentile.
@@ -650,6 +1079,10 @@ def build_butterworth_filter_workflow(
     out_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    zero_phase: bool = False,
+    chunk_size: int = 0,
+    n_threads: int = 1,
 ):
     workflow = pe.Workflow(
         name=f"{STEP_TEMPORAL_FILTERING}_{IMPLEMENTATION_BUTTERWORTH}",
@@ -663,8 +1096,20 @@ def build_butterworth_filter_workflow(
     output_node = build_output_node()
 
     butterworth_node = pe.Node(
-        ButterworthFilter(hp=hp, lp=lp, order=order, tr=tr), name="butterworth_filter"
+        ButterworthFilter(
+            hp=hp,
+            lp=lp,
+            order=order,
+            tr=tr,
+            zero_phase=zero_phase,
+            chunk_size=chunk_size,
+            n_threads=n_threads,
+        ),
+        name="butterworth_filter",
     )
+    butterworth_node.n_procs = n_threads
+    if mask_file:
+        butterworth_node.inputs.mask_file = mask_file
 
     # Set WF inputs and outputs
     if in_file:
@@ -708,7 +1153,9 @@ def build_fslmath_temporal_filter(
     if lp != -1:
         lp_volumes = 1 / (lp * fwhm_to_sigma * tr)
 
-    mean_image_node = pe.Node(MeanImage(), name="mean_image")
+    mean_image_node = pe.Node(
+        ComputeImageStatistics(percentiles=False), name="image_statistics"
+    )
     temporal_filter_node = pe.Node(
         TemporalFilter(highpass_sigma=hp_volumes, lowpass_sigma=lp_volumes),
         name="temporal_filter",
@@ -724,7 +1171,7 @@ def build_fslmath_temporal_filter(
     workflow.connect(input_node, "in_file", mean_image_node, "in_file")
     workflow.connect(input_node, "in_file", temporal_filter_node, "in_file")
     workflow.connect(input_node, "out_file", add_node, "out_file")
-    workflow.connect(mean_image_node, "out_file", add_node, "operand_file")
+    workflow.connect(mean_image_node, "mean_file", add_node, "operand_file")
     workflow.connect(temporal_filter_node, "out_file", add_node, "in_file")
     workflow.connect(add_node, "out_file", output_node, "out_file")
 
@@ -780,7 +1227,9 @@ def build_3dtproject_temporal_filter(
     temp_filt.inputs.polort = 2
     temp_filt.inputs.cenmode = "NTRP"
 
-    mean_image_node = pe.Node(MeanImage(), name="mean_image")
+    mean_image_node = pe.Node(
+        ComputeImageStatistics(percentiles=False), name="image_statistics"
+    )
     temporal_filter_node = pe.Node(temp_filt, name="3dTproject_temporal_filter")
     add_node = pe.Node(BinaryMaths(operation="add"), name="add_mean")
 
@@ -803,16 +1252,13 @@ def build_3dtproject_temporal_filter(
         vector_to_txt_node.inputs.out_file = "scrub_ort.txt"
         workflow.connect(input_node, "scrub_targets", vector_to_txt_node, "vector")
         workflow.connect(vector_to_txt_node, "out_file", temporal_filter_node, "censor")
-    workflow.connect(mean_image_node, "out_file", add_node, "operand_file")
+    workflow.connect(mean_image_node, "mean_file", add_node, "operand_file")
     workflow.connect(temporal_filter_node, "out_file", add_node, "in_file")
     workflow.connect(add_node, "out_file", output_node, "out_file")
 
     if export_file:
         input_node.inputs.export_file = export_file
-        export_node = pe.Node(
-            ExportFile(out_file=export_file, clobber=True, check_extension=False),
-            name="export_image",
-        )
+        export_node = pe.Node(ExportImage(out_file=export_file), name="export_image")
         workflow.connect(output_node, "out_file", export_node, "in_file")
         workflow.connect(input_node, "export_file", export_node, "out_file")
 
@@ -822,13 +1268,11 @@ def build_3dtproject_temporal_filter(
 def build_confound_regression_fsl_glm_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
-    confound_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
     mask_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
-    # TODO: This function currently returns an empy image
-
     workflow = pe.Workflow(
         name=f"{STEP_CONFOUND_REGRESSION}_{IMPLEMENTATION_FSL_GLM}", base_dir=base_dir
     )
@@ -837,7 +1281,7 @@ def build_confound_regression_fsl_glm_workflow(
 
     input_node = pe.Node(
         IdentityInterface(
-            fields=["in_file", "out_file", "design_file", "mask_file"],
+            fields=["in_file", "out_file", "confounds_file", "mask_file"],
             mandatory_inputs=False,
         ),
         name="inputnode",
@@ -851,14 +1295,35 @@ def build_confound_regression_fsl_glm_workflow(
         input_node.inputs.in_file = in_file
     if out_file:
         input_node.inputs.out_file = out_file
-    input_node.inputs.design_file = confound_file
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
 
-    regressor_node = pe.Node(GLM(), name="fsl_glm")
+    # fsl_glm needs a design matrix without a header, and its residuals are
+    #   demeaned, so the mean image is added back as with 3dTproject
+    design_node = pe.Node(
+        Function(
+            input_names=["confounds_file"],
+            output_names=["design_file"],
+            function=confounds_to_design,
+        ),
+        name="confounds_to_design",
+    )
+    regressor_node = pe.Node(
+        GLM(demean=True, out_res_name="residuals.nii.gz"), name="fsl_glm"
+    )
+    mean_image_node = pe.Node(
+        ComputeImageStatistics(percentiles=False), name="image_statistics"
+    )
+    add_node = pe.Node(BinaryMaths(operation="add"), name="add_mean")
 
+    workflow.connect(input_node, "confounds_file", design_node, "confounds_file")
     workflow.connect(input_node, "in_file", regressor_node, "in_file")
-    workflow.connect(input_node, "out_file", regressor_node, "out_res_name")
-    workflow.connect(input_node, "design_file", regressor_node, "design")
-    workflow.connect(regressor_node, "out_res", output_node, "out_file")
+    workflow.connect(input_node, "in_file", mean_image_node, "in_file")
+    workflow.connect(input_node, "out_file", add_node, "out_file")
+    workflow.connect(design_node, "design_file", regressor_node, "design")
+    workflow.connect(regressor_node, "out_res", add_node, "in_file")
+    workflow.connect(mean_image_node, "mean_file", add_node, "operand_file")
+    workflow.connect(add_node, "out_file", output_node, "out_file")
 
     if mask_file:
         input_node.inputs.mask_file = mask_file
@@ -897,7 +1362,9 @@ def build_confound_regression_afni_3dTproject(
     output_node = pe.Node(
         IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
     )
-    mean_image_node = pe.Node(MeanImage(), name="mean_image")
+    mean_image_node = pe.Node(
+        ComputeImageStatistics(percentiles=False), name="image_statistics"
+    )
     add_node = pe.Node(BinaryMaths(operation="add"), name="add_mean")
 
     # Set WF inputs and outputs
@@ -917,7 +1384,7 @@ def build_confound_regression_afni_3dTproject(
     workflow.connect(input_node, "out_file", add_node, "out_file")
     workflow.connect(input_node, "confounds_file", regressor_node, "ort")
     workflow.connect(regressor_node, "out_file", add_node, "in_file")
-    workflow.connect(mean_image_node, "out_file", add_node, "operand_file")
+    workflow.connect(mean_image_node, "mean_file", add_node, "operand_file")
     workflow.connect(add_node, "out_file", output_node, "out_file")
 
     if mask_file:
@@ -927,6 +1394,138 @@ def build_confound_regression_afni_3dTproject(
     return workflow
 
 
+def build_confound_regression_numpy_workflow(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Regress confounds out of an image in a single node, keeping the voxel mean.
+
+    Gives the same result as afni_3dTproject, without its extra mean image and
+    add passes.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_CONFOUND_REGRESSION}_{IMPLEMENTATION_NUMPY}", base_dir=base_dir
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "confounds_file", "mask_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    regressor_node = pe.Node(
+        RegressConfounds(n_threads=n_threads), name="regress_confounds"
+    )
+    regressor_node.n_procs = n_threads
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+
+    workflow.connect(input_node, "in_file", regressor_node, "in_file")
+    workflow.connect(input_node, "out_file", regressor_node, "out_file")
+    workflow.connect(input_node, "confounds_file", regressor_node, "confounds_file")
+    workflow.connect(regressor_node, "out_file", output_node, "out_file")
+
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", regressor_node, "mask_file")
+
+    return workflow
+
+
+def build_temporal_filtering_confound_regression_workflow(
+    hp: float,
+    lp: float,
+    tr: float,
+    basis: str = "sincos",
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    scrub_vector: list = None,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Temporally filter an image and regress confounds out of it in a single node.
+
+    The confounds and bandstop regressors are projected out together, as with
+    3dTproject's simultaneous mode, keeping the voxel mean. Scrub targets, if
+    given, are left out of the fit.
+    """
+    workflow = pe.Workflow(
+        name=STEP_TEMPORAL_FILTERING_CONFOUND_REGRESSION, base_dir=base_dir
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=[
+                "in_file",
+                "out_file",
+                "confounds_file",
+                "scrub_vector",
+                "mask_file",
+            ],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    filter_regress_node = pe.Node(
+        FilterRegressConfounds(
+            tr=tr, high_pass=hp, low_pass=lp, basis=basis, n_threads=n_threads
+        ),
+        name="filter_regress_confounds",
+    )
+    filter_regress_node.n_procs = n_threads
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if confounds_file:
+        input_node.inputs.confounds_file = confounds_file
+    if scrub_vector:
+        input_node.inputs.scrub_vector = scrub_vector
+
+    workflow.connect(input_node, "in_file", filter_regress_node, "in_file")
+    workflow.connect(input_node, "out_file", filter_regress_node, "out_file")
+    workflow.connect(
+        input_node, "confounds_file", filter_regress_node, "confounds_file"
+    )
+    workflow.connect(input_node, "scrub_vector", filter_regress_node, "scrub_vector")
+    workflow.connect(filter_regress_node, "out_file", output_node, "out_file")
+
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", filter_regress_node, "mask_file")
+
+    return workflow
+
+
 def build_aroma_workflow_fsl_regfilt(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -990,6 +1589,7 @@ def build_aroma_workflow_fsl_regfilt_R(
     mixing_file: os.PathLike = None,
     noise_file: os.PathLike = None,
     mask_file=None,
+    n_threads: int = 4,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -1017,9 +1617,10 @@ def build_aroma_workflow_fsl_regfilt_R(
     )
 
     regfilt_R_node = pe.Node(
-        RegressAromaR(script_file=fsl_regfilt_R_script_path, n_threads=4),
+        RegressAromaR(script_file=fsl_regfilt_R_script_path, n_threads=n_threads),
         name="fsl_regfilt_R",
     )
+    regfilt_R_node.n_procs = n_threads
 
     # Set WF inputs and outputs
     if in_file:
@@ -1040,6 +1641,62 @@ def build_aroma_workflow_fsl_regfilt_R(
     return workflow
 
 
+def build_aroma_workflow_numpy(
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Non-aggressively regress AROMA noise components out of an image in Python.
+
+    Gives the same result as fsl_regfilt_R, without starting R or FSL.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_AROMA_REGRESSION}_{IMPLEMENTATION_NUMPY}", base_dir=base_dir
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    input_node = pe.Node(
+        IdentityInterface(
+            fields=["in_file", "out_file", "mixing_file", "noise_file", "mask_file"],
+            mandatory_inputs=False,
+        ),
+        name="inputnode",
+    )
+    output_node = pe.Node(
+        IdentityInterface(fields=["out_file"], mandatory_inputs=True), name="outputnode"
+    )
+
+    regfilt_node = pe.Node(RegressAroma(n_threads=n_threads), name="regfilt")
+    regfilt_node.n_procs = n_threads
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if mixing_file:
+        input_node.inputs.mixing_file = mixing_file
+    if noise_file:
+        input_node.inputs.noise_file = noise_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+    if mask_file:
+        input_node.inputs.mask_file = mask_file
+        workflow.connect(input_node, "mask_file", regfilt_node, "mask_file")
+
+    workflow.connect(input_node, "in_file", regfilt_node, "in_file")
+    workflow.connect(input_node, "out_file", regfilt_node, "out_file")
+    workflow.connect(input_node, "mixing_file", regfilt_node, "mixing_file")
+    workflow.connect(input_node, "noise_file", regfilt_node, "noise_file")
+    workflow.connect(regfilt_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
 def build_apply_mask_workflow(
     in_file: os.PathLike = None,
     out_file: os.PathLike = None,
@@ -1118,6 +1775,7 @@ def build_scrubbing_workflow(
     insert_na=True,
     import_path: os.PathLike = None,
     export_path: os.PathLike = None,
+    mask_file: os.PathLike = None,
     base_dir: os.PathLike = None,
     crashdump_dir: os.PathLike = None,
 ):
@@ -1139,12 +1797,20 @@ def build_scrubbing_workflow(
 
     scrub_node = pe.Node(
         Function(
-            input_names=["nii_file", "scrub_vector", "insert_na", "export_path"],
+            input_names=[
+                "nii_file",
+                "scrub_vector",
+                "insert_na",
+                "export_path",
+                "mask_file",
+            ],
             output_names=["out_file"],
             function=scrub_image,
         ),
         name="scrub_timepoints",
     )
+    if mask_file:
+        scrub_node.inputs.mask_file = mask_file
 
     # Set WF inputs and outputs
     if import_path:
@@ -1197,6 +1863,63 @@ def build_resample_workflow(
     return workflow
 
 
+def build_resample_numpy_workflow(
+    reference_image: os.PathLike = None,
+    in_file: os.PathLike = None,
+    out_file: os.PathLike = None,
+    cache_dir: os.PathLike = None,
+    n_threads: int = 1,
+    base_dir: os.PathLike = None,
+    crashdump_dir: os.PathLike = None,
+):
+    """Resample an image onto a reference grid in a single node.
+
+    Gives the same trilinear resampling as build_resample_workflow. The
+    resampling map is built once per pair of source and reference grids, and
+    reused from cache_dir by every run sharing them.
+    """
+    workflow = pe.Workflow(
+        name=f"{STEP_RESAMPLE}_{IMPLEMENTATION_NUMPY}", base_dir=base_dir
+    )
+    if crashdump_dir is not None:
+        workflow.config["execution"]["crashdump_dir"] = crashdump_dir
+
+    # Setup identity (pass through) input/output nodes
+    input_node = build_input_node()
+    output_node = build_output_node()
+
+    resample_node = pe.Node(
+        ResampleImage(reference_image=reference_image, n_threads=n_threads),
+        name="resample",
+    )
+    resample_node.n_procs = n_threads
+    if cache_dir:
+        resample_node.inputs.cache_dir = str(cache_dir)
+
+    # Set WF inputs and outputs
+    if in_file:
+        input_node.inputs.in_file = in_file
+    if out_file:
+        input_node.inputs.out_file = out_file
+
+    workflow.connect(input_node, "in_file", resample_node, "in_file")
+    workflow.connect(input_node, "out_file", resample_node, "out_file")
+    workflow.connect(resample_node, "out_file", output_node, "out_file")
+
+    return workflow
+
+
+def _getResampleImplementation(implementationName: str):
+    if implementationName == IMPLEMENTATION_FLIRT:
+        return build_resample_workflow
+    elif implementationName == IMPLEMENTATION_NUMPY:
+        return build_resample_numpy_workflow
+    else:
+        raise ImplementationNotFoundError(
+            f"{STEP_RESAMPLE} implementation not found: {implementationName}"
+        )
+
+
 def _csv_to_list(csv_file):
     # Imports must be in function for running as node
     import numpy as np
@@ -0,0 +1,93 @@
+"""Native Intensity Normalization.
+
+Scales an image's intensities with NumPy. The statistic is calculated from the
+loaded voxel matrix and the scaling applied to it in place, so normalizing an
+image costs one read and one write.
+"""
+
+import os
+
+import numpy as np
+
+from .masked_image import MaskedImage
+
+METHOD_GLOBAL_MEDIAN = "global_median"
+METHOD_VOXEL_MEAN = "voxel_mean"
+METHODS = (METHOD_GLOBAL_MEDIAN, METHOD_VOXEL_MEAN)
+
+GLOBAL_MEDIAN_SCALE = 10000
+VOXEL_MEAN_SCALE = 100
+
+
+def global_median_normalize(data: np.ndarray, voxels: np.ndarray = None):
+    """Scale an image so that its global median is 10000, in place.
+
+    As with fslstats -p 50, the median is taken over the image's non-zero
+    values, within the selected voxels if given.
+
+    Args:
+        data (np.ndarray): A time by voxel matrix.
+        voxels (np.ndarray, optional): A boolean vector over the columns of data
+            selecting the voxels to take the median over.
+
+    Raises:
+        ValueError: If there are no non-zero values, or their median is zero, so
+            the image can't be scaled.
+    """
+    values = data[:, voxels] if voxels is not None else data
+    values = values[(values != 0) & np.isfinite(values)]
+    if values.size == 0:
+        raise ValueError("Image has no non-zero values to take the global median of.")
+    median = np.median(values)
+    if median == 0:
+        raise ValueError("Image has a global median of zero, so can't be scaled.")
+    data *= GLOBAL_MEDIAN_SCALE / median
+    return data
+
+
+def voxel_mean_normalize(data: np.ndarray):
+    """Scale each voxel's timeseries so that its mean is 100, in place.
+
+    As with fslmaths -div, voxels with a mean of zero are set to zero.
+
+    Args:
+        data (np.ndarray): A time by voxel matrix.
+    """
+    means = np.nanmean(data, axis=0)
+    scale = np.zeros_like(means)
+    np.divide(VOXEL_MEAN_SCALE, means, out=scale, where=means != 0)
+    data *= scale
+    return data
+
+
+def normalize_image(
+    in_file: os.PathLike,
+    out_file: os.PathLike,
+    method: str = METHOD_GLOBAL_MEDIAN,
+    mask_file: os.PathLike = None,
+) -> str:
+    """Normalize an image's intensity with one of the native methods.
+
+    Args:
+        in_file (os.PathLike): The image to normalize.
+        out_file (os.PathLike): Where to save the normalized image.
+        method (str, optional): "global_median" or "voxel_mean".
+        mask_file (os.PathLike, optional): A mask to take the global median
+            within. Not used by the voxel mean method.
+
+    Returns:
+        str: The path of the normalized image.
+    """
+    if method not in METHODS:
+        raise ValueError(
+            f"Normalization method must be one of {METHODS}, got: {method}"
+        )
+
+    image = MaskedImage.load(in_file)
+    if method == METHOD_GLOBAL_MEDIAN:
+        voxels = image.voxels_in(mask_file) if mask_file else None
+        global_median_normalize(image.data, voxels=voxels)
+    else:
+        voxel_mean_normalize(image.data)
+
+    return image.save(out_file)
@@ -0,0 +1,129 @@
+"""Postprocessing Manifest.
+
+Records, for each image a processing stream has exported, the identity of the
+inputs and options that produced the export. An incremental run compares these
+records to the current inputs and options to schedule only new or stale images.
+
+Each image has its own entry file, so that concurrent image jobs never write to
+the same file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from .step_cache import default_file_mode, file_fingerprint
+
+TEMP_PREFIX = ".tmp_"
+OUTPUT_INDEPENDENT_OPTIONS = {
+    "working_directory",
+    "write_process_graph",
+    "step_cache_directory",
+    "step_cache_size_gb",
+    "intermediate_format",
+    "target_directory",
+    "target_tasks",
+    "target_acquisitions",
+    "output_directory",
+    "batch_options",
+    "log_directory",
+}
+"""Postprocessing options which do not change the content of an export."""
+
+
+class PostprocessingManifest:
+    """A directory of entries describing a stream's exports, one per image.
+
+    Attributes:
+        directory (Path): Where entries are stored.
+    """
+
+    def __init__(self, directory: os.PathLike):
+        self.directory = Path(directory)
+
+    def record(
+        self,
+        key: str,
+        image_path: os.PathLike,
+        confounds_path: os.PathLike,
+        options_hash: str,
+        export_paths: list,
+    ):
+        """Record the inputs and options an image's exports were made from.
+
+        Args:
+            key (str): The image's name, as used for its job.
+            image_path (os.PathLike): The processed image.
+            confounds_path (os.PathLike): The image's confounds file, if any.
+            options_hash (str): The postprocessing options, from options_hash().
+            export_paths (list): The files exported for the image.
+        """
+        entry = {
+            "image": file_fingerprint(image_path),
+            "confounds": file_fingerprint(confounds_path),
+            "options": options_hash,
+            "exports": {
+                str(path): file_fingerprint(path) for path in export_paths if path
+            },
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Write under a temporary name first, so that planning never reads a
+        #   partially written entry
+        file_descriptor, temp_path = tempfile.mkstemp(
+            prefix=TEMP_PREFIX, dir=self.directory
+        )
+        with os.fdopen(file_descriptor, "w") as entry_file:
+            json.dump(entry, entry_file, indent=4)
+        os.chmod(temp_path, default_file_mode())
+        os.replace(temp_path, self._entry_path(key))
+
+    def is_current(
+        self,
+        key: str,
+        image_path: os.PathLike,
+        confounds_path: os.PathLike,
+        options_hash: str,
+    ) -> bool:
+        """Check whether an image's recorded exports are still up to date.
+
+        An image is stale if it has no entry, if its image, confounds or options
+        have changed since its entry was recorded, or if any of its exports have
+        been removed or modified since.
+        """
+        try:
+            with open(self._entry_path(key)) as entry_file:
+                entry = json.load(entry_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        if entry["options"] != options_hash or not entry["exports"]:
+            return False
+        try:
+            if entry["image"] != file_fingerprint(image_path):
+                return False
+            if entry["confounds"] != file_fingerprint(confounds_path):
+                return False
+            for export_path, fingerprint in entry["exports"].items():
+                if fingerprint != file_fingerprint(export_path):
+                    return False
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+
+def options_hash(postprocessing_options) -> str:
+    """Hash the postprocessing options which determine the content of an export."""
+    options = {
+        name: value
+        for name, value in postprocessing_options.to_dict().items()
+        if name not in OUTPUT_INDEPENDENT_OPTIONS
+    }
+    encoded = json.dumps(options, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
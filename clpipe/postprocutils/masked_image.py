@@ -0,0 +1,166 @@
+"""Masked Image Representation.
+
+Holds a 4D image as a C-contiguous float32 time by voxel matrix of only its
+in-mask voxels, along with the mask and affine needed to turn it back into a
+NIfTI image. Voxelwise steps work on this matrix directly, without keeping
+out-of-mask voxels or double precision copies of the image in memory.
+"""
+
+import os
+
+import numpy as np
+import nibabel as nib
+
+MASKED_IMAGE_DTYPE = np.float32
+LOAD_CHUNK_VOLUMES = 32
+"""How many volumes to read at a time while loading an image."""
+
+
+class MaskedImage:
+    """A 4D image's in-mask voxels as a time by voxel matrix.
+
+    Attributes:
+        data (np.ndarray): The time by voxel matrix of in-mask voxels.
+        mask (np.ndarray): A 3D boolean array marking the voxels held in data.
+            Columns of data follow the C order of the mask's True voxels.
+        affine (np.ndarray): The image's affine.
+        header (nib.Nifti1Header): The image's header, if loaded from a file.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        mask: np.ndarray,
+        affine: np.ndarray,
+        header: nib.Nifti1Header = None,
+    ):
+        if data.shape[1] != np.count_nonzero(mask):
+            raise ValueError(
+                f"Data has {data.shape[1]} voxels, but the mask has "
+                f"{np.count_nonzero(mask)}."
+            )
+        self.data = data
+        self.mask = mask
+        self.affine = affine
+        self.header = header
+
+    @classmethod
+    def load(
+        cls,
+        image_path: os.PathLike,
+        mask: os.PathLike = None,
+        dtype=MASKED_IMAGE_DTYPE,
+    ) -> "MaskedImage":
+        """Load an image's in-mask voxels.
+
+        The image is read a few volumes at a time, so the full image is never
+        held in memory. The file is kept open between reads, as a gzipped image
+        would otherwise be decompressed from its start for every read. If no mask
+        is given, all voxels are kept.
+
+        Args:
+            image_path (os.PathLike): Path to a 4D image.
+            mask (os.PathLike, optional): Path to a 3D mask, or a boolean array.
+            dtype (optional): The data type of the matrix. Defaults to float32.
+        """
+        image = nib.load(image_path, keep_file_open=True)
+        if len(image.shape) != 4:
+            raise ValueError(f"Expected a 4D image, got shape: {image.shape}")
+        mask = _load_mask(mask, image.shape[:3])
+
+        timepoints = image.shape[3]
+        data = np.empty((timepoints, np.count_nonzero(mask)), dtype=dtype)
+        for start in range(0, timepoints, LOAD_CHUNK_VOLUMES):
+            end = min(start + LOAD_CHUNK_VOLUMES, timepoints)
+            volumes = np.asarray(image.dataobj[..., start:end])
+            data[start:end] = volumes[mask].T
+
+        return cls(data, mask, image.affine, image.header.copy())
+
+    @classmethod
+    def from_array(
+        cls,
+        array: np.ndarray,
+        affine: np.ndarray,
+        mask: np.ndarray = None,
+        header: nib.Nifti1Header = None,
+        dtype=MASKED_IMAGE_DTYPE,
+    ) -> "MaskedImage":
+        """Create a masked image from a 4D array."""
+        mask = _load_mask(mask, array.shape[:3])
+        data = np.ascontiguousarray(array[mask].T, dtype=dtype)
+        return cls(data, mask, affine, header)
+
+    @property
+    def shape(self) -> tuple:
+        """The 4D shape of the full image."""
+        return self.mask.shape + (self.data.shape[0],)
+
+    @property
+    def n_timepoints(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def n_voxels(self) -> int:
+        return self.data.shape[1]
+
+    def with_data(self, data: np.ndarray) -> "MaskedImage":
+        """Create a masked image with the same voxels holding new data.
+
+        The new data may have a different number of rows, such as after
+        timepoints are removed.
+        """
+        return MaskedImage(data, self.mask, self.affine, self.header)
+
+    def voxels_in(self, mask: os.PathLike) -> np.ndarray:
+        """Select the columns of data which fall within another mask.
+
+        Args:
+            mask (os.PathLike): Path to a 3D mask, or a boolean array.
+
+        Returns:
+            np.ndarray: A boolean vector over the columns of data.
+        """
+        return _load_mask(mask, self.mask.shape)[self.mask]
+
+    def voxel_mask(self, voxels: np.ndarray) -> np.ndarray:
+        """Expand a boolean vector over the columns of data into a 3D mask."""
+        mask = np.zeros(self.mask.shape, dtype=bool)
+        mask[self.mask] = voxels
+        return mask
+
+    def to_array(self, fill_value=0) -> np.ndarray:
+        """Expand the data back into a 4D array, filling out-of-mask voxels."""
+        array = np.full(self.shape, fill_value, dtype=self.data.dtype)
+        array[self.mask] = self.data.T
+        return array
+
+    def to_nifti(self, dtype=MASKED_IMAGE_DTYPE) -> nib.Nifti1Image:
+        """Convert to a NIfTI image.
+
+        Args:
+            dtype (optional): The on-disk data type to set in the header.
+                Set to None to keep the data type of the original header.
+        """
+        header = self.header.copy() if self.header is not None else None
+        image = nib.Nifti1Image(self.to_array(), self.affine, header)
+        if dtype is not None:
+            image.set_data_dtype(dtype)
+        return image
+
+    def save(self, out_file: os.PathLike, dtype=MASKED_IMAGE_DTYPE) -> str:
+        """Save as a NIfTI image, returning its absolute path."""
+        nib.save(self.to_nifti(dtype=dtype), out_file)
+        return os.path.abspath(out_file)
+
+
+def _load_mask(mask, spatial_shape: tuple) -> np.ndarray:
+    if mask is None:
+        return np.ones(spatial_shape, dtype=bool)
+    if not isinstance(mask, np.ndarray):
+        mask = np.asanyarray(nib.load(mask).dataobj)
+    if mask.shape != tuple(spatial_shape):
+        raise ValueError(
+            f"Mask shape {mask.shape} does not match image shape {spatial_shape}."
+        )
+    return mask > 0
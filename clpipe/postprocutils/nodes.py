@@ -16,7 +16,27 @@ import nipype.pipeline.engine as pe
 from nipype.interfaces.utility import IdentityInterface
 from nipype.interfaces.base.traits_extension import isdefined
 
-from clpipe.postprocutils.utils import apply_filter, calc_filter
+from clpipe.postprocutils.utils import calc_filter
+from clpipe.postprocutils.masked_image import MaskedImage
+from clpipe.postprocutils.chunked_filter import (
+    filter_in_blocks,
+    filter_image_in_chunks,
+)
+from clpipe.postprocutils.confound_regression import (
+    regress_image,
+    regfilt_image,
+    filter_and_regress_image,
+    BASES,
+)
+from clpipe.postprocutils.spatial_smoothing import smooth_image
+from clpipe.postprocutils.resample import resample_image
+from clpipe.postprocutils import intensity_normalization, spatial_smoothing
+from clpipe.postprocutils.image_statistics import get_image_statistics
+from clpipe.postprocutils.compression import (
+    OUTPUT_TYPE_EXTENSIONS,
+    export_image,
+    intermediate_extension,
+)
 
 
 def build_input_node():
@@ -32,6 +52,14 @@ def build_output_node():
     )
 
 
+def _default_out_file(inputs, suffix: str, extension: str) -> str:
+    """Name an interface's output after its input, in its requested format."""
+    _, base, _ = split_filename(inputs.in_file)
+    if isdefined(inputs.output_type):
+        extension = intermediate_extension(inputs.output_type)
+    return base + suffix + extension
+
+
 class ButterworthFilterInputSpec(BaseInterfaceInputSpec):
     in_file = File(exists=True, desc="Image to be normalized", mandatory=False)
     hp = traits.Float(
@@ -42,7 +70,29 @@ class ButterworthFilterInputSpec(BaseInterfaceInputSpec):
     )
     tr = traits.Float(desc="Repetition time.", mandatory=True)
     order = traits.Float(desc="Order of the filter", mandatory=True)
+    zero_phase = traits.Bool(
+        False, usedefault=True, desc="Filter forwards and backwards."
+    )
+    chunk_size = traits.Int(
+        0,
+        usedefault=True,
+        desc="Voxels to filter at a time, streamed from and to disk. "
+        "Set to 0 to filter the whole image in memory.",
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of chunks to filter in parallel."
+    )
+    mask_file = File(
+        exists=True,
+        desc="Mask of voxels to filter. Voxels outside are zeroed.",
+        mandatory=False,
+    )
     out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
 
 
 class ButterworthFilterOutputSpec(TraitedSpec):
@@ -55,23 +105,37 @@ class ButterworthFilter(BaseInterface):
 
     def _run_interface(self, runtime):
         fname = self.inputs.in_file
-        img = nb.load(fname)
-        data = np.array(img.get_data())
 
         filter = calc_filter(
             self.inputs.hp, self.inputs.lp, self.inputs.tr, self.inputs.order
         )
-        filtered_data = apply_filter(filter, data)
-
-        new_img = nb.Nifti1Image(filtered_data, img.affine, img.header)
 
         if not isdefined(self.inputs.out_file):
-            _, base, _ = split_filename(fname)
-            self.new_file = base + "_filtered.nii"
+            self.new_file = _default_out_file(self.inputs, "_filtered", ".nii")
         else:
             self.new_file = self.inputs.out_file
 
-        nb.save(new_img, self.new_file)
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+
+        if self.inputs.chunk_size > 0:
+            filter_image_in_chunks(
+                filter,
+                fname,
+                self.new_file,
+                self.inputs.chunk_size,
+                n_threads=self.inputs.n_threads,
+                zero_phase=self.inputs.zero_phase,
+                mask_file=mask_file,
+            )
+        else:
+            image = MaskedImage.load(fname, mask=mask_file)
+            filter_in_blocks(
+                filter,
+                image.data,
+                n_threads=self.inputs.n_threads,
+                zero_phase=self.inputs.zero_phase,
+            )
+            image.save(self.new_file)
 
         return runtime
 
@@ -147,6 +211,11 @@ class ImageSliceInputSpec(BaseInterfaceInputSpec):
         default_value=0,
     )
     out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
 
 
 class ImageSliceOutputSpec(TraitedSpec):
@@ -182,8 +251,7 @@ class ImageSlice(BaseInterface):
             cropped_img = img.slicer[..., start_index:end_index]
 
         if not isdefined(self.inputs.out_file):
-            _, base, _ = split_filename(fname)
-            self.new_file = base + "_sliced.nii"
+            self.new_file = _default_out_file(self.inputs, "_sliced", ".nii")
         else:
             self.new_file = self.inputs.out_file
 
@@ -196,3 +264,445 @@ class ImageSlice(BaseInterface):
         outputs["out_file"] = os.path.abspath(self.new_file)
 
         return outputs
+
+
+class RegressConfoundsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be regressed", mandatory=False)
+    confounds_file = File(
+        exists=True, desc="Processed confounds TSV to regress out", mandatory=True
+    )
+    mask_file = File(
+        exists=True,
+        desc="Mask of voxels to regress. Voxels outside are set to their mean.",
+        mandatory=False,
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of voxel blocks to regress in parallel."
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class RegressConfoundsOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Regressed image")
+
+
+class RegressConfounds(BaseInterface):
+    input_spec = RegressConfoundsInputSpec
+    output_spec = RegressConfoundsOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(self.inputs, "_regressed", ".nii")
+        else:
+            self.new_file = self.inputs.out_file
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+
+        regress_image(
+            fname,
+            self.inputs.confounds_file,
+            self.new_file,
+            mask_file=mask_file,
+            n_threads=self.inputs.n_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class FilterRegressConfoundsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be processed", mandatory=False)
+    confounds_file = File(
+        exists=True,
+        desc="Processed, unfiltered confounds TSV to regress out",
+        mandatory=True,
+    )
+    tr = traits.Float(desc="Repetition time", mandatory=True)
+    high_pass = traits.Float(
+        desc="High pass cutoff in Hz. -1 to disable.", mandatory=True
+    )
+    low_pass = traits.Float(desc="Low pass cutoff in Hz. -1 to disable.", mandatory=True)
+    basis = traits.Enum(*BASES, usedefault=True, desc="The bandstop basis.")
+    scrub_vector = traits.List(
+        desc="Timepoints to leave out of the fit, flagged with 1s.",
+        mandatory=False,
+    )
+    mask_file = File(
+        exists=True,
+        desc="Mask of voxels to process. Voxels outside are set to their mean.",
+        mandatory=False,
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of voxel blocks to regress in parallel."
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class FilterRegressConfoundsOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Filtered and regressed image")
+
+
+class FilterRegressConfounds(BaseInterface):
+    """Temporally filters an image and regresses confounds out of it in one
+    projection."""
+
+    input_spec = FilterRegressConfoundsInputSpec
+    output_spec = FilterRegressConfoundsOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(
+                self.inputs, "_filtered_regressed", ".nii"
+            )
+        else:
+            self.new_file = self.inputs.out_file
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+        scrub_vector = (
+            self.inputs.scrub_vector if isdefined(self.inputs.scrub_vector) else None
+        )
+
+        filter_and_regress_image(
+            fname,
+            self.inputs.confounds_file,
+            self.new_file,
+            self.inputs.tr,
+            self.inputs.high_pass,
+            self.inputs.low_pass,
+            basis=self.inputs.basis,
+            scrub_vector=scrub_vector,
+            mask_file=mask_file,
+            n_threads=self.inputs.n_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class RegressAromaInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be regressed", mandatory=False)
+    mixing_file = File(exists=True, desc="The AROMA mixing file", mandatory=True)
+    noise_file = File(exists=True, desc="The AROMA noise file", mandatory=True)
+    mask_file = File(
+        exists=True,
+        desc="Mask of voxels to regress. Voxels outside are left unchanged.",
+        mandatory=False,
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of voxel blocks to regress in parallel."
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class RegressAromaOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Regressed image")
+
+
+class RegressAroma(BaseInterface):
+    input_spec = RegressAromaInputSpec
+    output_spec = RegressAromaOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(self.inputs, "_AROMAregressed", ".nii.gz")
+        else:
+            self.new_file = self.inputs.out_file
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+
+        regfilt_image(
+            fname,
+            self.inputs.mixing_file,
+            self.inputs.noise_file,
+            self.new_file,
+            mask_file=mask_file,
+            n_threads=self.inputs.n_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class SpatialSmoothInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be smoothed", mandatory=False)
+    fwhm = traits.Float(
+        desc="Full width at half maximum of the kernel in millimeters.",
+        mandatory=True,
+    )
+    method = traits.Enum(
+        *spatial_smoothing.METHODS, usedefault=True, desc="The smoothing method."
+    )
+    mask_file = File(
+        exists=True,
+        desc="Mask to smooth within. Voxels outside are zeroed.",
+        mandatory=False,
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of volumes to smooth in parallel."
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class SpatialSmoothOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Smoothed image")
+
+
+class SpatialSmooth(BaseInterface):
+    input_spec = SpatialSmoothInputSpec
+    output_spec = SpatialSmoothOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(self.inputs, "_smoothed", ".nii.gz")
+        else:
+            self.new_file = self.inputs.out_file
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+
+        smooth_image(
+            fname,
+            self.new_file,
+            self.inputs.fwhm,
+            method=self.inputs.method,
+            mask_file=mask_file,
+            n_threads=self.inputs.n_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class ResampleImageInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be resampled", mandatory=False)
+    reference_image = File(
+        exists=True, desc="Image on the grid to resample to", mandatory=True
+    )
+    cache_dir = traits.Directory(
+        desc="Directory to cache resampling maps in, shared between runs.",
+        mandatory=False,
+    )
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of volume blocks to resample in parallel."
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class ResampleImageOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Resampled image")
+
+
+class ResampleImage(BaseInterface):
+    input_spec = ResampleImageInputSpec
+    output_spec = ResampleImageOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(self.inputs, "_resampled", ".nii.gz")
+        else:
+            self.new_file = self.inputs.out_file
+        cache_dir = self.inputs.cache_dir if isdefined(self.inputs.cache_dir) else None
+
+        resample_image(
+            fname,
+            self.new_file,
+            self.inputs.reference_image,
+            cache_dir=cache_dir,
+            n_threads=self.inputs.n_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class IntensityNormalizeInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to be normalized", mandatory=False)
+    method = traits.Enum(
+        *intensity_normalization.METHODS,
+        usedefault=True,
+        desc="The normalization method.",
+    )
+    mask_file = File(
+        exists=True,
+        desc="Mask to take the global median within.",
+        mandatory=False,
+    )
+    out_file = File(mandatory=False)
+    output_type = traits.Enum(
+        *OUTPUT_TYPE_EXTENSIONS,
+        mandatory=False,
+        desc="Format of the default output file. Overrides the default extension.",
+    )
+
+
+class IntensityNormalizeOutputSpec(TraitedSpec):
+    out_file = File(exists=False, desc="Normalized image")
+
+
+class IntensityNormalize(BaseInterface):
+    input_spec = IntensityNormalizeInputSpec
+    output_spec = IntensityNormalizeOutputSpec
+
+    def _run_interface(self, runtime):
+        fname = self.inputs.in_file
+
+        if not isdefined(self.inputs.out_file):
+            self.new_file = _default_out_file(self.inputs, "_normalized", ".nii.gz")
+        else:
+            self.new_file = self.inputs.out_file
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+
+        intensity_normalization.normalize_image(
+            fname, self.new_file, method=self.inputs.method, mask_file=mask_file
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.new_file)
+
+        return outputs
+
+
+class ExportImageInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to export", mandatory=True)
+    out_file = File(desc="Export path", mandatory=True)
+    n_threads = traits.Int(
+        1, usedefault=True, desc="Number of blocks to compress in parallel."
+    )
+
+
+class ExportImageOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="Exported image")
+
+
+class ExportImage(BaseInterface):
+    """Exports an image, compressing it in parallel if the export path ends in
+    .gz and the image is not already compressed.
+
+    Replaces ExportFile for images, so that intermediate images can be written
+    uncompressed and only the export pays for compression.
+    """
+
+    input_spec = ExportImageInputSpec
+    output_spec = ExportImageOutputSpec
+
+    def _run_interface(self, runtime):
+        os.makedirs(
+            os.path.dirname(os.path.abspath(self.inputs.out_file)), exist_ok=True
+        )
+        self.new_file = export_image(
+            self.inputs.in_file, self.inputs.out_file, self.inputs.n_threads
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = self.new_file
+
+        return outputs
+
+
+class ComputeImageStatisticsInputSpec(BaseInterfaceInputSpec):
+    in_file = File(exists=True, desc="Image to summarize", mandatory=True)
+    mask_file = File(
+        exists=True, desc="Mask to take percentiles within.", mandatory=False
+    )
+    percentiles = traits.Bool(
+        True,
+        usedefault=True,
+        desc="Compute intensity percentiles. Set to False if only the mean "
+        "image is needed.",
+    )
+
+
+class ComputeImageStatisticsOutputSpec(TraitedSpec):
+    mean_file = File(exists=True, desc="The temporal mean image")
+    p2 = traits.Float(desc="The 2nd percentile intensity")
+    median = traits.Float(desc="The median intensity")
+
+
+class ComputeImageStatistics(BaseInterface):
+    """Computes an image's temporal mean and intensity percentiles in one pass.
+
+    Statistics are cached by file identity, so asking for them again for the
+    same image does not read it again.
+    """
+
+    input_spec = ComputeImageStatisticsInputSpec
+    output_spec = ComputeImageStatisticsOutputSpec
+
+    def _run_interface(self, runtime):
+        mask_file = self.inputs.mask_file if isdefined(self.inputs.mask_file) else None
+        self.statistics = get_image_statistics(
+            self.inputs.in_file, mask_file, percentiles=self.inputs.percentiles
+        )
+        self.statistics.mean_file(runtime.cwd)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["mean_file"] = self.statistics.mean_file()
+        if self.statistics.has_percentiles:
+            outputs["p2"] = self.statistics.p2
+            outputs["median"] = self.statistics.median
+
+        return outputs
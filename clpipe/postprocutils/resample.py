@@ -0,0 +1,233 @@
+"""Native Resampling.
+
+Resamples a 4D image onto a reference grid with trilinear interpolation, as
+FLIRT's -applyxfm with -usesqform does. The interpolation is a fixed linear map
+from source voxels to reference voxels, so it is built once as a sparse matrix
+per pair of grids, cached on disk, and applied to every volume of every run
+sharing those grids as a sparse matrix product.
+"""
+
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import nibabel as nib
+from scipy import sparse
+
+from .step_cache import default_file_mode
+
+RESAMPLE_DTYPE = np.float32
+MAP_FILE_PREFIX = "resample_map_"
+GRID_TOLERANCE = 1e-6
+"""How far, in voxels, a reference voxel may fall outside of the source grid
+and still be interpolated, to absorb rounding in the affines."""
+
+
+def grid_key(
+    source_affine: np.ndarray,
+    source_shape: tuple,
+    reference_affine: np.ndarray,
+    reference_shape: tuple,
+) -> str:
+    """Identify a pair of source and reference grids."""
+    digest = hashlib.sha1()
+    for affine, shape in (
+        (source_affine, source_shape),
+        (reference_affine, reference_shape),
+    ):
+        digest.update(np.asarray(affine, dtype=np.float64).tobytes())
+        digest.update(np.asarray(shape[:3], dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def resampling_map(
+    source_affine: np.ndarray,
+    source_shape: tuple,
+    reference_affine: np.ndarray,
+    reference_shape: tuple,
+) -> sparse.csr_matrix:
+    """Build the trilinear interpolation from a source grid onto a reference grid.
+
+    Each row holds the weights of the up to 8 source voxels surrounding a
+    reference voxel's position. Reference voxels outside of the source grid have
+    no weights, so they are resampled to zero. Voxels are numbered in C order.
+
+    Args:
+        source_affine (np.ndarray): The source image's affine.
+        source_shape (tuple): The source image's shape. Only the first 3
+            dimensions are used.
+        reference_affine (np.ndarray): The reference image's affine.
+        reference_shape (tuple): The reference image's shape.
+
+    Returns:
+        sparse.csr_matrix: A reference voxel by source voxel matrix.
+    """
+    source_shape = tuple(source_shape[:3])
+    reference_shape = tuple(reference_shape[:3])
+
+    # Each reference voxel's position in source voxel coordinates
+    reference_to_source = np.linalg.inv(source_affine) @ reference_affine
+    indices = np.indices(reference_shape).reshape(3, -1)
+    coordinates = (
+        reference_to_source[:3, :3] @ indices + reference_to_source[:3, 3:]
+    ).T
+    upper = np.asarray(source_shape) - 1
+    inside = np.all(
+        (coordinates >= -GRID_TOLERANCE) & (coordinates <= upper + GRID_TOLERANCE),
+        axis=1,
+    )
+    rows = np.flatnonzero(inside)
+    coordinates = np.clip(coordinates[inside], 0, upper)
+    # The last voxel along an axis is reached with a full weight on the upper
+    #   corner, so that the upper corner stays on the grid
+    floors = np.minimum(
+        np.floor(coordinates).astype(np.int64), np.maximum(upper - 1, 0)
+    )
+    fractions = coordinates - floors
+
+    all_rows, all_columns, all_weights = [], [], []
+    for corner in np.ndindex(2, 2, 2):
+        corner = np.asarray(corner)
+        corners = floors + corner
+        weights = np.prod(np.where(corner, fractions, 1 - fractions), axis=1)
+        # Single voxel thick dimensions have no upper neighbour
+        valid = np.all(corners <= upper, axis=1) & (weights > 0)
+        all_rows.append(rows[valid])
+        all_columns.append(np.ravel_multi_index(corners[valid].T, source_shape))
+        all_weights.append(weights[valid])
+
+    return sparse.csr_matrix(
+        (
+            np.concatenate(all_weights).astype(RESAMPLE_DTYPE),
+            (np.concatenate(all_rows), np.concatenate(all_columns)),
+        ),
+        shape=(int(np.prod(reference_shape)), int(np.prod(source_shape))),
+    )
+
+
+def load_resampling_map(
+    source_affine: np.ndarray,
+    source_shape: tuple,
+    reference_affine: np.ndarray,
+    reference_shape: tuple,
+    cache_dir: os.PathLike = None,
+) -> sparse.csr_matrix:
+    """Get the resampling map for a pair of grids, building it only if it is not
+    already cached.
+
+    Maps are saved to the cache directory by grid_key, so that every run sharing
+    the same grids reuses one map, including runs in other processes.
+
+    Args:
+        cache_dir (os.PathLike, optional): Where to cache the map. If not given,
+            the map is built and not saved.
+    """
+    if cache_dir is None:
+        return resampling_map(
+            source_affine, source_shape, reference_affine, reference_shape
+        )
+
+    key = grid_key(source_affine, source_shape, reference_affine, reference_shape)
+    map_path = os.path.join(cache_dir, f"{MAP_FILE_PREFIX}{key}.npz")
+    if os.path.exists(map_path):
+        return sparse.load_npz(map_path).tocsr()
+
+    resample_map = resampling_map(
+        source_affine, source_shape, reference_affine, reference_shape
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    # Save under a temporary name first, so that concurrent runs never read a
+    #   partially written map
+    file_descriptor, temp_path = tempfile.mkstemp(
+        suffix=".npz", prefix=MAP_FILE_PREFIX, dir=cache_dir
+    )
+    os.close(file_descriptor)
+    try:
+        sparse.save_npz(temp_path, resample_map)
+        os.chmod(temp_path, default_file_mode())
+        os.replace(temp_path, map_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return resample_map
+
+
+def resample_volumes(
+    resample_map: sparse.csr_matrix, data: np.ndarray, n_threads: int = 1
+) -> np.ndarray:
+    """Apply a resampling map to each volume of a 4D image.
+
+    Args:
+        resample_map (sparse.csr_matrix): A map from resampling_map.
+        data (np.ndarray): A 4D image on the map's source grid.
+        n_threads (int, optional): Blocks of volumes to resample in parallel.
+            Defaults to 1.
+
+    Returns:
+        np.ndarray: A reference voxel by time matrix, in C order.
+    """
+    timepoints = data.shape[3]
+    voxels = data.reshape(-1, timepoints)
+    resampled = np.empty((resample_map.shape[0], timepoints), dtype=RESAMPLE_DTYPE)
+
+    n_blocks = max(min(n_threads, timepoints), 1)
+    block_size = -(-timepoints // n_blocks)
+    blocks = [
+        slice(start, min(start + block_size, timepoints))
+        for start in range(0, timepoints, block_size)
+    ]
+
+    def _resample_block(block: slice):
+        resampled[:, block] = resample_map @ np.ascontiguousarray(voxels[:, block])
+
+    with ThreadPoolExecutor(max_workers=n_blocks) as executor:
+        list(executor.map(_resample_block, blocks))
+
+    return resampled
+
+
+def resample_image(
+    in_file: os.PathLike,
+    out_file: os.PathLike,
+    reference_image: os.PathLike,
+    cache_dir: os.PathLike = None,
+    n_threads: int = 1,
+) -> str:
+    """Resample an image onto a reference image's grid and save it as float32.
+
+    The resampled image keeps the input's repetition time.
+
+    Args:
+        in_file (os.PathLike): A 4D image.
+        out_file (os.PathLike): Where to save the resampled image.
+        reference_image (os.PathLike): An image on the target grid.
+        cache_dir (os.PathLike, optional): Where to cache resampling maps.
+        n_threads (int, optional): Blocks of volumes to resample in parallel.
+
+    Returns:
+        str: The path of the resampled image.
+    """
+    image = nib.load(in_file)
+    if len(image.shape) != 4:
+        raise ValueError(f"Expected a 4D image, got shape: {image.shape}")
+    reference = nib.load(reference_image)
+    reference_shape = reference.shape[:3]
+
+    resample_map = load_resampling_map(
+        image.affine, image.shape, reference.affine, reference_shape, cache_dir
+    )
+    resampled = resample_volumes(
+        resample_map, image.get_fdata(dtype=RESAMPLE_DTYPE), n_threads
+    ).reshape(reference_shape + (image.shape[3],))
+
+    header = image.header.copy()
+    header.set_zooms(reference.header.get_zooms()[:3] + image.header.get_zooms()[3:])
+    resampled_image = nib.Nifti1Image(resampled, reference.affine, header)
+    resampled_image.set_qform(reference.affine)
+    resampled_image.set_data_dtype(RESAMPLE_DTYPE)
+    nib.save(resampled_image, out_file)
+
+    return os.path.abspath(out_file)
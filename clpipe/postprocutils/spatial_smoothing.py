@@ -0,0 +1,294 @@
+"""Native Spatial Smoothing.
+
+Smooths each volume of a 4D image with NumPy and SciPy, spreading the volumes
+across a thread pool. Two methods are available: a SUSAN-equivalent
+edge-preserving smoother, and a plain Gaussian restricted to a mask.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from math import sqrt, log
+
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import gaussian_filter, median_filter
+
+from .image_statistics import ImageStatistics
+
+SMOOTHING_DTYPE = np.float32
+METHOD_SUSAN = "susan"
+METHOD_GAUSSIAN = "gaussian"
+METHODS = (METHOD_SUSAN, METHOD_GAUSSIAN)
+
+SUSAN_THRESHOLD_SCALE = 0.75
+"""Scales the image's p50 - p2 intensity range into SUSAN's brightness threshold."""
+SUSAN_KERNEL_RADIUS = 2.0
+"""The radius of the SUSAN kernel, in standard deviations of its spatial weight."""
+SUSAN_MAX_WEIGHT_BYTES = 1024**3
+"""The most memory used to keep SUSAN's weights between volumes. Kernels with
+more weights than fit recalculate them for each volume instead."""
+MIN_USAN_WEIGHT = 1e-4
+"""Voxels whose neighbours carry less total weight than this are replaced with
+their local median instead, as with susan's use_median option."""
+
+
+def fwhm_to_sigma(fwhm_mm: float) -> float:
+    """Convert a kernel's full width at half maximum to its standard deviation."""
+    return fwhm_mm / sqrt(8 * log(2))
+
+
+def susan_threshold(statistics: ImageStatistics) -> float:
+    """Calculate SUSAN's brightness threshold, 0.75 * (p50 - p2), from an image's
+    statistics."""
+    return (statistics.median - statistics.p2) * SUSAN_THRESHOLD_SCALE
+
+
+class SusanKernel:
+    """SUSAN's smoothing weights for the voxels of an image.
+
+    SUSAN weighs each neighbour of a voxel by its distance and by how close its
+    brightness in the USAN image is to the voxel's own. The USAN image is the
+    temporal mean, which is the same for every volume, so the weights are
+    calculated once here and reused for each volume. Weights are held only for
+    the voxels being smoothed - those within the mask, if one is given - as one
+    array per neighbour offset. If they would take more than max_weight_bytes,
+    each offset's weights are instead recalculated for every volume.
+
+    Attributes:
+        radius (tuple): The kernel's half-width along each axis, in voxels.
+        offsets (list): The (x, y, z) offset of each neighbour.
+        mask (np.ndarray): A 3D boolean array of the voxels being smoothed.
+        weights (list): The weights of each offset at each voxel being smoothed,
+            or None if they are recalculated for every volume.
+        total_weight (np.ndarray): The sum of the weights at each voxel being
+            smoothed.
+    """
+
+    def __init__(
+        self,
+        usan: np.ndarray,
+        brightness_threshold: float,
+        sigma_mm: float,
+        zooms: tuple,
+        mask: np.ndarray = None,
+        max_weight_bytes: int = SUSAN_MAX_WEIGHT_BYTES,
+    ):
+        sigma_voxels = np.asarray([sigma_mm / zoom for zoom in zooms])
+        self.radius = tuple(
+            int(np.ceil(SUSAN_KERNEL_RADIUS * sigma)) for sigma in sigma_voxels
+        )
+        self.brightness_threshold = brightness_threshold
+        self.mask = np.ones(usan.shape, dtype=bool) if mask is None else mask
+
+        padded_usan = _pad(usan.astype(SMOOTHING_DTYPE), self.radius, np.nan)
+        self._padded_usan = padded_usan.ravel()
+        # Each voxel's flat index within the padded image, from which a
+        #   neighbour's index is a fixed shift per offset
+        self._voxels = np.ravel_multi_index(
+            tuple(
+                coordinates + r
+                for coordinates, r in zip(np.nonzero(self.mask), self.radius)
+            ),
+            padded_usan.shape,
+        )
+        self._usan = self._padded_usan[self._voxels]
+        # Strides in elements of the flattened, C ordered, padded image
+        padded_strides = np.cumprod((1,) + padded_usan.shape[:0:-1])[::-1]
+
+        self.offsets = []
+        self._shifts = []
+        self._distances = []
+        for offset in np.ndindex(*(2 * r + 1 for r in self.radius)):
+            offset = tuple(o - r for o, r in zip(offset, self.radius))
+            distance = np.sum((np.asarray(offset) / sigma_voxels) ** 2)
+            # The centre voxel is left out, so its own noise is not kept
+            if distance == 0 or distance > SUSAN_KERNEL_RADIUS**2:
+                continue
+            self.offsets.append(offset)
+            self._shifts.append(int(np.dot(offset, padded_strides)))
+            self._distances.append(distance)
+
+        weight_bytes = (
+            len(self.offsets) * len(self._voxels) * np.dtype(SMOOTHING_DTYPE).itemsize
+        )
+        self.weights = [] if weight_bytes <= max_weight_bytes else None
+        self.total_weight = np.zeros(len(self._voxels), dtype=SMOOTHING_DTYPE)
+        for index in range(len(self.offsets)):
+            weights = self._calculate_weights(index)
+            self.total_weight += weights
+            if self.weights is not None:
+                self.weights.append(weights)
+
+    def smooth(self, volume: np.ndarray) -> np.ndarray:
+        """Smooth a single volume.
+
+        Args:
+            volume (np.ndarray): A 3D volume the same shape as the USAN image.
+
+        Returns:
+            np.ndarray: The smoothed volume, zero outside of the kernel's mask.
+        """
+        padded = _pad(volume.astype(SMOOTHING_DTYPE), self.radius, 0).ravel()
+        smoothed = np.zeros(len(self._voxels), dtype=SMOOTHING_DTYPE)
+        weighted = np.empty(len(self._voxels), dtype=SMOOTHING_DTYPE)
+        for index, shift in enumerate(self._shifts):
+            weights = (
+                self.weights[index]
+                if self.weights is not None
+                else self._calculate_weights(index)
+            )
+            np.multiply(weights, padded[self._voxels + shift], out=weighted)
+            smoothed += weighted
+
+        isolated = self.total_weight < MIN_USAN_WEIGHT
+        np.divide(smoothed, self.total_weight, out=smoothed, where=~isolated)
+        if isolated.any():
+            smoothed[isolated] = median_filter(volume, size=3)[self.mask][isolated]
+
+        smoothed_volume = np.zeros(volume.shape, dtype=SMOOTHING_DTYPE)
+        smoothed_volume[self.mask] = smoothed
+        return smoothed_volume
+
+    def _calculate_weights(self, index: int) -> np.ndarray:
+        neighbours = self._padded_usan[self._voxels + self._shifts[index]]
+        weights = np.full(
+            len(self._voxels),
+            np.exp(-self._distances[index] / 2),
+            dtype=SMOOTHING_DTYPE,
+        )
+        if self.brightness_threshold > 0:
+            weights *= np.exp(
+                -(((neighbours - self._usan) / self.brightness_threshold) ** 2)
+            )
+        # Neighbours beyond the edge of the image carry no weight
+        weights[np.isnan(neighbours)] = 0
+        return weights
+
+
+def susan_smooth(
+    data: np.ndarray,
+    fwhm_mm: float,
+    zooms: tuple,
+    mask: np.ndarray = None,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Smooth each volume of a 4D image with SUSAN, in place.
+
+    As in build_SUSAN_workflow, the USAN image is the temporal mean and the
+    brightness threshold is taken from the in-mask intensities.
+
+    Args:
+        data (np.ndarray): A 4D image.
+        fwhm_mm (float): Full width at half maximum of the kernel in millimeters.
+        zooms (tuple): The voxel size along each spatial axis in millimeters.
+        mask (np.ndarray, optional): A 3D boolean mask. Voxels outside of it are
+            zeroed after smoothing.
+        n_threads (int, optional): Volumes to smooth in parallel. Defaults to 1.
+
+    Returns:
+        np.ndarray: The smoothed image.
+    """
+    statistics = ImageStatistics.from_array(data, mask)
+    kernel = SusanKernel(
+        statistics.temporal_mean,
+        susan_threshold(statistics),
+        fwhm_to_sigma(fwhm_mm),
+        zooms,
+        mask,
+    )
+    return _smooth_volumes(kernel.smooth, data, mask, n_threads)
+
+
+def gaussian_smooth(
+    data: np.ndarray,
+    fwhm_mm: float,
+    zooms: tuple,
+    mask: np.ndarray = None,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Smooth each volume of a 4D image with a Gaussian, in place.
+
+    If a mask is given, only in-mask voxels contribute to the smoothed values,
+    and the kernel is renormalized near the mask's edge.
+
+    Args:
+        data (np.ndarray): A 4D image.
+        fwhm_mm (float): Full width at half maximum of the kernel in millimeters.
+        zooms (tuple): The voxel size along each spatial axis in millimeters.
+        mask (np.ndarray, optional): A 3D boolean mask. Voxels outside of it are
+            zeroed after smoothing.
+        n_threads (int, optional): Volumes to smooth in parallel. Defaults to 1.
+
+    Returns:
+        np.ndarray: The smoothed image.
+    """
+    sigma_voxels = [fwhm_to_sigma(fwhm_mm) / zoom for zoom in zooms]
+
+    if mask is None:
+
+        def _smooth_volume(volume: np.ndarray):
+            return gaussian_filter(volume, sigma_voxels)
+
+    else:
+        in_mask = mask.astype(SMOOTHING_DTYPE)
+        normalizer = gaussian_filter(in_mask, sigma_voxels)
+
+        def _smooth_volume(volume: np.ndarray):
+            smoothed = gaussian_filter(volume * in_mask, sigma_voxels)
+            np.divide(smoothed, normalizer, out=smoothed, where=mask)
+            return smoothed
+
+    return _smooth_volumes(_smooth_volume, data, mask, n_threads)
+
+
+def smooth_image(
+    in_file: os.PathLike,
+    out_file: os.PathLike,
+    fwhm_mm: float,
+    method: str = METHOD_SUSAN,
+    mask_file: os.PathLike = None,
+    n_threads: int = 1,
+) -> str:
+    """Smooth an image with one of the native methods and save it as float32.
+
+    Returns:
+        str: The path of the smoothed image.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Smoothing method must be one of {METHODS}, got: {method}")
+
+    image = nib.load(in_file)
+    if len(image.shape) != 4:
+        raise ValueError(f"Expected a 4D image, got shape: {image.shape}")
+    data = image.get_fdata(dtype=SMOOTHING_DTYPE)
+    mask = None
+    if mask_file:
+        mask = np.asanyarray(nib.load(mask_file).dataobj) > 0
+
+    smooth = susan_smooth if method == METHOD_SUSAN else gaussian_smooth
+    smooth(data, fwhm_mm, image.header.get_zooms()[:3], mask, n_threads)
+
+    smoothed_image = nib.Nifti1Image(data, image.affine, image.header)
+    smoothed_image.set_data_dtype(SMOOTHING_DTYPE)
+    nib.save(smoothed_image, out_file)
+
+    return os.path.abspath(out_file)
+
+
+def _smooth_volumes(smooth_volume, data: np.ndarray, mask: np.ndarray, n_threads: int):
+    def _smooth(index: int):
+        smoothed = smooth_volume(data[..., index])
+        if mask is not None:
+            smoothed[~mask] = 0
+        data[..., index] = smoothed
+
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        list(executor.map(_smooth, range(data.shape[3])))
+
+    return data
+
+
+def _pad(volume: np.ndarray, radius: tuple, fill_value) -> np.ndarray:
+    return np.pad(
+        volume, [(r, r) for r in radius], mode="constant", constant_values=fill_value
+    )
@@ -0,0 +1,249 @@
+"""Content-Addressed Step Output Cache.
+
+Saves the output of each image processing step under a key derived from
+everything that determines it: the input image, the steps before it, the step's
+own options and inputs, and the clpipe version. Streams which share a prefix of
+steps resolve to the same keys, so a stream can start from the output of the
+longest prefix already computed by any stream using the same cache directory.
+
+The cache is bounded in size, evicting its least recently used outputs first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from ..config.package import VERSION
+
+GIGABYTE = 1024**3
+TEMP_PREFIX = ".tmp_"
+
+# Steps whose inputs come from the confounds workflow, and so depend on the
+#   confounds file and every option that shapes its processing
+CONFOUND_DEPENDENT_STEPS = {
+    "ConfoundRegression",
+    "TemporalFilteringConfoundRegression",
+    "ScrubTimepoints",
+}
+AROMA_DEPENDENT_STEPS = {"AROMARegression"}
+TR_DEPENDENT_STEPS = {"TemporalFiltering", "TemporalFilteringConfoundRegression"}
+
+STEP_OPTION_NAMES = {
+    "TemporalFiltering": "temporal_filtering",
+    "IntensityNormalization": "intensity_normalization",
+    "SpatialSmoothing": "spatial_smoothing",
+    "AROMARegression": "aroma_regression",
+    "ScrubTimepoints": "scrub_timepoints",
+    "Resample": "resample",
+    "ConfoundRegression": "confound_regression",
+    "TrimTimepoints": "trim_timepoints",
+    "TemporalFilteringConfoundRegression": "temporal_filtering_confound_regression",
+}
+
+
+class StepCache:
+    """A size-bounded directory of step outputs, named by their keys.
+
+    Recency is tracked with each output's modification time, which is updated
+    whenever it is used.
+
+    Attributes:
+        directory (Path): Where outputs are stored.
+        max_size (int): The cache's size limit in bytes.
+    """
+
+    def __init__(self, directory: os.PathLike, max_size_gb: float = 100):
+        self.directory = Path(directory)
+        self.max_size = int(max_size_gb * GIGABYTE)
+
+    @classmethod
+    def from_options(cls, processing_options) -> "StepCache":
+        """Get the cache configured in a set of postprocessing options, or None if
+        no cache directory is set."""
+        if not processing_options.step_cache_directory:
+            return None
+        return cls(
+            processing_options.step_cache_directory,
+            processing_options.step_cache_size_gb,
+        )
+
+    def lookup(self, key: str) -> Path:
+        """Find the cached output for a key, or None if it is not cached."""
+        for path in self.directory.glob(f"{key}.*"):
+            return path
+        return None
+
+    def fetch(self, key: str, destination_dir: os.PathLike) -> Path:
+        """Place the cached output for a key in a directory, or return None if it is
+        not cached.
+
+        The output is hard linked where possible, so that it stays available even
+        if it is evicted from the cache afterwards.
+        """
+        cached_path = self.lookup(key)
+        if cached_path is None:
+            return None
+
+        os.makedirs(destination_dir, exist_ok=True)
+        destination = Path(destination_dir) / cached_path.name
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(cached_path, destination)
+        except OSError:
+            # Hard links fail across filesystems and where they are not permitted.
+            #   If copying fails too, such as when the output was evicted since it
+            #   was found or can't be read, it is treated as not cached
+            try:
+                shutil.copyfile(cached_path, destination)
+            except OSError:
+                if destination.exists():
+                    destination.unlink()
+                return None
+        try:
+            os.utime(cached_path)
+        except OSError:
+            pass
+
+        return destination
+
+    def store(self, key: str, in_file: os.PathLike) -> Path:
+        """Copy a step's output into the cache, then evict down to the size limit."""
+        cached_path = self.lookup(key)
+        if cached_path is not None:
+            os.utime(cached_path)
+            return cached_path
+
+        os.makedirs(self.directory, exist_ok=True)
+        cached_path = self.directory / f"{key}{_extension(in_file)}"
+        # Copy under a temporary name first, so that concurrent runs never read a
+        #   partially written output
+        file_descriptor, temp_path = tempfile.mkstemp(
+            prefix=TEMP_PREFIX, dir=self.directory
+        )
+        os.close(file_descriptor)
+        try:
+            shutil.copyfile(in_file, temp_path)
+            os.chmod(temp_path, default_file_mode())
+            os.replace(temp_path, cached_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.evict(keep=cached_path)
+        return cached_path
+
+    def evict(self, keep: os.PathLike = None):
+        """Remove the least recently used outputs until the cache fits its limit."""
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith(TEMP_PREFIX) or path == keep:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        if keep is not None and os.path.exists(keep):
+            total_size += os.path.getsize(keep)
+
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total_size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def default_file_mode() -> int:
+    """Get the mode files are created with under the process's umask.
+
+    Files written under a temporary name from tempfile.mkstemp are readable by
+    their owner only, so they are given this mode before taking their final name.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def step_cache_keys(
+    processing_options,
+    processing_steps: list,
+    in_file: os.PathLike,
+    mask_file: os.PathLike = None,
+    confounds_file: os.PathLike = None,
+    mixing_file: os.PathLike = None,
+    noise_file: os.PathLike = None,
+    tr: float = None,
+) -> list:
+    """Calculate the cache key of each step's output in a stream.
+
+    Each key covers the key before it, so a key identifies the whole chain of
+    steps which produced an output from the input image.
+
+    Returns:
+        list: One key per processing step.
+    """
+    step_options = processing_options.processing_step_options
+    key = _hash(
+        {"image": file_fingerprint(in_file), "mask": file_fingerprint(mask_file)}
+    )
+
+    keys = []
+    for step in processing_steps:
+        inputs = {}
+        if step in STEP_OPTION_NAMES:
+            options = getattr(step_options, STEP_OPTION_NAMES[step])
+            inputs["options"] = options.to_dict()
+        if step in TR_DEPENDENT_STEPS:
+            inputs["tr"] = tr
+        if step in AROMA_DEPENDENT_STEPS or step in CONFOUND_DEPENDENT_STEPS:
+            inputs["mixing_file"] = file_fingerprint(mixing_file)
+            inputs["noise_file"] = file_fingerprint(noise_file)
+        if step in CONFOUND_DEPENDENT_STEPS:
+            inputs["confounds_file"] = file_fingerprint(confounds_file)
+            inputs["confound_options"] = processing_options.confound_options.to_dict()
+            inputs["processing_steps"] = list(processing_steps)
+            inputs["processing_step_options"] = step_options.to_dict()
+            inputs["tr"] = tr
+
+        key = _hash(
+            {"parent": key, "step": step, "inputs": inputs, "version": VERSION}
+        )
+        keys.append(key)
+
+    return keys
+
+
+def file_fingerprint(path: os.PathLike) -> list:
+    """Identify a file by its path, size and modification time."""
+    if not path:
+        return None
+    stat = os.stat(path)
+    return [os.path.realpath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def store_step_output(in_file, cache_directory: str, max_size_gb: float, key: str):
+    """Node function to save a step's output to the cache, passing it through."""
+    from clpipe.postprocutils.step_cache import StepCache
+
+    StepCache(cache_directory, max_size_gb).store(key, in_file)
+
+    return in_file
+
+
+def _hash(value) -> str:
+    encoded = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _extension(path: os.PathLike) -> str:
+    name = Path(path).name
+    return ".nii.gz" if name.endswith(".nii.gz") else Path(name).suffix
@@ -106,43 +106,31 @@ def scrub_data(data, fdts):
     return data
 
 
-def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
-    """Scrub the targets from the given image."""
-    import nibabel as nib
+def scrub_image(
+    nii_file, scrub_vector, insert_na=True, export_path=None, mask_file=None
+):
+    """Scrub the targets from the given image.
+
+    If a mask is given, only its voxels are kept, and voxels outside of it are
+    zeroed."""
     import numpy as np
     from pathlib import Path
 
     from clpipe.postprocutils.utils import get_scrub_targets
+    from clpipe.postprocutils.masked_image import MaskedImage
 
-    image = nib.load(nii_file)
-    data = image.get_fdata()
-    affine = image.affine
-    orig_shape = data.shape
-    header = image.header
-
-    # Reorganize the data to be 2D with time on X
-    data = data.reshape((np.prod(np.shape(data)[:-1]), data.shape[-1]))
-    data = np.transpose(data)
+    # Load the data as 2D with time on X
+    image = MaskedImage.load(nii_file, mask=mask_file)
+    data = image.data
 
     # Get the scrub indexes
     scrub_targets = get_scrub_targets(scrub_vector)
     if insert_na:
         # Replace scrub targets with NA
         data[scrub_targets, :] = np.nan
-        new_shape = orig_shape
     else:
         # Remove the scrub targets
         data = np.delete(data, scrub_targets, axis=0)
-        new_shape = (
-            orig_shape[0],
-            orig_shape[1],
-            orig_shape[2],
-            orig_shape[3] - len(scrub_targets),
-        )
-
-    # Swap the data back to original format
-    data = np.transpose(data)
-    data = data.reshape(new_shape)
 
     if export_path is None:
         # Crude way to figure out .nii vs .nii.gz
@@ -156,8 +144,8 @@ def scrub_image(nii_file, scrub_vector, insert_na=True, export_path=None):
     else:
         out_path = export_path
 
-    out_image = nib.Nifti1Image(data, affine, header)
-    nib.save(out_image, out_path)
+    # Keep the original header's data type
+    image.with_data(data).save(out_path, dtype=None)
 
     return out_path
 
@@ -180,13 +168,15 @@ def calc_filter(hp, lp, tr, order):
     return sos
 
 
-def apply_filter(sos, arr):
-    from scipy.signal import sosfilt
+def apply_filter(sos, arr, axis=0, zero_phase=False):
+    from scipy.signal import sosfilt, sosfiltfilt
 
     if sos is "none":
         return arr
+    elif zero_phase:
+        return sosfiltfilt(sos, arr, axis=axis)
     else:
-        toReturn = sosfilt(sos, arr, axis=0)
+        toReturn = sosfilt(sos, arr, axis=axis)
         return toReturn
 
 
@@ -272,24 +262,20 @@ def plot_image_sample(
     )
 
 
-def nii_to_matrix(nii_file, save_df=False):
-    """Transform a .nii file to a 2D, time by (x, y, z) matrix."""
-    import numpy as np
-    import nibabel as nib
-    from pathlib import Path
+def nii_to_matrix(nii_file, save_df=False, mask_file=None):
+    """Transform a .nii file to a 2D, time by (x, y, z) matrix.
 
-    nii_img = nib.load(nii_file)
-    img_data = nii_img.get_fdata()
-    orig_shape = nii_img.shape
-    affine = nii_img.affine
+    If a mask is given, the matrix holds only its voxels, and can no longer be
+    reshaped to the original shape by matrix_to_nii."""
+    from pathlib import Path
 
-    # data = data.astype(np.float32)
+    from clpipe.postprocutils.masked_image import MaskedImage
 
-    # Transform the data to time by (x, y z), a 2d array
-    img_2d_matrix = img_data.reshape(
-        (np.prod(np.shape(img_data)[:-1]), img_data.shape[-1])
-    )
-    img_2d_matrix_transposed = np.transpose(img_2d_matrix)
+    # Load the data as time by (x, y z), a 2d array
+    image = MaskedImage.load(nii_file, mask=mask_file)
+    img_2d_matrix_transposed = image.data
+    orig_shape = image.shape
+    affine = image.affine
 
     if save_df:
         import pandas as pd
@@ -379,6 +365,19 @@ def vector_to_txt(vector):
     return str(fname.resolve())
 
 
+def confounds_to_design(confounds_file):
+    """Convert a confounds TSV to a headerless design matrix txt file."""
+    from pathlib import Path
+    import pandas as pd
+
+    fname = Path("design.txt")
+
+    confounds = pd.read_csv(confounds_file, sep="\t")
+    confounds.to_csv(fname, sep=" ", header=False, index=False)
+
+    return str(fname.resolve())
+
+
 def construct_motion_outliers(scrub_targets):
     import pandas
     import numpy as np
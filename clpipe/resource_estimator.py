@@ -0,0 +1,316 @@
+"""Per-job resource estimation from image headers.
+
+Predicts the peak memory and wall time a job will need from the NIfTI headers
+of the images it processes, so that each job can request what it needs instead
+of one size for every job. Only headers are read - image data is never loaded.
+"""
+
+import math
+import os
+from pathlib import Path
+from typing import List, NamedTuple
+
+import nibabel as nib
+import nipype.pipeline.engine as pe
+from nibabel.filebasedimages import ImageFileError
+from nipype.interfaces.utility import IdentityInterface
+
+from .job_manager import MEMORY_UNITS, format_memory, format_time
+from .postprocutils.image_workflows import (
+    STEP_APPLY_MASK,
+    STEP_AROMA_REGRESSION,
+    STEP_CONFOUND_REGRESSION,
+    STEP_INTENSITY_NORMALIZATION,
+    STEP_RESAMPLE,
+    STEP_SCRUB_TIMEPOINTS,
+    STEP_SPATIAL_SMOOTHING,
+    STEP_TEMPORAL_FILTERING,
+    STEP_TRIM_TIMEPOINTS,
+)
+from .postprocutils.spatial_smoothing import SUSAN_MAX_WEIGHT_BYTES
+
+IMAGE_TIME_DIMENSION_INDEX = 3
+IMAGE_EXTENSIONS = [".nii.gz", ".nii"]
+
+STEP_ROI_EXTRACTION = "ROIExtraction"
+STEP_FEAT = "FEAT"
+
+WORKING_BYTES_PER_VALUE = 4
+"""Bytes per voxel value while processing - the native steps, FSL and AFNI work on
+float32 images."""
+STEP_WORKING_BYTES_PER_VALUE = {
+    STEP_ROI_EXTRACTION: 8,
+}
+"""Bytes per voxel value of the steps which still work in float64."""
+
+STEP_MEMORY_COPIES = {
+    STEP_TEMPORAL_FILTERING: 3,
+    STEP_INTENSITY_NORMALIZATION: 2,
+    STEP_SPATIAL_SMOOTHING: 3,
+    STEP_AROMA_REGRESSION: 3,
+    STEP_CONFOUND_REGRESSION: 3,
+    STEP_APPLY_MASK: 2,
+    STEP_TRIM_TIMEPOINTS: 2,
+    STEP_RESAMPLE: 3,
+    STEP_SCRUB_TIMEPOINTS: 2,
+    STEP_ROI_EXTRACTION: 2,
+    STEP_FEAT: 4,
+}
+"""How many working copies of an image each step holds in memory at once."""
+
+STEP_EXTRA_MEMORY = {
+    STEP_SPATIAL_SMOOTHING: SUSAN_MAX_WEIGHT_BYTES,
+}
+"""The most memory each step holds beyond its copies of the image, such as the
+weights kept by native SUSAN smoothing."""
+
+STEP_SECONDS_PER_GIGAVALUE = {
+    STEP_TEMPORAL_FILTERING: 120,
+    STEP_INTENSITY_NORMALIZATION: 30,
+    STEP_SPATIAL_SMOOTHING: 240,
+    STEP_AROMA_REGRESSION: 90,
+    STEP_CONFOUND_REGRESSION: 90,
+    STEP_APPLY_MASK: 15,
+    STEP_TRIM_TIMEPOINTS: 15,
+    STEP_RESAMPLE: 180,
+    STEP_SCRUB_TIMEPOINTS: 30,
+    STEP_ROI_EXTRACTION: 60,
+    STEP_FEAT: 1800,
+}
+"""Seconds each step takes per billion voxel values (voxels x timepoints)."""
+
+DEFAULT_STEP_MEMORY_COPIES = 3
+DEFAULT_STEP_SECONDS_PER_GIGAVALUE = 120
+
+BASE_MEMORY = 2 * MEMORY_UNITS["G"]
+"""Memory for the interpreter, nipype and any external tools, per job."""
+BASE_NODE_MEMORY_GB = 0.2
+"""Memory for a node's process, as nipype assumes by default."""
+BASE_SECONDS = 10 * 60
+"""Time for startup, workflow setup and file I/O, per job."""
+
+SAFETY_FACTOR = 1.5
+"""Headroom added to every estimate."""
+MEMORY_INCREMENT = MEMORY_UNITS["G"]
+TIME_INCREMENT = 15 * 60
+"""Estimates are rounded up to these increments so that similar jobs make the
+same request, and can still share an array job or pack."""
+
+IMAGE_WORKFLOW_NAME = "image_wf"
+"""The name of the image processing workflow within a postprocessing workflow."""
+
+
+class ResourceEstimate(NamedTuple):
+    """A job's predicted memory and time requests, in batch request format."""
+
+    mem_use: str
+    time: str
+
+
+class ImageHeaderInfo(NamedTuple):
+    """The parts of an image header needed to size a job."""
+
+    voxels: int
+    timepoints: int
+    bytes_per_value: int
+
+    @property
+    def values(self) -> int:
+        return self.voxels * self.timepoints
+
+
+def read_image_header(image_path: os.PathLike) -> ImageHeaderInfo:
+    """Read the dimensions and data type of an image, without loading its data.
+
+    Args:
+        image_path (os.PathLike): Path to a NIfTI image. If the path has no
+            extension, .nii.gz and .nii are tried, as FSL allows.
+
+    Returns:
+        ImageHeaderInfo: The image's voxel count, timepoints and value size.
+    """
+    image_path = _resolve_image_path(image_path)
+    header = nib.load(str(image_path)).header
+    shape = header.get_data_shape()
+
+    voxels = int(math.prod(shape[:IMAGE_TIME_DIMENSION_INDEX]))
+    timepoints = 1
+    if len(shape) > IMAGE_TIME_DIMENSION_INDEX:
+        timepoints = int(shape[IMAGE_TIME_DIMENSION_INDEX])
+
+    return ImageHeaderInfo(voxels, timepoints, header.get_data_dtype().itemsize)
+
+
+def estimate_resources(
+    image_paths: List[os.PathLike],
+    processing_steps: List[str],
+    logger=None,
+    parallel_images: int = 1,
+) -> ResourceEstimate:
+    """Predict the peak memory and wall time of a job.
+
+    The job is assumed to run the given steps in order on each image, with up to
+    parallel_images images in progress at once. Peak memory is set by that many of
+    the largest images under the most memory-hungry step, while time adds up
+    across images and steps.
+
+    Args:
+        image_paths (List[os.PathLike]): The images the job will process.
+        processing_steps (List[str]): The steps run on each image.
+        logger: Used to warn about unreadable headers.
+        parallel_images (int, optional): How many images the job may process at
+            once, such as a subject-level job running its images with MultiProc.
+
+    Returns:
+        ResourceEstimate: The job's requests, or None if no image header could
+            be read.
+    """
+    headers = []
+    for image_path in image_paths:
+        try:
+            headers.append(read_image_header(image_path))
+        except (FileNotFoundError, ImageFileError) as err:
+            if logger:
+                logger.warning(f"Unable to read image header for sizing: {err}")
+    if not headers:
+        return None
+
+    seconds_per_gigavalue = sum(
+        STEP_SECONDS_PER_GIGAVALUE.get(step, DEFAULT_STEP_SECONDS_PER_GIGAVALUE)
+        for step in processing_steps
+    )
+
+    image_peaks = sorted(
+        (
+            header.values * _peak_bytes_per_value(processing_steps, header)
+            for header in headers
+        ),
+        reverse=True,
+    )
+    parallel_images = min(max(int(parallel_images), 1), len(headers))
+    memory = (
+        BASE_MEMORY
+        + sum(image_peaks[:parallel_images])
+        + _extra_memory(processing_steps) * parallel_images
+    )
+    seconds = BASE_SECONDS * len(headers) + sum(
+        header.values / 1e9 * seconds_per_gigavalue for header in headers
+    )
+
+    return ResourceEstimate(
+        mem_use=format_memory(_round_up(memory * SAFETY_FACTOR, MEMORY_INCREMENT)),
+        time=format_time(_round_up(seconds * SAFETY_FACTOR, TIME_INCREMENT)),
+    )
+
+
+def declare_node_resources(
+    workflow: pe.Workflow,
+    image_path: os.PathLike,
+    processing_steps: List[str],
+    logger=None,
+    memory_limit_gb: float = None,
+):
+    """Set the memory need of each node in an image's postprocessing workflow, so
+    that nipype's MultiProc plugin can run nodes in parallel within a memory limit.
+
+    Nodes of a processing step's workflow need that step's working copies of the
+    image. Other image processing nodes, such as exports or the fused engine's
+    single node, are given the needs of the most memory-hungry step. Confound
+    processing and pass-through nodes keep nipype's default. Thread needs are
+    declared by the workflow builders.
+
+    Needs are capped at memory_limit_gb, as MultiProc refuses to run a workflow
+    with a node needing more memory than it is given. Such a node then runs alone.
+
+    Args:
+        workflow (pe.Workflow): A workflow from build_postprocessing_wf.
+        image_path (os.PathLike): The image the workflow processes.
+        processing_steps (List[str]): The workflow's processing steps.
+        logger: Used to warn about unreadable headers.
+        memory_limit_gb (float, optional): The memory MultiProc runs the workflow
+            within.
+    """
+    try:
+        header = read_image_header(image_path)
+    except (FileNotFoundError, ImageFileError) as err:
+        if logger:
+            logger.warning(f"Unable to read image header for sizing: {err}")
+        return
+
+    value_gb = header.values / MEMORY_UNITS["G"]
+    # Match longer step names first, as some step names start with others
+    step_names = sorted(STEP_MEMORY_COPIES, key=len, reverse=True)
+
+    for node, hierarchy in _iter_nodes(workflow):
+        if IMAGE_WORKFLOW_NAME not in hierarchy or isinstance(
+            node.interface, IdentityInterface
+        ):
+            continue
+        step = next(
+            (
+                step
+                for step in step_names
+                if any(name.startswith(step) for name in hierarchy)
+            ),
+            None,
+        )
+        node_steps = [step] if step else processing_steps
+        mem_gb = max(
+            node.mem_gb,
+            BASE_NODE_MEMORY_GB
+            + value_gb * _peak_bytes_per_value(node_steps, header)
+            + _extra_memory(node_steps) / MEMORY_UNITS["G"],
+        )
+        if memory_limit_gb:
+            mem_gb = min(mem_gb, memory_limit_gb)
+        node._mem_gb = mem_gb
+
+
+def _iter_nodes(workflow: pe.Workflow, hierarchy: tuple = ()):
+    """Yield each node within a workflow and its sub-workflows, along with the
+    names of the workflows containing it."""
+    hierarchy = hierarchy + (workflow.name,)
+    for item in workflow._graph.nodes():
+        if isinstance(item, pe.Workflow):
+            yield from _iter_nodes(item, hierarchy)
+        else:
+            yield item, hierarchy
+
+
+def _peak_bytes_per_value(
+    processing_steps: List[str], header: ImageHeaderInfo
+) -> int:
+    """Get the most memory taken per voxel value by any of the steps' working
+    copies of an image."""
+    return max(
+        [
+            STEP_MEMORY_COPIES.get(step, DEFAULT_STEP_MEMORY_COPIES)
+            * max(
+                header.bytes_per_value,
+                STEP_WORKING_BYTES_PER_VALUE.get(step, WORKING_BYTES_PER_VALUE),
+            )
+            for step in processing_steps
+        ],
+        default=max(header.bytes_per_value, WORKING_BYTES_PER_VALUE),
+    )
+
+
+def _extra_memory(processing_steps: List[str]) -> int:
+    return max(
+        [STEP_EXTRA_MEMORY.get(step, 0) for step in processing_steps], default=0
+    )
+
+
+def _round_up(amount, increment):
+    return math.ceil(amount / increment) * increment
+
+
+def _resolve_image_path(image_path: os.PathLike) -> Path:
+    image_path = Path(image_path)
+    if image_path.exists():
+        return image_path
+    for extension in IMAGE_EXTENSIONS:
+        candidate = Path(str(image_path) + extension)
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(f"Image not found: {image_path}")
@@ -15,9 +15,11 @@ import glob
 import shutil
 from .config.options import ProjectOptions
 from .job_manager import JobManagerFactory
+from .resource_estimator import STEP_ROI_EXTRACTION, estimate_resources
 from pkg_resources import resource_stream, resource_filename
 from .errors import MaskFileNotFoundError
 from .utils import get_logger, resolve_fmriprep_dir
+from . import scratch_staging
 from pathlib import Path
 
 STEP_NAME = "roi_extraction"
@@ -96,11 +98,27 @@ def fmri_roi_extraction(
         mem_use=config.roi_extraction.memory_usage,
         time=config.roi_extraction.time_usage,
         threads=config.roi_extraction.n_threads,
-        email=config.email_address
+        email=config.email_address,
+        array=True,
+        pack_size=config.roi_extraction.pack_size,
+        pack_parallel=config.roi_extraction.pack_parallel_jobs,
+        pack_time=config.roi_extraction.pack_time_usage,
+        registry=config.get_job_registry_path(),
+        step=STEP_NAME,
+        telemetry=config.get_telemetry_path() if config.record_telemetry else None,
     )
     
     for subject in sublist:
         logger.debug(f"Setting up ROI extraction for subject {subject}")
+        resources = {}
+        if config.roi_extraction.estimate_resources and not single:
+            estimate = estimate_resources(
+                _find_subject_images(subject, task, config, logger),
+                [STEP_ROI_EXTRACTION],
+                logger=logger,
+            )
+            if estimate:
+                resources = estimate._asdict()
         for cur_atlas in atlas_list:
             custom_flag = False
             sphere_flag = False
@@ -175,9 +193,21 @@ def fmri_roi_extraction(
                 logger.debug("Overlap ok flag set")
 
             sub_string_temp = sub_string_temp + " " + subject
+            job_name = "ROI_extract_" + subject + "_" + atlas_name
+            if config.scratch_staging and not single:
+                # Timeseries are written within scratch, then copied back
+                sub_string_temp = scratch_staging.wrap_command(
+                    sub_string_temp,
+                    job_name,
+                    config.scratch_directory,
+                    outputs=[
+                        (f"{atlas_name}/*", config.roi_extraction.output_directory)
+                    ],
+                )
             batch_manager.add_job(
-                "ROI_extract_" + subject + "_" + atlas_name, 
-                sub_string_temp
+                job_name,
+                sub_string_temp,
+                **resources,
             )
             if single:
                 _fmri_roi_extract_subject(
@@ -232,19 +262,7 @@ def _fmri_roi_extract_subject(
         atlas_labelpath = os.path.abspath(atlas_label)
     logger.debug(f"Using atlas path: {atlas_path}")
 
-    search_string = os.path.abspath(
-        os.path.join(
-            config.roi_extraction.target_directory,
-            "sub-" + subject,
-            "**",
-            "*" + config.roi_extraction.target_suffix,
-        )
-    )
-    logger.debug(search_string)
-    subject_files = glob.glob(search_string, recursive=True)
-    if task is not None:
-        logger.info(f"Checking for task {task} for subjects: {subject_files}")
-        subject_files = [x for x in subject_files if "task-" + task in x]
+    subject_files = _find_subject_images(subject, task, config, logger)
     logger.info(f"Processing subjects: {subject_files}")
 
     os.makedirs(
@@ -268,6 +286,23 @@ def _fmri_roi_extract_subject(
         )
 
 
+def _find_subject_images(subject, task, config: ProjectOptions, logger):
+    search_string = os.path.abspath(
+        os.path.join(
+            config.roi_extraction.target_directory,
+            "sub-" + subject,
+            "**",
+            "*" + config.roi_extraction.target_suffix,
+        )
+    )
+    logger.debug(search_string)
+    subject_files = glob.glob(search_string, recursive=True)
+    if task is not None:
+        logger.info(f"Checking for task {task} for subjects: {subject_files}")
+        subject_files = [x for x in subject_files if "task-" + task in x]
+    return subject_files
+
+
 def fmri_roi_extract_image(
     file,
     config: ProjectOptions,
@@ -296,6 +331,13 @@ def fmri_roi_extract_image(
         logger.info("File Exists! Skipping. Use -overwrite to reprocess.")
         return
 
+    # Within a scratch-staged job, write to scratch for the job to copy back
+    atlas_output_dir = scratch_staging.local_path(
+        os.path.join(config.roi_extraction.output_directory, atlas_name),
+        config.roi_extraction.output_directory,
+    )
+    os.makedirs(atlas_output_dir, exist_ok=True)
+
     try:
         # First, try to find this image's mask from fMRIPrep.
         mask_file = fmriprep_mask_finder(file, config, logger)
@@ -350,10 +392,7 @@ def fmri_roi_extract_image(
         # Save ROI masked threshold timeseries
         np.savetxt(
             os.path.join(
-                os.path.join(
-                    config.roi_extraction.output_directory,
-                    atlas_name,
-                ),
+                atlas_output_dir,
                 file_outname + "_atlas-" + atlas_name + "_voxel_prop.csv",
             ),
             mask_ROIs[0],
@@ -363,7 +402,7 @@ def fmri_roi_extract_image(
     # Save the ROI timeseries
     np.savetxt(
         os.path.join(
-            os.path.join(config.roi_extraction.output_directory, atlas_name),
+            atlas_output_dir,
             file_outname + "_atlas-" + atlas_name + ".csv",
         ),
         ROI_ts,
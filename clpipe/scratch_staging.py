@@ -0,0 +1,155 @@
+"""Node-local scratch staging for the jobs launched by clpipe's job builders.
+
+When scratch staging is enabled, a job's command is run through a wrapper which
+creates a private directory on node-local storage - the configured scratch
+directory, or $TMPDIR - and passes it to the command. Jobs write their working
+files there in place of shared project storage, which is slowed down for everyone
+by the small-file I/O of many concurrent jobs. Once the command exits, whether or
+not it succeeded, only the files the job declared as outputs are copied back to
+shared storage, and the scratch directory is removed.
+"""
+
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+from pathlib import Path
+
+SCRATCH_ENV_VAR = "CLPIPE_SCRATCH_DIR"
+"""Set to the job's scratch directory for the wrapped command."""
+SCRATCH_DIR_PLACEHOLDER = "@CLPIPE_SCRATCH_DIR@"
+"""Refers to the job's scratch directory within a wrapped command, and is replaced
+by run_in_scratch on the node. A shell variable would instead be expanded, to
+nothing, by the shell submitting the job."""
+CRASH_FILE_PATTERN = "**/crash-*"
+"""Matches the crash files written by nipype."""
+SCRATCH_PREFIX = "clpipe_"
+
+SCRATCH_COMMAND = "run_in_scratch -job_name={job_name}{options} {command}"
+
+
+def wrap_command(command, job_name, scratch_directory="", outputs=None) -> str:
+    """Wrap a job's command so that it runs in a node-local scratch directory.
+
+    Args:
+        command (str): The job's command.
+        job_name (str): The job's name, used to name its scratch directory.
+        scratch_directory (str, optional): Where to create the scratch directory.
+            Environment variables are expanded on the node. Defaults to $TMPDIR.
+        outputs (list, optional): (pattern, destination) pairs. Files matching
+            each glob pattern, relative to the scratch directory, are copied to
+            the same relative path within the destination.
+    """
+    options = ""
+    if scratch_directory:
+        options += f" -scratch_directory={shlex.quote(str(scratch_directory))}"
+    for pattern, destination in outputs or []:
+        options += f" -output {shlex.quote(pattern)} {shlex.quote(str(destination))}"
+
+    return SCRATCH_COMMAND.format(
+        job_name=shlex.quote(str(job_name)),
+        options=options,
+        command=shlex.quote(command),
+    )
+
+
+def run_in_scratch(command, job_name, scratch_directory="", outputs=()) -> int:
+    """Run a shell command with a new scratch directory, then copy its declared
+    outputs back and remove the directory.
+
+    The command finds its scratch directory through the CLPIPE_SCRATCH_DIR
+    environment variable, and any SCRATCH_DIR_PLACEHOLDER within the command is
+    replaced with it. The command keeps the current working directory, so that
+    relative paths in the command still resolve. Outputs are copied back even if
+    the command fails or is terminated, so that crash files are kept.
+
+    Returns:
+        int: The command's exit code.
+    """
+    scratch_root = resolve_scratch_root(scratch_directory)
+    os.makedirs(scratch_root, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(
+        prefix=f"{SCRATCH_PREFIX}{_safe_name(job_name)}_", dir=scratch_root
+    )
+
+    try:
+        process = subprocess.Popen(
+            command.replace(SCRATCH_DIR_PLACEHOLDER, scratch_dir),
+            shell=True,
+            env=dict(os.environ, **{SCRATCH_ENV_VAR: scratch_dir}),
+            start_new_session=True,
+        )
+
+        # Pass on termination, e.g. from a job reaching its time limit, to the
+        #   whole command, so that its outputs can still be copied back
+        def _terminate(signum, frame):
+            try:
+                os.killpg(process.pid, signum)
+            except ProcessLookupError:
+                pass
+
+        previous_handler = signal.signal(signal.SIGTERM, _terminate)
+        try:
+            exit_code = process.wait()
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+    finally:
+        try:
+            sync_outputs(scratch_dir, outputs)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    if exit_code < 0:
+        exit_code = 128 - exit_code
+    return exit_code
+
+
+def sync_outputs(scratch_dir: os.PathLike, outputs) -> list:
+    """Copy the files matching each output's pattern to its destination.
+
+    Returns:
+        list: The paths copied to.
+    """
+    scratch_dir = Path(scratch_dir)
+    synced = []
+    for pattern, destination in outputs:
+        for path in scratch_dir.glob(pattern):
+            if not path.is_file():
+                continue
+            target = Path(destination) / path.relative_to(scratch_dir)
+            os.makedirs(target.parent, exist_ok=True)
+            shutil.copy2(path, target)
+            synced.append(target)
+
+    return synced
+
+
+def local_path(shared_path: os.PathLike, shared_root: os.PathLike) -> Path:
+    """Get the path a job should use in place of a path on shared storage.
+
+    Within run_in_scratch, a path under shared_root maps to the same relative path
+    within the job's scratch directory, from which outputs declared with
+    shared_root as their destination are copied back. Otherwise, the path is
+    returned unchanged.
+    """
+    scratch_dir = os.environ.get(SCRATCH_ENV_VAR)
+    if not scratch_dir:
+        return Path(shared_path)
+    return Path(scratch_dir) / Path(shared_path).relative_to(shared_root)
+
+
+def resolve_scratch_root(scratch_directory: str = "") -> str:
+    """Get the directory to create scratch directories in - the given directory,
+    with environment variables expanded, or $TMPDIR."""
+    if scratch_directory:
+        return os.path.expandvars(os.path.expanduser(scratch_directory))
+    return os.environ.get("TMPDIR") or tempfile.gettempdir()
+
+
+def _safe_name(job_name: str) -> str:
+    return "".join(
+        character if character.isalnum() or character in "-_" else "_"
+        for character in str(job_name)
+    )
@@ -0,0 +1,109 @@
+"""Pacing of batch job submissions.
+
+Limits how quickly jobs are handed to the batch system and how many are queued
+at once, so that large submissions neither overload the scheduler's controller
+nor run into per-user queue limits.
+"""
+
+import getpass
+import re
+import shlex
+import subprocess
+import threading
+import time
+
+QUEUED_JOB_PATTERN = re.compile(r"^\s*\d")
+"""Matches the lines of a queue listing which describe a job."""
+
+
+class RateLimiter:
+    """Spaces out events so that no more than a given number start per second."""
+
+    def __init__(self, per_second=0):
+        self.interval = 1.0 / per_second if per_second else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next event may start."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class QueueLimiter:
+    """Holds submissions until the batch queue has room for them.
+
+    The number of queued jobs is counted with the batch system's queue listing
+    when there may not be room, and tracked locally in between.
+    """
+
+    def __init__(
+        self,
+        max_queued=0,
+        queued_jobs_command=None,
+        poll_interval=60.0,
+        logger=None,
+    ):
+        self.max_queued = max_queued
+        self.queued_jobs_command = queued_jobs_command
+        self.poll_interval = poll_interval
+        self.logger = logger
+        self._queued = None
+        self._lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Block until there is room in the queue for count more jobs.
+
+        A submission larger than the limit is let through once the queue is
+        empty, rather than held forever.
+        """
+        if not self.max_queued:
+            return
+        with self._lock:
+            if self._queued is None:
+                self._queued = self.count_queued()
+            held = False
+            while self._queued and self._queued + count > self.max_queued:
+                if not held and self.logger:
+                    self.logger.info(
+                        f"Queue is at its limit of {self.max_queued} job(s) - "
+                        "holding submissions until queued jobs finish."
+                    )
+                held = True
+                time.sleep(self.poll_interval)
+                self._queued = self.count_queued()
+            self._queued += count
+
+    def release(self, count=1):
+        """Return room taken by a submission which did not go through."""
+        if not self.max_queued:
+            return
+        with self._lock:
+            self._queued = max(self._queued - count, 0)
+
+    def count_queued(self) -> int:
+        """Count your queued jobs, or return 0 if they can't be listed."""
+        command = self.queued_jobs_command.format(user=getpass.getuser())
+        try:
+            result = subprocess.run(
+                shlex.split(command), capture_output=True, text=True
+            )
+        except OSError as e:
+            result = None
+            error = str(e)
+        else:
+            error = result.stderr.strip()
+        if result is None or result.returncode != 0:
+            if self.logger:
+                self.logger.warning(f"Unable to count queued jobs: {error}")
+            return 0
+
+        return sum(
+            1 for line in result.stdout.splitlines() if QUEUED_JOB_PATTERN.match(line)
+        )
@@ -0,0 +1,142 @@
+import os
+
+import nibabel as nib
+import numpy as np
+from scipy.signal import sosfilt, sosfiltfilt
+
+from clpipe.postprocutils.chunked_filter import *
+from clpipe.postprocutils.nodes import ButterworthFilter
+from clpipe.postprocutils.utils import calc_filter
+
+
+def _reference_filter(image_path, sos, zero_phase=False):
+    data = nib.load(image_path).get_fdata()
+    if zero_phase:
+        return sosfiltfilt(sos, data, axis=-1)
+    return sosfilt(sos, data, axis=-1)
+
+
+def test_filter_image_in_chunks(scatch_dir, sample_raw_image):
+    sos = calc_filter(0.01, 0.1, 2, 2)
+    out_path = scatch_dir / "filtered.nii.gz"
+
+    # Five slices per slab, filtered two slabs at a time
+    filter_image_in_chunks(
+        sos, sample_raw_image, out_path, chunk_size=64 * 64 * 5, n_threads=2
+    )
+
+    filtered = nib.load(out_path)
+    assert filtered.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(
+        filtered.affine, nib.load(sample_raw_image).affine
+    )
+    np.testing.assert_allclose(
+        filtered.get_fdata(),
+        _reference_filter(sample_raw_image, sos),
+        rtol=1e-4,
+        atol=1e-2,
+    )
+
+
+def test_filter_image_in_chunks_zero_phase(scatch_dir, sample_raw_image):
+    sos = calc_filter(0.01, -1, 2, 2)
+    out_path = scatch_dir / "filtered.nii"
+
+    filter_image_in_chunks(
+        sos, sample_raw_image, out_path, chunk_size=1, zero_phase=True
+    )
+
+    np.testing.assert_allclose(
+        nib.load(out_path).get_fdata(),
+        _reference_filter(sample_raw_image, sos, zero_phase=True),
+        rtol=1e-4,
+        atol=1e-2,
+    )
+
+
+def test_filter_image_in_chunks_decompresses_once(
+    scatch_dir, sample_raw_image, monkeypatch
+):
+    from nibabel.openers import Opener
+
+    sos = calc_filter(0.01, 0.1, 2, 2)
+    out_dir = scatch_dir / "filtered"
+    out_dir.mkdir()
+    compressed_opens = []
+    original_init = Opener.__init__
+
+    def counting_init(self, fileish, *args, **kwargs):
+        if str(fileish).endswith(".gz"):
+            compressed_opens.append(fileish)
+        original_init(self, fileish, *args, **kwargs)
+
+    monkeypatch.setattr(Opener, "__init__", counting_init)
+    nib.load(sample_raw_image)
+    header_opens = len(compressed_opens)
+    compressed_opens.clear()
+    # One slice per slab
+    filter_image_in_chunks(sos, sample_raw_image, out_dir / "filtered.nii", 1)
+    monkeypatch.setattr(Opener, "__init__", original_init)
+
+    # Past reading its header, the input is not reopened for each slab
+    assert len(compressed_opens) == header_opens
+    assert os.listdir(out_dir) == ["filtered.nii"]
+    np.testing.assert_allclose(
+        nib.load(out_dir / "filtered.nii").get_fdata(),
+        _reference_filter(sample_raw_image, sos),
+        rtol=1e-4,
+        atol=1e-2,
+    )
+
+
+def test_filter_in_blocks():
+    data = np.random.default_rng(0).normal(size=(80, 25)).astype(np.float32)
+    sos = calc_filter(0.01, 0.1, 2, 2)
+    expected = sosfilt(sos, data.astype(np.float64), axis=0)
+
+    filtered = filter_in_blocks(sos, data, chunk_size=7, n_threads=3)
+
+    assert filtered is data
+    assert filtered.dtype == np.float32
+    np.testing.assert_allclose(filtered, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_butterworth_node_chunked(scatch_dir, sample_raw_image):
+    in_memory_path = scatch_dir / "in_memory.nii.gz"
+    chunked_path = scatch_dir / "chunked.nii.gz"
+    options = dict(hp=0.01, lp=-1, tr=2, order=2, in_file=sample_raw_image)
+
+    ButterworthFilter(out_file=str(in_memory_path), **options).run()
+    ButterworthFilter(
+        out_file=str(chunked_path), chunk_size=64 * 64 * 8, n_threads=2, **options
+    ).run()
+
+    np.testing.assert_allclose(
+        nib.load(chunked_path).get_fdata(),
+        nib.load(in_memory_path).get_fdata(),
+        rtol=1e-5,
+        atol=1e-4,
+    )
+
+
+def test_butterworth_node_masked(scatch_dir, sample_raw_image, sample_raw_image_mask):
+    unmasked_path = scatch_dir / "unmasked.nii.gz"
+    options = dict(hp=0.01, lp=-1, tr=2, order=2, in_file=sample_raw_image)
+    ButterworthFilter(out_file=str(unmasked_path), **options).run()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    unmasked = nib.load(unmasked_path).get_fdata()
+
+    for chunk_size in (0, 64 * 64 * 8):
+        masked_path = scatch_dir / f"masked_{chunk_size}.nii.gz"
+        ButterworthFilter(
+            out_file=str(masked_path),
+            mask_file=sample_raw_image_mask,
+            chunk_size=chunk_size,
+            **options,
+        ).run()
+
+        masked = nib.load(masked_path).get_fdata()
+        assert not masked[~mask].any()
+        np.testing.assert_allclose(
+            masked[mask], unmasked[mask], rtol=1e-5, atol=1e-4
+        )
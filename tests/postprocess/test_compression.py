@@ -0,0 +1,86 @@
+import gzip
+import shutil
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from clpipe.config.options import ProjectOptions
+from clpipe.postprocutils.compression import *
+from clpipe.postprocutils.step_cache import default_file_mode
+from clpipe.postprocutils.image_workflows import build_image_postprocessing_workflow
+
+
+@pytest.fixture()
+def uncompressed_image(scatch_dir, sample_raw_image):
+    image_path = scatch_dir / "sample_raw.nii"
+    nib.save(nib.load(sample_raw_image), image_path)
+    return image_path
+
+
+def test_parallel_gzip_round_trip(scatch_dir, uncompressed_image):
+    out_path = scatch_dir / "compressed.nii.gz"
+
+    # Small blocks give many gzip members, compressed out of order
+    parallel_gzip(uncompressed_image, out_path, n_threads=4, block_size=64 * 1024)
+
+    assert is_gzipped(out_path)
+    assert out_path.stat().st_mode & 0o777 == default_file_mode()
+    with gzip.open(out_path, "rb") as compressed:
+        assert compressed.read() == uncompressed_image.read_bytes()
+    np.testing.assert_array_equal(
+        nib.load(out_path).get_fdata(), nib.load(uncompressed_image).get_fdata()
+    )
+
+
+def test_export_image_matches_extension(
+    scatch_dir, sample_raw_image, uncompressed_image
+):
+    compressed_path = export_image(
+        uncompressed_image, scatch_dir / "export.nii.gz", n_threads=2
+    )
+    decompressed_path = export_image(sample_raw_image, scatch_dir / "export.nii")
+    copied_path = export_image(sample_raw_image, scatch_dir / "copied.nii.gz")
+
+    assert is_gzipped(compressed_path)
+    assert not is_gzipped(decompressed_path)
+    assert is_gzipped(copied_path)
+    for path in (compressed_path, decompressed_path, copied_path):
+        np.testing.assert_array_equal(
+            nib.load(path).get_fdata(), nib.load(sample_raw_image).get_fdata()
+        )
+
+
+def test_intermediate_extension_unknown_format():
+    assert intermediate_extension("NIFTI") == ".nii"
+    with pytest.raises(ValueError):
+        intermediate_extension("MINC")
+
+
+def test_image_wf_uncompressed_intermediates(
+    scatch_dir, sample_raw_image, sample_raw_image_mask
+):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = [
+        "TrimTimepoints",
+        "IntensityNormalization",
+    ]
+    step_options = postprocessing_config.processing_step_options
+    step_options.intensity_normalization.implementation = "10000_GlobalMedian_numpy"
+    out_path = scatch_dir / "postprocessed.nii.gz"
+
+    wf = build_image_postprocessing_workflow(
+        postprocessing_config,
+        in_file=sample_raw_image,
+        export_path=out_path,
+        mask_file=sample_raw_image_mask,
+        tr=2,
+        base_dir=scatch_dir,
+        crashdump_dir=scatch_dir,
+    )
+    wf.run()
+
+    intermediates = [path.name for path in scatch_dir.rglob("*_normalized.nii*")]
+    assert intermediates == ["sample_raw_sliced_normalized.nii"]
+    assert is_gzipped(out_path)
+    assert nib.load(out_path).shape[-1] == nib.load(sample_raw_image).shape[-1]
@@ -75,6 +75,32 @@ def test_build_confounds_processing_workflow_aroma_regression(
     wf.run()
 
 
+def test_confounds_aroma_regression_keeps_image_implementation(
+    sample_confounds_timeseries, sample_melodic_mixing, sample_aroma_noise_ics
+):
+    """Check that confounds use the native regfilt without changing the options
+    the image workflow is built from."""
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["AROMARegression"]
+
+    wf = build_confounds_processing_workflow(
+        postprocessing_config,
+        confounds_file=sample_confounds_timeseries,
+        tr=2,
+        mixing_file=sample_melodic_mixing,
+        noise_file=sample_aroma_noise_ics,
+    )
+
+    assert (
+        postprocessing_config.processing_step_options.aroma_regression.implementation
+        == IMPLEMENTATION_FSL_REGFILT
+    )
+    assert any(
+        IMPLEMENTATION_NUMPY in node_name for node_name in wf.list_node_names()
+    )
+
+
 def test_build_confounds_processing_workflow_2_steps_no_scrub(
     artifact_dir,
     sample_confounds_timeseries,
@@ -0,0 +1,305 @@
+import pytest
+import nibabel as nib
+import numpy as np
+from scipy.signal import sosfilt
+
+from clpipe.config.options import ProjectOptions
+from clpipe.errors import ImplementationNotFoundError
+from clpipe.postprocutils.fused_engine import *
+from clpipe.postprocutils.confound_regression import bandstop_basis, filter_and_regress
+from clpipe.postprocutils.global_workflows import build_postprocessing_wf
+from clpipe.postprocutils.nodes import ImageSlice, SpatialSmooth
+from clpipe.postprocutils.utils import calc_filter, scrub_image
+
+
+def test_fused_trim_matches_nipype(scatch_dir, sample_raw_image):
+    nipype_path = scatch_dir / "trimmed_nipype.nii.gz"
+    fused_path = scatch_dir / "trimmed_fused.nii.gz"
+    ImageSlice(
+        in_file=sample_raw_image,
+        out_file=str(nipype_path),
+        trim_from_beginning=2,
+        trim_from_end=3,
+    ).run()
+
+    plan = [{"step": "TrimTimepoints", "from_beginning": 2, "from_end": 3}]
+    run_fused_plan(sample_raw_image, plan, out_file=fused_path)
+
+    np.testing.assert_allclose(
+        nib.load(fused_path).get_fdata(), nib.load(nipype_path).get_fdata(), rtol=1e-6
+    )
+
+
+def test_fused_scrub_matches_nipype(scatch_dir, sample_raw_image):
+    timepoints = nib.load(sample_raw_image).shape[-1]
+    scrub_vector = [0] * timepoints
+    scrub_vector[1] = scrub_vector[4] = 1
+    nipype_path = scrub_image(
+        sample_raw_image,
+        scrub_vector,
+        insert_na=False,
+        export_path=str(scatch_dir / "scrubbed_nipype.nii.gz"),
+    )
+
+    plan = [{"step": "ScrubTimepoints", "insert_na": False}]
+    fused_path = run_fused_plan(
+        sample_raw_image,
+        plan,
+        out_file=scatch_dir / "scrubbed_fused.nii.gz",
+        scrub_vector=scrub_vector,
+    )
+
+    np.testing.assert_allclose(
+        nib.load(fused_path).get_fdata(), nib.load(nipype_path).get_fdata(), rtol=1e-5
+    )
+
+
+def test_butterworth_filter_along_time():
+    data = np.random.default_rng(0).normal(size=(50, 8))
+    sos = calc_filter(0.01, 0.1, 2, 2)
+
+    filtered = butterworth_filter(data.copy(), hp=0.01, lp=0.1, tr=2, order=2)
+
+    np.testing.assert_allclose(filtered[:, 3], sosfilt(sos, data[:, 3]))
+
+
+def test_regress_confounds_keeps_mean():
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(60, 3))
+    noise = rng.normal(scale=0.1, size=(60, 4))
+    data = 100 + (confounds @ np.array([5.0, -2.0, 1.0]))[:, np.newaxis] + noise
+    voxels = np.array([True, True, True, False])
+
+    regressed = regress_confounds(data.copy(), confounds, voxels=voxels)
+
+    design = np.column_stack([np.ones(60), confounds])
+    timeseries = data[:, 0]
+    betas = np.linalg.lstsq(design, timeseries, rcond=None)[0]
+    expected = timeseries - (confounds - confounds.mean(axis=0)) @ betas[1:]
+    np.testing.assert_allclose(regressed[:, 0], expected)
+    # Unselected voxels are left at their mean
+    np.testing.assert_allclose(regressed[:, 3], data[:, 3].mean())
+
+
+def test_regress_confounds_skips_scrubbed_timepoints():
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(30, 2))
+    data = 10 + (confounds @ np.array([1.0, 2.0]))[:, np.newaxis]
+    data = data + rng.normal(size=(30, 3))
+    data[5] = np.nan
+    confounds[5] = np.nan
+
+    regressed = regress_confounds(data, confounds)
+
+    assert np.isnan(regressed[5]).all()
+    assert np.isfinite(np.delete(regressed, 5, axis=0)).all()
+
+
+def test_global_median_normalize():
+    data = np.array([[0.0, 1.0], [2.0, 3.0]])
+
+    normalized = global_median_normalize(data)
+
+    np.testing.assert_allclose(normalized, [[0, 5000], [10000, 15000]])
+
+
+def test_global_median_normalize_no_values():
+    data = np.array([[0.0, np.nan], [0.0, 1.0]])
+
+    # Only the selected voxel's values count, and it has none
+    with pytest.raises(ValueError):
+        global_median_normalize(data, voxels=np.array([True, False]))
+    with pytest.raises(ValueError):
+        global_median_normalize(np.array([[-1.0, 1.0]]))
+
+
+def test_fused_plan_unsupported_implementation():
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = ["TemporalFiltering"]
+    postprocessing_config.processing_step_options.temporal_filtering.implementation = (
+        "fslmaths"
+    )
+
+    with pytest.raises(ImplementationNotFoundError):
+        build_fused_plan(
+            postprocessing_config, postprocessing_config.processing_steps, tr=2
+        )
+
+
+def test_build_postprocessing_wf_fused(
+    scatch_dir,
+    sample_raw_image,
+    sample_raw_image_mask,
+    sample_confounds_timeseries,
+):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.engine = ENGINE_FUSED
+    postprocessing_config.processing_steps = [
+        "TrimTimepoints",
+        "ConfoundRegression",
+        "IntensityNormalization",
+        "ApplyMask",
+    ]
+    out_path = scatch_dir / "postprocessed_image.nii.gz"
+
+    wf = build_postprocessing_wf(
+        postprocessing_config,
+        image_file=sample_raw_image,
+        image_export_path=out_path,
+        tr=2,
+        mask_file=sample_raw_image_mask,
+        confounds_file=sample_confounds_timeseries,
+        confounds_export_path=scatch_dir / "postprocessed_confounds.tsv",
+        base_dir=scatch_dir,
+        crashdump_dir=scatch_dir,
+    )
+    wf.run()
+
+    image = nib.load(out_path)
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    trim = postprocessing_config.processing_step_options.trim_timepoints
+    assert image.shape[-1] == (
+        nib.load(sample_raw_image).shape[-1] - trim.from_beginning - trim.from_end
+    )
+    assert np.all(image.get_fdata()[~mask] == 0)
+    np.testing.assert_allclose(np.median(image.get_fdata()[mask]), 10000, rtol=0.05)
+
+
+def test_regress_confounds_drops_dependent_confounds():
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(40, 2))
+    # A constant and a duplicated column add nothing to the fit
+    confounds = np.column_stack([confounds, confounds[:, 0] * 2, np.ones(40)])
+    data = 50 + rng.normal(size=(40, 5)).astype(np.float32)
+    expected = regress_confounds(data.astype(np.float64), confounds[:, :2])
+
+    regressed = regress_confounds(data, confounds, n_threads=2)
+
+    assert regressed.dtype == np.float32
+    np.testing.assert_allclose(regressed, expected, rtol=1e-5)
+
+
+def test_fused_smoothing_matches_nipype(
+    scatch_dir, sample_raw_image, sample_raw_image_mask
+):
+    nipype_path = scatch_dir / "smoothed_nipype.nii.gz"
+    SpatialSmooth(
+        in_file=sample_raw_image,
+        out_file=str(nipype_path),
+        fwhm=6,
+        mask_file=sample_raw_image_mask,
+    ).run()
+
+    plan = [{"step": "SpatialSmoothing", "method": "susan", "fwhm": 6, "n_threads": 2}]
+    fused_path = run_fused_plan(
+        sample_raw_image,
+        plan,
+        out_file=scatch_dir / "smoothed_fused.nii.gz",
+        mask_file=sample_raw_image_mask,
+    )
+
+    np.testing.assert_allclose(
+        nib.load(fused_path).get_fdata(),
+        nib.load(nipype_path).get_fdata(),
+        rtol=1e-5,
+        atol=1e-3,
+    )
+
+
+@pytest.mark.parametrize(
+    "basis, wave",
+    [
+        ("sincos", lambda t, hz: np.sin(2 * np.pi * hz * t * 2)),
+        # Discrete cosines are sampled half a timepoint in
+        ("dct", lambda t, hz: np.cos(2 * np.pi * hz * (t + 0.5) * 2)),
+    ],
+)
+def test_bandstop_basis_removes_stopped_frequencies(basis, wave):
+    timepoints = np.arange(100)
+    slow = wave(timepoints, 0.005)
+    passed = wave(timepoints, 0.05)
+    fast = wave(timepoints, 0.2)
+    data = np.column_stack([slow, passed, fast + passed]) + 100
+
+    filtered = filter_and_regress(data, np.empty((100, 0)), 2, 0.01, 0.1, basis=basis)
+
+    np.testing.assert_allclose(filtered[:, 0], 100, atol=1e-8)
+    np.testing.assert_allclose(filtered[:, 1], passed + 100, atol=1e-8)
+    np.testing.assert_allclose(filtered[:, 2], passed + 100, atol=1e-8)
+
+
+def test_filter_and_regress_matches_lstsq():
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(60, 3))
+    data = 50 + rng.normal(size=(60, 8))
+    design = np.column_stack([confounds, bandstop_basis(60, 2, 0.01, 0.1, "dct")])
+    design = np.column_stack([np.ones(60), design - design.mean(axis=0)])
+    beta = np.linalg.lstsq(design, data, rcond=None)[0]
+    expected = data - design[:, 1:] @ beta[1:]
+
+    processed = filter_and_regress(
+        data.copy(), confounds, 2, 0.01, 0.1, basis="dct", n_threads=2
+    )
+
+    np.testing.assert_allclose(processed, expected, atol=1e-8)
+
+
+def test_filter_and_regress_censored():
+    rng = np.random.default_rng(0)
+    confounds = rng.normal(size=(60, 3))
+    data = 50 + rng.normal(size=(60, 8))
+    data[[10, 11, 40]] += 20
+    censored = np.zeros(60, dtype=bool)
+    censored[[10, 11, 40]] = True
+    design = np.column_stack([confounds, bandstop_basis(60, 2, 0.01, -1)])
+    # The kept mean is the mean over the fitted timepoints
+    design = design - design[~censored].mean(axis=0)
+    design = np.column_stack([np.ones(60), design])
+    beta = np.linalg.lstsq(design[~censored], data[~censored], rcond=None)[0]
+    expected = data - design[:, 1:] @ beta[1:]
+
+    processed = filter_and_regress(
+        data.copy(), confounds, 2, 0.01, -1, censored=censored
+    )
+
+    np.testing.assert_allclose(processed, expected, atol=1e-8)
+
+
+def test_build_postprocessing_wf_fused_filter_regress_censored(
+    scatch_dir,
+    sample_raw_image,
+    sample_raw_image_mask,
+    sample_confounds_timeseries,
+):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.engine = ENGINE_FUSED
+    postprocessing_config.processing_steps = [
+        "TemporalFilteringConfoundRegression",
+        "ScrubTimepoints",
+        "ApplyMask",
+    ]
+    step_options = postprocessing_config.processing_step_options
+    step_options.temporal_filtering.filtering_low_pass = 0.1
+    step_options.temporal_filtering_confound_regression.censor = True
+    step_options.scrub_timepoints.scrub_columns[0].target_variable = "csf"
+    step_options.scrub_timepoints.scrub_columns[0].threshold = 332.44
+    out_path = scatch_dir / "postprocessed_image.nii.gz"
+
+    wf = build_postprocessing_wf(
+        postprocessing_config,
+        image_file=sample_raw_image,
+        image_export_path=out_path,
+        tr=2,
+        mask_file=sample_raw_image_mask,
+        confounds_file=sample_confounds_timeseries,
+        confounds_export_path=scatch_dir / "postprocessed_confounds.tsv",
+        base_dir=scatch_dir,
+        crashdump_dir=scatch_dir,
+    )
+    wf.run()
+
+    image = nib.load(out_path).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    assert image.shape[-1] == nib.load(sample_raw_image).shape[-1]
+    assert np.isnan(image[mask]).any(axis=0).any()
+    assert np.all(image[~mask] == 0)
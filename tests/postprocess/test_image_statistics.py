@@ -0,0 +1,125 @@
+import os
+import shutil
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from clpipe.postprocutils.image_statistics import *
+from clpipe.postprocutils.nodes import ComputeImageStatistics
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_image_statistics_cache()
+    yield
+    clear_image_statistics_cache()
+
+
+def test_image_statistics_from_file(
+    sample_raw_image, sample_raw_image_mask, monkeypatch
+):
+    import clpipe.postprocutils.image_statistics as image_statistics
+
+    monkeypatch.setattr(image_statistics, "LOAD_CHUNK_VOLUMES", 3)
+    statistics = ImageStatistics.from_file(sample_raw_image, sample_raw_image_mask)
+    raw = nib.load(sample_raw_image).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    values = raw[mask]
+    values = values[values != 0]
+
+    np.testing.assert_allclose(statistics.temporal_mean, raw.mean(axis=3), rtol=1e-5)
+    assert statistics.p2 == pytest.approx(np.percentile(values, 2), rel=1e-5)
+    assert statistics.median == pytest.approx(np.median(values), rel=1e-5)
+
+
+def test_image_statistics_from_file_opens_once(sample_raw_image, monkeypatch):
+    import clpipe.postprocutils.image_statistics as image_statistics
+    from nibabel.openers import Opener
+
+    opened = []
+    original_init = Opener.__init__
+
+    def counting_init(self, fileish, *args, **kwargs):
+        opened.append(fileish)
+        original_init(self, fileish, *args, **kwargs)
+
+    def count_opens(chunk_volumes):
+        opened.clear()
+        monkeypatch.setattr(image_statistics, "LOAD_CHUNK_VOLUMES", chunk_volumes)
+        ImageStatistics.from_file(sample_raw_image)
+        return len(opened)
+
+    monkeypatch.setattr(Opener, "__init__", counting_init)
+    single_read_opens = count_opens(32)
+    chunked_opens = count_opens(2)
+    monkeypatch.setattr(Opener, "__init__", original_init)
+
+    assert chunked_opens == single_read_opens
+
+
+def test_image_statistics_mean_only(sample_raw_image):
+    statistics = ImageStatistics.from_file(sample_raw_image, percentiles=False)
+
+    assert not statistics.has_percentiles
+    assert statistics.temporal_mean.shape == nib.load(sample_raw_image).shape[:3]
+
+
+def test_image_statistics_mean_file(scatch_dir, sample_raw_image):
+    statistics = ImageStatistics.from_file(sample_raw_image, percentiles=False)
+
+    mean_file = statistics.mean_file(scatch_dir)
+
+    assert statistics.mean_file(scatch_dir / "elsewhere") == mean_file
+    mean_image = nib.load(mean_file)
+    np.testing.assert_array_equal(mean_image.affine, nib.load(sample_raw_image).affine)
+    np.testing.assert_allclose(mean_image.get_fdata(), statistics.temporal_mean)
+
+
+def test_get_image_statistics_cached(scatch_dir, sample_raw_image):
+    image_path = scatch_dir / "cached.nii.gz"
+    shutil.copy(sample_raw_image, image_path)
+
+    statistics = get_image_statistics(image_path)
+
+    assert get_image_statistics(image_path) is statistics
+    assert get_image_statistics(image_path, percentiles=False) is statistics
+
+    # A rewritten image is recomputed
+    stat = os.stat(image_path)
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert get_image_statistics(image_path) is not statistics
+
+
+def test_get_image_statistics_adds_percentiles(sample_raw_image):
+    mean_only = get_image_statistics(sample_raw_image, percentiles=False)
+
+    statistics = get_image_statistics(sample_raw_image)
+
+    assert statistics is not mean_only
+    assert statistics.has_percentiles
+    assert get_image_statistics(sample_raw_image, percentiles=False) is statistics
+
+
+def test_get_image_statistics_keyed_by_mask(sample_raw_image, sample_raw_image_mask):
+    unmasked = get_image_statistics(sample_raw_image)
+
+    masked = get_image_statistics(sample_raw_image, sample_raw_image_mask)
+
+    assert masked is not unmasked
+
+
+def test_compute_image_statistics_node(
+    scatch_dir, sample_raw_image, sample_raw_image_mask, monkeypatch
+):
+    node = ComputeImageStatistics(
+        in_file=sample_raw_image, mask_file=sample_raw_image_mask
+    )
+    monkeypatch.chdir(scatch_dir)
+
+    outputs = node.run().outputs
+    statistics = get_image_statistics(sample_raw_image, sample_raw_image_mask)
+
+    assert os.path.exists(outputs.mean_file)
+    assert outputs.p2 == statistics.p2
+    assert outputs.median == statistics.median
@@ -1,4 +1,7 @@
 import pytest
+import nibabel as nib
+import numpy as np
+import pandas as pd
 
 from clpipe.postprocutils.image_workflows import *
 from clpipe.postprocutils.confounds_workflows import build_confounds_processing_workflow
@@ -72,6 +75,25 @@ def test_calculate_100_voxel_mean_wf(
     assert True
 
 
+def test_calculate_100_voxel_mean_numpy_wf(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, request, helpers
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    out_path = test_path / "normalized_100vm.nii.gz"
+    wf = build_100_voxel_mean_numpy_workflow(
+        in_file=sample_raw_image,
+        out_file=out_path,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    normalized = nib.load(out_path).get_fdata()
+    np.testing.assert_allclose(normalized[mask].mean(axis=1), 100, rtol=1e-4)
+
+
 def test_calculate_10000_global_median_wf(
     artifact_dir,
     sample_raw_image,
@@ -107,6 +129,31 @@ def test_calculate_10000_global_median_wf(
     assert True
 
 
+def test_calculate_10000_global_median_numpy_wf(
+    artifact_dir, sample_raw_image, sample_raw_image_mask, request, helpers
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    out_path = test_path / "normalized_10000gm.nii.gz"
+    wf = build_10000_global_median_numpy_workflow(
+        in_file=sample_raw_image,
+        out_file=out_path,
+        mask_file=sample_raw_image_mask,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    raw = nib.load(sample_raw_image).get_fdata()
+    normalized = nib.load(out_path).get_fdata()
+    in_mask = normalized[mask]
+    np.testing.assert_allclose(np.median(in_mask[in_mask != 0]), 10000, rtol=1e-4)
+    np.testing.assert_allclose(
+        normalized, raw * (10000 / np.median(raw[mask][raw[mask] != 0])), rtol=1e-5
+    )
+
+
 def test_butterworth_filter_wf(
     artifact_dir, sample_raw_image, plot_img, write_graph, request, helpers
 ):
@@ -234,7 +281,6 @@ class TestWorkflows:
         self.plot_img = plot_img
 
 
-@pytest.mark.skip(reason="Needs to be fixed but not prioritized")
 def test_confound_regression_fsl_glm_wf(
     artifact_dir,
     sample_raw_image,
@@ -250,7 +296,7 @@ def test_confound_regression_fsl_glm_wf(
     regressed_path = test_path / "sample_raw_regressed.nii"
 
     wf = build_confound_regression_fsl_glm_workflow(
-        confound_file=sample_postprocessed_confounds,
+        confounds_file=sample_postprocessed_confounds,
         in_file=sample_raw_image,
         out_file=regressed_path,
         mask_file=sample_raw_image_mask,
@@ -299,6 +345,113 @@ def test_confound_regression_afni_3dTproject_wf(
         helpers.plot_4D_img_slice(regressed_path, "regressed.png")
 
 
+def test_confound_regression_numpy_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_postprocessed_confounds,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    regressed_path = test_path / "sample_raw_regressed.nii.gz"
+
+    wf = build_confound_regression_numpy_workflow(
+        confounds_file=sample_postprocessed_confounds,
+        in_file=sample_raw_image,
+        out_file=regressed_path,
+        mask_file=sample_raw_image_mask,
+        n_threads=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    raw = nib.load(sample_raw_image).get_fdata()[mask]
+    regressed = nib.load(regressed_path).get_fdata()[mask]
+    confounds = pd.read_csv(sample_postprocessed_confounds, sep="\t").to_numpy()
+    confounds = confounds - confounds.mean(axis=0)
+
+    np.testing.assert_allclose(regressed.mean(axis=1), raw.mean(axis=1), rtol=1e-4)
+    residuals = regressed - regressed.mean(axis=1, keepdims=True)
+    assert np.abs(residuals @ confounds).max() < 1e-2 * np.abs(raw @ confounds).max()
+
+
+def test_temporal_filtering_confound_regression_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_postprocessed_confounds,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    out_path = test_path / "sample_raw_filtered_regressed.nii.gz"
+
+    wf = build_temporal_filtering_confound_regression_workflow(
+        hp=0.01,
+        lp=0.1,
+        tr=2,
+        confounds_file=sample_postprocessed_confounds,
+        in_file=sample_raw_image,
+        out_file=out_path,
+        scrub_vector=[0, 0, 1, 0, 0, 0, 0, 0, 0, 0],
+        mask_file=sample_raw_image_mask,
+        n_threads=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    raw = nib.load(sample_raw_image).get_fdata()[mask]
+    processed = nib.load(out_path).get_fdata()[mask]
+
+    assert processed.shape == raw.shape
+    assert not np.isnan(processed).any()
+    assert not np.allclose(processed, raw)
+
+
+def test_apply_aroma_numpy_wf(
+    artifact_dir,
+    sample_raw_image,
+    sample_melodic_mixing,
+    sample_aroma_noise_ics,
+    sample_raw_image_mask,
+    request,
+    helpers,
+):
+    test_path = helpers.create_test_dir(artifact_dir, request.node.name)
+
+    regressed_path = test_path / "sample_raw_aroma.nii.gz"
+
+    wf = build_aroma_workflow_numpy(
+        mixing_file=sample_melodic_mixing,
+        noise_file=sample_aroma_noise_ics,
+        in_file=sample_raw_image,
+        out_file=regressed_path,
+        mask_file=sample_raw_image_mask,
+        n_threads=2,
+        base_dir=test_path,
+        crashdump_dir=test_path,
+    )
+    wf.run()
+
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    raw = nib.load(sample_raw_image).get_fdata()
+    regressed = nib.load(regressed_path).get_fdata()
+    mixing = np.loadtxt(sample_melodic_mixing)
+    noise_ics = np.loadtxt(sample_aroma_noise_ics, delimiter=",", dtype=int) - 1
+
+    betas = np.linalg.lstsq(mixing, raw[mask].T, rcond=None)[0]
+    expected = raw[mask] - (mixing[:, noise_ics] @ betas[noise_ics]).T
+    np.testing.assert_allclose(regressed[mask], expected, rtol=1e-3, atol=1e-1)
+    np.testing.assert_allclose(regressed[~mask], raw[~mask])
+
+
 def test_apply_aroma_fsl_regfilt_wf(
     artifact_dir,
     sample_raw_image,
@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import pytest
+
+from clpipe.config.options import ProjectOptions
+from clpipe.postprocutils.manifest import *
+from clpipe.postprocutils.step_cache import default_file_mode
+
+
+@pytest.fixture()
+def recorded_manifest(scatch_dir, sample_raw_image, sample_confounds_timeseries):
+    """A manifest with one recorded image, exported to the scratch directory."""
+    image_path = scatch_dir / "image.nii.gz"
+    shutil.copy(sample_raw_image, image_path)
+    export_path = scatch_dir / "image_postproc.nii.gz"
+    shutil.copy(sample_raw_image, export_path)
+
+    manifest = PostprocessingManifest(scatch_dir / "manifest")
+    options = ProjectOptions().postprocessing
+    manifest.record(
+        "image",
+        image_path,
+        sample_confounds_timeseries,
+        options_hash(options),
+        export_paths=[export_path, None],
+    )
+    return manifest, image_path, export_path, options
+
+
+def test_manifest_current(recorded_manifest, sample_confounds_timeseries):
+    manifest, image_path, _, options = recorded_manifest
+
+    assert manifest.is_current(
+        "image", image_path, sample_confounds_timeseries, options_hash(options)
+    )
+
+
+def test_manifest_entry_file_mode(recorded_manifest):
+    manifest, _, _, _ = recorded_manifest
+
+    entry_modes = [
+        path.stat().st_mode & 0o777 for path in manifest.directory.iterdir()
+    ]
+
+    assert entry_modes == [default_file_mode()]
+
+
+def test_manifest_unrecorded_image(recorded_manifest, sample_confounds_timeseries):
+    manifest, image_path, _, options = recorded_manifest
+
+    assert not manifest.is_current(
+        "other_image", image_path, sample_confounds_timeseries, options_hash(options)
+    )
+
+
+def test_manifest_stale_after_input_change(
+    recorded_manifest, sample_confounds_timeseries
+):
+    manifest, image_path, _, options = recorded_manifest
+
+    stat = os.stat(image_path)
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert not manifest.is_current(
+        "image", image_path, sample_confounds_timeseries, options_hash(options)
+    )
+
+
+def test_manifest_stale_after_export_removed(
+    recorded_manifest, sample_confounds_timeseries
+):
+    manifest, image_path, export_path, options = recorded_manifest
+
+    os.remove(export_path)
+
+    assert not manifest.is_current(
+        "image", image_path, sample_confounds_timeseries, options_hash(options)
+    )
+
+
+def test_manifest_stale_after_confounds_change(
+    recorded_manifest, sample_postprocessed_confounds
+):
+    manifest, image_path, _, options = recorded_manifest
+
+    assert not manifest.is_current(
+        "image", image_path, sample_postprocessed_confounds, options_hash(options)
+    )
+
+
+def test_options_hash_ignores_output_independent_options():
+    options = ProjectOptions().postprocessing
+    original_hash = options_hash(options)
+
+    options.batch_options.memory_usage = "100G"
+    options.working_directory = "/elsewhere"
+    assert options_hash(options) == original_hash
+
+    options.processing_step_options.spatial_smoothing.fwhm = 8
+    assert options_hash(options) != original_hash
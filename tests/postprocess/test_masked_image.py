@@ -0,0 +1,81 @@
+import nibabel as nib
+import numpy as np
+
+from clpipe.postprocutils.masked_image import *
+
+
+def test_masked_image_load(sample_raw_image, sample_raw_image_mask):
+    image = MaskedImage.load(sample_raw_image, mask=sample_raw_image_mask)
+    raw = nib.load(sample_raw_image).get_fdata()
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+
+    assert image.data.dtype == np.float32
+    assert image.data.flags["C_CONTIGUOUS"]
+    assert image.data.shape == (raw.shape[-1], np.count_nonzero(mask))
+    np.testing.assert_allclose(image.data, raw[mask].T)
+
+
+def test_masked_image_load_in_chunks(sample_raw_image, monkeypatch):
+    import clpipe.postprocutils.masked_image as masked_image
+
+    monkeypatch.setattr(masked_image, "LOAD_CHUNK_VOLUMES", 3)
+    image = MaskedImage.load(sample_raw_image)
+
+    np.testing.assert_allclose(
+        image.to_array(), nib.load(sample_raw_image).get_fdata()
+    )
+
+
+def test_masked_image_load_gzipped_opens_once(sample_raw_image, monkeypatch):
+    import clpipe.postprocutils.masked_image as masked_image
+    from nibabel.openers import Opener
+
+    assert str(sample_raw_image).endswith(".nii.gz")
+    opened = []
+    original_init = Opener.__init__
+
+    def counting_init(self, fileish, *args, **kwargs):
+        opened.append(fileish)
+        original_init(self, fileish, *args, **kwargs)
+
+    def count_opens(chunk_volumes):
+        opened.clear()
+        monkeypatch.setattr(masked_image, "LOAD_CHUNK_VOLUMES", chunk_volumes)
+        image = MaskedImage.load(sample_raw_image)
+        return len(opened), image
+
+    monkeypatch.setattr(Opener, "__init__", counting_init)
+    single_read_opens, _ = count_opens(32)
+    chunked_opens, image = count_opens(2)
+    monkeypatch.setattr(Opener, "__init__", original_init)
+
+    # Reading in chunks must not reopen, and so re-decompress, the file
+    assert chunked_opens == single_read_opens
+    np.testing.assert_allclose(
+        image.to_array(), nib.load(sample_raw_image).get_fdata()
+    )
+
+
+def test_masked_image_round_trip(scatch_dir, sample_raw_image, sample_raw_image_mask):
+    image = MaskedImage.load(sample_raw_image, mask=sample_raw_image_mask)
+
+    out_path = image.with_data(image.data[2:]).save(scatch_dir / "trimmed.nii.gz")
+
+    saved = nib.load(out_path)
+    mask = nib.load(sample_raw_image_mask).get_fdata() > 0
+    assert saved.get_data_dtype() == np.float32
+    assert saved.shape == image.shape[:3] + (image.n_timepoints - 2,)
+    np.testing.assert_array_equal(saved.affine, image.affine)
+    assert np.all(saved.get_fdata()[~mask] == 0)
+    np.testing.assert_allclose(saved.get_fdata()[mask].T, image.data[2:])
+
+
+def test_masked_image_voxels_in(sample_raw_image, sample_raw_image_mask):
+    image = MaskedImage.load(sample_raw_image)
+
+    voxels = image.voxels_in(sample_raw_image_mask)
+
+    assert voxels.shape == (image.n_voxels,)
+    assert voxels.sum() == np.count_nonzero(
+        nib.load(sample_raw_image_mask).get_fdata()
+    )
@@ -0,0 +1,112 @@
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+from scipy.ndimage import map_coordinates
+
+from clpipe.postprocutils.resample import *
+from clpipe.postprocutils.step_cache import default_file_mode
+from clpipe.postprocutils.image_workflows import build_resample_numpy_workflow
+
+REFERENCE_SHAPE = (40, 40, 20)
+
+
+@pytest.fixture()
+def reference_image(scatch_dir, sample_raw_image):
+    """A 3mm isotropic grid, offset from the sample image's."""
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    affine[:3, 3] = nib.load(sample_raw_image).affine[:3, 3] + [1, -2, 0.5]
+    reference_path = scatch_dir / "reference.nii.gz"
+    nib.save(
+        nib.Nifti1Image(np.zeros(REFERENCE_SHAPE, dtype=np.float32), affine),
+        reference_path,
+    )
+    return reference_path
+
+
+def _trilinear(data: np.ndarray, source_affine, reference_affine):
+    reference_to_source = np.linalg.inv(source_affine) @ reference_affine
+    indices = np.indices(REFERENCE_SHAPE).reshape(3, -1)
+    coordinates = reference_to_source[:3, :3] @ indices + reference_to_source[:3, 3:]
+    return map_coordinates(data, coordinates, order=1, mode="constant").reshape(
+        REFERENCE_SHAPE
+    )
+
+
+def test_resample_volumes_matches_trilinear(sample_raw_image, reference_image):
+    image = nib.load(sample_raw_image)
+    reference = nib.load(reference_image)
+    data = image.get_fdata(dtype=np.float32)
+
+    resample_map = resampling_map(
+        image.affine, image.shape, reference.affine, REFERENCE_SHAPE
+    )
+    resampled = resample_volumes(resample_map, data, n_threads=3)
+
+    resampled = resampled.reshape(REFERENCE_SHAPE + (image.shape[3],))
+    for volume in (0, 5, 9):
+        np.testing.assert_allclose(
+            resampled[..., volume],
+            _trilinear(data[..., volume], image.affine, reference.affine),
+            atol=1e-3,
+        )
+
+
+def test_resampling_map_identity():
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    data = np.random.default_rng(0).random((5, 6, 7, 2)).astype(np.float32)
+
+    resample_map = resampling_map(affine, data.shape, affine, data.shape)
+    resampled = resample_volumes(resample_map, data)
+
+    np.testing.assert_allclose(resampled.reshape(data.shape), data, rtol=1e-6)
+
+
+def test_load_resampling_map_cached(
+    scatch_dir, sample_raw_image, reference_image, monkeypatch
+):
+    import clpipe.postprocutils.resample as resample
+
+    image = nib.load(sample_raw_image)
+    reference = nib.load(reference_image)
+    cache_dir = scatch_dir / "resample_cache"
+    grids = (image.affine, image.shape, reference.affine, REFERENCE_SHAPE)
+
+    resample_map = load_resampling_map(*grids, cache_dir=cache_dir)
+
+    assert os.listdir(cache_dir) == [f"{MAP_FILE_PREFIX}{grid_key(*grids)}.npz"]
+    map_mode = os.stat(cache_dir / os.listdir(cache_dir)[0]).st_mode & 0o777
+    assert map_mode == default_file_mode()
+
+    def _fail(*args):
+        raise AssertionError("The resampling map should be loaded from the cache.")
+
+    monkeypatch.setattr(resample, "resampling_map", _fail)
+    cached_map = load_resampling_map(*grids, cache_dir=cache_dir)
+
+    assert (cached_map != resample_map).nnz == 0
+
+
+def test_resample_numpy_wf(scatch_dir, sample_raw_image, reference_image):
+    resampled_path = scatch_dir / "resampled.nii.gz"
+    cache_dir = scatch_dir / "resample_cache"
+
+    wf = build_resample_numpy_workflow(
+        reference_image=reference_image,
+        in_file=sample_raw_image,
+        out_file=resampled_path,
+        cache_dir=cache_dir,
+        n_threads=2,
+        base_dir=scatch_dir,
+        crashdump_dir=scatch_dir,
+    )
+    wf.run()
+
+    resampled = nib.load(resampled_path)
+    reference = nib.load(reference_image)
+    image = nib.load(sample_raw_image)
+    assert resampled.shape == REFERENCE_SHAPE + (image.shape[3],)
+    np.testing.assert_allclose(resampled.affine, reference.affine, atol=1e-5)
+    assert resampled.header.get_zooms() == (3.0, 3.0, 3.0, image.header.get_zooms()[3])
+    assert len(os.listdir(cache_dir)) == 1
@@ -0,0 +1,162 @@
+import os
+import shutil
+import time
+
+import nibabel as nib
+import numpy as np
+
+from clpipe.config.options import ProjectOptions
+from clpipe.postprocutils.step_cache import *
+from clpipe.postprocutils.image_workflows import build_image_postprocessing_workflow
+
+
+def _postprocessing_config(cache_dir, processing_steps):
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.step_cache_directory = str(cache_dir)
+    postprocessing_config.processing_steps = processing_steps
+    step_options = postprocessing_config.processing_step_options
+    step_options.intensity_normalization.implementation = "10000_GlobalMedian_numpy"
+    return postprocessing_config
+
+
+def _run_stream(scatch_dir, name, postprocessing_config, in_file, mask_file):
+    out_path = scatch_dir / f"{name}.nii.gz"
+    wf = build_image_postprocessing_workflow(
+        postprocessing_config,
+        in_file=in_file,
+        export_path=out_path,
+        name=name,
+        mask_file=mask_file,
+        tr=2,
+        base_dir=scatch_dir,
+        crashdump_dir=scatch_dir,
+    )
+    wf.run()
+    return wf, out_path
+
+
+def test_step_cache_keys_share_common_steps(
+    scatch_dir, sample_raw_image, sample_raw_image_mask
+):
+    config = _postprocessing_config(
+        scatch_dir, ["TrimTimepoints", "IntensityNormalization", "TemporalFiltering"]
+    )
+    other_config = _postprocessing_config(
+        scatch_dir, ["TrimTimepoints", "IntensityNormalization", "SpatialSmoothing"]
+    )
+    other_config.processing_step_options.intensity_normalization.implementation = (
+        "100_voxelmean_numpy"
+    )
+
+    keys = step_cache_keys(
+        config, config.processing_steps, sample_raw_image, sample_raw_image_mask, tr=2
+    )
+    other_keys = step_cache_keys(
+        other_config,
+        other_config.processing_steps,
+        sample_raw_image,
+        sample_raw_image_mask,
+        tr=2,
+    )
+
+    assert len(keys) == 3
+    assert keys[0] == other_keys[0]
+    assert keys[1] != other_keys[1]
+    # A different input image shares nothing
+    assert step_cache_keys(
+        config, config.processing_steps, sample_raw_image_mask, tr=2
+    )[0] not in keys
+
+
+def test_step_cache_store_and_fetch(scatch_dir, sample_raw_image):
+    step_cache = StepCache(scatch_dir / "step_cache")
+
+    assert step_cache.fetch("missing", scatch_dir / "fetched") is None
+    cached_path = step_cache.store("key", sample_raw_image)
+    fetched_path = step_cache.fetch("key", scatch_dir / "fetched")
+
+    assert cached_path.name == "key.nii.gz"
+    assert fetched_path.parent == scatch_dir / "fetched"
+    np.testing.assert_array_equal(
+        nib.load(fetched_path).get_fdata(), nib.load(sample_raw_image).get_fdata()
+    )
+
+
+def test_step_cache_store_file_mode(scatch_dir, sample_raw_image):
+    previous_umask = os.umask(0o022)
+    try:
+        cached_path = StepCache(scatch_dir / "step_cache").store(
+            "key", sample_raw_image
+        )
+    finally:
+        os.umask(previous_umask)
+
+    assert cached_path.stat().st_mode & 0o777 == 0o644
+
+
+def test_step_cache_fetch_unreadable(scatch_dir, sample_raw_image, monkeypatch):
+    step_cache = StepCache(scatch_dir / "step_cache")
+    step_cache.store("key", sample_raw_image)
+
+    def _fail(*args, **kwargs):
+        raise PermissionError("Operation not permitted")
+
+    monkeypatch.setattr(os, "link", _fail)
+    monkeypatch.setattr(shutil, "copyfile", _fail)
+
+    assert step_cache.fetch("key", scatch_dir / "fetched") is None
+    assert not (scatch_dir / "fetched" / "key.nii.gz").exists()
+
+
+def test_step_cache_evicts_least_recently_used(scatch_dir):
+    step_cache = StepCache(scatch_dir / "step_cache", max_size_gb=250 / GIGABYTE)
+    for key in ("first", "second"):
+        source = scatch_dir / f"{key}.nii"
+        source.write_bytes(b"0" * 100)
+        step_cache.store(key, source)
+        time.sleep(0.01)
+    # Using the first output makes the second the least recently used
+    step_cache.fetch("first", scatch_dir / "fetched")
+    time.sleep(0.01)
+
+    source = scatch_dir / "third.nii"
+    source.write_bytes(b"0" * 100)
+    step_cache.store("third", source)
+
+    assert sorted(os.listdir(step_cache.directory)) == ["first.nii", "third.nii"]
+
+
+def test_image_wf_resumes_from_cached_steps(
+    scatch_dir, sample_raw_image, sample_raw_image_mask
+):
+    cache_dir = scatch_dir / "step_cache"
+    config = _postprocessing_config(
+        cache_dir, ["TrimTimepoints", "IntensityNormalization"]
+    )
+    _, out_path = _run_stream(
+        scatch_dir, "first_stream", config, sample_raw_image, sample_raw_image_mask
+    )
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Every step is cached, so the stream only exports the cached output
+    wf, cached_out_path = _run_stream(
+        scatch_dir, "second_stream", config, sample_raw_image, sample_raw_image_mask
+    )
+
+    assert not any("step_cache_" in node for node in wf.list_node_names())
+    np.testing.assert_array_equal(
+        nib.load(cached_out_path).get_fdata(), nib.load(out_path).get_fdata()
+    )
+
+    # A stream sharing only the first step starts after it
+    config.processing_step_options.intensity_normalization.implementation = (
+        "100_voxelmean_numpy"
+    )
+    wf, _ = _run_stream(
+        scatch_dir, "third_stream", config, sample_raw_image, sample_raw_image_mask
+    )
+
+    assert [node for node in wf.list_node_names() if "step_cache_" in node] == [
+        "step_cache_0"
+    ]
+    assert len(os.listdir(cache_dir)) == 3
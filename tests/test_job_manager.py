@@ -70,9 +70,223 @@ def test_local_manager_instantiation(scatch_dir):
     assert len(local_manager.job_queue) == 2
 
     local_manager.print_jobs()
-    process1, process2 = local_manager.submit_jobs()
+    job1, job2 = local_manager.submit_jobs()
 
-    assert process1.stdout.decode("utf-8") == "local\n"
-    assert process2.stdout.decode("utf-8") == "running\n"
+    assert job1.returncode == 0
+    with open(job1.output_file) as f:
+        assert f.read() == "local\n"
+    with open(job2.output_file) as f:
+        assert f.read() == "running\n"
 
     assert len(local_manager.job_queue) == 0
+
+
+def test_local_manager_fail_fast(scatch_dir):
+    local_manager = JobManagerFactory.get(
+        output_directory=scatch_dir,
+        failure_policy=FAILURE_POLICY_FAIL_FAST,
+    )
+    local_manager.max_workers = 1
+
+    local_manager.add_job("fails", "exit 3")
+    local_manager.add_job("skipped", "echo skipped")
+
+    failed_job, skipped_job = local_manager.submit_jobs()
+
+    assert failed_job.returncode == 3
+    assert skipped_job.returncode is None
+
+
+def test_local_manager_max_workers():
+    assert LocalJobManager.calc_max_workers(threads=os.cpu_count() * 2) == 1
+    assert LocalJobManager.calc_max_workers(mem_use="1000000G") == 1
+
+
+def test_parse_memory():
+    assert parse_memory("20G") == 20 * 1024**3
+    assert parse_memory("1000") == 1000 * 1024**2
+    assert parse_memory("") is None
+
+
+def test_scale_memory():
+    assert scale_memory("10G", 2) == "20G"
+    assert scale_memory("10G", 1.25) == "12800M"
+    assert scale_memory("3G", 1.5) == "4608M"
+    assert scale_memory("1000", 1.0005) == "1001M"
+    assert scale_memory(None, 2) is None
+
+
+def test_batch_manager_array_jobs(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.array_max_size = 2
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir, array=True
+    )
+
+    batch_manager.add_job("job1", "echo hi")
+    batch_manager.add_job("job2", "echo test")
+    batch_manager.add_job("job3", "echo again")
+
+    array_job, single_job = batch_manager.create_array_jobs()
+
+    assert "--array=1-2" in array_job.job_string
+    assert single_job.job_string == batch_manager.job_queue[2].job_string
+
+    task_script = os.path.join(scatch_dir, ARRAY_TASK_DIR, f"{array_job.job_name}.sh")
+    with open(task_script) as f:
+        task_table = f.read()
+    assert "1)\n    ( echo hi )" in task_table
+    assert "2)\n    ( echo test )" in task_table
+    assert "echo again" not in task_table
+
+
+def test_batch_manager_array_jobs_inactive(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("pitt")
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir, array=True
+    )
+
+    assert not batch_manager.array
+
+
+def test_batch_manager_dependencies(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    # Stand in for sbatch by echoing its submission message
+    batch_config.submission_head = "echo Submitted batch job 42 #"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+
+    parent = batch_manager.add_job("parent", "echo parent")
+    child = batch_manager.add_job(
+        "child", "echo child", parent_jobs=[parent], dependency_type="afterany"
+    )
+    # Queued out of order to check that parents are submitted first
+    batch_manager.job_queue.reverse()
+
+    batch_manager.submit_jobs()
+
+    assert parent.scheduler_id == "42"
+    assert "--dependency=afterany:42" in child.job_string
+
+
+def test_batch_manager_script_submission(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.script_submission = True
+    # Stand in for sbatch by running the script, which treats directives as comments
+    batch_config.submission_head = "bash"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config,
+        output_directory=scatch_dir,
+        mem_use="10G",
+        email="user@example.com",
+    )
+
+    parent = batch_manager.add_job(
+        "parent", """echo "Submitted batch job 42" 'with "quotes"'"""
+    )
+    child = batch_manager.add_job("child", "echo child", parent_jobs=[parent])
+    assert child.job_string == f"bash {scatch_dir}/batch_scripts/child.sh"
+
+    batch_manager.submit_jobs()
+
+    assert parent.scheduler_id == "42"
+    with open(scatch_dir / "batch_scripts" / "child.sh") as f:
+        script = f.read().splitlines()
+    assert script[:3] == [
+        "#!/bin/bash",
+        "#SBATCH -n 1",
+        "#SBATCH --mail-user user@example.com --mail-type=FAIL",
+    ]
+    assert "#SBATCH --mem=10G" in script
+    assert '#SBATCH --job-name="child"' in script
+    assert "#SBATCH --dependency=afterok:42" in script
+    assert script[-1] == "echo child"
+
+
+def test_sort_jobs_cycle():
+    job1 = Job("job1", "echo 1")
+    job2 = Job("job2", "echo 2", parent_jobs=[job1])
+    job1.parent_jobs.append(job2)
+
+    with pytest.raises(ValueError):
+        sort_jobs([job1, job2])
+
+
+def test_local_manager_dependencies(scatch_dir):
+    local_manager = JobManagerFactory.get(output_directory=scatch_dir)
+    order_file = os.path.join(scatch_dir, "order.txt")
+
+    parent = local_manager.add_job("parent", f"sleep 0.2; echo parent >> {order_file}")
+    child = local_manager.add_job(
+        "child", f"echo child >> {order_file}", parent_jobs=[parent]
+    )
+    failed = local_manager.add_job("failed", "exit 1")
+    skipped = local_manager.add_job("skipped", "echo skipped", parent_jobs=[failed])
+    ran_anyway = local_manager.add_job(
+        "ran_anyway",
+        "echo ran",
+        parent_jobs=[failed],
+        dependency_type=DEPENDENCY_AFTER_ANY,
+    )
+
+    local_manager.submit_jobs()
+
+    with open(order_file) as f:
+        assert f.read() == "parent\nchild\n"
+    assert child.returncode == 0
+    assert skipped.returncode is None
+    assert ran_anyway.returncode == 0
+
+
+def test_batch_manager_packs(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config,
+        output_directory=scatch_dir,
+        mem_use="10G",
+        time="1:0:0",
+        pack_size=2,
+        pack_parallel=2,
+    )
+
+    batch_manager.add_job("job1", "echo hi")
+    batch_manager.add_job("job2", "echo test")
+    batch_manager.add_job("job3", "echo again")
+
+    pack, single_job = batch_manager.create_packs()
+
+    assert pack.pack_jobs == batch_manager.job_queue[:2]
+    assert "--mem=20G" in pack.job_string
+    assert "--cpus-per-task=2" in pack.job_string
+    assert "--time=1:00:00" in pack.job_string
+    assert single_job is batch_manager.job_queue[2]
+
+    pack_file = pack.command.split(" ")[-1]
+    assert run_job_pack(pack_file) == 0
+
+    status_file = os.path.splitext(pack_file)[0] + PACK_STATUS_FILE_SUFFIX
+    with open(status_file) as f:
+        statuses = f.read().splitlines()
+    assert statuses[1].startswith("job1\t0\t")
+    assert statuses[2].startswith("job2\t0\t")
+
+
+def test_batch_manager_pack_time(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config,
+        output_directory=scatch_dir,
+        time="1:0:0",
+        pack_parallel=2,
+        pack_time="4:0:0",
+    )
+
+    assert batch_manager.pack_size == 8
+
+
+def test_parse_time():
+    assert parse_time("2:0:0") == 7200
+    assert parse_time("90") == 5400
+    assert parse_time("1-12") == 129600
+    assert format_time(5400) == "1:30:00"
@@ -0,0 +1,139 @@
+import pytest
+from clpipe.job_manager import *
+from clpipe.job_registry import *
+
+
+def fake_runner(outputs):
+    """Stand in for batch system query commands with canned output."""
+
+    def runner(args):
+        return outputs.get(args[0])
+
+    return runner
+
+
+@pytest.fixture()
+def fake_batch_config():
+    batch_config = BatchManagerConfig.from_default("unc")
+    # Stand in for sbatch by echoing its submission message
+    batch_config.submission_head = "echo Submitted batch job 42 #"
+    return batch_config
+
+
+def test_registry_records_batch_jobs(scatch_dir, fake_batch_config):
+    registry = JobRegistry(os.path.join(scatch_dir, "jobs.db"))
+    batch_manager = JobManagerFactory.get(
+        batch_config=fake_batch_config,
+        output_directory=scatch_dir,
+        mem_use="10G",
+        registry=registry,
+        step="postprocess",
+    )
+    batch_manager.add_job("job1", "echo hi")
+    batch_manager.submit_jobs()
+
+    (job,) = registry.get_jobs(step="postprocess")
+    assert job["job_name"] == "job1"
+    assert job["command"] == "echo hi"
+    assert job["scheduler_id"] == "42"
+    assert job["memory"] == "10G"
+    assert job["state"] == STATE_SUBMITTED
+
+
+def test_registry_records_local_jobs(scatch_dir):
+    registry = JobRegistry(os.path.join(scatch_dir, "jobs.db"))
+    local_manager = JobManagerFactory.get(
+        output_directory=scatch_dir, registry=registry
+    )
+    local_manager.add_job("succeeds", "echo hi")
+    local_manager.add_job("fails", "exit 1")
+    local_manager.submit_jobs()
+
+    assert [job["job_name"] for job in registry.get_jobs(states=FAILED_STATES)] == [
+        "fails"
+    ]
+
+
+def test_registry_poll(scatch_dir, fake_batch_config):
+    registry = JobRegistry(os.path.join(scatch_dir, "jobs.db"))
+    batch_manager = JobManagerFactory.get(
+        batch_config=fake_batch_config,
+        output_directory=scatch_dir,
+        array=True,
+        registry=registry,
+    )
+    batch_manager.add_job("job1", "echo 1")
+    batch_manager.add_job("job2", "echo 2")
+    batch_manager.add_job("job3", "echo 3")
+    batch_manager.submit_jobs()
+
+    adapter = SlurmAdapter(
+        fake_runner({"sacct": "42_1|COMPLETED\n42_2|TIMEOUT\n42_[3]|PENDING\n"})
+    )
+    registry.poll(adapter)
+
+    states = {job["job_name"]: job["state"] for job in registry.get_jobs()}
+    assert states == {
+        "job1": STATE_COMPLETED,
+        "job2": STATE_TIMEOUT,
+        "job3": STATE_PENDING,
+    }
+
+
+def test_resubmit_failed_jobs(scatch_dir, fake_batch_config):
+    registry_path = os.path.join(scatch_dir, "jobs.db")
+    registry = JobRegistry(registry_path)
+    batch_manager = JobManagerFactory.get(
+        batch_config=fake_batch_config,
+        output_directory=scatch_dir,
+        mem_use="10G",
+        time="1:0:0",
+        registry=registry,
+        step="postprocess",
+    )
+    batch_manager.add_job("succeeded", "echo hi")
+    batch_manager.add_job("failed", "echo again")
+    batch_manager.submit_jobs()
+    succeeded, failed = registry.get_jobs()
+    registry.update_state(succeeded["id"], STATE_COMPLETED)
+    registry.update_state(failed["id"], STATE_OUT_OF_MEMORY)
+
+    resubmit_jobs(
+        registry_path=registry_path,
+        failed=True,
+        memory_factor=2,
+        time_factor=1.5,
+        submit=True,
+    )
+
+    latest = registry.get_jobs()
+    assert [job["job_name"] for job in latest] == ["succeeded", "failed"]
+    resubmission = latest[1]
+    assert resubmission["resubmitted_from"] == failed["id"]
+    assert resubmission["memory"] == "20G"
+    assert resubmission["time"] == "1:30:00"
+    assert resubmission["state"] == STATE_SUBMITTED
+
+
+def test_sge_adapter():
+    qstat = (
+        "job-ID  prior   name  user  state submit/start at     queue  slots ja-task-ID\n"
+        "-------------------------------------------------------------------------\n"
+        "101 0.5 job1 user r 01/01/2024 10:00:00 all.q@node1 1\n"
+        "102 0.5 job2 user qw 01/01/2024 10:00:00 1 2-3:1\n"
+    )
+    qacct = (
+        "==============================================================\n"
+        "jobname      job3\n"
+        "taskid       undefined\n"
+        "failed       0\n"
+        "exit_status  1\n"
+    )
+    adapter = SGEAdapter(fake_runner({"qstat": qstat, "qacct": qacct}))
+
+    states = adapter.query(["101", "102", "103"])
+
+    assert states["101"] == STATE_RUNNING
+    assert states["102_2"] == STATE_PENDING
+    assert states["102_3"] == STATE_PENDING
+    assert states["103"] == STATE_FAILED
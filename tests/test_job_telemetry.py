@@ -0,0 +1,86 @@
+import sys
+
+import pytest
+from clpipe.job_manager import *
+from clpipe.job_telemetry import *
+
+ALLOCATE_COMMAND = (
+    f"{sys.executable} -c "
+    "'import time; x = bytearray(100 * 1024 ** 2); time.sleep(0.5)'"
+)
+
+
+def test_run_with_telemetry(scatch_dir):
+    telemetry_file = scatch_dir / "telemetry.tsv"
+
+    exit_code = run_with_telemetry(
+        ALLOCATE_COMMAND,
+        telemetry_file,
+        "job1",
+        step="postprocess",
+        mem_use="1G",
+        interval=0.1,
+    )
+    run_with_telemetry("exit 3", telemetry_file, "job2", interval=0.1)
+
+    first, second = load_telemetry(telemetry_file)
+    assert exit_code == 0
+    assert first["job_name"] == "job1"
+    assert first["step"] == "postprocess"
+    assert first["requested_memory"] == "1G"
+    assert int(first["peak_rss_bytes"]) >= 100 * 1024**2
+    assert float(first["wall_seconds"]) >= 0.5
+    assert second["exit_code"] == "3"
+
+
+def test_summarize_telemetry():
+    records = [
+        {
+            "step": "postprocess",
+            "requested_memory": "20G",
+            "requested_time": "2:0:0",
+            "requested_threads": "1",
+            "exit_code": "0",
+            "wall_seconds": str(wall),
+            "cpu_seconds": str(wall / 2),
+            "peak_rss_bytes": str(peak),
+        }
+        for wall, peak in [(600, 3 * 1024**3), (1800, 4 * 1024**3)]
+    ]
+
+    (summary,) = summarize_telemetry(records)
+
+    assert summary["jobs"] == 2
+    assert summary["failed"] == 0
+    assert summary["max_peak_memory"] == "4G"
+    assert summary["cpu_efficiency"] == 0.5
+    assert summary["suggested_memory"] == "5G"
+    assert summary["suggested_time"] == "0:45:00"
+
+
+def test_batch_jobs_wrapped_with_telemetry(scatch_dir):
+    telemetry_file = scatch_dir / "telemetry.tsv"
+    batch_manager = JobManagerFactory.get(
+        batch_config=BatchManagerConfig.from_default("unc"),
+        output_directory=scatch_dir,
+        mem_use="10G",
+        array=True,
+        step="postprocess",
+        telemetry=telemetry_file,
+    )
+    single = batch_manager.add_job("single", "echo hi")
+    assert "run_with_telemetry" in single.job_string
+    assert "-step=postprocess -mem_use=10G" in single.job_string
+
+    batch_manager.add_job("job2", "echo 2")
+    (array_job,) = batch_manager.create_array_jobs()
+    task_script = array_job.command.split()[-1]
+    with open(task_script) as f:
+        assert f.read().count("run_with_telemetry") == 2
+
+
+def test_local_jobs_without_telemetry(scatch_dir):
+    local_manager = JobManagerFactory.get(output_directory=scatch_dir)
+    job = local_manager.add_job("job1", "echo hi")
+
+    assert local_manager.launch_command(job) == "echo hi"
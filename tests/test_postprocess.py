@@ -139,3 +139,83 @@ def test_build_export_path_confounds(clpipe_fmriprep_dir: Path):
     assert str(export_path) == str(
         subject_out_dir / "func" / "sub-0_task-rest_desc-confounds_timeseries.tsv"
     )
+
+
+def test_create_image_submission_strings_multiple_streams(tmp_path):
+    """Test that an image's job runs every stream targeting it."""
+    from types import SimpleNamespace
+    from clpipe.postprocess import _create_image_submission_strings
+    from clpipe.utils import get_logger
+
+    streams = []
+    for stream in ["default", "smooth"]:
+        run_config = PostProcessingRunConfig(
+            stream_output_directory=str(tmp_path / "data_postprocess" / stream),
+            stream_working_directory=str(tmp_path / "data_working" / stream),
+        )
+        streams.append((run_config, tmp_path / "data_working" / stream / "run.json"))
+    image = SimpleNamespace(
+        path=str(tmp_path / "sub-0_task-rest_desc-preproc_bold.nii.gz")
+    )
+
+    submission_strings = _create_image_submission_strings(
+        [(image, streams)],
+        "sub-0",
+        tmp_path / "logs",
+        False,
+        get_logger("test_postprocess"),
+    )
+
+    assert submission_strings == {
+        "sub-0_task-rest_desc-preproc_bold.nii": (
+            f"postprocess_image {streams[0][1]} {image.path} "
+            f"{tmp_path / 'data_postprocess' / 'default' / 'sub-0'} "
+            f"{tmp_path / 'data_working' / 'default' / 'sub-0'} "
+            f"{tmp_path / 'logs'} -stream_run_config {streams[1][1]} "
+        )
+    }
+
+
+def test_create_subject_submission_string(tmp_path):
+    """Test that a subject-level job lists each image with its streams."""
+    from types import SimpleNamespace
+    from clpipe.postprocess import (
+        _create_subject_submission_string,
+        _record_subject_job_memory,
+    )
+    from clpipe.utils import get_logger
+
+    run_config = PostProcessingRunConfig(
+        stream_output_directory=str(tmp_path / "data_postprocess" / "default"),
+        stream_working_directory=str(tmp_path / "data_working" / "default"),
+    )
+    run_config_path = tmp_path / "data_working" / "default" / "run_config.json"
+    images = [
+        SimpleNamespace(path=str(tmp_path / f"sub-0_task-{task}_bold.nii.gz"))
+        for task in ["rest", "gonogo"]
+    ]
+
+    submission_strings = _create_subject_submission_string(
+        [(image, [(run_config, run_config_path)]) for image in images],
+        "sub-0",
+        tmp_path,
+        False,
+        get_logger("test_postprocess"),
+    )
+
+    job_file = tmp_path / SUBJECT_JOB_FILE_NAME
+    assert submission_strings == {
+        "sub-0": f"postprocess_subject_images {job_file} {tmp_path} "
+    }
+    with open(job_file) as f:
+        subject_job = json.load(f)
+    assert subject_job["subject"] == "sub-0"
+    assert [image["image"] for image in subject_job["images"]] == [
+        image.path for image in images
+    ]
+    assert subject_job["images"][0]["run_configs"] == [str(run_config_path)]
+
+    # The job's memory request is saved for its MultiProc run
+    _record_subject_job_memory(tmp_path, "36G")
+    with open(job_file) as f:
+        assert json.load(f)["memory_usage"] == "36G"
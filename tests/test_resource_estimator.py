@@ -0,0 +1,175 @@
+import nibabel as nib
+import numpy as np
+import pytest
+
+from clpipe.job_manager import *
+from clpipe.resource_estimator import *
+
+
+def write_header_only(image_path, shape, dtype=np.float32):
+    """Write a NIfTI header describing an image, without any image data."""
+    header = nib.Nifti1Header()
+    header.set_data_shape(shape)
+    header.set_data_dtype(dtype)
+    with open(image_path, "wb") as image_file:
+        header.write_to(image_file)
+    return image_path
+
+
+def test_read_image_header(sample_raw_image):
+    header = read_image_header(sample_raw_image)
+
+    assert header.voxels == 147456
+    assert header.timepoints == 10
+
+
+def test_read_image_header_no_extension(scatch_dir):
+    write_header_only(scatch_dir / "image.nii", (10, 10, 10, 20), np.int16)
+
+    header = read_image_header(scatch_dir / "image")
+
+    assert header == ImageHeaderInfo(1000, 20, 2)
+
+
+def test_estimate_resources_scales_with_image(scatch_dir):
+    steps = ["SpatialSmoothing", "TemporalFiltering"]
+    short_run = write_header_only(scatch_dir / "short.nii", (97, 115, 97, 200))
+    long_run = write_header_only(scatch_dir / "long.nii", (97, 115, 97, 2000))
+
+    short_estimate = estimate_resources([short_run], steps)
+    long_estimate = estimate_resources([long_run], steps)
+
+    assert parse_memory(short_estimate.mem_use) < parse_memory(long_estimate.mem_use)
+    assert parse_time(short_estimate.time) < parse_time(long_estimate.time)
+
+
+def test_estimate_resources_parallel_images(scatch_dir):
+    steps = ["TemporalFiltering"]
+    images = [
+        write_header_only(scatch_dir / f"run-{run}.nii", (97, 115, 97, 1000))
+        for run in range(4)
+    ]
+
+    serial = parse_memory(estimate_resources(images, steps).mem_use)
+    parallel = parse_memory(
+        estimate_resources(images, steps, parallel_images=2).mem_use
+    )
+    # More parallel images than the job has adds nothing
+    all_parallel = parse_memory(
+        estimate_resources(images, steps, parallel_images=8).mem_use
+    )
+
+    assert serial < parallel < all_parallel
+    assert all_parallel == parse_memory(
+        estimate_resources(images, steps, parallel_images=4).mem_use
+    )
+
+
+def test_estimate_resources_working_precision(scatch_dir):
+    image = write_header_only(scatch_dir / "image.nii", (97, 115, 97, 2000))
+
+    # Native steps hold three float32 copies: (2 + 24.2) GB * 1.5 safety
+    assert estimate_resources([image], ["TemporalFiltering"]).mem_use == "40G"
+    # ROI extraction holds two float64 copies: (2 + 32.2) GB * 1.5 safety
+    assert estimate_resources([image], ["ROIExtraction"]).mem_use == "52G"
+
+
+def test_estimate_resources_unreadable():
+    assert estimate_resources(["does_not_exist.nii.gz"], ["ApplyMask"]) is None
+
+
+def test_format_memory():
+    assert format_memory(2 * 1024**3) == "2G"
+    assert format_memory(1.5 * 1024**3) == "1536M"
+    assert format_memory(1) == "1M"
+
+
+def test_estimated_resources_per_job(scatch_dir):
+    image = write_header_only(scatch_dir / "image.nii", (97, 115, 97, 2000))
+    estimate = estimate_resources([image], ["TemporalFiltering"])
+    batch_manager = JobManagerFactory.get(
+        batch_config=BatchManagerConfig.from_default("unc"),
+        output_directory=scatch_dir,
+        mem_use="20G",
+        time="2:0:0",
+    )
+
+    estimated = batch_manager.add_job("estimated", "echo hi", **estimate._asdict())
+    default = batch_manager.add_job("default", "echo hi")
+
+    assert estimated.resources[:2] == (estimate.mem_use, estimate.time)
+    assert default.resources[:2] == ("20G", "2:0:0")
+
+
+def test_declare_node_resources(
+    scatch_dir, sample_raw_image, sample_raw_image_mask, sample_confounds_timeseries
+):
+    from clpipe.config.options import ProjectOptions
+    from clpipe.postprocutils.global_workflows import build_postprocessing_wf
+    from clpipe.resource_estimator import _iter_nodes
+
+    postprocessing_config = ProjectOptions().postprocessing
+    postprocessing_config.processing_steps = [
+        "TrimTimepoints",
+        "SpatialSmoothing",
+        "IntensityNormalization",
+    ]
+    step_options = postprocessing_config.processing_step_options
+    step_options.spatial_smoothing.implementation = "SUSAN_numpy"
+    step_options.intensity_normalization.implementation = "10000_GlobalMedian_numpy"
+    wf = build_postprocessing_wf(
+        postprocessing_config,
+        tr=2,
+        image_file=sample_raw_image,
+        image_export_path=scatch_dir / "image.nii.gz",
+        mask_file=sample_raw_image_mask,
+        confounds_file=sample_confounds_timeseries,
+        base_dir=scatch_dir,
+    )
+
+    declare_node_resources(wf, sample_raw_image, postprocessing_config.processing_steps)
+
+    nodes = {
+        ".".join(hierarchy[1:] + (node.name,)): node
+        for node, hierarchy in _iter_nodes(wf)
+    }
+    # The steps work on float32 copies of the image
+    image_gb = 64 * 64 * 36 * 10 * 4 / 1024**3
+    kernel_gb = STEP_EXTRA_MEMORY["SpatialSmoothing"] / 1024**3
+    smoothing = next(
+        node
+        for name, node in nodes.items()
+        if name.startswith("image_wf.SpatialSmoothing") and "spatial_smooth" in name
+    )
+    assert smoothing.mem_gb == pytest.approx(
+        BASE_NODE_MEMORY_GB
+        + image_gb * STEP_MEMORY_COPIES["SpatialSmoothing"]
+        + kernel_gb
+    )
+    assert nodes["image_wf.export_image"].mem_gb == pytest.approx(
+        BASE_NODE_MEMORY_GB + image_gb * 3 + kernel_gb
+    )
+    normalization = next(
+        node
+        for name, node in nodes.items()
+        if name.startswith("image_wf.IntensityNormalization")
+        and not name.endswith("node")
+    )
+    assert normalization.mem_gb == pytest.approx(
+        BASE_NODE_MEMORY_GB
+        + image_gb * STEP_MEMORY_COPIES["IntensityNormalization"]
+    )
+    assert nodes["image_wf.inputnode"].mem_gb == 0.2
+
+    declare_node_resources(
+        wf,
+        sample_raw_image,
+        postprocessing_config.processing_steps,
+        memory_limit_gb=0.21,
+    )
+    assert smoothing.mem_gb == 0.21
+    assert all(
+        node.mem_gb == 0.2
+        for name, node in nodes.items()
+        if name.startswith("confounds_wf")
+    )
@@ -0,0 +1,88 @@
+import os
+import shlex
+import subprocess
+from pathlib import Path
+
+from clpipe.job_manager import BatchManagerConfig, JobManagerFactory
+from clpipe.scratch_staging import *
+
+WRITE_COMMAND = (
+    'mkdir -p "$CLPIPE_SCRATCH_DIR/stream/sub-1" && '
+    'echo crash > "$CLPIPE_SCRATCH_DIR/stream/sub-1/crash-node.pklz" && '
+    'echo work > "$CLPIPE_SCRATCH_DIR/stream/sub-1/intermediate.nii" && '
+    "echo " + SCRATCH_DIR_PLACEHOLDER + " > {scratch_record} && exit 3"
+)
+
+
+def test_run_in_scratch_syncs_declared_outputs(scatch_dir):
+    scratch_root = scatch_dir / "node_local"
+    working_dir = scatch_dir / "working"
+    scratch_record = scatch_dir / "scratch_dir.txt"
+
+    exit_code = run_in_scratch(
+        WRITE_COMMAND.format(scratch_record=scratch_record),
+        "sub-1 image",
+        scratch_directory=str(scratch_root),
+        outputs=[(f"stream/{CRASH_FILE_PATTERN}", working_dir)],
+    )
+
+    assert exit_code == 3
+    # Crash files are copied back even though the job failed
+    assert (working_dir / "stream" / "sub-1" / "crash-node.pklz").exists()
+    assert not (working_dir / "stream" / "sub-1" / "intermediate.nii").exists()
+    # The scratch directory was within the scratch root, and is removed
+    scratch_dir = scratch_record.read_text().strip()
+    assert os.path.dirname(scratch_dir) == str(scratch_root)
+    assert not os.path.exists(scratch_dir)
+
+
+def test_wrap_command():
+    command = wrap_command(
+        "postprocess_image run_config.json 'image file.nii.gz'",
+        "sub-1_image",
+        scratch_directory="/scratch/$USER",
+        outputs=[("stream/**/crash-*", "/proj/working")],
+    )
+
+    assert shlex.split(command) == [
+        "run_in_scratch",
+        "-job_name=sub-1_image",
+        "-scratch_directory=/scratch/$USER",
+        "-output",
+        "stream/**/crash-*",
+        "/proj/working",
+        "postprocess_image run_config.json 'image file.nii.gz'",
+    ]
+
+
+def test_wrapped_command_survives_submission(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    # Stand in for sbatch by printing the command it was given to run
+    batch_config.submission_head = "printf %s"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+    command = wrap_command(
+        f"fmriprep -w {SCRATCH_DIR_PLACEHOLDER} -B {SCRATCH_DIR_PLACEHOLDER},/proj",
+        "sub-1_fmriprep",
+        scratch_directory=str(scatch_dir),
+    )
+    job = batch_manager.add_job("sub-1_fmriprep", command)
+
+    submitted = subprocess.run(
+        job.job_string, shell=True, capture_output=True, text=True, check=True
+    ).stdout
+
+    # The submitting shell leaves the placeholder for run_in_scratch to fill in
+    assert submitted.count(SCRATCH_DIR_PLACEHOLDER) == 2
+
+
+def test_local_path(scatch_dir, monkeypatch):
+    shared_path = scatch_dir / "working" / "stream" / "sub-1"
+
+    assert local_path(shared_path, scatch_dir / "working") == shared_path
+
+    monkeypatch.setenv(SCRATCH_ENV_VAR, "/tmp/scratch")
+    assert local_path(shared_path, scatch_dir / "working") == Path(
+        "/tmp/scratch/stream/sub-1"
+    )
@@ -0,0 +1,143 @@
+import threading
+import time
+
+import pytest
+from clpipe.job_manager import *
+from clpipe.submission_engine import *
+
+
+@pytest.fixture()
+def flaky_batch_config(scatch_dir):
+    """A stand in for sbatch which times out twice before submitting."""
+    attempts_file = scatch_dir / "attempts"
+    fake_sbatch = scatch_dir / "fake_sbatch.sh"
+    fake_sbatch.write_text(
+        f'echo attempt >> "{attempts_file}"\n'
+        f'if [ $(wc -l < "{attempts_file}") -le 2 ]; then\n'
+        '    echo "sbatch: error: Socket timed out on send/recv operation" >&2\n'
+        "    exit 1\n"
+        "fi\n"
+        "echo Submitted batch job 42\n"
+    )
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = f"bash {fake_sbatch}"
+    batch_config.submission_backoff = 0.01
+    batch_config.submissions_per_second = 0
+    return batch_config
+
+
+def test_submission_retries_transient_errors(scatch_dir, flaky_batch_config):
+    batch_manager = JobManagerFactory.get(
+        batch_config=flaky_batch_config, output_directory=scatch_dir
+    )
+    job = batch_manager.add_job("job1", "echo hi")
+
+    batch_manager.submit_jobs()
+
+    assert job.scheduler_id == "42"
+    assert job.submission_error is None
+    assert len((scatch_dir / "attempts").read_text().splitlines()) == 3
+
+
+def test_submission_gives_up_after_retries(scatch_dir, flaky_batch_config):
+    flaky_batch_config.submission_retries = 1
+    registry = os.path.join(scatch_dir, "jobs.db")
+    batch_manager = JobManagerFactory.get(
+        batch_config=flaky_batch_config,
+        output_directory=scatch_dir,
+        registry=registry,
+    )
+    parent = batch_manager.add_job("parent", "echo hi")
+    child = batch_manager.add_job("child", "echo hi", parent_jobs=[parent])
+
+    batch_manager.submit_jobs()
+
+    assert "Socket timed out" in parent.submission_error
+    assert child.submission_error is not None
+    # Neither job is lost: both are recorded for resubmission
+    states = {job["job_name"]: job["state"] for job in JobRegistry(registry).get_jobs()}
+    assert states == {"parent": STATE_FAILED, "child": STATE_FAILED}
+
+
+def test_submission_does_not_retry_other_errors(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = "echo 'sbatch: error: Invalid account' >&2; false"
+    batch_config.submission_backoff = 0.01
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+    job = batch_manager.add_job("job1", "echo hi")
+
+    start = time.monotonic()
+    batch_manager.submit_jobs()
+
+    assert job.submission_error == "sbatch: error: Invalid account"
+    assert time.monotonic() - start < 1
+
+
+def test_submission_missing_command(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.script_submission = True
+    batch_config.submission_head = "does_not_exist_sbatch"
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+    parent = batch_manager.add_job("parent", "echo hi")
+    child = batch_manager.add_job("child", "echo hi", parent_jobs=[parent])
+
+    batch_manager.submit_jobs()
+
+    assert "does_not_exist_sbatch" in parent.submission_error
+    assert child.submission_error is not None
+
+
+def test_submission_gives_up_at_queue_limit(scatch_dir):
+    batch_config = BatchManagerConfig.from_default("unc")
+    batch_config.submission_head = (
+        "echo 'sbatch: error: QOSMaxSubmitJobPerUserLimit' >&2; false"
+    )
+    batch_config.queue_poll_interval = 0.01
+    batch_config.queue_limit_retries = 2
+    batch_manager = JobManagerFactory.get(
+        batch_config=batch_config, output_directory=scatch_dir
+    )
+    job = batch_manager.add_job("job1", "echo hi")
+
+    batch_manager.submit_jobs()
+
+    assert "QOSMaxSubmitJobPerUserLimit" in job.submission_error
+
+
+def test_rate_limiter():
+    rate_limiter = RateLimiter(per_second=50)
+
+    start = time.monotonic()
+    for _ in range(6):
+        rate_limiter.wait()
+
+    assert time.monotonic() - start >= 0.1
+
+
+def test_queue_limiter_holds_until_room(scatch_dir):
+    queue_listing = scatch_dir / "queue.txt"
+    queue_listing.write_text("101 job1\n102 job2\n103 job3\n")
+    queue_limiter = QueueLimiter(
+        max_queued=3, queued_jobs_command=f"cat {queue_listing}", poll_interval=0.05
+    )
+
+    held = threading.Thread(target=queue_limiter.acquire, args=(1,))
+    held.start()
+    held.join(0.2)
+    assert held.is_alive()
+
+    queue_listing.write_text("102 job2\n103 job3\n")
+    held.join(1)
+    assert not held.is_alive()
+
+
+def test_queue_limiter_counts_listing():
+    queue_limiter = QueueLimiter(
+        max_queued=10, queued_jobs_command="printf 'JOBID\\n101\\n 102_1\\n'"
+    )
+
+    assert queue_limiter.count_queued() == 2